@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Общая подготовка для бенчмарков: временная БД, фиктивные переменные окружения
+и импорт bot.py без запуска polling.
+"""
+import os
+import sys
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def load_bot(db_path: str | None = None):
+    """Импортирует bot.py с временной БД и возвращает модуль."""
+    if db_path is None:
+        db_path = os.path.join(tempfile.mkdtemp(prefix="tgbot-bench-"), "bench.db")
+    os.environ.setdefault("BOT_TOKEN", "0:bench")
+    os.environ.setdefault("ZOOM_URL", "https://example.invalid/zoom")
+    os.environ.setdefault("INDUSTRY_ZOOM_URL", "https://example.invalid/zoom2")
+    os.environ["DB_PATH"] = db_path
+    os.environ.pop("DATABASE_PATH", None)
+    os.environ.setdefault("STORAGE_DIR", os.path.join(os.path.dirname(db_path), "storage"))
+    if str(ROOT) not in sys.path:
+        sys.path.insert(0, str(ROOT))
+    import logging
+
+    logging.disable(logging.WARNING)
+    import bot
+
+    bot.ensure_db_path(bot.DB_PATH)
+    bot.ensure_storage_dir(bot.STORAGE_DIR)
+    return bot
+
+
+def percentiles(samples: list[float]) -> tuple[float, float]:
+    """p50 и p99 в микросекундах."""
+    ordered = sorted(samples)
+    p50 = statistics.median(ordered)
+    p99 = ordered[min(len(ordered) - 1, int(round(len(ordered) * 0.99)) - 1)]
+    return p50 * 1e6, p99 * 1e6
+
+
+def measure(fn, *args, repeat: int = 2000, warmup: int = 50) -> tuple[float, float]:
+    for _ in range(warmup):
+        fn(*args)
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(*args)
+        samples.append(time.perf_counter() - started)
+    return percentiles(samples)
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Микро-бенчмарк пула соединений SQLite.
+
+Сравнивает p50/p99 задержку горячих хелперов при новом соединении на каждый
+вызов (DB_POOL_ENABLED=0, прежнее поведение) и с пулом потока.
+
+    python benchmarks/bench_db_pool.py [--profiles 500] [--docs 300] [--repeat 2000]
+"""
+import argparse
+from datetime import datetime
+
+from _bootstrap import load_bot, measure
+
+
+def seed(bot, profiles: int, docs: int):
+    con = bot.db_connect()
+    cur = con.cursor()
+    now = datetime.utcnow().isoformat()
+    cur.executemany(
+        """INSERT INTO profiles(full_name, year_start, city, birthday, about, topics, tg_link, created_at)
+           VALUES (?, 2020, 'Москва', '01.02', 'о себе', 'темы', ?, ?)""",
+        [(f"Сотрудник {i}", f"@user{i}", now) for i in range(profiles)],
+    )
+    cur.execute("INSERT INTO doc_categories(title, created_at) VALUES ('Регламенты', ?)", (now,))
+    category_id = cur.lastrowid
+    cur.executemany(
+        """INSERT INTO docs(category_id, title, description, file_id, uploaded_at, content_text)
+           VALUES (?, ?, 'описание', ?, ?, ?)""",
+        [
+            (category_id, f"Документ {i}", f"file{i}", now, ("текст отпуск регламент " * 200) + str(i))
+            for i in range(docs)
+        ],
+    )
+    cur.executemany(
+        """INSERT INTO notifications(user_id, notification_type, title, body, is_read, created_at)
+           VALUES (42, 'info', 'Уведомление', '', ?, ?)""",
+        [(i % 2, now) for i in range(200)],
+    )
+    con.commit()
+    con.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profiles", type=int, default=500)
+    parser.add_argument("--docs", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    bot = load_bot()
+    bot.db_init()
+    seed(bot, args.profiles, args.docs)
+
+    cases = [
+        ("db_profiles_get", bot.db_profiles_get, (args.profiles // 2,), args.repeat),
+        ("db_notifications_unread_count", bot.db_notifications_unread_count, (42,), args.repeat),
+        ("db_docs_search", bot.db_docs_search, ("отпуск",), max(20, args.repeat // 20)),
+    ]
+    print(f"{'function':32} {'mode':8} {'p50, us':>10} {'p99, us':>10}")
+    for name, fn, fn_args, repeat in cases:
+        for enabled in (False, True):
+            bot.DB_POOL_ENABLED = enabled
+            p50, p99 = measure(fn, *fn_args, repeat=repeat)
+            mode = "pool" if enabled else "connect"
+            print(f"{name:32} {mode:8} {p50:10.1f} {p99:10.1f}")
+    bot.db_pool_close_all()
+    print("pool stats:", bot.db_pool_stats())
+
+
+if __name__ == "__main__":
+    main()
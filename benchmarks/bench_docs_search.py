@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Листание результатов поиска документов: сессия поиска против поиска заново.
+
+«research» очищает DOCS_SEARCH_SESSIONS перед каждым нажатием, то есть
+повторяет прежнее поведение: db_docs_search (и db_docs_search_by_tag при
+фильтре по тегу) на каждое ◀️/▶️.
+
+    python benchmarks/bench_docs_search.py [--docs 5000] [--repeat 300]
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime
+
+from _bootstrap import load_bot, percentiles
+
+
+class Context:
+    def __init__(self):
+        self.user_data = {}
+
+
+def seed(bot, docs: int):
+    con = bot.db_connect()
+    now = datetime.utcnow().isoformat()
+    con.executemany(
+        "INSERT INTO doc_categories(title, created_at) VALUES (?, ?)",
+        [(f"Категория {i}", now) for i in range(20)],
+    )
+    con.executemany(
+        "INSERT INTO docs(category_id, title, description, file_id, uploaded_at, content_text) VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            (
+                1 + i % 20,
+                f"Регламент {i}",
+                "Порядок оформления отпуска" if i % 3 else "Командировки",
+                f"file{i}",
+                now,
+                "Заявление на отпуск подаётся за две недели. " * 40,
+            )
+            for i in range(docs)
+        ],
+    )
+    con.execute("INSERT INTO doc_tags(title, created_at) VALUES ('кадры', ?)", (now,))
+    con.executemany("INSERT INTO doc_tag_links(doc_id, tag_id) VALUES (?, 1)", [(1 + i,) for i in range(0, docs, 2)])
+    con.commit()
+    con.close()
+    bot.db_docs_fts_rebuild()
+
+
+async def run(bot, mode: str, filters_state: dict, repeat: int) -> tuple[float, float]:
+    context = Context()
+    bot.set_docs_search_state(context, query="отпуск", filters_state=filters_state)
+    samples = []
+    for index in range(repeat):
+        if mode == "research":
+            bot.DOCS_SEARCH_SESSIONS.clear()
+        started = time.perf_counter()
+        await bot.build_docs_search_results(context, index % 40, 1)
+        samples.append(time.perf_counter() - started)
+    return percentiles(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=300)
+    args = parser.parse_args()
+
+    bot = load_bot()
+    bot.db_init()
+    seed(bot, args.docs)
+
+    print(f"{args.docs} docs, query «отпуск»")
+    print(f"{'filter':8} {'mode':9} {'p50, us':>10} {'p99, us':>10}")
+    for name, filters_state in (("none", {}), ("tag", {"tag_id": 1, "tag_title": "кадры"})):
+        for mode in ("research", "session"):
+            p50, p99 = asyncio.run(run(bot, mode, filters_state, args.repeat))
+            print(f"{name:8} {mode:9} {p50:10.1f} {p99:10.1f}")
+    print("sessions:", bot.DOCS_SEARCH_SESSIONS.stats())
+
+
+if __name__ == "__main__":
+    main()
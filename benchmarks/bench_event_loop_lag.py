@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Задержка event loop во время тяжёлого запроса.
+
+Запускает EventLoopLagMonitor с коротким интервалом и выполняет серию
+db_docs_search по большой библиотеке: сначала прямо в event loop (как раньше),
+затем через ``await db.call(...)``. Выводит p50/p99/max задержки цикла.
+
+    python benchmarks/bench_event_loop_lag.py [--docs 2000] [--queries 10]
+"""
+import argparse
+import asyncio
+from datetime import datetime
+
+from _bootstrap import load_bot
+
+
+def seed(bot, docs: int):
+    con = bot.db_connect()
+    cur = con.cursor()
+    now = datetime.utcnow().isoformat()
+    cur.execute("INSERT INTO doc_categories(title, created_at) VALUES ('Регламенты', ?)", (now,))
+    category_id = cur.lastrowid
+    body = "регламент командировки отпуск согласование " * 2000
+    cur.executemany(
+        """INSERT INTO docs(category_id, title, description, file_id, uploaded_at, content_text)
+           VALUES (?, ?, '', ?, ?, ?)""",
+        [(category_id, f"Документ {i}", f"file{i}", now, body + str(i)) for i in range(docs)],
+    )
+    con.commit()
+    con.close()
+
+
+async def run_mode(bot, offload: bool, queries: int) -> dict:
+    monitor = bot.EventLoopLagMonitor(interval=0.01, window=100_000)
+    monitor.start()
+    await asyncio.sleep(0.05)
+    for _ in range(queries):
+        if offload:
+            await bot.db.call(bot.db_docs_search, "отпуск")
+        else:
+            bot.db_docs_search("отпуск")
+        await asyncio.sleep(0)
+    await asyncio.sleep(0.05)
+    await monitor.stop()
+    return monitor.snapshot()
+
+
+async def main_async(args):
+    bot = load_bot()
+    bot.db_init()
+    seed(bot, args.docs)
+    print(f"{'mode':10} {'p50, ms':>9} {'p99, ms':>9} {'max, ms':>9}")
+    for offload in (False, True):
+        snap = await run_mode(bot, offload, args.queries)
+        mode = "db.call" if offload else "inline"
+        print(f"{mode:10} {snap['p50_ms']:9.1f} {snap['p99_ms']:9.1f} {snap['max_ms']:9.1f}")
+    bot.db.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=10)
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Перелистывание FAQ: раскладка из FAQ_LAYOUT_CACHE против раскладки заново.
+
+«repack» очищает FAQ_LAYOUT_CACHE перед каждым вызовом, то есть повторяет
+прежнее поведение: полное чтение faq_items и упаковка всех карточек в
+страницы на каждое нажатие ◀️/▶️.
+
+    python benchmarks/bench_faq_pages.py [--items 1000] [--repeat 300]
+"""
+import argparse
+from datetime import datetime
+
+from _bootstrap import load_bot, measure
+
+
+def seed(bot, items: int):
+    con = bot.db_connect()
+    now = datetime.utcnow().isoformat()
+    con.executemany(
+        "INSERT INTO faq_items(question, answer, created_at) VALUES (?, ?, ?)",
+        [
+            (
+                f"Как оформить <b>заявку</b> № {i}?",
+                ("Откройте раздел заявок и заполните форму. " * (5 + i % 40)).strip(),
+                now,
+            )
+            for i in range(items)
+        ],
+    )
+    con.commit()
+    con.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=300)
+    args = parser.parse_args()
+
+    bot = load_bot()
+    bot.db_init()
+    seed(bot, args.items)
+    middle = args.items // 12
+
+    cases = [
+        # Текущий список вопросов (FAQ UX v6).
+        ("answers page", lambda: bot.build_help_faq_answers_page(middle, 1)),
+        # Упаковка полных карточек по FAQ_PAGE_TEXT_LIMIT (ядро).
+        ("faq_pack_pages", lambda: bot.faq_layout(bot.faq_pack_pages, bot.faq_items_all())[middle // 2]),
+    ]
+    print(f"{args.items} FAQ items")
+    print(f"{'case':16} {'mode':7} {'p50, us':>10} {'p99, us':>10}")
+    for name, fn in cases:
+        def repack():
+            bot.FAQ_LAYOUT_CACHE.clear()
+            return fn()
+
+        for mode, call in (("repack", repack), ("cached", fn)):
+            p50, p99 = measure(call, repeat=args.repeat)
+            print(f"{name:16} {mode:7} {p50:10.1f} {p99:10.1f}")
+    print("cache:", bot.FAQ_LAYOUT_CACHE.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+Задержка маршрутизации нажатий help:* и текстового ввода.
+
+Для каждого callback_data, встречающегося в bot.py, измеряется
+время от вызова обработчика до первого обращения к Bot API (fake-бот
+прерывает обработку на этом вызове, поэтому сама работа раздела не
+учитывается). Сначала замеряется исходная цепочка обёрток cb_help/on_text,
+затем маршрутизаторы из build_help_routers(). Доступ участника заранее
+кладётся в кэш.
+
+Перед замером проверяется, что маршрутизаторы ведут себя как цепочка: для
+каждого callback_data и каждого состояния текстового ввода первое обращение к
+Bot API (метод и аргументы), исключение и user_data после вызова совпадают.
+При расхождениях бенчмарк печатает их и завершается с кодом 1.
+
+    python benchmarks/bench_help_router.py [--repeat 200]
+"""
+import argparse
+import asyncio
+import re
+import sys
+import time
+
+from _bootstrap import ROOT, load_bot, percentiles
+
+
+class _Stop(BaseException):
+    """Первый вызов Bot API: дальше раздел уже работает сам."""
+
+
+# Путь к вызванному методу Bot API и его аргументы — для проверки
+# эквивалентности маршрутизаторов и цепочки.
+_API_TRACE: list = []
+
+
+class _Api:
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        _API_TRACE.append(name)
+        return self
+
+    def __call__(self, *args, **kwargs):
+        _API_TRACE.append((repr(args), repr(sorted(kwargs.items()))))
+        raise _Stop
+
+    def __repr__(self):
+        # Без адреса объекта: выводы двух прогонов сравниваются как строки.
+        return f"<{type(self).__name__}>"
+
+
+class _Member:
+    status = "member"
+
+
+class _Bot(_Api):
+    async def get_chat_member(self, chat_id, user_id):
+        return _Member()
+
+
+class _User:
+    id = 42
+    username = "bench"
+    first_name = "Bench"
+    last_name = None
+    full_name = "Bench"
+    is_bot = False
+
+
+class _Chat:
+    id = 42
+    type = "private"
+
+
+class _Query(_Api):
+    def __init__(self, data: str):
+        object.__setattr__(self, "data", data)
+
+
+class _Message(_Api):
+    def __init__(self, text: str):
+        object.__setattr__(self, "text", text)
+        object.__setattr__(self, "chat_id", 42)
+
+
+class _Update:
+    def __init__(self, data: str | None = None, text: str | None = None):
+        self.callback_query = _Query(data) if data is not None else None
+        self.message = _Message(text) if text is not None else None
+        self.effective_message = self.message
+        self.effective_user = _User()
+        self.effective_chat = _Chat()
+
+
+class _Context:
+    def __init__(self, user_data: dict):
+        self.user_data = user_data
+        self.bot = _Bot()
+        self.bot_data = {}
+        self.chat_data = {}
+        self.args = []
+
+
+def known_callbacks() -> list[str]:
+    literals = re.findall(r'"(help:[^"]*)"', (ROOT / "bot.py").read_text(encoding="utf-8"))
+    return sorted({value.split("{")[0] for value in literals} | {"noop"})
+
+
+async def _outcome(handler, update, context) -> tuple:
+    """Первое обращение к Bot API, исключение и user_data после вызова."""
+    _API_TRACE.clear()
+    try:
+        await handler(update, context)
+        error = None
+    except _Stop:
+        error = None
+    except Exception as exc:
+        error = f"{type(exc).__name__}: {exc}"
+    return tuple(_API_TRACE), error, repr(sorted(context.user_data.items()))
+
+
+def _use_layers(bot, layer_globals: dict):
+    # build_help_routers() переназначает в bot «предыдущие версии» обработчиков
+    # на уровни маршрутизатора. Чтобы вызвать исходную цепочку обёрток,
+    # возвращаем сохранённые функции, для маршрутизатора — снова его уровни.
+    vars(bot).update(layer_globals)
+
+
+async def check_equivalence(bot, chain, routed, routers, datas, text_states) -> list[str]:
+    callback_router, text_router = routers
+    cases = [("callback", data, bot.cb_help, callback_router.dispatch, {"data": data}, {}) for data in datas]
+    cases += [
+        ("text state", state, bot.on_text, text_router.dispatch, {"text": "бенчмарк"}, state)
+        for state in text_states
+    ]
+    mismatches = []
+    for kind, label, chain_handler, router_handler, update_kwargs, state in cases:
+        _use_layers(bot, chain)
+        expected = await _outcome(chain_handler, _Update(**update_kwargs), _Context(dict(state)))
+        _use_layers(bot, routed)
+        actual = await _outcome(router_handler, _Update(**update_kwargs), _Context(dict(state)))
+        if expected != actual:
+            mismatches.append(f"{kind} {label!r}:\n  chain:  {expected}\n  router: {actual}")
+    return mismatches
+
+
+async def _time_call(handler, update, context) -> float:
+    started = time.perf_counter()
+    try:
+        await handler(update, context)
+    except _Stop:
+        pass
+    except Exception:
+        pass
+    return time.perf_counter() - started
+
+
+async def run(handler_cb, handler_text, datas, text_states, repeat: int) -> dict:
+    cb_samples = []
+    worst = (0.0, "")
+    for data in datas:
+        per_data = []
+        for _ in range(repeat):
+            per_data.append(await _time_call(handler_cb, _Update(data=data), _Context({})))
+        cb_samples.extend(per_data)
+        median = sorted(per_data)[len(per_data) // 2]
+        if median > worst[0]:
+            worst = (median, data)
+    text_samples = []
+    for state in text_states:
+        for _ in range(repeat):
+            text_samples.append(
+                await _time_call(handler_text, _Update(text="бенчмарк"), _Context(dict(state)))
+            )
+    return {
+        "callback": percentiles(cb_samples),
+        "text": percentiles(text_samples),
+        "worst": (worst[0] * 1e6, worst[1]),
+    }
+
+
+async def main_async(args):
+    bot = load_bot()
+    bot.db_init()
+    bot.CHAT_MEMBER_CACHE.set((bot.ACCESS_CHAT_ID, _User.id), "member")
+    datas = known_callbacks()
+    state_keys = dict.fromkeys(key for _, keys in bot.HELP_TEXT_LAYERS for key in keys)
+    text_states = [{}] + [{key: "x"} for key in state_keys]
+
+    aliases = [alias for alias, _ in bot.HELP_CALLBACK_LAYERS] + [alias for alias, _ in bot.HELP_TEXT_LAYERS]
+    chain = {alias: getattr(bot, alias) for alias in aliases}
+    callback_router, text_router = bot.build_help_routers()
+    routed = {alias: getattr(bot, alias) for alias in aliases}
+
+    mismatches = await check_equivalence(bot, chain, routed, (callback_router, text_router), datas, text_states)
+    if mismatches:
+        print("\n".join(mismatches))
+        print(f"router differs from the wrapper chain: {len(mismatches)} case(s)")
+        sys.exit(1)
+    print(f"router matches the wrapper chain: {len(datas)} callbacks, {len(text_states)} text states")
+
+    _use_layers(bot, chain)
+    results = {"chain": await run(bot.cb_help, bot.on_text, datas, text_states, args.repeat)}
+    _use_layers(bot, routed)
+    results["router"] = await run(
+        callback_router.dispatch, text_router.dispatch, datas, text_states, args.repeat
+    )
+
+    print(f"callback_data: {len(datas)}, text states: {len(text_states)}, repeat: {args.repeat}")
+    print(f"{'mode':8} {'cb p50, us':>11} {'cb p99, us':>11} {'text p50':>9} {'text p99':>9}  slowest callback")
+    for mode, res in results.items():
+        cb50, cb99 = res["callback"]
+        tx50, tx99 = res["text"]
+        worst_us, worst_data = res["worst"]
+        print(
+            f"{mode:8} {cb50:11.1f} {cb99:11.1f} {tx50:9.1f} {tx99:9.1f}  "
+            f"{worst_data} ({worst_us:.0f} us)"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=200)
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Задержка прямых вызовов Bot API: новый httpx.AsyncClient на вызов против
+общего клиента с keep-alive (HTTP_CLIENTS).
+
+Запросы идут в локальную заглушку Bot API. Установка TCP+TLS соединения с
+api.telegram.org имитируется задержкой --connect-delay на каждое новое
+соединение (по умолчанию 30 мс — порядка двух RTT до Telegram).
+
+    python benchmarks/bench_http_client.py [--calls 200] [--connect-delay 30]
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import httpx
+
+from _bootstrap import load_bot, percentiles
+
+
+class StubBotApi:
+    """HTTP/1.1-заглушка: на любой POST отвечает {"ok": true}."""
+
+    def __init__(self, connect_delay: float):
+        self.connect_delay = connect_delay
+        self.connections = 0
+        self.server = None
+
+    async def start(self) -> int:
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        await asyncio.sleep(self.connect_delay)
+        body = json.dumps({"ok": True, "result": {"message_id": 1}}).encode()
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = 0
+                for line in head.decode("latin-1").split("\r\n"):
+                    name, _, value = line.partition(":")
+                    if name.strip().lower() == "content-length":
+                        length = int(value.strip())
+                if length:
+                    await reader.readexactly(length)
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    + f"Content-Length: {len(body)}\r\n\r\n".encode()
+                    + body
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+
+async def per_call_client(url: str, payload: dict):
+    """Прежний _telegram_bot_api_json: клиент создаётся на каждый вызов."""
+    async with httpx.AsyncClient(timeout=25.0) as client:
+        response = await client.post(url, json=payload)
+    return response.json().get("result")
+
+
+async def run(call, calls: int) -> list[float]:
+    samples = []
+    for _ in range(calls):
+        started = time.perf_counter()
+        await call()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+async def main_async(args):
+    stub = StubBotApi(args.connect_delay / 1000)
+    port = await stub.start()
+    os.environ["TELEGRAM_API_URL"] = f"http://127.0.0.1:{port}"
+    bot = load_bot()
+    payload = {"chat_id": 42, "text": "бенчмарк"}
+    url = f"{bot.TELEGRAM_API_URL}/bot{bot.BOT_TOKEN}/sendMessage"
+
+    cases = [
+        ("per-call", lambda: per_call_client(url, payload)),
+        ("shared", lambda: bot._telegram_bot_api_json("sendMessage", payload)),
+    ]
+    print(f"calls: {args.calls}, simulated handshake: {args.connect_delay} ms")
+    print(f"{'client':9} {'p50, ms':>8} {'p99, ms':>8} {'connections':>12}")
+    for name, call in cases:
+        stub.connections = 0
+        p50, p99 = percentiles(await run(call, args.calls))
+        print(f"{name:9} {p50 / 1000:8.2f} {p99 / 1000:8.2f} {stub.connections:12d}")
+
+    await bot.HTTP_CLIENTS.aclose()
+    await stub.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--connect-delay", type=float, default=30.0, help="мс на новое соединение")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Построение горячих клавиатур: из кэша (cached_keyboard) против сборки заново.
+
+«rebuild» очищает KEYBOARD_CACHE перед каждым вызовом, то есть повторяет
+прежнее поведение: запросы к SQLite и копирование рядов каждым слоем меню.
+
+    python benchmarks/bench_keyboards.py [--profiles 500] [--docs 2000] [--repeat 2000]
+"""
+import argparse
+from datetime import datetime
+
+from _bootstrap import load_bot, measure
+
+
+def seed(bot, profiles: int, docs: int):
+    con = bot.db_connect()
+    cur = con.cursor()
+    now = datetime.utcnow().isoformat()
+    cur.executemany(
+        """INSERT INTO profiles(full_name, year_start, city, about, topics, tg_link, created_at)
+           VALUES (?, 2020, 'Москва', 'о себе', 'темы', ?, ?)""",
+        [(f"Сотрудник {i}", f"@user{i}", now) for i in range(profiles)],
+    )
+    cur.executemany(
+        "INSERT INTO doc_categories(title, created_at) VALUES (?, ?)",
+        [(f"Категория {i}", now) for i in range(30)],
+    )
+    cur.executemany(
+        "INSERT INTO docs(category_id, title, file_id, uploaded_at) VALUES (?, ?, ?, ?)",
+        [(1 + i % 30, f"Документ {i}", f"file{i}", now) for i in range(docs)],
+    )
+    cur.executemany("INSERT INTO doc_tags(title, created_at) VALUES (?, ?)", [(f"тег{i}", now) for i in range(40)])
+    cur.executemany(
+        "INSERT INTO doc_tag_links(doc_id, tag_id) VALUES (?, ?)",
+        [(1 + i, 1 + i % 40) for i in range(docs)],
+    )
+    cur.executemany(
+        "INSERT INTO doc_collections(title, created_at) VALUES (?, ?)",
+        [(f"Подборка {i}", now) for i in range(15)],
+    )
+    cur.executemany(
+        "INSERT INTO doc_collection_items(collection_id, doc_id, position) VALUES (?, ?, ?)",
+        [(1 + i % 15, 1 + i, i) for i in range(docs // 2)],
+    )
+    cur.executemany(
+        "INSERT INTO broadcast_tags(name, created_at) VALUES (?, ?)",
+        [(f"tag{i}", now) for i in range(25)],
+    )
+    con.commit()
+    con.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profiles", type=int, default=500)
+    parser.add_argument("--docs", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    bot = load_bot()
+    bot.db_init()
+    seed(bot, args.profiles, args.docs)
+
+    cases = [
+        ("kb_help_docs_categories", ()),
+        ("kb_doc_tags_manage", ()),
+        ("kb_doc_collections", ()),
+        ("kb_broadcast_tags_manage", ()),
+        ("kb_help_links_menu", ()),
+        ("kb_help_team", (3,)),
+        ("kb_help_settings", ()),
+    ]
+    print(f"{'keyboard':26} {'mode':8} {'p50, us':>10} {'p99, us':>10}")
+    for name, fn_args in cases:
+        builder = getattr(bot, name)
+
+        def rebuild(*a):
+            bot.KEYBOARD_CACHE.clear()
+            return builder(*a)
+
+        for mode, fn in (("rebuild", rebuild), ("cached", builder)):
+            p50, p99 = measure(fn, *fn_args, repeat=args.repeat)
+            print(f"{name:26} {mode:8} {p50:10.1f} {p99:10.1f}")
+    print("cache:", bot.KEYBOARD_CACHE.stats())
+
+
+if __name__ == "__main__":
+    main()
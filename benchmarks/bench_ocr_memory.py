@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Пиковая память (RSS) OCR отсканированного PDF.
+
+Каждый режим запускается в отдельном процессе, чтобы ru_maxrss не смешивался
+(память внешних pdftoppm/tesseract не учитывается):
+
+    batch     — прежняя схема: все страницы рендерятся в память, затем OCR;
+    stream    — потоковый конвейер _extract_pdf_text с фиксированным DPI 200;
+    adaptive  — потоковый конвейер с первым проходом в DOC_OCR_FAST_DPI и
+                повтором в DOC_OCR_DPI только для страниц с низкой уверенностью.
+
+Pillow и остальные Python-пакеты OCR не входят в requirements.txt бота,
+они перечислены в benchmarks/requirements.txt; нужны также системные
+tesseract и pdftoppm. Без --pdf генерируется синтетический скан на --pages
+страниц.
+
+    pip install -r benchmarks/requirements.txt
+    python benchmarks/bench_ocr_memory.py [--pdf scan.pdf] [--pages 30]
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from _bootstrap import ROOT
+
+MODES = {
+    "batch": {"DOC_OCR_DPI": "200", "DOC_OCR_FAST_DPI": "200"},
+    "stream": {"DOC_OCR_DPI": "200", "DOC_OCR_FAST_DPI": "200"},
+    "adaptive": {},
+}
+
+
+def make_scan(path: Path, pages: int):
+    """Многостраничный PDF из картинок с текстом (без текстового слоя)."""
+    from PIL import Image, ImageDraw
+
+    images = []
+    for page_no in range(1, pages + 1):
+        image = Image.new("L", (1240, 1754), 255)
+        draw = ImageDraw.Draw(image)
+        for line in range(40):
+            draw.text((80, 80 + line * 40), f"Page {page_no} line {line} vacation policy", fill=0)
+        images.append(image)
+    images[0].save(path, save_all=True, append_images=images[1:], resolution=150)
+
+
+def _batch_extract(worker, path: Path) -> str:
+    """Прежний _extract_pdf_text: список всех отрисованных страниц в памяти."""
+    _text, page_count, _errors = worker._pdf_text_layer(path)
+    last_page = min(page_count or worker.DOC_OCR_MAX_PAGES, worker.DOC_OCR_MAX_PAGES)
+    try:
+        from pdf2image import convert_from_path
+
+        images = convert_from_path(str(path), dpi=200, first_page=1, last_page=last_page)
+    except Exception:
+        from PIL import Image
+
+        with tempfile.TemporaryDirectory(prefix="bench_ocr_") as tmp_dir:
+            subprocess.run(
+                ["pdftoppm", "-png", "-r", "200", "-f", "1", "-l", str(last_page), str(path), f"{tmp_dir}/page"],
+                check=True,
+            )
+            images = []
+            for image_path in sorted(Path(tmp_dir).glob("page-*.png")):
+                with Image.open(image_path) as image:
+                    images.append(image.copy())
+    parts = [worker._ocr_pil_image(image)[0] for image in images]
+    return worker._normalize_document_text("\n".join(parts))
+
+
+def child(mode: str, pdf: str):
+    # Извлечение не зависит от bot.py: хватает модуля рабочих процессов.
+    sys.path.insert(0, str(ROOT))
+    import document_worker as worker
+
+    retries = 0
+    high_dpi = worker._ocr_pdf_page_high_dpi
+
+    def counting_high_dpi(*args):
+        nonlocal retries
+        retries += 1
+        return high_dpi(*args)
+
+    worker._ocr_pdf_page_high_dpi = counting_high_dpi
+    started = time.perf_counter()
+    if mode == "batch":
+        text = _batch_extract(worker, Path(pdf))
+    else:
+        text, _ocr_used, _errors = worker._extract_pdf_text(Path(pdf))
+    elapsed = time.perf_counter() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({
+        "seconds": elapsed,
+        "rss_mb": peak / 1024,
+        "chars": len(text),
+        "retries": retries,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pdf")
+    parser.add_argument("--pages", type=int, default=30)
+    parser.add_argument("--child", choices=sorted(MODES))
+    args = parser.parse_args()
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        sys.exit("Нужен Pillow: pip install -r benchmarks/requirements.txt")
+    if args.child:
+        child(args.child, args.pdf)
+        return
+
+    tmp_dir = tempfile.mkdtemp(prefix="bench_ocr_")
+    pdf = args.pdf
+    if not pdf:
+        pdf = os.path.join(tmp_dir, "scan.pdf")
+        make_scan(Path(pdf), args.pages)
+
+    print(f"pdf: {pdf}")
+    print(f"{'mode':9} {'peak RSS, MB':>13} {'time, s':>8} {'chars':>7} {'hi-DPI':>7}")
+    for mode, env in MODES.items():
+        result = subprocess.run(
+            [sys.executable, __file__, "--child", mode, "--pdf", pdf],
+            env={**os.environ, **env},
+            stdout=subprocess.PIPE,
+            check=True,
+        )
+        res = json.loads(result.stdout.decode().strip().splitlines()[-1])
+        print(
+            f"{mode:9} {res['rss_mb']:13.1f} {res['seconds']:8.2f} "
+            f"{res['chars']:7d} {res['retries']:7d}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Время восстановления ZIP-бэкапа: построчный импорт против restore_backup_zip.
+
+Генерируется бэкап на --profiles анкет и --docs документов. Каждый режим
+запускается в отдельном процессе со своей пустой БД; бэкап восстанавливается
+дважды — в пустую базу и повторно поверх тех же данных (все строки — upsert):
+
+    row-by-row  — прежняя схема: INSERT/SELECT на каждую строку, своё
+                  соединение на каждую категорию документа;
+    bulk        — restore_backup_zip без отложенных индексов;
+    bulk+defer  — restore_backup_zip, вторичные индексы строятся после загрузки.
+
+    python benchmarks/bench_restore.py [--profiles 10000] [--docs 5000]
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+from datetime import datetime
+
+from _bootstrap import load_bot
+
+MODES = ("row-by-row", "bulk", "bulk+defer")
+
+
+def make_backup(path: str, profiles: int, docs: int, categories: int = 20):
+    def write(zf, name, fieldnames, rows):
+        buf = io.StringIO()
+        writer = csv.DictWriter(buf, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+        zf.writestr(name, buf.getvalue().encode("utf-8-sig"))
+
+    interests = ["sport", "music", "travel", "books", "games", "cooking"]
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        write(zf, "doc_categories.csv", ["title", "created_at"], (
+            {"title": f"Категория {i}", "created_at": "2024-01-01T00:00:00"} for i in range(categories)
+        ))
+        write(zf, "docs.csv", [
+            "category_title", "doc_title", "doc_description", "doc_file_id",
+            "doc_file_unique_id", "doc_mime_type", "doc_local_path",
+        ], (
+            {
+                "category_title": f"Категория {i % categories}",
+                "doc_title": f"Регламент {i}",
+                "doc_description": f"Описание документа {i}",
+                "doc_file_id": f"file-{i}",
+                "doc_file_unique_id": f"uniq-{i}",
+                "doc_mime_type": "application/pdf",
+                "doc_local_path": "",
+            }
+            for i in range(docs)
+        ))
+        write(zf, "profiles.csv", [
+            "profile_id", "full_name", "year_start", "city", "birthday", "about", "topics",
+            "interests_json", "tg_link", "tg_user_id", "is_active", "avg_test_score", "photo_file_id",
+        ], (
+            {
+                "profile_id": i,
+                "full_name": f"Сотрудник {i}",
+                "year_start": 2000 + i % 25,
+                "city": "Москва",
+                "birthday": f"{i % 28 + 1:02d}.{i % 12 + 1:02d}",
+                "about": "о себе",
+                "topics": "темы",
+                "interests_json": json.dumps(interests[i % 4:i % 4 + 2]),
+                "tg_link": f"@user{i}",
+                "tg_user_id": 100000 + i,
+                "is_active": 1,
+                "avg_test_score": i % 100,
+                "photo_file_id": "",
+            }
+            for i in range(1, profiles + 1)
+        ))
+
+
+def row_by_row_restore(bot, path: str) -> dict:
+    """Прежний restore_backup_zip_bytes (разделы profiles, категории и docs)."""
+    stats = {"profiles": 0, "categories": 0, "docs": 0}
+    with zipfile.ZipFile(path) as zf:
+        rows = csv.DictReader(io.StringIO(zf.read("profiles.csv").decode("utf-8-sig")))
+        con = bot.db_connect()
+        cur = con.cursor()
+        for row in rows:
+            cur.execute(
+                bot._RESTORE_PROFILE_UPSERT_SQL,
+                (
+                    int(row["profile_id"]), row["full_name"], int(row["year_start"]), row["city"],
+                    row["birthday"] or None, row["about"], row["topics"],
+                    bot._profile_interests_encode(bot._profile_interests_decode(row["interests_json"])),
+                    row["tg_link"], int(row["tg_user_id"]), int(row["is_active"]),
+                    int(row["avg_test_score"]), row["photo_file_id"] or None, datetime.utcnow().isoformat(),
+                ),
+            )
+            stats["profiles"] += 1
+        con.commit()
+        con.close()
+
+        rows = csv.DictReader(io.StringIO(zf.read("doc_categories.csv").decode("utf-8-sig")))
+        con = bot.db_connect()
+        cur = con.cursor()
+        for row in rows:
+            cur.execute(
+                "INSERT INTO doc_categories(title, created_at) VALUES(?, ?) "
+                "ON CONFLICT(title) DO UPDATE SET created_at=excluded.created_at",
+                (row["title"], row["created_at"]),
+            )
+            stats["categories"] += 1
+        con.commit()
+        con.close()
+
+        def ensure_category(title: str) -> int:
+            con = bot.db_connect()
+            cur = con.cursor()
+            cur.execute("SELECT id FROM doc_categories WHERE title=?", (title,))
+            r = cur.fetchone()
+            con.close()
+            return int(r[0])
+
+        rows = csv.DictReader(io.StringIO(zf.read("docs.csv").decode("utf-8-sig")))
+        con = bot.db_connect()
+        cur = con.cursor()
+        for row in rows:
+            cid = ensure_category(row["category_title"])
+            cur.execute(
+                "SELECT id FROM docs WHERE category_id=? AND title=? AND file_id=?",
+                (cid, row["doc_title"], row["doc_file_id"]),
+            )
+            if cur.fetchone():
+                continue
+            cur.execute(
+                "INSERT INTO docs(category_id, title, description, file_id, file_unique_id, mime_type, uploaded_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    cid, row["doc_title"], row["doc_description"], row["doc_file_id"],
+                    row["doc_file_unique_id"], row["doc_mime_type"], datetime.utcnow().isoformat(),
+                ),
+            )
+            stats["docs"] += 1
+        con.commit()
+        con.close()
+    bot.db_docs_fts_rebuild()
+    return stats
+
+
+def child(mode: str, path: str):
+    bot = load_bot()
+    bot.db_init()
+    if mode == "row-by-row":
+        restore = lambda: row_by_row_restore(bot, path)  # noqa: E731
+    else:
+        bot.RESTORE_DEFER_INDEXES_MIN_BYTES = 0 if mode == "bulk+defer" else 1 << 62
+        restore = lambda: bot.restore_backup_zip(path)  # noqa: E731
+    result = {}
+    for run in ("empty", "repeat"):
+        started = time.perf_counter()
+        stats = restore()
+        result[run] = time.perf_counter() - started
+    result["profiles"] = stats["profiles"]
+    result["docs"] = bot.db_connect().execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profiles", type=int, default=10000)
+    parser.add_argument("--docs", type=int, default=5000)
+    parser.add_argument("--child", choices=MODES)
+    parser.add_argument("--zip")
+    args = parser.parse_args()
+    if args.child:
+        child(args.child, args.zip)
+        return
+
+    path = os.path.join(tempfile.mkdtemp(prefix="bench_restore_"), "backup.zip")
+    make_backup(path, args.profiles, args.docs)
+    print(f"backup: {args.profiles} profiles, {args.docs} docs, {os.path.getsize(path) // 1024} KB")
+    print(f"{'mode':11} {'empty DB, s':>12} {'repeat, s':>10} {'docs':>6}")
+    for mode in MODES:
+        result = subprocess.run(
+            [sys.executable, __file__, "--child", mode, "--zip", path],
+            stdout=subprocess.PIPE,
+            check=True,
+        )
+        res = json.loads(result.stdout.decode().strip().splitlines()[-1])
+        print(f"{mode:11} {res['empty']:12.2f} {res['repeat']:10.2f} {res['docs']:6d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Время db_init() на большой базе: все шаги схемы на каждом запуске (как было
+до реестра миграций) против версионированных миграций.
+
+Сначала создаётся база с --profiles анкетами, --assignments назначениями
+тестов, --notifications уведомлениями и --docs документами. Каждый запуск
+идёт в отдельном процессе:
+
+    every-boot  — meta.schema_version и каталог битов интересов сброшены, так
+                  что выполняются все CREATE/ALTER, заполнения и пересчёт масок;
+    versioned   — обычный повторный запуск: только задачи запуска.
+
+    python benchmarks/bench_startup.py [--profiles 50000] [--runs 5]
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from _bootstrap import load_bot
+
+MODES = ("every-boot", "versioned")
+
+
+def populate(db_path: str, args):
+    bot = load_bot(db_path)
+    bot.db_init()
+    rnd = random.Random(7)
+    now = "2026-01-01T00:00:00"
+    keys = list(bot.PROFILE_INTEREST_BITS)
+    con = sqlite3.connect(db_path)
+    con.executemany(
+        "INSERT INTO profiles(full_name, year_start, city, birthday, about, topics, interests_json, tg_link, created_at) "
+        "VALUES(?, ?, 'Москва', ?, '', '', ?, ?, ?)",
+        (
+            (
+                f"Сотрудник {i}", 2000 + i % 25, f"{i % 28 + 1:02d}.{i % 12 + 1:02d}",
+                json.dumps(rnd.sample(keys, 3)), f"@user{i}", now,
+            )
+            for i in range(args.profiles)
+        ),
+    )
+    con.execute("INSERT INTO test_templates(title, created_at) VALUES('Тест', ?)", (now,))
+    con.executemany(
+        "INSERT INTO test_questions(template_id, idx, q_type, question_text, created_at) VALUES(1, ?, 'open', ?, ?)",
+        ((i, f"Вопрос {i}", now) for i in range(20)),
+    )
+    con.executemany(
+        "INSERT INTO test_assignments(template_id, profile_id, assigned_at, status) VALUES(1, ?, ?, 'finished')",
+        ((1 + i % args.profiles, now) for i in range(args.assignments)),
+    )
+    con.executemany(
+        "INSERT INTO notifications(user_id, notification_type, title, created_at) VALUES(?, 'info', 'Новость', ?)",
+        ((i % args.profiles, now) for i in range(args.notifications)),
+    )
+    con.execute("INSERT INTO doc_categories(title, created_at) VALUES('Регламенты', ?)", (now,))
+    con.executemany(
+        "INSERT INTO docs(category_id, title, file_id, uploaded_at) VALUES(1, ?, ?, ?)",
+        ((f"Документ {i}", f"file-{i}", now) for i in range(args.docs)),
+    )
+    con.commit()
+    con.close()
+    bot.db_init()
+
+
+def child(mode: str, db_path: str):
+    if mode == "every-boot":
+        con = sqlite3.connect(db_path)
+        con.execute("DELETE FROM meta WHERE key='schema_version'")
+        con.execute("DELETE FROM profile_interest_bits")
+        con.commit()
+        con.close()
+    bot = load_bot(db_path)
+    started = time.perf_counter()
+    bot.db_init()
+    print(json.dumps({"seconds": time.perf_counter() - started}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profiles", type=int, default=50000)
+    parser.add_argument("--assignments", type=int, default=100000)
+    parser.add_argument("--notifications", type=int, default=200000)
+    parser.add_argument("--docs", type=int, default=2000)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--child", choices=MODES)
+    parser.add_argument("--db")
+    args = parser.parse_args()
+    if args.child:
+        child(args.child, args.db)
+        return
+
+    db_path = os.path.join(tempfile.mkdtemp(prefix="bench_startup_"), "bench.db")
+    populate(db_path, args)
+    print(
+        f"db: {os.path.getsize(db_path) // (1024 * 1024)} MB, {args.profiles} profiles, "
+        f"{args.assignments} assignments, {args.notifications} notifications, {args.docs} docs"
+    )
+    print(f"{'mode':11} {'median, ms':>11} {'max, ms':>9}")
+    for mode in MODES:
+        samples = []
+        for _ in range(args.runs):
+            result = subprocess.run(
+                [sys.executable, __file__, "--child", mode, "--db", db_path],
+                stdout=subprocess.PIPE,
+                check=True,
+            )
+            samples.append(json.loads(result.stdout.decode().strip().splitlines()[-1])["seconds"])
+        print(f"{mode:11} {statistics.median(samples) * 1000:11.1f} {max(samples) * 1000:9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,28 @@
 # -*- coding: utf-8 -*-
 import asyncio
 import os
+import sys
+import multiprocessing
 import re
 import random
 import sqlite3
 import logging
 import time
+import threading
 import csv
 import io
 import zipfile
+import tempfile
 import json
+import functools
+import heapq
+import bisect
+import pickle
 import html as html_lib
 import httpx
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 from datetime import datetime, date, timedelta
 
@@ -27,20 +38,26 @@ from telegram import (
     InlineKeyboardMarkup,
 )
 from telegram.constants import ParseMode
-from telegram.error import Forbidden, TimedOut, NetworkError
+from telegram.error import BadRequest, Forbidden, TimedOut, NetworkError, RetryAfter
 from telegram.helpers import escape
 from telegram.ext import (
     Application,
+    BasePersistence,
     CommandHandler,
     CallbackQueryHandler,
+    ChatMemberHandler,
     InlineQueryHandler,
     ContextTypes,
     MessageHandler,
+    PersistenceInput,
     filters,
 )
 
 from telegram.request import HTTPXRequest
 
+# Начало выполнения тела модуля — для --profile-startup.
+_MODULE_EXEC_STARTED = time.perf_counter()
+
 
 # ---------------- TEXT -> HTML (entities incl. blockquote) ----------------
 def _utf16_to_py_index(s: str, u16_index: int) -> int:
@@ -157,7 +174,7 @@ logging.basicConfig(
     format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
 )
 logger = logging.getLogger("meetings-bot")
-BUILD_VERSION = "PROFILE-ABOUT-DETAILS-2026-07-30-V27"
+BUILD_VERSION = "EXTERNAL-ACCESS-2026-08-04-V33"
 
 PROFILE_INTEREST_MAX = 5
 PROFILE_INTERESTS = [
@@ -186,6 +203,30 @@ PROFILE_INTERESTS = [
 ]
 PROFILE_INTEREST_LABELS = dict(PROFILE_INTERESTS)
 PROFILE_INTEREST_KEYS = set(PROFILE_INTEREST_LABELS)
+# Номер бита интереса в profiles.interests_mask — позиция в каталоге.
+PROFILE_INTEREST_BITS = {key: bit for bit, (key, _label) in enumerate(PROFILE_INTERESTS)}
+
+
+def _interests_mask_sql(column: str) -> str:
+    """SQL-выражение: маска интересов из JSON-колонки по profile_interest_bits."""
+    return (
+        "(SELECT COALESCE(SUM(1 << b.bit), 0) FROM profile_interest_bits b "
+        "WHERE b.interest_key IN (SELECT value FROM json_each("
+        f"CASE WHEN json_valid({column}) THEN {column} ELSE '[]' END)))"
+    )
+
+
+def _birthday_part_sql(column: str, start: int) -> str:
+    """SQL-выражение: день (start=1) или месяц (start=4) из «ДД.ММ», иначе NULL."""
+    return (
+        f"(CASE WHEN TRIM({column}) GLOB '[0-9][0-9].[0-9][0-9]' "
+        f"THEN CAST(substr(TRIM({column}), {start}, 2) AS INTEGER) END)"
+    )
+
+
+def profile_interests_from_mask(mask: int) -> list[str]:
+    return [key for bit, (key, _label) in enumerate(PROFILE_INTERESTS) if mask >> bit & 1]
+
 
 def normalize_profile_interests(values) -> list[str]:
     """Оставляет только разрешённые уникальные интересы, сохраняя порядок каталога."""
@@ -233,15 +274,6 @@ def profile_shared_interests(left_profile: dict | None, right_profile: dict | No
     return [key for key, _label in PROFILE_INTERESTS if key in left and key in right]
 
 
-def filter_shared_interest_matches(matches: list[dict], interest_key: str | None = None) -> list[dict]:
-    """Фильтрует готовую подборку по одному общему интересу."""
-    if not interest_key or interest_key == "all":
-        return list(matches)
-    if interest_key not in PROFILE_INTEREST_KEYS:
-        return []
-    return [item for item in matches if interest_key in item.get("shared_interests", [])]
-
-
 def similar_colleagues_callback(interest_key: str | None, page: int = 0) -> str:
     key = interest_key if interest_key in PROFILE_INTEREST_KEYS else "all"
     return f"help:team:similar:filter:{key}:{max(0, int(page))}"
@@ -255,16 +287,19 @@ DB_PATH = os.getenv("DATABASE_PATH") or os.getenv("DB_PATH", "bot.db")
 
 STORAGE_DIR = os.getenv("STORAGE_DIR", "storage")
 
-# Полнотекстовый индекс документов. Текст ограничивается по размеру, чтобы
-# очень большие файлы не раздували SQLite. OCR по умолчанию распознаёт русский
-# и английский; язык можно переопределить через DOC_OCR_LANG.
-DOC_INDEX_MAX_CHARS = max(10_000, int(os.getenv("DOC_INDEX_MAX_CHARS", "1000000")))
-DOC_OCR_LANG = os.getenv("DOC_OCR_LANG", "rus+eng")
-DOC_OCR_MAX_PAGES = max(1, int(os.getenv("DOC_OCR_MAX_PAGES", "50")))
-DOC_OCR_MAX_IMAGES = max(1, int(os.getenv("DOC_OCR_MAX_IMAGES", "50")))
+# Извлечение текста и OCR живут в document_worker.py: рабочие процессы
+# индексации выполняют его функции; инструменты импортируют его напрямую.
+from document_worker import (
+    _normalize_document_text,
+    ocr_pdf_page,
+    _document_index_result,
+    document_content_hash,
+    extract_document_stage,
+    ocr_settings_key,
+)
+
 DOCS_SEARCH_PAGE_SIZE = 8
 DOC_INDEX_CONCURRENCY = max(1, int(os.getenv("DOC_INDEX_CONCURRENCY", "2")))
-DOC_INDEX_SEMAPHORE = asyncio.Semaphore(DOC_INDEX_CONCURRENCY)
 
 
 # -------- ACCESS CONTROL --------
@@ -328,6 +363,79 @@ MEETING_MESSAGE_TTL_SECONDS = 10 * 60
 HELP_SCOPE_CHAT_ID = "help_scope_chat_id"
 
 
+# ---------------- HTTP CLIENTS ----------------
+# Прямые вызовы Bot API (rich-карточки, эфемерные ответы) и внешние запросы
+# идут через общие клиенты с keep-alive. Раньше каждый вызов открывал новый
+# httpx.AsyncClient и заново устанавливал TCP+TLS соединение.
+
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org").rstrip("/")
+HTTP_MAX_CONNECTIONS = max(1, int(os.getenv("HTTP_MAX_CONNECTIONS", "20")))
+HTTP_MAX_KEEPALIVE = max(0, int(os.getenv("HTTP_MAX_KEEPALIVE", "10")))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+# HTTP/2 требует пакет h2 (pip install httpx[http2]); без него — HTTP/1.1.
+HTTP_HTTP2 = os.getenv("HTTP_HTTP2", "0") == "1"
+
+HTTP_CLIENT_PROFILES = {
+    "telegram": {"timeout": 25.0},
+    "web": {
+        "timeout": 10.0,
+        "follow_redirects": True,
+        "headers": {
+            "User-Agent": "Mozilla/5.0 (compatible; meetings-bot/1.0)",
+            "Accept-Language": "ru-RU,ru;q=0.9",
+        },
+    },
+}
+
+
+class HttpClients:
+    """Общие httpx.AsyncClient по профилям; создаются в post_init или при первом запросе."""
+
+    def __init__(self, profiles: dict[str, dict]):
+        self.profiles = profiles
+        self._clients: dict[str, httpx.AsyncClient] = {}
+        self._http2: bool | None = None
+
+    def _http2_enabled(self) -> bool:
+        if self._http2 is None:
+            self._http2 = False
+            if HTTP_HTTP2:
+                try:
+                    import h2  # noqa: F401
+
+                    self._http2 = True
+                except ImportError:
+                    logger.warning("HTTP_HTTP2=1, но пакет h2 не установлен: используется HTTP/1.1")
+        return self._http2
+
+    def get(self, name: str) -> httpx.AsyncClient:
+        client = self._clients.get(name)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                http2=self._http2_enabled(),
+                limits=httpx.Limits(
+                    max_connections=HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                    keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+                ),
+                **self.profiles[name],
+            )
+            self._clients[name] = client
+        return client
+
+    def start(self):
+        for name in self.profiles:
+            self.get(name)
+
+    async def aclose(self):
+        clients, self._clients = self._clients, {}
+        for client in clients.values():
+            await client.aclose()
+
+
+HTTP_CLIENTS = HttpClients(HTTP_CLIENT_PROFILES)
+
+
 # ---------------- HOROSCOPE ----------------
 
 ZODIAC = [
@@ -491,15 +599,10 @@ async def fetch_rambler_horo(sign_slug: str) -> tuple[str, str | None]:
     We intentionally return ONLY the horoscope body text (no menus/author/like/share).
     """
     url = f"https://horoscopes.rambler.ru/{sign_slug}/"
-    headers = {
-        "User-Agent": "Mozilla/5.0 (compatible; meetings-bot/1.0)",
-        "Accept-Language": "ru-RU,ru;q=0.9",
-    }
 
-    async with httpx.AsyncClient(timeout=10.0, headers=headers, follow_redirects=True) as client:
-        r = await client.get(url)
-        r.raise_for_status()
-        page_html = r.text
+    r = await HTTP_CLIENTS.get("web").get(url)
+    r.raise_for_status()
+    page_html = r.text
 
     # Strip scripts/styles to avoid noise
     cleaned = re.sub(r"(?is)<script[^>]*>.*?</script>", " ", page_html)
@@ -613,10 +716,735 @@ def schedule_message_delete(
         name=f"delete:{message.chat_id}:{message.message_id}",
     )
 
+# ---------------- DB: CONNECTION POOL ----------------
+# Каждый поток держит небольшой стек долгоживущих соединений с SQLite.
+# db_connect() выдаёт соединение из стека (или открывает новое), а con.close()
+# и выход из ``with`` возвращают его обратно вместо реального закрытия. Горячие
+# обработчики больше не платят за открытие файла и разбор схемы на каждый
+# callback, а кэш подготовленных выражений sqlite3 переживает отдельные вызовы.
+# DB_POOL_ENABLED=0 возвращает прежнее поведение (новое соединение на вызов).
+
+DB_POOL_ENABLED = os.getenv("DB_POOL_ENABLED", "1").strip().lower() not in {"0", "false", "no", "off"}
+DB_BUSY_TIMEOUT_MS = max(1000, int(os.getenv("DB_BUSY_TIMEOUT_MS", "20000")))
+DB_STATEMENT_CACHE_SIZE = max(16, int(os.getenv("DB_STATEMENT_CACHE_SIZE", "256")))
+# Сколько свободных соединений поток держит про запас. Вложенные вызовы
+# db_* получают отдельные соединения, поэтому стек больше одного.
+DB_POOL_MAX_IDLE_PER_THREAD = 4
+
+_db_pool_local = threading.local()
+_db_pool_lock = threading.Lock()
+_db_pool_open: set = set()
+_db_pool_stats = {"opened": 0, "reused": 0, "closed": 0}
+
+
+def _db_open_raw(path: str) -> sqlite3.Connection:
+    """Открывает соединение и выставляет PRAGMA, общие для всего бота."""
+    con = sqlite3.connect(
+        path,
+        timeout=DB_BUSY_TIMEOUT_MS / 1000,
+        cached_statements=DB_STATEMENT_CACHE_SIZE,
+        check_same_thread=False,
+    )
+    if path != ":memory:":
+        try:
+            # WAL сохраняется в файле БД; повторный вызов ничего не стоит.
+            con.execute("PRAGMA journal_mode=WAL")
+        except sqlite3.OperationalError as e:
+            logger.warning("SQLite WAL mode is unavailable: %s", e)
+    con.execute("PRAGMA synchronous=NORMAL")
+    con.execute(f"PRAGMA busy_timeout={int(DB_BUSY_TIMEOUT_MS)}")
+    return con
+
+
+def _db_pool_idle(path: str) -> list:
+    idle_by_path = getattr(_db_pool_local, "idle", None)
+    if idle_by_path is None:
+        idle_by_path = {}
+        _db_pool_local.idle = idle_by_path
+    return idle_by_path.setdefault(path, [])
+
+
+def _db_pool_acquire(path: str) -> sqlite3.Connection:
+    idle = _db_pool_idle(path)
+    while idle:
+        con = idle.pop()
+        # После db_pool_close_all() в стеке могли остаться закрытые соединения.
+        if con in _db_pool_open:
+            _db_pool_stats["reused"] += 1
+            return con
+    con = _db_open_raw(path)
+    with _db_pool_lock:
+        _db_pool_open.add(con)
+        _db_pool_stats["opened"] += 1
+    return con
+
+
+def _db_pool_discard(con: sqlite3.Connection):
+    with _db_pool_lock:
+        _db_pool_open.discard(con)
+        _db_pool_stats["closed"] += 1
+    try:
+        con.close()
+    except sqlite3.Error:
+        pass
+
+
+def _db_pool_release(path: str, con: sqlite3.Connection):
+    """
+    Возвращает соединение в стек потока.
+
+    Незакоммиченные изменения откатываются (как при обычном ``close()``), а
+    состояние, которое меняют отдельные фичи (row_factory, foreign_keys),
+    сбрасывается, чтобы следующий вызов получил «чистое» соединение.
+    """
+    try:
+        if con.in_transaction:
+            con.rollback()
+        con.row_factory = None
+        con.text_factory = str
+        con.execute("PRAGMA foreign_keys=OFF")
+    except sqlite3.Error:
+        _db_pool_discard(con)
+        return
+    idle = _db_pool_idle(path)
+    if len(idle) >= DB_POOL_MAX_IDLE_PER_THREAD:
+        _db_pool_discard(con)
+        return
+    idle.append(con)
+
+
+class PooledConnection:
+    """
+    Обёртка над ``sqlite3.Connection`` из пула потока.
+
+    Ведёт себя как обычное соединение: ``close()`` и выход из ``with`` (после
+    commit/rollback) возвращают его в пул. Если обёртку используют после
+    возврата, она прозрачно берёт соединение из пула заново.
+    """
+
+    __slots__ = ("_path", "_con")
+
+    def __init__(self, path: str):
+        object.__setattr__(self, "_path", path)
+        object.__setattr__(self, "_con", None)
+        object.__setattr__(self, "_con", _db_pool_acquire(path))
+
+    def _lease(self) -> sqlite3.Connection:
+        con = self._con
+        if con is None:
+            con = _db_pool_acquire(self._path)
+            object.__setattr__(self, "_con", con)
+        return con
+
+    def __getattr__(self, name):
+        return getattr(self._lease(), name)
+
+    # Самые частые методы проксируются явно, без __getattr__.
+    def cursor(self, *args, **kwargs):
+        return self._lease().cursor(*args, **kwargs)
+
+    def execute(self, *args, **kwargs):
+        return self._lease().execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        return self._lease().executemany(*args, **kwargs)
+
+    def commit(self):
+        return self._lease().commit()
+
+    def rollback(self):
+        return self._lease().rollback()
+
+    def __setattr__(self, name, value):
+        setattr(self._lease(), name, value)
+
+    def close(self):
+        con = self._con
+        if con is None:
+            return
+        object.__setattr__(self, "_con", None)
+        _db_pool_release(self._path, con)
+
+    def __enter__(self):
+        self._lease().__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        con = self._lease()
+        try:
+            return con.__exit__(exc_type, exc, tb)
+        finally:
+            self.close()
+
+    def __del__(self):
+        # Соединение, которое забыли закрыть на пути исключения, тоже
+        # возвращается в пул, а не висит до сборки мусора.
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+def db_connect():
+    """Соединение с основной БД бота: из пула потока или новое при DB_POOL_ENABLED=0."""
+    if not DB_POOL_ENABLED:
+        return sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT_MS / 1000)
+    return PooledConnection(DB_PATH)
+
+
+def db_pool_close_all():
+    """Закрывает все соединения пула (при остановке бота)."""
+    with _db_pool_lock:
+        connections = list(_db_pool_open)
+        _db_pool_open.clear()
+        _db_pool_stats["closed"] += len(connections)
+    for con in connections:
+        try:
+            con.close()
+        except sqlite3.Error:
+            pass
+    idle_by_path = getattr(_db_pool_local, "idle", None)
+    if idle_by_path:
+        idle_by_path.clear()
+
+
+def db_pool_stats() -> dict:
+    with _db_pool_lock:
+        stats = dict(_db_pool_stats)
+        stats["open"] = len(_db_pool_open)
+    return stats
+
+
+# ---------------- DB: ASYNC FACADE ----------------
+# Синхронные db_* нельзя вызывать прямо из обработчиков: тяжёлый поиск или
+# восстановление бэкапа блокирует event loop, и кнопки остальных
+# пользователей «висят». Фасад выполняет их в выделенных потоках:
+#   await db.call(fn, ...)  — чтение, несколько потоков (WAL не блокирует чтение);
+#   await db.write(fn, ...) — запись, один поток, чтобы записи не спорили за lock.
+# У каждого потока собственный пул соединений из db_connect().
+
+DB_READER_THREADS = max(1, int(os.getenv("DB_READER_THREADS", "4")))
+
+
+class AsyncDB:
+    def __init__(self, reader_threads: int = DB_READER_THREADS):
+        self._reader_threads = max(1, int(reader_threads))
+        self._readers: ThreadPoolExecutor | None = None
+        self._writer: ThreadPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    def _executors(self) -> tuple[ThreadPoolExecutor, ThreadPoolExecutor]:
+        with self._lock:
+            if self._readers is None:
+                self._readers = ThreadPoolExecutor(
+                    max_workers=self._reader_threads,
+                    thread_name_prefix="db-reader",
+                )
+            if self._writer is None:
+                self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+            return self._readers, self._writer
+
+    async def call(self, fn, *args, **kwargs):
+        """Выполняет читающий db_* в потоке чтения."""
+        readers, _ = self._executors()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(readers, functools.partial(fn, *args, **kwargs))
+
+    async def write(self, fn, *args, **kwargs):
+        """Выполняет пишущий db_* в единственном потоке записи."""
+        _, writer = self._executors()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(writer, functools.partial(fn, *args, **kwargs))
+
+    def shutdown(self):
+        with self._lock:
+            executors = [self._readers, self._writer]
+            self._readers = None
+            self._writer = None
+        for executor in executors:
+            if executor is not None:
+                executor.shutdown(wait=True)
+
+
+db = AsyncDB()
+
+
+# Задержка event loop: фоновая задача засыпает на фиксированный интервал и
+# измеряет, насколько позже запланированного она проснулась. Если в обработчике
+# выполняется блокирующая работа, задержка растёт — это видно в /status.
+EVENT_LOOP_LAG_INTERVAL_SECONDS = 0.5
+EVENT_LOOP_LAG_WARN_SECONDS = 1.0
+
+
+class EventLoopLagMonitor:
+    def __init__(self, interval: float = EVENT_LOOP_LAG_INTERVAL_SECONDS, window: int = 600):
+        self.interval = float(interval)
+        self.samples: deque[float] = deque(maxlen=max(10, int(window)))
+        self.max_lag = 0.0
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        task, self._task = self._task, None
+        if task is None:
+            return
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - started - self.interval)
+            self.samples.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if lag >= EVENT_LOOP_LAG_WARN_SECONDS:
+                logger.warning("Event loop lag %.0f ms", lag * 1000)
+
+    def snapshot(self) -> dict:
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {"samples": 0, "last_ms": 0.0, "p50_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+        return {
+            "samples": len(ordered),
+            "last_ms": self.samples[-1] * 1000,
+            "p50_ms": ordered[len(ordered) // 2] * 1000,
+            "p99_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000,
+            "max_ms": self.max_lag * 1000,
+        }
+
+
+LOOP_LAG = EventLoopLagMonitor()
+
+
+# ---------------- CACHES ----------------
+# Небольшой кэш с TTL для ответов, которые дорого получать на каждое нажатие
+# (Bot API, SQLite). Отрицательные ответы живут отдельно заданное (обычно
+# меньшее) время. get_or_load объединяет одновременные промахи по одному
+# ключу в один запрос. Счётчики попаданий выводятся в /status.
+
+_CACHE_MISSING = object()
+
+
+class TTLCache:
+    def __init__(
+        self,
+        name: str,
+        ttl: float,
+        negative_ttl: float | None = None,
+        maxsize: int | None = None,
+    ):
+        self.name = name
+        self.ttl = float(ttl)
+        self.negative_ttl = float(ttl if negative_ttl is None else negative_ttl)
+        self.maxsize = maxsize
+        self._entries: OrderedDict = OrderedDict()
+        self._inflight: dict = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key, default=_CACHE_MISSING):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+        return default
+
+    def set(self, key, value, ttl: float | None = None, negative: bool = False):
+        if ttl is None:
+            ttl = self.negative_ttl if negative else self.ttl
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            if self.maxsize is not None:
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def invalidate_where(self, predicate):
+        with self._lock:
+            stale = [key for key in self._entries if predicate(key)]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    async def get_or_load(self, key, loader, is_negative=lambda value: not value):
+        """
+        Значение из кэша или результат ``await loader()``.
+
+        Исключения загрузчика не кэшируются и получают все ожидающие вызовы.
+        """
+        value = self.get(key)
+        if value is not _CACHE_MISSING:
+            return value
+        pending = self._inflight.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await loader()
+        except BaseException as exc:
+            future.set_exception(exc)
+            # Исключение уже передано ожидающим; без этого asyncio пишет
+            # «Future exception was never retrieved», если их не было.
+            future.exception()
+            raise
+        else:
+            self.set(key, value, negative=is_negative(value))
+            future.set_result(value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = len(self._entries)
+        lookups = self.hits + self.misses
+        return {
+            "size": size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+        }
+
+
+# ---------------- DELIVERY ENGINE ----------------
+# Рассылки по многим чатам идут параллельно, но в пределах лимитов Bot API:
+# общий токен-бакет (~30 сообщений/с на бота) и отдельный бакет на каждый чат
+# (~1 сообщение/с). RetryAfter не считается ошибкой: движок выжидает
+# указанное время и повторяет тот же вызов. Для отложенных рассылок список
+# уже доставленных получателей хранится в scheduled_communications.result_json,
+# поэтому после падения/перезапуска отправка продолжается без дублей.
+
+DELIVERY_CONCURRENCY = max(1, int(os.getenv("DELIVERY_CONCURRENCY", "8")))
+DELIVERY_GLOBAL_RATE = float(os.getenv("DELIVERY_GLOBAL_RATE", "30"))
+DELIVERY_PER_CHAT_RATE = float(os.getenv("DELIVERY_PER_CHAT_RATE", "1"))
+DELIVERY_MAX_RETRIES = int(os.getenv("DELIVERY_MAX_RETRIES", "5"))
+DELIVERY_CHAT_BUCKETS_MAX = 4096
+
+
+class TokenBucket:
+    """Асинхронный токен-бакет: rate токенов в секунду, запас до capacity."""
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = max(0.001, float(rate))
+        self.capacity = max(1.0, float(capacity if capacity is not None else rate))
+        self._tokens = self.capacity
+        self._stamp = time.monotonic()
+        self._blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def pause(self, seconds: float):
+        self._blocked_until = max(self._blocked_until, time.monotonic() + max(0.0, seconds))
+
+    def is_idle(self) -> bool:
+        now = time.monotonic()
+        self._refill(now)
+        return self._tokens >= self.capacity and self._blocked_until <= now
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            wait = self._blocked_until - now
+            if wait <= 0:
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            await asyncio.sleep(wait)
+
+
+def _retry_after_seconds(exc: RetryAfter) -> float:
+    value = getattr(exc, "retry_after", 1)
+    if hasattr(value, "total_seconds"):
+        value = value.total_seconds()
+    try:
+        return max(0.5, float(value))
+    except (TypeError, ValueError):
+        return 1.0
+
+
+class DeliveryProgress:
+    """Доставленные получатели отложенной рассылки (ключ — str(chat_id))."""
+
+    def __init__(self, item_id: int, result_json: str | None = None):
+        self.item_id = int(item_id)
+        self.done: set[str] = set()
+        try:
+            previous = json.loads(result_json or "{}")
+        except (TypeError, ValueError):
+            previous = {}
+        if isinstance(previous, dict):
+            self.done.update(str(x) for x in previous.get("delivered") or [])
+        self.resumed = len(self.done)
+        self._dirty = False
+        self._lock = asyncio.Lock()
+
+    def result(self, ok: int, fail: int) -> dict:
+        return {"ok": int(ok), "fail": int(fail), "delivered": sorted(self.done)}
+
+    async def mark(self, key: str):
+        self.done.add(key)
+        self._dirty = True
+        if self._lock.locked():
+            # Текущая запись увидит _dirty и сохранит и эту отметку.
+            return
+        async with self._lock:
+            while self._dirty:
+                self._dirty = False
+                await db.write(
+                    db_scheduled_communication_progress,
+                    self.item_id,
+                    {"delivered": sorted(self.done)},
+                )
+
+
+class DeliveryEngine:
+    def __init__(
+        self,
+        concurrency: int = DELIVERY_CONCURRENCY,
+        global_rate: float = DELIVERY_GLOBAL_RATE,
+        per_chat_rate: float = DELIVERY_PER_CHAT_RATE,
+        max_retries: int = DELIVERY_MAX_RETRIES,
+    ):
+        self.concurrency = max(1, int(concurrency))
+        self.per_chat_rate = per_chat_rate
+        self.max_retries = max(0, int(max_retries))
+        self._global = TokenBucket(global_rate)
+        self._chats: dict = {}
+        self.sent = 0
+        self.retries = 0
+        self.failed = 0
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= DELIVERY_CHAT_BUCKETS_MAX:
+                self._chats = {k: b for k, b in self._chats.items() if not b.is_idle()}
+            bucket = TokenBucket(self.per_chat_rate)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def call(self, chat_id, factory):
+        """
+        Один вызов Bot API в chat_id с учётом лимитов.
+
+        factory — функция без аргументов, возвращающая новую корутину
+        (при RetryAfter вызов повторяется целиком).
+        """
+        attempt = 0
+        chat_bucket = self._chat_bucket(int(chat_id))
+        while True:
+            await chat_bucket.acquire()
+            await self._global.acquire()
+            try:
+                result = await factory()
+            except RetryAfter as exc:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                delay = _retry_after_seconds(exc)
+                self.retries += 1
+                # Flood control обычно действует на весь бот: притормаживаем всех.
+                self._global.pause(delay)
+                chat_bucket.pause(delay)
+                logger.warning("Flood control for %s, retry in %.1fs", chat_id, delay)
+                continue
+            self.sent += 1
+            return result
+
+    async def run(
+        self,
+        recipients,
+        deliver,
+        *,
+        label: str = "Delivery",
+        progress: DeliveryProgress | None = None,
+    ) -> tuple[int, int]:
+        """
+        Параллельно вызывает ``await deliver(recipient)`` для каждого получателя.
+
+        Сообщения одного получателя отправляются по порядку внутри deliver.
+        Возвращает (ok, fail); уже доставленные по progress считаются в ok.
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        ok = 0
+        fail = 0
+
+        async def one(recipient):
+            nonlocal ok, fail
+            key = str(recipient)
+            if progress is not None and key in progress.done:
+                ok += 1
+                return
+            async with semaphore:
+                try:
+                    await deliver(recipient)
+                except Exception as exc:
+                    logger.exception("%s failed to %s: %s", label, recipient, exc)
+                    self.failed += 1
+                    fail += 1
+                    return
+            ok += 1
+            if progress is not None:
+                try:
+                    await progress.mark(key)
+                except Exception as exc:
+                    logger.exception("Cannot persist delivery progress: %s", exc)
+
+        unique = list(dict.fromkeys(recipients))
+        await asyncio.gather(*(one(r) for r in unique))
+        return ok, fail
+
+    def stats(self) -> dict:
+        return {"sent": self.sent, "retries": self.retries, "failed": self.failed}
+
+
+DELIVERY = DeliveryEngine()
+
+
 # ---------------- DB ----------------
+# Схема собирается из шагов миграции, которые регистрируют разделы бота.
+# Шаг выполняется один раз в собственной транзакции, номер последнего
+# применённого шага хранится в meta.schema_version, поэтому обычный запуск не
+# повторяет CREATE ... IF NOT EXISTS, пробные ALTER и заполнения старых строк.
+# Шаги идемпотентны: база без schema_version (созданная до реестра) просто
+# проходит их все один раз. То, что нужно при каждом запуске (вернуть в
+# очередь зависшие отправки, сверить каталог интересов, почистить старое
+# состояние), регистрируется через db_startup_task.
+
+SCHEMA_VERSION_KEY = "schema_version"
+SCHEMA_MIGRATIONS: dict[int, tuple[str, object, bool]] = {}
+DB_STARTUP_TASKS: list = []
+# (шаг или задача, секунды) последнего db_init — для --profile-startup
+DB_INIT_TIMINGS: list[tuple[object, float]] = []
+
+
+def schema_migration(version: int, name: str, transaction: bool = True):
+    """
+    Регистрирует шаг схемы с номером version.
+
+    Шаг получает соединение с открытой транзакцией и не делает commit сам.
+    transaction=False — для шагов, которые пишут через обычные db_* функции
+    (у каждой своё соединение); такой шаг вызывается без аргументов.
+    """
+    def register(fn):
+        if version in SCHEMA_MIGRATIONS:
+            raise RuntimeError(f"Schema migration {version} is already registered")
+        SCHEMA_MIGRATIONS[version] = (name, fn, transaction)
+        return fn
+    return register
+
+
+def db_startup_task(fn):
+    """Регистрирует задачу, которая выполняется при каждом запуске после миграций."""
+    DB_STARTUP_TASKS.append(fn)
+    return fn
+
+
+def _schema_version(con) -> int:
+    row = con.execute("SELECT value FROM meta WHERE key=?", (SCHEMA_VERSION_KEY,)).fetchone()
+    return int(row[0]) if row and str(row[0]).isdigit() else 0
+
+
+def _schema_version_set(con, version: int):
+    con.execute(
+        "INSERT INTO meta(key, value) VALUES(?, ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+        (SCHEMA_VERSION_KEY, str(version)),
+    )
+
+
+def db_migrate() -> list[int]:
+    """Применяет недостающие шаги схемы по порядку номеров; возвращает применённые."""
+    applied = []
+    con = db_connect()
+    try:
+        # Пересборка таблиц (RENAME/CREATE/INSERT) требует выключенных FK,
+        # а внутри транзакции PRAGMA foreign_keys не меняется.
+        con.execute("PRAGMA foreign_keys=OFF")
+        con.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        con.commit()
+        current = _schema_version(con)
+        missing = [v for v in range(current + 1, max(SCHEMA_MIGRATIONS) + 1) if v not in SCHEMA_MIGRATIONS]
+        if missing:
+            raise RuntimeError(f"Schema migrations {missing} are not registered")
+        for version in sorted(SCHEMA_MIGRATIONS):
+            if version <= current:
+                continue
+            name, fn, transaction = SCHEMA_MIGRATIONS[version]
+            started = time.perf_counter()
+            if transaction:
+                con.execute("BEGIN IMMEDIATE")
+                try:
+                    # Другой процесс мог применить шаг, пока мы ждали блокировку.
+                    if _schema_version(con) >= version:
+                        con.rollback()
+                        continue
+                    fn(con)
+                    _schema_version_set(con, version)
+                    con.commit()
+                except BaseException:
+                    con.rollback()
+                    raise
+                finally:
+                    con.row_factory = None
+            else:
+                fn()
+                _schema_version_set(con, version)
+                con.commit()
+            elapsed = time.perf_counter() - started
+            DB_INIT_TIMINGS.append((fn, elapsed))
+            logger.info("Schema migration %s (%s) applied in %.1f ms", version, name, elapsed * 1000)
+            applied.append(version)
+    finally:
+        con.close()
+    return applied
+
 
 def db_init():
-    con = sqlite3.connect(DB_PATH)
+    """Доводит схему до текущей версии и выполняет задачи запуска."""
+    DB_INIT_TIMINGS.clear()
+    db_migrate()
+    for task in DB_STARTUP_TASKS:
+        started = time.perf_counter()
+        task()
+        DB_INIT_TIMINGS.append((task, time.perf_counter() - started))
+
+
+@schema_migration(1, "base")
+def _migrate_base(con):
     cur = con.cursor()
 
     # рассылочные чаты
@@ -716,6 +1544,20 @@ def db_init():
         )
     """)
 
+    # Разобранный гороскоп на день: один раз на знак, а не на каждый запрос.
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS horo_cache (
+            day TEXT NOT NULL,
+            sign_slug TEXT NOT NULL,
+            date_str TEXT,
+            body TEXT NOT NULL,
+            advice TEXT NOT NULL,
+            focus TEXT NOT NULL,
+            fetched_at TEXT NOT NULL,
+            PRIMARY KEY (day, sign_slug)
+        )
+    """)
+
     # ------- HELP MENU: документы -------
     cur.execute("""
         CREATE TABLE IF NOT EXISTS doc_categories (
@@ -842,6 +1684,32 @@ def db_init():
     cur.execute("CREATE INDEX IF NOT EXISTS idx_doc_views_user_time ON doc_views(user_id, last_viewed_at DESC)")
     cur.execute("CREATE INDEX IF NOT EXISTS idx_docs_content_status ON docs(content_index_status)")
 
+    # Кэш извлечения по содержимому файла: одинаковые файлы и неизменившиеся
+    # страницы скана не распознаются повторно.
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS doc_extract_cache (
+            content_hash TEXT PRIMARY KEY,
+            content_text TEXT,
+            status TEXT NOT NULL,
+            ocr_used INTEGER NOT NULL DEFAULT 0,
+            page_count INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS doc_extract_cache_files (
+            file_unique_id TEXT PRIMARY KEY,
+            content_hash TEXT NOT NULL
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS doc_page_ocr_cache (
+            page_hash TEXT PRIMARY KEY,
+            content_text TEXT,
+            created_at TEXT NOT NULL
+        )
+    """)
+
     # ------- HELP MENU: FAQ -------
     cur.execute("""
         CREATE TABLE IF NOT EXISTS faq_items (
@@ -877,6 +1745,31 @@ def db_init():
     except sqlite3.OperationalError:
         pass
 
+    # День рождения «ДД.ММ» в виде индексируемых месяца и дня: диапазоны
+    # ближайших дней рождения выбираются по индексу, а не разбором всех анкет.
+    # Колонки заполняются при старте и поддерживаются триггерами на birthday.
+    for column in ("birth_month", "birth_day"):
+        try:
+            cur.execute(f"ALTER TABLE profiles ADD COLUMN {column} INTEGER")
+        except sqlite3.OperationalError:
+            pass
+    cur.execute(
+        f"UPDATE profiles SET birth_month={_birthday_part_sql('birthday', 4)}, "
+        f"birth_day={_birthday_part_sql('birthday', 1)}"
+    )
+    for event in ("INSERT", "UPDATE OF birthday"):
+        suffix = event.split()[0].lower()
+        cur.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_profiles_birthday_{suffix} AFTER {event} ON profiles
+            BEGIN
+                UPDATE profiles
+                SET birth_month={_birthday_part_sql('NEW.birthday', 4)},
+                    birth_day={_birthday_part_sql('NEW.birthday', 1)}
+                WHERE id=NEW.id;
+            END
+        """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_profiles_birth_md ON profiles(birth_month, birth_day)")
+
 
 
 
@@ -887,6 +1780,46 @@ def db_init():
         pass
     cur.execute("UPDATE profiles SET interests_json='[]' WHERE interests_json IS NULL OR interests_json=''")
 
+    # Те же интересы битовой маской для подбора похожих коллег. Номера битов
+    # берутся из каталога (сверяются при каждом старте в
+    # _profile_interest_bits_sync), дальше маски поддерживают триггеры на
+    # любую запись interests_json.
+    try:
+        cur.execute("ALTER TABLE profiles ADD COLUMN interests_mask INTEGER NOT NULL DEFAULT 0")
+    except sqlite3.OperationalError:
+        pass
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS profile_interest_bits (
+            interest_key TEXT PRIMARY KEY,
+            bit INTEGER NOT NULL
+        )
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_profiles_interests_mask_ins AFTER INSERT ON profiles
+        BEGIN
+            UPDATE profiles SET interests_mask={_interests_mask_sql('NEW.interests_json')} WHERE id=NEW.id;
+        END
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_profiles_interests_mask_upd AFTER UPDATE OF interests_json ON profiles
+        BEGIN
+            UPDATE profiles SET interests_mask={_interests_mask_sql('NEW.interests_json')} WHERE id=NEW.id;
+        END
+    """)
+    # Версия анкет для ProfileInterestIndex и кэша дней рождения: меняется
+    # при любом изменении состава, имён, интересов или дней рождения. Триггеры
+    # пересоздаются, чтобы список колонок обновлялся и в существующих БД.
+    for event in ("INSERT", "DELETE", "UPDATE OF full_name, is_active, interests_mask, birth_month, birth_day"):
+        suffix = event.split()[0].lower()
+        cur.execute(f"DROP TRIGGER IF EXISTS trg_profiles_version_{suffix}")
+        cur.execute(f"""
+            CREATE TRIGGER trg_profiles_version_{suffix} AFTER {event} ON profiles
+            BEGIN
+                INSERT INTO meta(key, value) VALUES('profiles_version', '1')
+                ON CONFLICT(key) DO UPDATE SET value=CAST(value AS INTEGER) + 1;
+            END
+        """)
+
     # ✅ миграция для старых БД: tg_user_id
     try:
         cur.execute("ALTER TABLE profiles ADD COLUMN tg_user_id INTEGER")
@@ -1023,8 +1956,6 @@ def db_init():
         "CREATE INDEX IF NOT EXISTS idx_scheduled_communications_due "
         "ON scheduled_communications(status, send_at_utc)"
     )
-    # If the process stopped after reserving a task, retry it after restart.
-    cur.execute("UPDATE scheduled_communications SET status='pending' WHERE status='sending'")
 
     # ===================== TESTING (employees) DB =====================
     # templates
@@ -1093,12 +2024,39 @@ def db_init():
         )
     """)
 
-    con.commit()
-    con.close()
+
+@db_startup_task
+def _docs_fts_startup():
+    # Доступность FTS5 зависит от сборки SQLite, поэтому проверяется при каждом запуске.
+    with db_connect() as con:
+        index_changes = _docs_fts_init(con.cursor())
+    _docs_search_index_apply(index_changes)
+
+
+@db_startup_task
+def _profile_interest_bits_sync():
+    """Сверяет номера битов с каталогом интересов; при расхождении пересчитывает маски."""
+    with db_connect() as con:
+        stored = dict(con.execute("SELECT interest_key, bit FROM profile_interest_bits").fetchall())
+        if stored == PROFILE_INTEREST_BITS:
+            return
+        con.execute("DELETE FROM profile_interest_bits")
+        con.executemany(
+            "INSERT INTO profile_interest_bits(interest_key, bit) VALUES(?, ?)",
+            list(PROFILE_INTEREST_BITS.items()),
+        )
+        con.execute(f"UPDATE profiles SET interests_mask={_interests_mask_sql('interests_json')}")
+
+
+@db_startup_task
+def _scheduled_communications_requeue():
+    # If the process stopped after reserving a task, retry it after restart.
+    with db_connect() as con:
+        con.execute("UPDATE scheduled_communications SET status='pending' WHERE status='sending'")
 
 
 def db_get_meta(key: str) -> str | None:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("SELECT value FROM meta WHERE key=?", (key,))
     row = cur.fetchone()
@@ -1107,7 +2065,7 @@ def db_get_meta(key: str) -> str | None:
 
 
 def db_set_meta(key: str, value: str):
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("""
         INSERT INTO meta(key, value)
@@ -1127,7 +2085,7 @@ def normalize_broadcast_tag_name(value: str) -> str:
 
 
 def db_broadcast_tags_list() -> list[dict]:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("SELECT id, name FROM broadcast_tags ORDER BY name COLLATE NOCASE ASC")
     rows = cur.fetchall()
@@ -1136,7 +2094,7 @@ def db_broadcast_tags_list() -> list[dict]:
 
 
 def db_broadcast_tag_get(tag_id: int) -> dict | None:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("SELECT id, name FROM broadcast_tags WHERE id=?", (int(tag_id),))
     row = cur.fetchone()
@@ -1148,7 +2106,7 @@ def db_broadcast_tag_add(name: str) -> dict | None:
     clean = normalize_broadcast_tag_name(name)
     if not clean:
         return None
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         "INSERT INTO broadcast_tags(name, created_at) VALUES(?, ?) "
@@ -1163,7 +2121,7 @@ def db_broadcast_tag_add(name: str) -> dict | None:
 
 
 def db_broadcast_tag_delete(tag_id: int) -> bool:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("DELETE FROM broadcast_tags WHERE id=?", (int(tag_id),))
     ok = cur.rowcount > 0
@@ -1173,7 +2131,7 @@ def db_broadcast_tag_delete(tag_id: int) -> bool:
 
 
 def db_profiles_list_for_delivery() -> list[dict]:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         "SELECT id, full_name, tg_user_id FROM profiles "
@@ -1194,7 +2152,7 @@ def db_scheduled_communication_add(
     send_at_utc: str,
     created_by: int | None,
 ) -> int:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -1218,11 +2176,11 @@ def db_scheduled_communication_add(
 
 def db_scheduled_communications_due(limit: int = 20) -> list[dict]:
     now_utc = datetime.utcnow().isoformat()
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
-        SELECT id, kind, payload_json, send_at_utc
+        SELECT id, kind, payload_json, send_at_utc, result_json
         FROM scheduled_communications
         WHERE status='pending' AND send_at_utc<=?
         ORDER BY send_at_utc ASC, id ASC
@@ -1238,13 +2196,14 @@ def db_scheduled_communications_due(limit: int = 20) -> list[dict]:
             "kind": r[1],
             "payload_json": r[2],
             "send_at_utc": r[3],
+            "result_json": r[4],
         }
         for r in rows
     ]
 
 
 def db_scheduled_communication_reserve(item_id: int) -> bool:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         "UPDATE scheduled_communications SET status='sending' "
@@ -1257,13 +2216,26 @@ def db_scheduled_communication_reserve(item_id: int) -> bool:
     return ok
 
 
+def db_scheduled_communication_progress(item_id: int, result: dict):
+    """Промежуточный result_json во время отправки (для продолжения после рестарта)."""
+    con = db_connect()
+    cur = con.cursor()
+    cur.execute(
+        "UPDATE scheduled_communications SET result_json=? "
+        "WHERE id=? AND status='sending'",
+        (json.dumps(result, ensure_ascii=False), int(item_id)),
+    )
+    con.commit()
+    con.close()
+
+
 def db_scheduled_communication_finish(
     item_id: int,
     status: str,
     result: dict | None = None,
     error: str | None = None,
 ):
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -1284,7 +2256,7 @@ def db_scheduled_communication_finish(
 
 
 def db_get_suggest_last_ts(user_id: int) -> int | None:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("SELECT last_sent_ts FROM suggest_rate WHERE user_id=?", (int(user_id),))
     row = cur.fetchone()
@@ -1292,7 +2264,7 @@ def db_get_suggest_last_ts(user_id: int) -> int | None:
     return int(row[0]) if row else None
 
 def db_set_suggest_last_ts(user_id: int, ts: int):
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("""
         INSERT INTO suggest_rate(user_id, last_sent_ts)
@@ -1302,8 +2274,53 @@ def db_set_suggest_last_ts(user_id: int, ts: int):
     con.commit()
     con.close()
 
+def db_horo_cache_get(day_iso: str, sign_slug: str) -> dict | None:
+    con = db_connect()
+    cur = con.cursor()
+    cur.execute(
+        "SELECT date_str, body, advice, focus FROM horo_cache WHERE day=? AND sign_slug=?",
+        (day_iso, sign_slug),
+    )
+    row = cur.fetchone()
+    con.close()
+    if not row:
+        return None
+    return {"date_str": row[0], "body": row[1], "advice": row[2], "focus": row[3]}
+
+
+def db_horo_cache_signs(day_iso: str) -> set[str]:
+    con = db_connect()
+    cur = con.cursor()
+    cur.execute("SELECT sign_slug FROM horo_cache WHERE day=?", (day_iso,))
+    rows = cur.fetchall()
+    con.close()
+    return {row[0] for row in rows}
+
+
+def db_horo_cache_put(day_iso: str, sign_slug: str, horo: dict) -> None:
+    con = db_connect()
+    cur = con.cursor()
+    cur.execute(
+        """INSERT OR REPLACE INTO horo_cache(day, sign_slug, date_str, body, advice, focus, fetched_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?)""",
+        (
+            day_iso,
+            sign_slug,
+            horo.get("date_str"),
+            horo["body"],
+            horo["advice"],
+            horo["focus"],
+            datetime.utcnow().isoformat(),
+        ),
+    )
+    # Старые дни больше не понадобятся.
+    cur.execute("DELETE FROM horo_cache WHERE day<?", ((date.fromisoformat(day_iso) - timedelta(days=7)).isoformat(),))
+    con.commit()
+    con.close()
+
+
 def db_get_horo_last_date(user_id: int) -> str | None:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("SELECT last_date FROM horo_rate WHERE user_id=?", (int(user_id),))
     row = cur.fetchone()
@@ -1312,7 +2329,7 @@ def db_get_horo_last_date(user_id: int) -> str | None:
 
 
 def db_set_horo_last_date(user_id: int, date_iso: str):
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """INSERT INTO horo_rate(user_id, last_date) VALUES(?, ?)
@@ -1326,7 +2343,7 @@ def db_set_horo_last_date(user_id: int, date_iso: str):
 
 
 def db_horo_get_user_sign(user_id: int) -> str | None:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("SELECT sign_slug FROM horo_users WHERE user_id=?", (int(user_id),))
     row = cur.fetchone()
@@ -1335,7 +2352,7 @@ def db_horo_get_user_sign(user_id: int) -> str | None:
 
 
 def db_horo_set_user_sign(user_id: int, sign_slug: str):
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """INSERT INTO horo_users(user_id, sign_slug) VALUES(?, ?)
@@ -1347,7 +2364,7 @@ def db_horo_set_user_sign(user_id: int, sign_slug: str):
 
 
 def db_add_chat(chat_id: int):
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("""
         INSERT INTO notify_chats(chat_id, added_at)
@@ -1359,7 +2376,7 @@ def db_add_chat(chat_id: int):
 
 
 def db_remove_chat(chat_id: int):
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("DELETE FROM notify_chats WHERE chat_id=?", (chat_id,))
     con.commit()
@@ -1367,7 +2384,7 @@ def db_remove_chat(chat_id: int):
 
 
 def db_list_chats() -> list[int]:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("SELECT chat_id FROM notify_chats ORDER BY chat_id ASC")
     rows = cur.fetchall()
@@ -1376,7 +2393,7 @@ def db_list_chats() -> list[int]:
 
 
 def db_get_state(meeting_type: str, d: date):
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         "SELECT canceled, reason, reschedule_date, reschedule_time "
@@ -1415,7 +2432,7 @@ def db_set_canceled(
     else:
         reschedule_time = None
 
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("""
         INSERT INTO meeting_state (
@@ -1446,7 +2463,7 @@ def db_upsert_reschedule(
         parse_regular_meeting_time(new_time)
         or regular_meeting_default_time(meeting_type)
     )
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("""
         INSERT INTO meeting_reschedules(
@@ -1468,7 +2485,7 @@ def db_upsert_reschedule(
 
 def db_delete_reschedule(meeting_type: str, original_d: date) -> bool:
     """Удаляет ранее созданный перенос регулярной встречи."""
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         "DELETE FROM meeting_reschedules WHERE meeting_type=? AND original_date=?",
@@ -1492,7 +2509,7 @@ def db_get_due_reschedules(
     время уведомления которых уже наступило. Это позволяет безопасно
     догнать уведомление после краткого перезапуска бота.
     """
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     if as_of_time is None:
         cur.execute("""
@@ -1524,7 +2541,7 @@ def db_get_due_reschedules(
 def db_mark_reschedules_sent(meeting_type: str, original_isos: list[str]):
     if not original_isos:
         return
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.executemany(
         "UPDATE meeting_reschedules SET sent=1 WHERE meeting_type=? AND original_date=?",
@@ -1533,10 +2550,292 @@ def db_mark_reschedules_sent(meeting_type: str, original_isos: list[str]):
     con.commit()
     con.close()
 
+# ---------------- SEARCH INDEX (docs / FAQ / cases) ----------------
+# Общий инвертированный индекс в памяти для трёх поисков бота. Слова
+# приводятся к основе русским стеммером (Snowball), поэтому «отпуска»,
+# «отпуском» и «отпуск» совпадают. Слово запроса находит термины по префиксу
+# основы, а если таких нет — по опечатке (одна правка, для основ от 5 букв).
+# Индексы строятся один раз при старте и дальше обновляются точечно
+# хелперами записи, поэтому поиск не пересобирает тексты на каждый запрос.
+
+_RU_VOWELS = frozenset("аеиоуыэюя")
+_RU_PERFECTIVE_GERUND_1 = ("вшись", "вши", "в")
+_RU_PERFECTIVE_GERUND_2 = ("ившись", "ывшись", "ивши", "ывши", "ив", "ыв")
+_RU_ADJECTIVE = (
+    "ими", "ыми", "его", "ого", "ему", "ому",
+    "ее", "ие", "ые", "ое", "ей", "ий", "ый", "ой", "ем", "им", "ым", "ом",
+    "их", "ых", "ую", "юю", "ая", "яя", "ою", "ею",
+)
+_RU_PARTICIPLE_1 = ("ем", "нн", "вш", "ющ", "щ")
+_RU_PARTICIPLE_2 = ("ивш", "ывш", "ующ")
+_RU_REFLEXIVE = ("ся", "сь")
+_RU_VERB_1 = (
+    "ете", "йте", "ешь", "нно",
+    "ла", "на", "ли", "ем", "ло", "но", "ет", "ют", "ны", "ть",
+    "й", "л", "н",
+)
+_RU_VERB_2 = (
+    "ейте", "уйте",
+    "ила", "ыла", "ена", "ите", "или", "ыли", "ило", "ыло", "ено", "ует", "уют",
+    "ены", "ить", "ыть", "ишь",
+    "ей", "уй", "ил", "ыл", "им", "ым", "ен", "ят", "ит", "ыт", "ую",
+    "ю",
+)
+_RU_NOUN = (
+    "иями", "ями", "ами", "ией", "иям", "ием", "иях",
+    "ев", "ов", "ие", "ье", "еи", "ии", "ей", "ой", "ий", "ям", "ем", "ам", "ом",
+    "ах", "ях", "ию", "ью", "ия", "ья",
+    "а", "е", "и", "й", "о", "у", "ы", "ь", "ю", "я",
+)
+_RU_SUPERLATIVE = ("ейше", "ейш")
+_RU_DERIVATIONAL = ("ость", "ост")
+
+
+def _ru_remove_suffix(word: str, start: int, plain: tuple, after_a: tuple = ()) -> str | None:
+    """
+    Снимает самое длинное окончание из ``plain``/``after_a`` в пределах региона.
+
+    Окончания из ``after_a`` допускаются только после «а»/«я» (сама буква
+    остаётся), как в Snowball; если самое длинное совпадение этому условию не
+    отвечает, окончание не снимается.
+    """
+    best = ""
+    best_after_a = False
+    for suffixes, needs_a in ((plain, False), (after_a, True)):
+        for suffix in suffixes:
+            if len(suffix) > len(best) and word.endswith(suffix) and len(word) - len(suffix) >= start:
+                best, best_after_a = suffix, needs_a
+    if not best:
+        return None
+    stem = word[: -len(best)]
+    if best_after_a and not (len(stem) > start and stem[-1] in "ая"):
+        return None
+    return stem
+
+
+def _ru_region_after_consonant(word: str, start: int) -> int:
+    for i in range(max(1, start + 1), len(word)):
+        if word[i] not in _RU_VOWELS and word[i - 1] in _RU_VOWELS:
+            return i + 1
+    return len(word)
+
+
+@functools.lru_cache(maxsize=65536)
+def ru_stem(word: str) -> str:
+    """Основа слова по русскому стеммеру Snowball; латиница и числа не меняются."""
+    word = (word or "").casefold().replace("ё", "е")
+    if not word or not all("а" <= ch <= "я" for ch in word):
+        return word
+    rv = next((i + 1 for i, ch in enumerate(word) if ch in _RU_VOWELS), len(word))
+    r2 = _ru_region_after_consonant(word, _ru_region_after_consonant(word, 0))
+
+    stem = _ru_remove_suffix(word, rv, _RU_PERFECTIVE_GERUND_2, _RU_PERFECTIVE_GERUND_1)
+    if stem is None:
+        stem = _ru_remove_suffix(word, rv, _RU_REFLEXIVE) or word
+        adjective = _ru_remove_suffix(stem, rv, _RU_ADJECTIVE)
+        if adjective is not None:
+            stem = _ru_remove_suffix(adjective, rv, _RU_PARTICIPLE_2, _RU_PARTICIPLE_1) or adjective
+        else:
+            stem = (
+                _ru_remove_suffix(stem, rv, _RU_VERB_2, _RU_VERB_1)
+                or _ru_remove_suffix(stem, rv, _RU_NOUN)
+                or stem
+            )
+    if stem.endswith("и") and len(stem) - 1 >= rv:
+        stem = stem[:-1]
+    stem = _ru_remove_suffix(stem, r2, _RU_DERIVATIONAL) or stem
+    superlative = _ru_remove_suffix(stem, rv, _RU_SUPERLATIVE)
+    if superlative is not None:
+        stem = superlative
+    if stem.endswith("нн") and len(stem) - 1 >= rv:
+        stem = stem[:-1]
+    elif superlative is None and stem.endswith("ь") and len(stem) - 1 >= rv:
+        stem = stem[:-1]
+    return stem
+
+
+def search_words(text: str | None) -> list[str]:
+    """Слова текста в нижнем регистре, «ё» заменена на «е»."""
+    return re.findall(r"[0-9a-zа-я]+", (text or "").casefold().replace("ё", "е"))
+
+
+def _within_one_edit(a: str, b: str) -> bool:
+    """Расстояние Дамерау–Левенштейна между a и b не больше 1."""
+    if a == b:
+        return True
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) == len(b):
+        diff = [i for i in range(len(a)) if a[i] != b[i]]
+        if len(diff) == 1:
+            return True
+        return (
+            len(diff) == 2
+            and diff[1] == diff[0] + 1
+            and a[diff[0]] == b[diff[1]]
+            and a[diff[1]] == b[diff[0]]
+        )
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    return a[i:] == b[i + 1:]
+
+
+SEARCH_TYPO_MIN_LEN = 5
+SEARCH_TYPO_PREFIX_MIN_LEN = 6
+# Вклад совпадения в релевантность: точная основа, префикс, опечатка.
+_SEARCH_MATCH_EXACT = 1.0
+_SEARCH_MATCH_PREFIX = 0.7
+_SEARCH_MATCH_TYPO = 0.4
+
+
+class SearchIndex:
+    """
+    Инвертированный индекс: основа слова -> {ключ записи: вес поля}.
+
+    ``loader`` возвращает пары ``(key, fields)``, где ``fields`` — список
+    ``(text, weight)``. Он вызывается один раз при первом обращении (или явно
+    через ``ensure_loaded``); дальше индекс меняют ``add``/``remove``.
+    """
+
+    def __init__(self, name: str, loader=None):
+        self.name = name
+        self._loader = loader
+        self._lock = threading.RLock()
+        self._postings: dict[str, dict] = {}
+        self._terms_by_key: dict = {}
+        self._vocab: list[str] = []
+        self._vocab_dirty = False
+        self.loaded = False
+
+    def ensure_loaded(self):
+        if self.loaded or self._loader is None:
+            return
+        entries = list(self._loader())
+        with self._lock:
+            if not self.loaded:
+                self._rebuild_locked(entries)
+
+    def rebuild(self, entries):
+        entries = list(entries)
+        with self._lock:
+            self._rebuild_locked(entries)
+
+    def _rebuild_locked(self, entries):
+        self._postings = {}
+        self._terms_by_key = {}
+        for key, fields in entries:
+            self._add_locked(key, fields)
+        self._vocab_dirty = True
+        self.loaded = True
+
+    def add(self, key, fields):
+        """Добавляет или заменяет запись. До первой загрузки ничего не делает."""
+        with self._lock:
+            if not self.loaded:
+                return
+            self._remove_locked(key)
+            self._add_locked(key, fields)
+
+    def remove(self, key):
+        with self._lock:
+            if self.loaded:
+                self._remove_locked(key)
+
+    def _add_locked(self, key, fields):
+        weights: dict[str, float] = {}
+        for text, weight in fields:
+            for word in search_words(text):
+                term = ru_stem(word)
+                if weights.get(term, 0.0) < weight:
+                    weights[term] = float(weight)
+        for term, weight in weights.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                self._vocab_dirty = True
+            postings[key] = weight
+        self._terms_by_key[key] = tuple(weights)
+
+    def _remove_locked(self, key):
+        for term in self._terms_by_key.pop(key, ()):
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(key, None)
+            if not postings:
+                del self._postings[term]
+                self._vocab_dirty = True
+
+    def _vocab_locked(self) -> list[str]:
+        if self._vocab_dirty:
+            self._vocab = sorted(self._postings)
+            self._vocab_dirty = False
+        return self._vocab
+
+    def _term_range(self, vocab: list[str], prefix: str) -> list[str]:
+        lo = bisect.bisect_left(vocab, prefix)
+        hi = bisect.bisect_left(vocab, prefix + "\uffff")
+        return vocab[lo:hi]
+
+    def _token_scores(self, vocab: list[str], word: str) -> dict:
+        stem = ru_stem(word)
+        scores: dict = {}
+        for term in self._term_range(vocab, stem):
+            factor = _SEARCH_MATCH_EXACT if term == stem else _SEARCH_MATCH_PREFIX
+            for key, weight in self._postings[term].items():
+                scores[key] = max(scores.get(key, 0.0), weight * factor)
+        if scores or len(stem) < SEARCH_TYPO_MIN_LEN:
+            return scores
+        # Опечатки ищем только среди терминов с той же первой буквой:
+        # в первой букве ошибаются редко, а перебор становится коротким.
+        # Опечатка в начале длинного слова («командирвк...») тоже считается,
+        # для коротких основ префикс с правкой даёт слишком много шума.
+        allow_prefix = len(stem) >= SEARCH_TYPO_PREFIX_MIN_LEN
+        for term in self._term_range(vocab, stem[0]):
+            if _within_one_edit(stem, term) or (
+                allow_prefix
+                and len(term) > len(stem)
+                and _within_one_edit(stem, term[: len(stem)])
+            ):
+                for key, weight in self._postings[term].items():
+                    scores[key] = max(scores.get(key, 0.0), weight * _SEARCH_MATCH_TYPO)
+        return scores
+
+    def search(self, query: str, min_word_len: int = 1) -> list[tuple]:
+        """
+        Записи, где нашлись все слова запроса, по убыванию релевантности.
+
+        Возвращает пары ``(key, score)``; пустой список, если в запросе нет слов.
+        """
+        words = [word for word in search_words(query) if len(word) >= min_word_len]
+        if not words:
+            return []
+        self.ensure_loaded()
+        with self._lock:
+            vocab = self._vocab_locked()
+            total: dict | None = None
+            for word in dict.fromkeys(words):
+                scores = self._token_scores(vocab, word)
+                if total is None:
+                    total = scores
+                else:
+                    total = {key: total[key] + score for key, score in scores.items() if key in total}
+                if not total:
+                    return []
+        return sorted(total.items(), key=lambda pair: -pair[1])
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"records": len(self._terms_by_key), "terms": len(self._postings)}
+
+
 # ---------------- HELP DB: DOCS ----------------
 
 def db_docs_list_categories() -> list[tuple[int, str]]:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("SELECT id, title FROM doc_categories ORDER BY title COLLATE NOCASE ASC")
     rows = cur.fetchall()
@@ -1544,7 +2843,7 @@ def db_docs_list_categories() -> list[tuple[int, str]]:
     return [(r[0], r[1]) for r in rows]
 
 def db_docs_add_category(title: str) -> int:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         "INSERT INTO doc_categories(title, created_at) VALUES (?, ?)",
@@ -1556,7 +2855,7 @@ def db_docs_add_category(title: str) -> int:
     return cid
 
 def db_docs_get_category(category_id: int) -> dict | None:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("SELECT id, title FROM doc_categories WHERE id=?", (int(category_id),))
     row = cur.fetchone()
@@ -1571,16 +2870,18 @@ def db_docs_rename_category(category_id: int, new_title: str) -> bool:
     if len(title) < 2:
         return False
 
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("UPDATE doc_categories SET title=? WHERE id=?", (title, int(category_id)))
     ok = cur.rowcount > 0
+    index_changes = _docs_search_sync_where(cur, "d.category_id=?", (int(category_id),)) if ok else None
     con.commit()
     con.close()
+    _docs_search_index_apply(index_changes)
     return ok
 
 def db_docs_delete_category_if_empty(category_id: int) -> bool:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("SELECT COUNT(*) FROM docs WHERE category_id=?", (category_id,))
     cnt = cur.fetchone()[0]
@@ -1594,7 +2895,7 @@ def db_docs_delete_category_if_empty(category_id: int) -> bool:
     return deleted
 
 def db_docs_list_by_category(category_id: int) -> list[tuple[int, str]]:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         "SELECT id, title FROM docs WHERE category_id=? ORDER BY id DESC",
@@ -1605,7 +2906,7 @@ def db_docs_list_by_category(category_id: int) -> list[tuple[int, str]]:
     return [(r[0], r[1]) for r in rows]
 
 def db_docs_get(doc_id: int):
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         "SELECT id, category_id, title, description, file_id, file_unique_id, mime_type, local_path FROM docs WHERE id=?",
@@ -1618,7 +2919,7 @@ def db_docs_get(doc_id: int):
     return {"id": row[0], "category_id": row[1], "title": row[2], "description": row[3], "file_id": row[4], "file_unique_id": row[5], "mime": row[6], "local_path": row[7]}
 
 def db_docs_add_doc(category_id: int, title: str, description: str | None, file_id: str, file_unique_id: str | None, mime_type: str | None, local_path: str | None) -> int:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     now = datetime.utcnow().isoformat()
     cur.execute("""
@@ -1638,29 +2939,34 @@ def db_docs_add_doc(category_id: int, title: str, description: str | None, file_
         now,
         now,
     ))
-    con.commit()
     did = cur.lastrowid
+    index_changes = _docs_search_sync(cur, [did])
+    con.commit()
     con.close()
+    _docs_search_index_apply(index_changes)
     return did
 
 def db_docs_delete_doc(doc_id: int) -> bool:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     did = int(doc_id)
     cur.execute("DELETE FROM doc_tag_links WHERE doc_id=?", (did,))
     cur.execute("DELETE FROM doc_favorites WHERE doc_id=?", (did,))
     cur.execute("DELETE FROM doc_views WHERE doc_id=?", (did,))
     cur.execute("DELETE FROM doc_collection_items WHERE doc_id=?", (did,))
+    _doc_extract_cache_forget(cur, did)
     cur.execute("DELETE FROM docs WHERE id=?", (did,))
     deleted = cur.rowcount > 0
+    index_changes = _docs_search_sync(cur, [did])
     con.commit()
     con.close()
+    _docs_search_index_apply(index_changes)
     return deleted
 
 
 
 def db_docs_get_category_id_by_title(title: str) -> int | None:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("SELECT id FROM doc_categories WHERE title=?", (title.strip(),))
     row = cur.fetchone()
@@ -1676,7 +2982,7 @@ def db_docs_ensure_category(title: str) -> int:
 def db_docs_get_by_file_unique_id(file_unique_id: str):
     if not file_unique_id:
         return None
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         "SELECT id, category_id, title, description, file_id, file_unique_id, mime_type, local_path FROM docs WHERE file_unique_id=?",
@@ -1702,7 +3008,7 @@ def db_docs_upsert_by_unique(category_id: int, title: str, description: str | No
     if file_unique_id:
         existing = db_docs_get_by_file_unique_id(file_unique_id)
         if existing:
-            con = sqlite3.connect(DB_PATH)
+            con = db_connect()
             cur = con.cursor()
             cur.execute(
                 """UPDATE docs
@@ -1722,8 +3028,10 @@ def db_docs_upsert_by_unique(category_id: int, title: str, description: str | No
                     file_unique_id,
                 ),
             )
+            index_changes = _docs_search_sync_where(cur, "d.file_unique_id=?", (file_unique_id,))
             con.commit()
             con.close()
+            _docs_search_index_apply(index_changes)
             return int(existing["id"])
     # fallback insert
     return db_docs_add_doc(category_id, title, description, file_id, file_unique_id, mime_type, local_path)
@@ -1740,7 +3048,7 @@ def db_profiles_upsert(
     interests: list[str] | None = None,
 ) -> int:
     """Upsert анкеты по tg_link (если есть), иначе по full_name."""
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
 
     key = (tg_link or "").strip()
@@ -1812,7 +3120,7 @@ def _db_doc_rows_to_dicts(rows) -> list[dict]:
 
 
 def db_docs_list_all(limit: int = 100) -> list[dict]:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -1840,13 +3148,208 @@ def _doc_search_tokens(query: str) -> list[str]:
     ]
 
 
+# Полнотекстовый индекс документов (SQLite FTS5). Токенайзер unicode61 не
+# сворачивает «ё» и не всегда совпадает с ``casefold``, поэтому текст
+# нормализуется в Python до записи в индекс и так же нормализуется запрос.
+# Индекс хранит только нормализованный текст; карточки читаются из docs.
+# Если сборка SQLite без FTS5, поиск откатывается на прежний просмотр в Python.
+#
+# Карточки (название, описание, категория, теги) дополнительно лежат в общем
+# SearchIndex в памяти: он даёт поиск с опечатками, которого нет в FTS5.
+DOCS_FTS_TABLE = "docs_fts"
+# Веса bm25 по колонкам: title, description, category, tags, content.
+DOCS_FTS_WEIGHTS = (10.0, 4.0, 2.0, 6.0, 1.0)
+_docs_fts_enabled = False
+
+
+def _docs_fts_normalize(text: str | None) -> str:
+    return (text or "").casefold().replace("ё", "е")
+
+
+def _docs_search_index_fields(title, description, category, tags) -> list[tuple[str, float]]:
+    return [
+        (title or "", DOCS_FTS_WEIGHTS[0]),
+        (description or "", DOCS_FTS_WEIGHTS[1]),
+        (category or "", DOCS_FTS_WEIGHTS[2]),
+        (tags or "", DOCS_FTS_WEIGHTS[3]),
+    ]
+
+
+_DOCS_SEARCH_ROWS_SQL = """
+    SELECT d.id, d.title, COALESCE(d.description, ''), COALESCE(c.title, ''),
+           COALESCE((SELECT GROUP_CONCAT(t.title, ' ')
+                     FROM doc_tag_links l JOIN doc_tags t ON t.id=l.tag_id
+                     WHERE l.doc_id=d.id), ''),
+           {content}
+    FROM docs d
+    LEFT JOIN doc_categories c ON c.id=d.category_id
+    {where}
+"""
+
+
+def _docs_search_index_load():
+    con = db_connect()
+    try:
+        cur = con.cursor()
+        cur.execute(_DOCS_SEARCH_ROWS_SQL.format(content="''", where=""))
+        return [
+            (int(row[0]), _docs_search_index_fields(*row[1:5]))
+            for row in cur.fetchall()
+        ]
+    finally:
+        con.close()
+
+
+DOCS_SEARCH_INDEX = SearchIndex("docs", _docs_search_index_load)
+
+
+def _docs_fts_init(cur) -> tuple | None:
+    """
+    Создаёт FTS5-таблицу и перестраивает её, если она разошлась с docs.
+
+    Возвращает изменения SearchIndex для ``_docs_search_index_apply``.
+    """
+    global _docs_fts_enabled
+    try:
+        cur.execute(
+            f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {DOCS_FTS_TABLE} USING fts5(
+                title, description, category, tags, content,
+                tokenize='unicode61 remove_diacritics 2'
+            )
+            """
+        )
+    except sqlite3.OperationalError as e:
+        logger.warning("SQLite FTS5 is unavailable, docs search uses Python scan: %s", e)
+        _docs_fts_enabled = False
+        return None
+    _docs_fts_enabled = True
+    docs_count = int(cur.execute("SELECT COUNT(*) FROM docs").fetchone()[0] or 0)
+    fts_count = int(cur.execute(f"SELECT COUNT(*) FROM {DOCS_FTS_TABLE}").fetchone()[0] or 0)
+    if docs_count != fts_count:
+        logger.info("Rebuilding docs full-text index: docs=%s indexed=%s", docs_count, fts_count)
+        return _docs_search_sync(cur, None)
+    return None
+
+
+def _docs_search_sync(cur, doc_ids) -> tuple | None:
+    """
+    Переписывает индексы поиска для ``doc_ids`` (``None`` — для всех документов).
+
+    Вызывается в той же транзакции, что и изменение карточки, поэтому FTS5 не
+    расходится с docs. SearchIndex в памяти транзакцию не видит: возвращаемые
+    изменения вызывающий передаёт в ``_docs_search_index_apply`` после commit,
+    чтобы откат не оставил в памяти несуществующих карточек.
+    Удалённые документы просто исчезают из обоих индексов.
+    """
+    if doc_ids is None:
+        ids = None
+        where, params = "", ()
+        if _docs_fts_enabled:
+            cur.execute(f"DELETE FROM {DOCS_FTS_TABLE}")
+    else:
+        ids = sorted({int(doc_id) for doc_id in doc_ids})
+        if not ids:
+            return None
+        marks = ",".join("?" for _ in ids)
+        where, params = f"WHERE d.id IN ({marks})", ids
+        if _docs_fts_enabled:
+            cur.execute(f"DELETE FROM {DOCS_FTS_TABLE} WHERE rowid IN ({marks})", ids)
+    content = "COALESCE(d.content_text, '')" if _docs_fts_enabled else "''"
+    cur.execute(_DOCS_SEARCH_ROWS_SQL.format(content=content, where=where), params)
+
+    memory_entries = []
+
+    def fts_rows():
+        # Курсор читается построчно: содержимое всех документов сразу в память
+        # не попадает даже при полной перестройке.
+        for row in cur if ids is None else cur.fetchall():
+            memory_entries.append((int(row[0]), _docs_search_index_fields(*row[1:5])))
+            yield (int(row[0]), *(_docs_fts_normalize(value) for value in row[1:]))
+
+    if _docs_fts_enabled:
+        cur.connection.executemany(
+            f"INSERT INTO {DOCS_FTS_TABLE}(rowid, title, description, category, tags, content) VALUES(?, ?, ?, ?, ?, ?)",
+            fts_rows(),
+        )
+    else:
+        for _row in fts_rows():
+            pass
+    return ids, memory_entries
+
+
+def _docs_search_index_apply(changes: tuple | None) -> None:
+    """Переносит в SearchIndex изменения из ``_docs_search_sync`` после commit."""
+    if changes is None:
+        return
+    ids, memory_entries = changes
+    if ids is None:
+        DOCS_SEARCH_INDEX.rebuild(memory_entries)
+        return
+    found = set()
+    for doc_id, fields in memory_entries:
+        found.add(doc_id)
+        DOCS_SEARCH_INDEX.add(doc_id, fields)
+    for doc_id in ids:
+        if doc_id not in found:
+            DOCS_SEARCH_INDEX.remove(doc_id)
+
+
+def _docs_search_sync_where(cur, condition: str, params: tuple) -> tuple | None:
+    """Переиндексирует документы, выбранные условием по docs/doc_tag_links."""
+    cur.execute(f"SELECT DISTINCT d.id FROM docs d LEFT JOIN doc_tag_links l ON l.doc_id=d.id WHERE {condition}", params)
+    return _docs_search_sync(cur, [row[0] for row in cur.fetchall()])
+
+
+def db_docs_fts_rebuild() -> None:
+    con = db_connect()
+    cur = con.cursor()
+    index_changes = _docs_search_sync(cur, None)
+    con.commit()
+    con.close()
+    _docs_search_index_apply(index_changes)
+
+
+def _docs_fts_match_query(tokens: list[str]) -> str:
+    # Каждое слово ищется по префиксу основы: «отпусках» находит «отпуск»,
+    # «отпускной» и «отпуска».
+    return " AND ".join(f'"{ru_stem(_docs_fts_normalize(token))}"*' for token in tokens)
+
+
+def _db_docs_by_ids(doc_ids: list[int]) -> list[dict]:
+    """Карточки документов в порядке ``doc_ids`` (без content_text)."""
+    if not doc_ids:
+        return []
+    marks = ",".join("?" for _ in doc_ids)
+    con = db_connect()
+    cur = con.cursor()
+    cur.execute(
+        f"""
+        SELECT d.id, d.category_id, d.title, d.description, d.file_id,
+               d.file_unique_id, d.mime_type, d.local_path, d.uploaded_at,
+               COALESCE(d.updated_at, d.uploaded_at), c.title
+        FROM docs d
+        JOIN doc_categories c ON c.id=d.category_id
+        WHERE d.id IN ({marks})
+        """,
+        [int(doc_id) for doc_id in doc_ids],
+    )
+    rows = cur.fetchall()
+    con.close()
+    by_id = {int(row[0]): row for row in rows}
+    return _db_doc_rows_to_dicts([by_id[int(doc_id)] for doc_id in doc_ids if int(doc_id) in by_id])
+
+
 def db_docs_search(query: str, limit: int = 500) -> list[dict]:
     """
     Ищет по названию, описанию, категории, тегам и содержимому файла.
 
-    SQLite ``NOCASE`` работает только для ASCII, поэтому сравнение выполняется
-    в Python через ``casefold``. Все слова запроса обязательны, что позволяет
-    искать, например, ``отпуск hr`` независимо от порядка слов в карточке.
+    Все слова запроса обязательны, что позволяет искать, например,
+    ``отпуск hr`` независимо от порядка слов в карточке. Слова сравниваются
+    по основе (FTS5, bm25). Если точных совпадений не набирается даже на одну
+    страницу выдачи (``DOCS_SEARCH_PAGE_SIZE``), добавляются карточки,
+    найденные в SearchIndex с учётом опечаток. В Python попадают только
+    top-N карточек без содержимого файлов.
     """
     tokens = _doc_search_tokens(query)
     if not tokens:
@@ -1854,8 +3357,52 @@ def db_docs_search(query: str, limit: int = 500) -> list[dict]:
     safe_limit = int(limit)
     if safe_limit <= 0:
         return []
+    if not _docs_fts_enabled:
+        return _db_docs_search_scan(tokens, safe_limit)
+
+    con = db_connect()
+    cur = con.cursor()
+    cur.execute(
+        f"""
+        SELECT d.id, d.category_id, d.title, d.description, d.file_id,
+               d.file_unique_id, d.mime_type, d.local_path, d.uploaded_at,
+               COALESCE(d.updated_at, d.uploaded_at), c.title
+        FROM {DOCS_FTS_TABLE} f
+        JOIN docs d ON d.id=f.rowid
+        JOIN doc_categories c ON c.id=d.category_id
+        WHERE {DOCS_FTS_TABLE} MATCH ?
+        ORDER BY bm25({DOCS_FTS_TABLE}, {", ".join(str(w) for w in DOCS_FTS_WEIGHTS)}),
+                 d.title COLLATE NOCASE, d.id
+        LIMIT ?
+        """,
+        (_docs_fts_match_query(tokens), safe_limit),
+    )
+    rows = cur.fetchall()
+    con.close()
+    result = _db_doc_rows_to_dicts(rows)
+    # Опечатки ищем, только когда точных совпадений меньше страницы выдачи:
+    # иначе пользователь и так видит полную страницу, а перебор словаря
+    # SearchIndex выполнялся бы почти на каждый запрос.
+    if len(result) >= min(safe_limit, DOCS_SEARCH_PAGE_SIZE):
+        return result
+
+    seen = {int(item["id"]) for item in result}
+    extra_ids = [
+        int(doc_id)
+        for doc_id, _score in DOCS_SEARCH_INDEX.search(" ".join(tokens))
+        if int(doc_id) not in seen
+    ][: safe_limit - len(result)]
+    return result + _db_docs_by_ids(extra_ids)
+
+
+def _db_docs_search_scan(tokens: list[str], safe_limit: int) -> list[dict]:
+    """
+    Запасной поиск без FTS5: полный просмотр docs.
 
-    con = sqlite3.connect(DB_PATH)
+    SQLite ``NOCASE`` работает только для ASCII, поэтому сравнение выполняется
+    в Python через ``casefold``.
+    """
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -1897,7 +3444,7 @@ def db_docs_search(query: str, limit: int = 500) -> list[dict]:
 
 def db_docs_search_by_tag(tag_id: int, limit: int = 500) -> list[dict]:
     """Возвращает документы, у которых выбранный тег назначен явно."""
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -1920,7 +3467,7 @@ def db_docs_search_by_tag(tag_id: int, limit: int = 500) -> list[dict]:
 
 def db_docs_new(days: int = 30, limit: int = 40) -> list[dict]:
     threshold = (datetime.utcnow() - timedelta(days=max(1, int(days)))).isoformat()
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -1943,7 +3490,7 @@ def db_docs_new(days: int = 30, limit: int = 40) -> list[dict]:
 def db_doc_record_view(user_id: int | None, doc_id: int):
     if not user_id:
         return
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -1962,7 +3509,7 @@ def db_doc_record_view(user_id: int | None, doc_id: int):
 def db_docs_recent(user_id: int | None, limit: int = 40) -> list[dict]:
     if not user_id:
         return []
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -1986,7 +3533,7 @@ def db_docs_recent(user_id: int | None, limit: int = 40) -> list[dict]:
 def db_doc_is_favorite(user_id: int | None, doc_id: int) -> bool:
     if not user_id:
         return False
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("SELECT 1 FROM doc_favorites WHERE user_id=? AND doc_id=?", (int(user_id), int(doc_id)))
     result = cur.fetchone() is not None
@@ -1997,7 +3544,7 @@ def db_doc_is_favorite(user_id: int | None, doc_id: int) -> bool:
 def db_doc_toggle_favorite(user_id: int | None, doc_id: int) -> bool:
     if not user_id:
         return False
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("SELECT 1 FROM doc_favorites WHERE user_id=? AND doc_id=?", (int(user_id), int(doc_id)))
     if cur.fetchone():
@@ -2017,7 +3564,7 @@ def db_doc_toggle_favorite(user_id: int | None, doc_id: int) -> bool:
 def db_docs_favorites(user_id: int | None, limit: int = 40) -> list[dict]:
     if not user_id:
         return []
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -2039,7 +3586,7 @@ def db_docs_favorites(user_id: int | None, limit: int = 40) -> list[dict]:
 
 
 def db_doc_tags_list() -> list[dict]:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -2059,7 +3606,7 @@ def db_doc_tag_add(title: str) -> int:
     clean = re.sub(r"\s+", " ", (title or "").strip()).lstrip("#")
     if len(clean) < 2:
         raise ValueError("Название тега слишком короткое")
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         "INSERT INTO doc_tags(title, created_at) VALUES(?, ?)",
@@ -2072,18 +3619,22 @@ def db_doc_tag_add(title: str) -> int:
 
 
 def db_doc_tag_delete(tag_id: int) -> bool:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
+    cur.execute("SELECT doc_id FROM doc_tag_links WHERE tag_id=?", (int(tag_id),))
+    tagged_doc_ids = [row[0] for row in cur.fetchall()]
     cur.execute("DELETE FROM doc_tag_links WHERE tag_id=?", (int(tag_id),))
     cur.execute("DELETE FROM doc_tags WHERE id=?", (int(tag_id),))
     ok = cur.rowcount > 0
+    index_changes = _docs_search_sync(cur, tagged_doc_ids)
     con.commit()
     con.close()
+    _docs_search_index_apply(index_changes)
     return ok
 
 
 def db_doc_get_tags(doc_id: int) -> list[dict]:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -2101,7 +3652,7 @@ def db_doc_get_tags(doc_id: int) -> list[dict]:
 
 
 def db_doc_toggle_tag(doc_id: int, tag_id: int) -> bool:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("SELECT 1 FROM doc_tag_links WHERE doc_id=? AND tag_id=?", (int(doc_id), int(tag_id)))
     if cur.fetchone():
@@ -2111,8 +3662,10 @@ def db_doc_toggle_tag(doc_id: int, tag_id: int) -> bool:
         cur.execute("INSERT OR IGNORE INTO doc_tag_links(doc_id, tag_id) VALUES(?, ?)", (int(doc_id), int(tag_id)))
         enabled = True
     cur.execute("UPDATE docs SET updated_at=? WHERE id=?", (datetime.utcnow().isoformat(), int(doc_id)))
+    index_changes = _docs_search_sync(cur, [doc_id])
     con.commit()
     con.close()
+    _docs_search_index_apply(index_changes)
     return enabled
 
 
@@ -2120,36 +3673,42 @@ def db_doc_update_title(doc_id: int, title: str) -> bool:
     clean = re.sub(r"\s+", " ", (title or "").strip())[:120]
     if len(clean) < 2:
         return False
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("UPDATE docs SET title=?, updated_at=? WHERE id=?", (clean, datetime.utcnow().isoformat(), int(doc_id)))
     ok = cur.rowcount > 0
+    index_changes = _docs_search_sync(cur, [doc_id]) if ok else None
     con.commit()
     con.close()
+    _docs_search_index_apply(index_changes)
     return ok
 
 
 def db_doc_update_description(doc_id: int, description: str | None) -> bool:
     clean = (description or "").strip()[:1200] or None
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("UPDATE docs SET description=?, updated_at=? WHERE id=?", (clean, datetime.utcnow().isoformat(), int(doc_id)))
     ok = cur.rowcount > 0
+    index_changes = _docs_search_sync(cur, [doc_id]) if ok else None
     con.commit()
     con.close()
+    _docs_search_index_apply(index_changes)
     return ok
 
 
 def db_doc_update_category(doc_id: int, category_id: int) -> bool:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         "UPDATE docs SET category_id=?, updated_at=? WHERE id=?",
         (int(category_id), datetime.utcnow().isoformat(), int(doc_id)),
     )
     ok = cur.rowcount > 0
+    index_changes = _docs_search_sync(cur, [doc_id]) if ok else None
     con.commit()
     con.close()
+    _docs_search_index_apply(index_changes)
     return ok
 
 
@@ -2160,7 +3719,7 @@ def db_doc_replace_file(
     mime_type: str | None,
     local_path: str | None,
 ) -> bool:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -2180,13 +3739,19 @@ def db_doc_replace_file(
         ),
     )
     ok = cur.rowcount > 0
+    index_changes = None
+    if ok:
+        # Текст документа сброшен — записи кэша, ссылающиеся на него, больше не годятся.
+        _doc_extract_cache_forget(cur, doc_id)
+        index_changes = _docs_search_sync(cur, [doc_id])
     con.commit()
     con.close()
+    _docs_search_index_apply(index_changes)
     return ok
 
 
 def db_doc_set_local_path(doc_id: int, local_path: str) -> None:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("UPDATE docs SET local_path=? WHERE id=?", (local_path, int(doc_id)))
     con.commit()
@@ -2199,7 +3764,7 @@ def db_doc_set_content_index(
     status: str,
     error: str | None = None,
 ) -> None:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -2216,12 +3781,230 @@ def db_doc_set_content_index(
             int(doc_id),
         ),
     )
+    index_changes = _docs_search_sync(cur, [doc_id])
+    con.commit()
+    con.close()
+    _docs_search_index_apply(index_changes)
+
+
+# Кэш извлечения хранит только хэш содержимого и метаданные результата;
+# сам текст берётся из docs.content_text документа-источника (doc_id).
+# Запись действительна, пока у источника тот же статус индексации.
+DOC_PAGE_CACHE_MAX_AGE_DAYS = max(1, int(os.getenv("DOC_PAGE_CACHE_MAX_AGE_DAYS", "180")))
+
+
+@schema_migration(23, "doc_extract_cache_meta")
+def _migrate_doc_extract_cache_meta(con):
+    # Прежняя таблица хранила копию content_text и не помнила ошибку.
+    con.execute("DROP TABLE IF EXISTS doc_extract_cache")
+    con.execute("DELETE FROM doc_extract_cache_files")
+    con.execute(
+        """
+        CREATE TABLE doc_extract_cache (
+            content_hash TEXT PRIMARY KEY,
+            doc_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            error TEXT,
+            ocr_used INTEGER NOT NULL DEFAULT 0,
+            ocr_settings TEXT,
+            page_count INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL
+        )
+        """
+    )
+    con.execute("CREATE INDEX IF NOT EXISTS idx_doc_extract_cache_doc ON doc_extract_cache(doc_id)")
+    # Ключи страниц теперь включают DPI; старые записи больше не совпадут.
+    con.execute("DELETE FROM doc_page_ocr_cache")
+
+
+_DOC_EXTRACT_CACHE_SELECT = """
+    SELECT c.content_hash, src.content_text, c.status, c.error, c.ocr_used, c.page_count
+    FROM doc_extract_cache c
+    JOIN docs src ON src.id=c.doc_id AND src.content_index_status=c.status
+"""
+
+
+def _doc_extract_cache_row(row) -> dict | None:
+    if not row:
+        return None
+    return {
+        "content_hash": row[0],
+        "text": row[1] or "",
+        "status": row[2],
+        "error": row[3],
+        "ocr_used": bool(row[4]),
+        "page_count": int(row[5] or 0),
+    }
+
+
+def db_doc_extract_cache_get(content_hash: str) -> dict | None:
+    con = db_connect()
+    cur = con.cursor()
+    cur.execute(
+        f"{_DOC_EXTRACT_CACHE_SELECT} WHERE c.content_hash=? AND (c.ocr_used=0 OR c.ocr_settings=?)",
+        (content_hash, ocr_settings_key()),
+    )
+    row = cur.fetchone()
+    con.close()
+    return _doc_extract_cache_row(row)
+
+
+def db_doc_extract_cache_for_doc(doc_id: int) -> dict | None:
+    """Кэш по file_unique_id документа: позволяет обойтись без скачивания."""
+    con = db_connect()
+    cur = con.cursor()
+    cur.execute(
+        f"""
+        {_DOC_EXTRACT_CACHE_SELECT}
+        JOIN doc_extract_cache_files f ON f.content_hash=c.content_hash
+        JOIN docs d ON d.file_unique_id=f.file_unique_id
+        WHERE d.id=? AND (c.ocr_used=0 OR c.ocr_settings=?)
+        """,
+        (int(doc_id), ocr_settings_key()),
+    )
+    row = cur.fetchone()
+    con.close()
+    return _doc_extract_cache_row(row)
+
+
+def db_doc_extract_cache_put(
+    content_hash: str,
+    doc_id: int,
+    status: str,
+    error: str | None,
+    ocr_used: bool,
+    page_count: int = 0,
+) -> None:
+    con = db_connect()
+    cur = con.cursor()
+    cur.execute(
+        """
+        INSERT OR REPLACE INTO doc_extract_cache(
+            content_hash, doc_id, status, error, ocr_used, ocr_settings, page_count, created_at
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (
+            content_hash,
+            int(doc_id),
+            status,
+            (error or "")[:1000] or None,
+            1 if ocr_used else 0,
+            ocr_settings_key() if ocr_used else None,
+            int(page_count or 0),
+            datetime.utcnow().isoformat(),
+        ),
+    )
+    _doc_extract_cache_link(cur, content_hash, doc_id)
+    con.commit()
+    con.close()
+
+
+def _doc_extract_cache_link(cur, content_hash: str, doc_id: int) -> None:
+    """Связывает file_unique_id документа с записью кэша."""
+    cur.execute(
+        """
+        INSERT OR REPLACE INTO doc_extract_cache_files(file_unique_id, content_hash)
+        SELECT file_unique_id, ? FROM docs
+        WHERE id=? AND file_unique_id IS NOT NULL AND file_unique_id<>''
+        """,
+        (content_hash, int(doc_id)),
+    )
+
+
+def db_doc_extract_cache_link(content_hash: str, doc_id: int) -> None:
+    con = db_connect()
+    cur = con.cursor()
+    _doc_extract_cache_link(cur, content_hash, doc_id)
+    con.commit()
+    con.close()
+
+
+def _doc_extract_cache_forget(cur, doc_id: int) -> None:
+    """Снимает записи кэша, текст которых лежит в документе doc_id."""
+    cur.execute("DELETE FROM doc_extract_cache WHERE doc_id=?", (int(doc_id),))
+    cur.execute(
+        "DELETE FROM doc_extract_cache_files "
+        "WHERE content_hash NOT IN (SELECT content_hash FROM doc_extract_cache)"
+    )
+
+
+def db_doc_extract_cache_prune() -> int:
+    """
+    Чистит кэш извлечения: записи, чей источник удалён или переиндексирован,
+    осиротевшие связи file_unique_id и страницы OCR старше
+    DOC_PAGE_CACHE_MAX_AGE_DAYS. Возвращает число удалённых строк.
+    """
+    cutoff = (datetime.utcnow() - timedelta(days=DOC_PAGE_CACHE_MAX_AGE_DAYS)).isoformat()
+    con = db_connect()
+    cur = con.cursor()
+    cur.execute(
+        """
+        DELETE FROM doc_extract_cache
+        WHERE NOT EXISTS (
+            SELECT 1 FROM docs src
+            WHERE src.id=doc_extract_cache.doc_id AND src.content_index_status=doc_extract_cache.status
+        )
+        """
+    )
+    removed = cur.rowcount
+    cur.execute(
+        "DELETE FROM doc_extract_cache_files "
+        "WHERE content_hash NOT IN (SELECT content_hash FROM doc_extract_cache)"
+    )
+    removed += cur.rowcount
+    cur.execute("DELETE FROM doc_page_ocr_cache WHERE created_at<?", (cutoff,))
+    removed += cur.rowcount
+    con.commit()
+    con.close()
+    return removed
+
+
+@db_startup_task
+def _doc_extract_cache_startup_prune():
+    db_doc_extract_cache_prune()
+
+
+async def job_doc_extract_cache_prune(context: ContextTypes.DEFAULT_TYPE):
+    removed = await db.write(db_doc_extract_cache_prune)
+    if removed:
+        logger.info("Document extract cache pruned: %s rows", removed)
+
+
+def db_doc_page_cache_get_many(page_hashes: list[str]) -> dict[str, str]:
+    keys = list(dict.fromkeys(key for key in page_hashes if key))
+    if not keys:
+        return {}
+    con = db_connect()
+    cur = con.cursor()
+    found: dict[str, str] = {}
+    for start in range(0, len(keys), 500):
+        chunk = keys[start:start + 500]
+        cur.execute(
+            f"SELECT page_hash, content_text FROM doc_page_ocr_cache WHERE page_hash IN ({','.join('?' * len(chunk))})",
+            chunk,
+        )
+        found.update((row[0], row[1] or "") for row in cur.fetchall())
+    con.close()
+    return found
+
+
+def db_doc_page_cache_put_many(items: list[tuple[str, str]]) -> None:
+    if not items:
+        return
+    now = datetime.utcnow().isoformat()
+    con = db_connect()
+    cur = con.cursor()
+    cur.executemany(
+        "INSERT OR REPLACE INTO doc_page_ocr_cache(page_hash, content_text, created_at) VALUES (?, ?, ?)",
+        [(key, text or None, now) for key, text in items],
+    )
     con.commit()
     con.close()
 
 
 def db_docs_pending_content_index(limit: int = 10) -> list[dict]:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -2248,400 +4031,363 @@ def db_docs_pending_content_index(limit: int = 10) -> list[dict]:
     ]
 
 
-def _normalize_document_text(text: str) -> str:
-    value = (text or "").replace("\x00", " ")
-    value = re.sub(r"[ \t\f\v]+", " ", value)
-    value = re.sub(r"\s*\n\s*", "\n", value)
-    value = re.sub(r"\n{3,}", "\n\n", value).strip()
-    return value[:DOC_INDEX_MAX_CHARS]
-
-
-def _xml_visible_text(data: bytes) -> str:
-    """Извлекает пользовательский текст из XML внутри Office-файла."""
-    import xml.etree.ElementTree as ET
-
-    root = ET.fromstring(data)
-    chunks: list[str] = []
-    text_tags = {"t", "instrText", "delText"}
-    break_tags = {"p", "tr", "br", "cr"}
-    for element in root.iter():
-        local_name = element.tag.rsplit("}", 1)[-1]
-        if local_name in text_tags and element.text:
-            chunks.append(element.text)
-        elif local_name == "tab":
-            chunks.append("\t")
-        elif local_name in break_tags:
-            chunks.append("\n")
-    return _normalize_document_text(" ".join(chunks))
-
-
-def _ocr_pil_image(image) -> tuple[str, str | None]:
-    """OCR PIL-изображения: сначала pytesseract, затем системный tesseract."""
-    languages = [DOC_OCR_LANG]
-    if DOC_OCR_LANG != "eng":
-        languages.append("eng")
-
-    package_error = None
-    try:
-        import pytesseract
-
-        for language in languages:
-            try:
-                value = pytesseract.image_to_string(image, lang=language)
-                if value and value.strip():
-                    return value, None
-            except Exception as exc:
-                package_error = str(exc)
-    except Exception as exc:
-        package_error = str(exc)
+def _doc_index_file_suffix(mime_type: str | None, local_path: str | None = None) -> str:
+    if local_path and Path(local_path).suffix:
+        return Path(local_path).suffix
+    mime = (mime_type or "").casefold()
+    if mime == "application/pdf":
+        return ".pdf"
+    if "wordprocessingml.document" in mime:
+        return ".docx"
+    if "spreadsheetml.sheet" in mime:
+        return ".xlsx"
+    return ".bin"
 
-    try:
-        import subprocess
-
-        image_buffer = io.BytesIO()
-        image.save(image_buffer, format="PNG")
-        last_error = package_error
-        for language in languages:
-            result = subprocess.run(
-                ["tesseract", "stdin", "stdout", "-l", language],
-                input=image_buffer.getvalue(),
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                timeout=120,
-                check=False,
-            )
-            if result.returncode == 0:
-                value = result.stdout.decode("utf-8", errors="ignore")
-                if value.strip():
-                    return value, None
-            last_error = result.stderr.decode("utf-8", errors="ignore").strip() or last_error
-        return "", last_error or "Tesseract не вернул текст"
-    except Exception as exc:
-        return "", package_error or str(exc)
 
+async def _ensure_document_local_copy(
+    bot,
+    doc_id: int,
+    local_path: str | None,
+    mime_type: str | None,
+    file_id: str | None,
+) -> str | None:
+    """
+    Путь к локальной копии документа; при необходимости скачивает её.
 
-def _ocr_image_blobs(blobs: list[bytes]) -> tuple[str, list[str]]:
-    if not blobs:
-        return "", []
-    errors: list[str] = []
-    parts: list[str] = []
+    None — скачать пока не удалось (документ остаётся pending),
+    пустая строка — копии нет и скачать нечего.
+    """
+    if local_path and Path(local_path).exists():
+        return local_path
+    if not file_id:
+        await db.write(
+            db_doc_set_content_index, doc_id, None, "unavailable", "Нет локальной копии и Telegram file_id"
+        )
+        return ""
     try:
-        from PIL import Image
-    except Exception as exc:
-        return "", [f"OCR недоступен: {exc}"]
-
-    for blob in blobs[:DOC_OCR_MAX_IMAGES]:
-        try:
-            with Image.open(io.BytesIO(blob)) as image:
-                value, ocr_error = _ocr_pil_image(image)
-            if value and value.strip():
-                parts.append(value)
-            elif ocr_error:
-                errors.append(ocr_error)
-        except Exception as exc:
-            errors.append(str(exc))
-    return _normalize_document_text("\n".join(parts)), errors
-
-
-def _extract_docx_text(path: Path) -> tuple[str, bool, list[str]]:
-    errors: list[str] = []
-    parts: list[str] = []
-    ocr_used = False
-    with zipfile.ZipFile(path, "r") as zf:
-        names = zf.namelist()
-        xml_names = [
-            name
-            for name in names
-            if name == "word/document.xml"
-            or (
-                name.startswith("word/")
-                and name.endswith(".xml")
-                and any(key in name for key in ("header", "footer", "footnotes", "endnotes", "comments"))
-            )
-        ]
-        for name in sorted(xml_names):
-            try:
-                value = _xml_visible_text(zf.read(name))
-                if value:
-                    parts.append(value)
-            except Exception as exc:
-                errors.append(f"{name}: {exc}")
-
-        # Документы-сканы часто состоят только из изображений. OCR запускается
-        # лишь при отсутствии нормального текстового слоя.
-        text = _normalize_document_text("\n".join(parts))
-        if len(text) < 100:
-            image_blobs = [
-                zf.read(name)
-                for name in names
-                if name.startswith("word/media/") and not name.endswith("/")
-            ]
-            ocr_text, ocr_errors = _ocr_image_blobs(image_blobs)
-            errors.extend(ocr_errors)
-            if ocr_text:
-                parts.append(ocr_text)
-                ocr_used = True
-    return _normalize_document_text("\n".join(parts)), ocr_used, errors
-
-
-def _extract_xlsx_text(path: Path) -> tuple[str, bool, list[str]]:
-    import xml.etree.ElementTree as ET
+        suffix = _doc_index_file_suffix(mime_type, local_path)
+        resolved_path = str(Path(STORAGE_DIR) / "docs" / f"index_{int(doc_id)}{suffix}")
+        tg_file = await bot.get_file(file_id)
+        await tg_file.download_to_drive(custom_path=resolved_path)
+        await db.write(db_doc_set_local_path, doc_id, resolved_path)
+        return resolved_path
+    except Exception:
+        logger.exception("Cannot download document for indexing: doc_id=%s", doc_id)
+        return None
 
-    errors: list[str] = []
-    parts: list[str] = []
-    ocr_used = False
-    with zipfile.ZipFile(path, "r") as zf:
-        names = zf.namelist()
-        shared_strings: list[str] = []
-        if "xl/sharedStrings.xml" in names:
-            try:
-                root = ET.fromstring(zf.read("xl/sharedStrings.xml"))
-                for item in root.iter():
-                    if item.tag.rsplit("}", 1)[-1] != "si":
-                        continue
-                    value = " ".join(
-                        node.text or ""
-                        for node in item.iter()
-                        if node.tag.rsplit("}", 1)[-1] == "t"
-                    ).strip()
-                    shared_strings.append(value)
-            except Exception as exc:
-                errors.append(f"sharedStrings.xml: {exc}")
 
-        for name in sorted(n for n in names if n.startswith("xl/worksheets/") and n.endswith(".xml")):
-            try:
-                root = ET.fromstring(zf.read(name))
-                parts.append(Path(name).stem)
-                for cell in root.iter():
-                    if cell.tag.rsplit("}", 1)[-1] != "c":
-                        continue
-                    cell_type = cell.attrib.get("t", "")
-                    raw_value = None
-                    inline_values: list[str] = []
-                    formula = None
-                    for node in cell.iter():
-                        local_name = node.tag.rsplit("}", 1)[-1]
-                        if local_name == "v":
-                            raw_value = node.text
-                        elif local_name == "t" and node.text:
-                            inline_values.append(node.text)
-                        elif local_name == "f" and node.text:
-                            formula = node.text
-                    if cell_type == "s" and raw_value is not None:
-                        try:
-                            parts.append(shared_strings[int(raw_value)])
-                        except (IndexError, TypeError, ValueError):
-                            pass
-                    elif inline_values:
-                        parts.append(" ".join(inline_values))
-                    elif raw_value is not None:
-                        parts.append(raw_value)
-                    if formula:
-                        parts.append(formula)
-            except Exception as exc:
-                errors.append(f"{name}: {exc}")
-
-        text = _normalize_document_text("\n".join(parts))
-        if len(text) < 100:
-            image_blobs = [
-                zf.read(name)
-                for name in names
-                if name.startswith("xl/media/") and not name.endswith("/")
-            ]
-            ocr_text, ocr_errors = _ocr_image_blobs(image_blobs)
-            errors.extend(ocr_errors)
-            if ocr_text:
-                parts.append(ocr_text)
-                ocr_used = True
-    return _normalize_document_text("\n".join(parts)), ocr_used, errors
+# ---------------- DOCUMENT INDEXING SERVICE ----------------
+# Извлечение текста и OCR занимают CPU, поэтому выполняются в пуле процессов,
+# а не в потоках (в потоках они всё равно упирались в GIL). Документы идут
+# через очередь; страницы скана распознаются параллельно в разных процессах,
+# у каждого документа есть лимит времени, а повторная постановка или удаление
+# документа отменяют ещё не начатые страницы.
+
+DOC_INDEX_PROCESSES = max(0, int(os.getenv("DOC_INDEX_PROCESSES", str(min(4, os.cpu_count() or 1)))))
+DOC_INDEX_TIMEOUT_SECONDS = max(30, int(os.getenv("DOC_INDEX_TIMEOUT_SECONDS", "900")))
+DOC_INDEX_QUEUE_MAX = max(1, int(os.getenv("DOC_INDEX_QUEUE_MAX", "200")))
+
+
+class DocumentIndexJob:
+    __slots__ = ("doc_id", "local_path", "mime_type", "file_id", "bot", "waiters", "cancelled")
+
+    def __init__(self, doc_id: int, local_path, mime_type, file_id, bot):
+        self.doc_id = int(doc_id)
+        self.local_path = local_path
+        self.mime_type = mime_type
+        self.file_id = file_id
+        self.bot = bot
+        self.waiters: list[asyncio.Future] = []
+        self.cancelled = False
+
+    def resolve(self, status: str = "error"):
+        # Ожидающий всегда получает статус индексации: отмена задания,
+        # тайм-аут и сбой извлечения — это "error", а не исключение в обработчике.
+        for waiter in self.waiters:
+            if not waiter.done():
+                waiter.set_result(status)
+
+
+class DocumentIndexService:
+    def __init__(
+        self,
+        processes: int = DOC_INDEX_PROCESSES,
+        concurrency: int = DOC_INDEX_CONCURRENCY,
+        timeout: float = DOC_INDEX_TIMEOUT_SECONDS,
+    ):
+        self.processes = processes
+        self.concurrency = max(1, int(concurrency))
+        self.timeout = float(timeout)
+        self._pool: ProcessPoolExecutor | None = None
+        self._pool_generation = 0
+        self._queue: asyncio.Queue | None = None
+        self._queued: dict[int, DocumentIndexJob] = {}
+        self._running: dict[int, tuple[DocumentIndexJob, asyncio.Task]] = {}
+        self._workers: list[asyncio.Task] = []
+        self._progress: dict[int, dict] = {}
+        self.done = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.cache_hits = 0
+        self.recycled = 0
+
+    def _executor(self) -> ProcessPoolExecutor | None:
+        # processes=0 — извлечение в потоках, как раньше (удобно для отладки).
+        if self.processes and self._pool is None:
+            # spawn: дочерний процесс не наследует потоки и соединения бота.
+            # Он импортирует bot.py как __mp_main__ (бот стартует только под
+            # __name__ == "__main__") и выполняет функции document_worker.
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.processes,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._pool
+
+    def _terminate_pool(self):
+        """
+        Завершает рабочие процессы; следующий вызов _run создаст новый пул.
 
+        Отменённый по тайм-ауту OCR иначе занимал бы процесс до конца
+        документа, а при остановке бота — задерживал бы выход.
+        """
+        pool = self._pool
+        if pool is None:
+            return
+        self._pool = None
+        self._pool_generation += 1
+        # У ProcessPoolExecutor нет публичного способа остановить занятый процесс.
+        for process in list((getattr(pool, "_processes", None) or {}).values()):
+            process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _ensure_workers(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        self._workers = [task for task in self._workers if not task.done()]
+        loop = asyncio.get_running_loop()
+        while len(self._workers) < self.concurrency:
+            self._workers.append(loop.create_task(self._worker(), name="document-indexer"))
+
+    def is_tracked(self, doc_id: int) -> bool:
+        return int(doc_id) in self._queued or int(doc_id) in self._running
+
+    def enqueue(self, bot, doc_id: int, local_path, mime_type, file_id, wait: bool = False):
+        """
+        Ставит документ в очередь; повторная постановка заменяет прежнюю.
 
-def _extract_pdf_text(path: Path) -> tuple[str, bool, list[str]]:
-    errors: list[str] = []
-    parts: list[str] = []
-    page_count = 0
-    try:
-        from pypdf import PdfReader
+        С wait=True возвращает future со статусом индексации.
+        """
+        self._ensure_workers()
+        doc_id = int(doc_id)
+        job = self._queued.get(doc_id)
+        if job is not None:
+            job.local_path, job.mime_type, job.file_id, job.bot = local_path, mime_type, file_id, bot
+        else:
+            # Файл мог смениться: незаконченная индексация старой версии не нужна.
+            self.cancel(doc_id)
+            job = DocumentIndexJob(doc_id, local_path, mime_type, file_id, bot)
+            self._queued[doc_id] = job
+            self._queue.put_nowait(job)
+        if not wait:
+            return None
+        future = asyncio.get_running_loop().create_future()
+        job.waiters.append(future)
+        return future
+
+    def cancel(self, doc_id: int) -> bool:
+        doc_id = int(doc_id)
+        cancelled = False
+        job = self._queued.pop(doc_id, None)
+        if job is not None:
+            job.cancelled = True
+            job.resolve()
+            cancelled = True
+        running = self._running.get(doc_id)
+        if running is not None:
+            running[0].cancelled = True
+            running[1].cancel()
+            cancelled = True
+        return cancelled
+
+    def queued_count(self) -> int:
+        return len(self._queued)
+
+    def progress(self) -> list[dict]:
+        return [dict(item, doc_id=doc_id) for doc_id, item in self._progress.items()]
+
+    def stats(self) -> dict:
+        return {
+            "queued": len(self._queued),
+            "running": len(self._running),
+            "done": self.done,
+            "failed": self.failed,
+            "timeouts": self.timeouts,
+            "recycled": self.recycled,
+            "cache_hits": self.cache_hits,
+        }
 
-        reader = PdfReader(str(path))
-        page_count = len(reader.pages)
-        for page in reader.pages:
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
             try:
-                value = page.extract_text() or ""
-                if value.strip():
-                    parts.append(value)
-            except Exception as exc:
-                errors.append(f"PDF page: {exc}")
-    except Exception as exc:
-        errors.append(f"PDF text layer: {exc}")
-
-    text = _normalize_document_text("\n".join(parts))
-    minimum_text = max(80, min(page_count or 1, DOC_OCR_MAX_PAGES) * 20)
-    if len(text) < minimum_text:
-        # pdftotext — дополнительный fallback для окружений без pypdf.
+                if self._queued.get(job.doc_id) is job:
+                    del self._queued[job.doc_id]
+                    await self._process(job)
+            finally:
+                self._queue.task_done()
+
+    async def _process(self, job: DocumentIndexJob):
+        task = asyncio.get_running_loop().create_task(self._index(job))
+        self._running[job.doc_id] = (job, task)
         try:
-            import subprocess
-
-            result = subprocess.run(
-                ["pdftotext", "-layout", str(path), "-"],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                timeout=120,
-                check=False,
-            )
-            if result.returncode == 0:
-                cli_text = result.stdout.decode("utf-8", errors="ignore")
-                if cli_text.strip():
-                    text = _normalize_document_text(f"{text}\n{cli_text}")
-            else:
-                errors.append(result.stderr.decode("utf-8", errors="ignore").strip())
+            status = await asyncio.wait_for(task, self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            logger.warning("Document indexing timed out: doc_id=%s", job.doc_id)
+            self.recycled += int(self._pool is not None)
+            self._terminate_pool()
+            status = "error"
+            await db.write(
+                db_doc_set_content_index,
+                job.doc_id,
+                None,
+                status,
+                f"Превышено время индексации ({int(self.timeout)} с)",
+            )
+        except asyncio.CancelledError:
+            if not job.cancelled:
+                job.resolve()
+                raise
+            status = "error"
         except Exception as exc:
-            errors.append(f"pdftotext: {exc}")
-    if len(text) >= minimum_text:
-        return text, False, errors
-
-    # Если текстового слоя нет или он почти пустой, рендерим страницы и
-    # распознаём изображения. При отсутствии Python-обвязки используем
-    # системные pdftoppm и tesseract.
-    try:
-        last_page = min(page_count or DOC_OCR_MAX_PAGES, DOC_OCR_MAX_PAGES)
+            self.failed += 1
+            logger.exception("Document indexing failed: doc_id=%s", job.doc_id)
+            status = "error"
+            await db.write(db_doc_set_content_index, job.doc_id, None, status, str(exc)[:500])
+        finally:
+            if self._running.get(job.doc_id, (None, None))[1] is task:
+                del self._running[job.doc_id]
+            self._progress.pop(job.doc_id, None)
+        job.resolve(status)
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        generation = self._pool_generation
         try:
-            from pdf2image import convert_from_path
+            return await loop.run_in_executor(self._executor(), fn, *args)
+        except BrokenProcessPool:
+            if generation == self._pool_generation:
+                # Рабочий процесс упал (например, по памяти): следующим
+                # документам нужен новый пул.
+                self.recycled += 1
+                self._terminate_pool()
+                raise
+            # Пул пересоздан из-за тайм-аута другого документа — повторяем на новом.
+            return await loop.run_in_executor(self._executor(), fn, *args)
+
+    async def _index(self, job: DocumentIndexJob) -> str:
+        progress = {"stage": "download", "pages_done": 0, "pages_total": 0}
+        self._progress[job.doc_id] = progress
+        # Файл с тем же file_unique_id уже разбирался — скачивать не нужно.
+        cached = await db.call(db_doc_extract_cache_for_doc, job.doc_id)
+        if cached is not None:
+            return await self._apply_cached(job, cached)
+        local_path = await _ensure_document_local_copy(
+            job.bot, job.doc_id, job.local_path, job.mime_type, job.file_id
+        )
+        if local_path is None:
+            return "pending"
+        if not local_path:
+            return "unavailable"
 
-            images = convert_from_path(
-                str(path),
-                dpi=200,
-                first_page=1,
-                last_page=last_page,
-            )
-        except Exception:
-            import subprocess
-            import tempfile
-            from PIL import Image
-
-            with tempfile.TemporaryDirectory(prefix="doc_ocr_") as tmp_dir:
-                output_prefix = str(Path(tmp_dir) / "page")
-                render_error = "pdftoppm недоступен"
-                rendered = False
-                executables = ["pdftoppm"]
-                if Path("/usr/bin/pdftoppm").exists():
-                    executables.append("/usr/bin/pdftoppm")
-                for executable in dict.fromkeys(executables):
-                    try:
-                        result = subprocess.run(
-                            [
-                                executable, "-png", "-r", "200",
-                                "-f", "1", "-l", str(last_page),
-                                str(path), output_prefix,
-                            ],
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE,
-                            timeout=300,
-                            check=False,
-                        )
-                        if result.returncode == 0:
-                            rendered = True
-                            break
-                        render_error = result.stderr.decode("utf-8", errors="ignore").strip() or render_error
-                    except Exception as exc:
-                        render_error = str(exc)
-                if not rendered:
-                    raise RuntimeError(render_error)
-                images = []
-                for image_path in sorted(Path(tmp_dir).glob("page-*.png")):
-                    with Image.open(image_path) as image:
-                        images.append(image.copy())
-
-        ocr_parts: list[str] = []
-        for image in images:
-            value, ocr_error = _ocr_pil_image(image)
+        progress["stage"] = "hash"
+        content_hash = await self._run(document_content_hash, local_path)
+        cached = await db.call(db_doc_extract_cache_get, content_hash)
+        if cached is not None:
+            # Запоминаем file_unique_id этой копии для следующих обращений.
+            await db.write(db_doc_extract_cache_link, content_hash, job.doc_id)
+            return await self._apply_cached(job, cached)
+
+        progress["stage"] = "extract"
+        stage = await self._run(extract_document_stage, local_path, job.mime_type)
+        pages = int(stage.get("ocr_pages") or 0)
+        complete = True
+        if pages:
+            progress.update(stage="ocr", pages_total=pages)
+            text, status, error, complete = await self._ocr_pages(local_path, stage, pages, progress)
+        else:
+            text, status, error = stage["text"], stage["status"], stage.get("error")
+
+        await db.write(db_doc_set_content_index, job.doc_id, text, status, error)
+        if error:
+            logger.warning("Document index diagnostic: doc_id=%s status=%s error=%s", job.doc_id, status, error)
+        # Ошибки OCR могут быть временными (нет tesseract) — такие результаты не кэшируем.
+        if complete and (status in {"indexed", "indexed_ocr", "unsupported"} or (status == "empty" and not error)):
+            await db.write(
+                db_doc_extract_cache_put, content_hash, job.doc_id, status, error, status == "indexed_ocr", pages
+            )
+        self.done += 1
+        return status
+
+    async def _apply_cached(self, job: DocumentIndexJob, cached: dict) -> str:
+        await db.write(db_doc_set_content_index, job.doc_id, cached["text"], cached["status"], cached["error"])
+        self.cache_hits += 1
+        self.done += 1
+        return cached["status"]
+
+    async def _ocr_pages(self, local_path: str, stage: dict, pages: int, progress: dict):
+        keys = list(stage.get("page_keys") or [])
+        if len(keys) != pages:
+            keys = []
+        cached_pages = await db.call(db_doc_page_cache_get_many, keys) if keys else {}
+        results: dict[int, tuple[str, str | None]] = {}
+        page_futures: dict[int, asyncio.Future] = {}
+        for page_no in range(1, pages + 1):
+            key = keys[page_no - 1] if keys else None
+            if key in cached_pages:
+                results[page_no] = (cached_pages[key], None)
+            else:
+                page_futures[page_no] = asyncio.ensure_future(self._run(ocr_pdf_page, local_path, page_no))
+        progress["pages_done"] = len(results)
+        try:
+            for finished in asyncio.as_completed(list(page_futures.values())):
+                await finished
+                progress["pages_done"] += 1
+        finally:
+            # Отмена или тайм-аут: ещё не начатые страницы снимаются с пула.
+            for page_future in page_futures.values():
+                page_future.cancel()
+
+        fresh_pages = []
+        for page_no, page_future in page_futures.items():
+            value, ocr_error = page_future.result()
+            results[page_no] = (value, ocr_error)
+            if keys and (value.strip() or not ocr_error):
+                fresh_pages.append((keys[page_no - 1], value))
+        await db.write(db_doc_page_cache_put_many, fresh_pages)
+
+        errors = list(stage.get("errors") or [])
+        ocr_parts = []
+        complete = True
+        for page_no in sorted(results):
+            value, ocr_error = results[page_no]
             if value and value.strip():
                 ocr_parts.append(value)
             elif ocr_error:
                 errors.append(ocr_error)
+                complete = False
         ocr_text = _normalize_document_text("\n".join(ocr_parts))
-        if ocr_text:
-            return _normalize_document_text(f"{text}\n{ocr_text}"), True, errors
-    except Exception as exc:
-        errors.append(f"PDF OCR: {exc}")
-    return text, False, errors
-
+        text, status, error = _document_index_result(f"{stage['text']}\n{ocr_text}", bool(ocr_text), errors)
+        return text, status, error, complete
 
-def extract_document_text(local_path: str, mime_type: str | None) -> tuple[str, str, str | None]:
-    """Возвращает (текст, статус, диагностическая ошибка) для поискового индекса."""
-    path = Path(local_path)
-    if not path.exists() or not path.is_file():
-        return "", "pending", "Локальный файл пока недоступен"
-
-    suffix = path.suffix.casefold()
-    mime = (mime_type or "").casefold()
-    errors: list[str] = []
-    ocr_used = False
-    try:
-        if suffix == ".pdf" or mime == "application/pdf":
-            text, ocr_used, errors = _extract_pdf_text(path)
-        elif suffix == ".docx" or "wordprocessingml.document" in mime:
-            text, ocr_used, errors = _extract_docx_text(path)
-        elif suffix == ".xlsx" or "spreadsheetml.sheet" in mime:
-            text, ocr_used, errors = _extract_xlsx_text(path)
-        elif suffix in {".txt", ".md", ".csv", ".tsv", ".json", ".xml", ".html", ".htm"} or mime.startswith("text/"):
-            text = path.read_text(encoding="utf-8-sig", errors="ignore")
-        else:
-            return "", "unsupported", None
-    except Exception as exc:
-        return "", "error", str(exc)
+    def shutdown(self):
+        for task in self._workers:
+            task.cancel()
+        self._workers = []
+        self._terminate_pool()
 
-    text = _normalize_document_text(text)
-    error_text = "; ".join(errors[:5]) or None
-    if text:
-        return text, ("indexed_ocr" if ocr_used else "indexed"), error_text
-    return "", "empty", error_text
 
-
-def index_document_content(doc_id: int, local_path: str, mime_type: str | None) -> str:
-    text, status, error = extract_document_text(local_path, mime_type)
-    db_doc_set_content_index(doc_id, text, status, error)
-    if error:
-        logger.warning("Document index diagnostic: doc_id=%s status=%s error=%s", doc_id, status, error)
-    return status
-
-
-def _doc_index_file_suffix(mime_type: str | None, local_path: str | None = None) -> str:
-    if local_path and Path(local_path).suffix:
-        return Path(local_path).suffix
-    mime = (mime_type or "").casefold()
-    if mime == "application/pdf":
-        return ".pdf"
-    if "wordprocessingml.document" in mime:
-        return ".docx"
-    if "spreadsheetml.sheet" in mime:
-        return ".xlsx"
-    return ".bin"
-
-
-async def _index_document_for_search_unlocked(
-    context: ContextTypes.DEFAULT_TYPE,
-    doc_id: int,
-    local_path: str | None,
-    mime_type: str | None,
-    file_id: str | None = None,
-) -> str:
-    """Гарантирует локальную копию и индексирует документ вне event loop."""
-    resolved_path = local_path
-    if not resolved_path or not Path(resolved_path).exists():
-        if not file_id:
-            db_doc_set_content_index(doc_id, None, "unavailable", "Нет локальной копии и Telegram file_id")
-            return "unavailable"
-        try:
-            suffix = _doc_index_file_suffix(mime_type, local_path)
-            resolved_path = str(Path(STORAGE_DIR) / "docs" / f"index_{int(doc_id)}{suffix}")
-            tg_file = await context.bot.get_file(file_id)
-            await tg_file.download_to_drive(custom_path=resolved_path)
-            db_doc_set_local_path(doc_id, resolved_path)
-        except Exception as exc:
-            logger.exception("Cannot download document for indexing: doc_id=%s", doc_id)
-            return "pending"
-    return await asyncio.to_thread(index_document_content, int(doc_id), resolved_path, mime_type)
+DOC_INDEXER = DocumentIndexService()
 
 
 async def index_document_for_search(
@@ -2651,14 +4397,7 @@ async def index_document_for_search(
     mime_type: str | None,
     file_id: str | None = None,
 ) -> str:
-    async with DOC_INDEX_SEMAPHORE:
-        return await _index_document_for_search_unlocked(
-            context,
-            doc_id,
-            local_path,
-            mime_type,
-            file_id,
-        )
+    return await DOC_INDEXER.enqueue(context.bot, doc_id, local_path, mime_type, file_id, wait=True)
 
 
 def schedule_document_index(
@@ -2668,41 +4407,30 @@ def schedule_document_index(
     mime_type: str | None,
     file_id: str | None,
 ) -> None:
-    context.application.create_task(
-        index_document_for_search(context, doc_id, local_path, mime_type, file_id),
-        name=f"document-index:{int(doc_id)}",
-    )
+    DOC_INDEXER.enqueue(context.bot, doc_id, local_path, mime_type, file_id)
 
 
 async def job_index_pending_documents(context: ContextTypes.DEFAULT_TYPE):
-    """Небольшими пачками индексирует старые и недавно добавленные документы."""
-    items = db_docs_pending_content_index(limit=20)
-    if not items:
+    """Дозаполняет очередь индексации старыми и недавно добавленными документами."""
+    free = DOC_INDEX_QUEUE_MAX - DOC_INDEXER.queued_count()
+    if free <= 0:
         return
-    results = await asyncio.gather(
-        *[
-            index_document_for_search(
-                context,
-                int(item["id"]),
-                item.get("local_path"),
-                item.get("mime"),
-                item.get("file_id"),
-            )
-            for item in items
-        ],
-        return_exceptions=True,
-    )
-    for item, result in zip(items, results):
-        if isinstance(result, Exception):
-            logger.error(
-                "Background document indexing failed: doc_id=%s error=%s",
-                item["id"],
-                result,
-            )
+    # Выполняющиеся документы ещё числятся pending, поэтому берём с запасом.
+    items = await db.call(db_docs_pending_content_index, limit=free + DOC_INDEXER.concurrency)
+    for item in items:
+        if DOC_INDEXER.is_tracked(item["id"]):
+            continue
+        DOC_INDEXER.enqueue(
+            context.bot,
+            int(item["id"]),
+            item.get("local_path"),
+            item.get("mime"),
+            item.get("file_id"),
+        )
 
 
 def db_doc_collections_list() -> list[dict]:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -2722,7 +4450,7 @@ def db_doc_collections_list() -> list[dict]:
 
 
 def db_doc_collection_get(collection_id: int) -> dict | None:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("SELECT id, title, description FROM doc_collections WHERE id=?", (int(collection_id),))
     row = cur.fetchone()
@@ -2736,7 +4464,7 @@ def db_doc_collection_add(title: str, description: str | None = None) -> int:
     clean = re.sub(r"\s+", " ", (title or "").strip())
     if len(clean) < 2:
         raise ValueError("Название подборки слишком короткое")
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         "INSERT INTO doc_collections(title, description, created_at) VALUES(?, ?, ?)",
@@ -2749,7 +4477,7 @@ def db_doc_collection_add(title: str, description: str | None = None) -> int:
 
 
 def db_doc_collection_delete(collection_id: int) -> bool:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("DELETE FROM doc_collection_items WHERE collection_id=?", (int(collection_id),))
     cur.execute("DELETE FROM doc_collections WHERE id=?", (int(collection_id),))
@@ -2760,7 +4488,7 @@ def db_doc_collection_delete(collection_id: int) -> bool:
 
 
 def db_doc_collection_items(collection_id: int) -> list[dict]:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -2781,7 +4509,7 @@ def db_doc_collection_items(collection_id: int) -> list[dict]:
 
 
 def db_doc_collection_add_item(collection_id: int, doc_id: int) -> bool:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("SELECT COALESCE(MAX(position), -1)+1 FROM doc_collection_items WHERE collection_id=?", (int(collection_id),))
     pos = int((cur.fetchone() or [0])[0] or 0)
@@ -2796,7 +4524,7 @@ def db_doc_collection_add_item(collection_id: int, doc_id: int) -> bool:
 
 
 def db_doc_collection_remove_item(collection_id: int, doc_id: int) -> bool:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         "DELETE FROM doc_collection_items WHERE collection_id=? AND doc_id=?",
@@ -2809,9 +4537,23 @@ def db_doc_collection_remove_item(collection_id: int, doc_id: int) -> bool:
 
 # ---------------- HELP DB: FAQ ----------------
 
+def _faq_search_index_fields(question: str | None, answer: str | None) -> list[tuple[str, float]]:
+    return [(faq_plain_text(question), 2.0), (faq_plain_text(answer), 1.0)]
+
+
+def _faq_search_index_load():
+    return [
+        (int(item["id"]), _faq_search_index_fields(item["question"], item["answer"]))
+        for item in db_faq_list_full()
+    ]
+
+
+FAQ_SEARCH_INDEX = SearchIndex("faq", _faq_search_index_load)
+
+
 def db_faq_list() -> list[tuple[int, str]]:
     """Список FAQ (id, question), последние сверху."""
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("SELECT id, question FROM faq_items ORDER BY id DESC")
     rows = cur.fetchall()
@@ -2821,7 +4563,7 @@ def db_faq_list() -> list[tuple[int, str]]:
 
 def db_faq_list_full() -> list[dict]:
     """Полный список FAQ для общей таблицы: новые записи добавляются в конец."""
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         "SELECT id, question, answer FROM faq_items ORDER BY id ASC"
@@ -2834,8 +4576,27 @@ def db_faq_list_full() -> list[dict]:
     ]
 
 
+def db_faq_list_by_ids(faq_ids: list[int]) -> list[dict]:
+    """FAQ с указанными id в порядке общей таблицы."""
+    if not faq_ids:
+        return []
+    marks = ",".join("?" for _ in faq_ids)
+    con = db_connect()
+    cur = con.cursor()
+    cur.execute(
+        f"SELECT id, question, answer FROM faq_items WHERE id IN ({marks}) ORDER BY id ASC",
+        [int(fid) for fid in faq_ids],
+    )
+    rows = cur.fetchall()
+    con.close()
+    return [
+        {"id": int(r[0]), "question": r[1] or "", "answer": r[2] or ""}
+        for r in rows
+    ]
+
+
 def db_faq_get(fid: int) -> dict | None:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("SELECT id, question, answer FROM faq_items WHERE id=?", (int(fid),))
     row = cur.fetchone()
@@ -2846,7 +4607,7 @@ def db_faq_get(fid: int) -> dict | None:
 
 
 def db_faq_add(question: str, answer: str) -> int:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         "INSERT INTO faq_items(question, answer, created_at) VALUES(?, ?, ?)",
@@ -2855,16 +4616,20 @@ def db_faq_add(question: str, answer: str) -> int:
     con.commit()
     fid = cur.lastrowid
     con.close()
+    FAQ_SEARCH_INDEX.add(int(fid), _faq_search_index_fields(question, answer))
+    FAQ_LAYOUT_CACHE.clear()
     return int(fid)
 
 
 def db_faq_delete(fid: int) -> bool:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("DELETE FROM faq_items WHERE id=?", (int(fid),))
     ok = cur.rowcount > 0
     con.commit()
     con.close()
+    FAQ_SEARCH_INDEX.remove(int(fid))
+    FAQ_LAYOUT_CACHE.clear()
     return ok
 
 
@@ -2875,7 +4640,7 @@ def db_faq_upsert(question: str, answer: str) -> int:
     if not q or not a:
         return 0
 
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("SELECT id FROM faq_items WHERE question=?", (q,))
     row = cur.fetchone()
@@ -2884,6 +4649,8 @@ def db_faq_upsert(question: str, answer: str) -> int:
         cur.execute("UPDATE faq_items SET answer=? WHERE id=?", (a, fid))
         con.commit()
         con.close()
+        FAQ_SEARCH_INDEX.add(fid, _faq_search_index_fields(q, a))
+        FAQ_LAYOUT_CACHE.clear()
         return fid
 
     cur.execute(
@@ -2893,12 +4660,14 @@ def db_faq_upsert(question: str, answer: str) -> int:
     con.commit()
     fid = int(cur.lastrowid)
     con.close()
+    FAQ_SEARCH_INDEX.add(fid, _faq_search_index_fields(q, a))
+    FAQ_LAYOUT_CACHE.clear()
     return fid
 
 # ---------------- HELP DB: PROFILES ----------------
 
 def db_profiles_list() -> list[tuple[int, str]]:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         "SELECT id, full_name FROM profiles "
@@ -2909,63 +4678,132 @@ def db_profiles_list() -> list[tuple[int, str]]:
     con.close()
     return [(r[0], r[1]) for r in rows]
 
-def db_profiles_with_shared_interests(profile_id: int) -> list[dict]:
+class ProfileInterestIndex:
     """
-    Активные коллеги с общими интересами.
+    Подбор коллег с общими интересами по битовым маскам.
+
+    В памяти держатся маски активных анкет и списки анкет по каждому интересу:
+    кандидатами становятся только анкеты из списков своих интересов, а
+    коэффициент Жаккара считается через popcount масок. Готовая ранжированная
+    подборка (и её срезы по одному интересу) кэшируется на анкету, поэтому
+    листание страниц только режет список. Триггеры profiles меняют
+    meta.profiles_version — тогда индекс и все подборки перестраиваются.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self._lock = threading.Lock()
+        self._version = _CACHE_MISSING
+        self._masks: dict[int, int] = {}
+        self._names: dict[int, str] = {}
+        self._postings: list[list[int]] = [[] for _ in PROFILE_INTERESTS]
+        self.matches = TTLCache("similar_colleagues", ttl=24 * 60 * 60, maxsize=maxsize)
+
+    def _refresh(self):
+        con = db_connect()
+        cur = con.cursor()
+        cur.execute("SELECT value FROM meta WHERE key='profiles_version'")
+        row = cur.fetchone()
+        version = row[0] if row else None
+        if version == self._version:
+            con.close()
+            return
+        cur.execute(
+            "SELECT id, full_name, interests_mask FROM profiles "
+            "WHERE COALESCE(is_active, 1)=1 AND interests_mask<>0"
+        )
+        rows = cur.fetchall()
+        con.close()
+
+        masks = {}
+        names = {}
+        postings = [[] for _ in PROFILE_INTERESTS]
+        for pid, full_name, mask in rows:
+            masks[int(pid)] = int(mask)
+            names[int(pid)] = full_name
+            for bit in range(len(PROFILE_INTERESTS)):
+                if mask >> bit & 1:
+                    postings[bit].append(int(pid))
+        with self._lock:
+            self._masks, self._names, self._postings = masks, names, postings
+            self._version = version
+            self.matches.clear()
+
+    def _own_mask(self, profile_id: int) -> int:
+        mask = self._masks.get(profile_id)
+        if mask is not None:
+            return mask
+        # Неактивная анкета или анкета без интересов в индекс не попадает.
+        con = db_connect()
+        cur = con.cursor()
+        cur.execute("SELECT interests_mask FROM profiles WHERE id=?", (profile_id,))
+        row = cur.fetchone()
+        con.close()
+        return int(row[0] or 0) if row else 0
+
+    def _rank(self, profile_id: int) -> list[dict]:
+        own = self._own_mask(profile_id)
+        candidates = set()
+        for bit in range(len(PROFILE_INTERESTS)):
+            if own >> bit & 1:
+                candidates.update(self._postings[bit])
+        candidates.discard(profile_id)
+
+        matches = []
+        for pid in candidates:
+            mask = self._masks[pid]
+            shared = own & mask
+            shared_count = shared.bit_count()
+            matches.append({
+                "id": pid,
+                "full_name": self._names[pid],
+                "interests": profile_interests_from_mask(mask),
+                "shared_interests": profile_interests_from_mask(shared),
+                "shared_count": shared_count,
+                "similarity_score": shared_count / (own | mask).bit_count(),
+                "shared_mask": shared,
+            })
+        matches.sort(
+            key=lambda item: (
+                -float(item["similarity_score"]),
+                -int(item["shared_count"]),
+                str(item["full_name"]).casefold(),
+            )
+        )
+        return matches
+
+    def similar(self, profile_id: int, interest_key: str | None = None) -> list[dict]:
+        """Подборка для анкеты; список общий для всех вызовов — не изменять."""
+        self._refresh()
+        profile_id = int(profile_id)
+        key = (profile_id, interest_key if interest_key in PROFILE_INTEREST_KEYS else "all")
+        cached = self.matches.get(key)
+        if cached is not _CACHE_MISSING:
+            return cached
+        if key[1] == "all":
+            result = self._rank(profile_id)
+        else:
+            bit = PROFILE_INTEREST_BITS[key[1]]
+            result = [item for item in self.similar(profile_id) if item["shared_mask"] >> bit & 1]
+        self.matches.set(key, result)
+        return result
+
+
+PROFILE_INTEREST_INDEX = ProfileInterestIndex()
+
+
+def db_profiles_with_shared_interests(profile_id: int, interest_key: str | None = None) -> list[dict]:
+    """
+    Активные коллеги с общими интересами (все или по одному интересу).
 
     Сортировка использует коэффициент Жаккара: число общих интересов делится
     на число уникальных интересов двух сотрудников. Поэтому два совпадения
     из двух считаются более близким профилем, чем два совпадения из пяти.
     """
-    current = db_profiles_get(int(profile_id))
-    if not current:
-        return []
-    own = set(normalize_profile_interests(current.get("interests")))
-    if not own:
-        return []
-
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.execute(
-        "SELECT id, full_name, interests_json FROM profiles "
-        "WHERE id<>? AND COALESCE(is_active, 1)=1",
-        (int(profile_id),),
-    )
-    rows = cur.fetchall()
-    con.close()
-
-    matches = []
-    for pid, full_name, raw_interests in rows:
-        colleague = set(_profile_interests_decode(raw_interests))
-        shared = [
-            key for key, _label in PROFILE_INTERESTS
-            if key in own and key in colleague
-        ]
-        if not shared:
-            continue
-        union_count = len(own | colleague)
-        similarity_score = (len(shared) / union_count) if union_count else 0.0
-        matches.append({
-            "id": int(pid),
-            "full_name": full_name,
-            "interests": [key for key, _label in PROFILE_INTERESTS if key in colleague],
-            "shared_interests": shared,
-            "shared_count": len(shared),
-            "similarity_score": similarity_score,
-        })
-
-    matches.sort(
-        key=lambda item: (
-            -float(item["similarity_score"]),
-            -int(item["shared_count"]),
-            str(item["full_name"]).casefold(),
-        )
-    )
-    return matches
+    return PROFILE_INTEREST_INDEX.similar(profile_id, interest_key)
 
 
 def db_profiles_get(pid: int):
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("""
         SELECT id, full_name, year_start, city, birthday, about, topics, tg_link,
@@ -2994,7 +4832,7 @@ def db_profiles_get(pid: int):
 
 
 def db_profiles_get_by_tg_link(tg_link: str):
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("""
         SELECT id, full_name, year_start, city, birthday, about, topics, tg_link,
@@ -3028,7 +4866,7 @@ def db_profiles_get_by_tg_link(tg_link: str):
 # ===================== TESTING: TG USER ID SYNC (profiles) =========
 
 def db_profiles_set_tg_user_id(profile_id: int, tg_user_id: int):
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("UPDATE profiles SET tg_user_id=? WHERE id=?", (int(tg_user_id), int(profile_id)))
     con.commit()
@@ -3036,7 +4874,7 @@ def db_profiles_set_tg_user_id(profile_id: int, tg_user_id: int):
 
 def db_profiles_set_avg_test_score(profile_id: int, avg_test_score: int | None):
     """Устанавливает средний балл тестирования (в процентах) для карточки сотрудника."""
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("UPDATE profiles SET avg_test_score=? WHERE id=?", (avg_test_score, int(profile_id)))
     con.commit()
@@ -3046,7 +4884,7 @@ def db_profiles_set_avg_test_score(profile_id: int, avg_test_score: int | None):
 
 
 def db_profiles_get_by_tg_user_id(tg_user_id: int):
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -3103,7 +4941,7 @@ def db_profiles_ensure_from_tg_user(user) -> tuple[int, bool]:
     ).strip()
     tg_link = _normalize_profile_tg_link(getattr(user, "username", None)) or ""
 
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     try:
         cur.execute(
@@ -3158,7 +4996,7 @@ def db_profiles_deactivate_by_tg_user(user) -> int | None:
     tg_user_id = int(user.id)
     tg_link = _normalize_profile_tg_link(getattr(user, "username", None))
 
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     try:
         cur.execute(
@@ -3201,12 +5039,12 @@ async def sync_profile_user_id_from_update(update: Update):
     tg_link = _normalize_profile_tg_link(getattr(user, "username", None))
     if not tg_link:
         return
-    prof = db_profiles_get_by_tg_link(tg_link)
+    prof = await db.call(db_profiles_get_by_tg_link, tg_link)
     if not prof:
         return
     if prof.get("tg_user_id") == user.id:
         return
-    db_profiles_set_tg_user_id(int(prof["id"]), int(user.id))
+    await db.write(db_profiles_set_tg_user_id, int(prof["id"]), int(user.id))
 
 def db_profiles_add(
     full_name: str,
@@ -3219,7 +5057,7 @@ def db_profiles_add(
     photo_file_id: str | None = None,
     interests: list[str] | None = None,
 ) -> int:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("""
         INSERT INTO profiles(
@@ -3250,7 +5088,7 @@ def db_profiles_update(
     keep_existing_photo: bool = True,
     interests: list[str] | None = None,
 ) -> bool:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     if keep_existing_photo and photo_file_id is None:
         cur.execute(
@@ -3285,7 +5123,7 @@ def db_profiles_update(
 
 
 def db_profiles_delete(pid: int) -> bool:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("DELETE FROM profiles WHERE id=?", (pid,))
     ok = cur.rowcount > 0
@@ -3297,15 +5135,19 @@ def db_profiles_birthdays(ddmm: str) -> list[dict]:
     """
     Возвращает список профилей, у кого birthday == 'ДД.ММ'
     """
-    con = sqlite3.connect(DB_PATH)
+    parsed = _parse_birthday_ddmm(ddmm)
+    if not parsed:
+        return []
+    day, month = parsed
+    con = db_connect()
     cur = con.cursor()
     cur.execute("""
         SELECT id, full_name, tg_link, birthday
         FROM profiles
-        WHERE birthday = ?
+        WHERE birth_month = ? AND birth_day = ?
           AND COALESCE(is_active, 1)=1
         ORDER BY full_name COLLATE NOCASE ASC
-    """, (ddmm,))
+    """, (month, day))
     rows = cur.fetchall()
     con.close()
 
@@ -3322,7 +5164,7 @@ def db_profiles_birthdays(ddmm: str) -> list[dict]:
 
 def db_profiles_with_birthdays() -> list[dict]:
     """Возвращает сотрудников, у которых заполнена дата рождения ДД.ММ."""
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -3344,6 +5186,38 @@ def db_profiles_with_birthdays() -> list[dict]:
     ]
 
 
+def db_profiles_birthdays_between(first: tuple[int, int], last: tuple[int, int]) -> list[dict]:
+    """Анкеты с днём рождения (месяц, день) в диапазоне first..last одного года."""
+    con = db_connect()
+    cur = con.cursor()
+    cur.execute(
+        """
+        SELECT id, full_name, birthday, birth_month, birth_day
+        FROM profiles
+        WHERE (birth_month, birth_day) >= (?, ?)
+          AND (birth_month, birth_day) <= (?, ?)
+        """,
+        (*first, *last),
+    )
+    rows = cur.fetchall()
+    con.close()
+    return [
+        {
+            "id": int(row[0]),
+            "full_name": row[1],
+            "birthday": row[2],
+            "birth_month": int(row[3]),
+            "birth_day": int(row[4]),
+        }
+        for row in rows
+    ]
+
+
+def db_profiles_version() -> str | None:
+    """Счётчик изменений анкет, который ведут триггеры profiles."""
+    return db_get_meta("profiles_version")
+
+
 # ---------------- ACHIEVEMENTS, NOMINATIONS, REACTIONS ----------------
 
 NOMINATION_CATEGORIES = {
@@ -3447,7 +5321,7 @@ def achievement_progress_from_count(count: int) -> dict:
 
 def db_achievements_list(profile_id: int) -> list[dict]:
     """Список ачивок профиля: последние сверху, с уровнем."""
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -3477,7 +5351,7 @@ def db_achievements_list(profile_id: int) -> list[dict]:
 
 
 def db_achievement_get(award_id: int) -> dict | None:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -3521,7 +5395,7 @@ def db_achievement_award_add(
     clean_key = (achievement_key or normalize_achievement_key(clean_title)).strip()[:80]
     clean_level = max(1, min(int(level or 1), 99))
 
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -3549,7 +5423,7 @@ def db_achievement_award_add(
 
 
 def db_achievement_key_count(profile_id: int, achievement_key: str) -> int:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         "SELECT COUNT(*) FROM achievement_awards WHERE profile_id=? AND achievement_key=?",
@@ -3566,7 +5440,7 @@ def db_achievement_progress(profile_id: int, achievement_key: str) -> dict:
 
 def db_achievement_progress_summary(profile_id: int) -> list[dict]:
     """По одной строке прогресса на каждый тип ачивки."""
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -3596,7 +5470,7 @@ def db_achievement_progress_summary(profile_id: int) -> list[dict]:
 
 
 def db_achievements_count(profile_id: int) -> int:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("SELECT COUNT(*) FROM achievement_awards WHERE profile_id=?", (int(profile_id),))
     count = int((cur.fetchone() or [0])[0] or 0)
@@ -3609,7 +5483,7 @@ def db_achievements_count(profile_id: int) -> int:
 def db_achievement_reaction_set(award_id: int, user_id: int, reaction: str) -> bool:
     if reaction not in ACHIEVEMENT_REACTIONS:
         return False
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -3628,7 +5502,7 @@ def db_achievement_reaction_set(award_id: int, user_id: int, reaction: str) -> b
 
 def db_achievement_reaction_counts(award_id: int) -> dict[str, int]:
     counts = {key: 0 for key in ACHIEVEMENT_REACTIONS}
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         "SELECT reaction, COUNT(*) FROM achievement_reactions WHERE award_id=? GROUP BY reaction",
@@ -3652,7 +5526,7 @@ def db_notification_add(
 ) -> int | None:
     if not user_id:
         return None
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -3684,7 +5558,7 @@ def db_notification_add_once(
     """Добавляет внутреннее уведомление один раз для одного события."""
     if not user_id:
         return None
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -3713,7 +5587,7 @@ def db_notification_add_once(
 def db_notifications_unread_count(user_id: int | None) -> int:
     if not user_id:
         return 0
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("SELECT COUNT(*) FROM notifications WHERE user_id=? AND is_read=0", (int(user_id),))
     count = int((cur.fetchone() or [0])[0] or 0)
@@ -3729,7 +5603,7 @@ def db_notifications_list(user_id: int, page: int = 0, page_size: int = 8) -> di
     ``is_read`` на 1. Прочитанные записи остаются в БД как техническая история
     доставки, но в пользовательском разделе «Новые уведомления» не показываются.
     """
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         "SELECT COUNT(*) FROM notifications WHERE user_id=? AND is_read=0",
@@ -3765,7 +5639,7 @@ def db_notifications_list(user_id: int, page: int = 0, page_size: int = 8) -> di
 
 
 def db_notification_get(notification_id: int, user_id: int) -> dict | None:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -3791,7 +5665,7 @@ def db_notification_get(notification_id: int, user_id: int) -> dict | None:
 
 
 def db_notification_mark_read(notification_id: int, user_id: int) -> bool:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         "UPDATE notifications SET is_read=1 WHERE id=? AND user_id=?",
@@ -3804,7 +5678,7 @@ def db_notification_mark_read(notification_id: int, user_id: int) -> bool:
 
 
 def db_notifications_mark_all_read(user_id: int) -> int:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("UPDATE notifications SET is_read=1 WHERE user_id=? AND is_read=0", (int(user_id),))
     count = int(cur.rowcount or 0)
@@ -3826,7 +5700,7 @@ def db_nomination_check_allowed(
     if category_key not in NOMINATION_CATEGORIES:
         return False, "Неизвестная категория номинации."
 
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -3877,7 +5751,7 @@ def db_nomination_create(
 ) -> int:
     if category_key not in NOMINATION_CATEGORIES:
         category_key = "team_help"
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -3904,7 +5778,7 @@ def db_nomination_create(
 
 
 def db_nomination_get(nomination_id: int) -> dict | None:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -3947,7 +5821,7 @@ def db_nomination_get(nomination_id: int) -> dict | None:
 
 
 def db_nominations_pending(limit: int = 30) -> list[dict]:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -3980,7 +5854,7 @@ def db_nominations_pending(limit: int = 30) -> list[dict]:
 
 def db_nomination_approve(nomination_id: int, reviewed_by: int) -> dict | None:
     """Атомарно одобряет номинацию, выдаёт категорийную ачивку и считает уровень по порогам 1/3/7."""
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     try:
         cur = con.cursor()
         cur.execute("BEGIN IMMEDIATE")
@@ -4054,7 +5928,7 @@ def db_nomination_approve(nomination_id: int, reviewed_by: int) -> dict | None:
 
 
 def db_nomination_reject(nomination_id: int, reviewed_by: int) -> bool:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -4072,7 +5946,7 @@ def db_nomination_reject(nomination_id: int, reviewed_by: int) -> bool:
 
 def export_achievement_awards_rows() -> list[dict]:
     """Для CSV/ZIP-бэкапа: все выданные ачивки, включая уровни."""
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -4460,22 +6334,16 @@ async def notify_regular_meeting_change(context: ContextTypes.DEFAULT_TYPE, data
             f"Причина: {reason}"
         )
 
-    ok = 0
-    fail = 0
-    for chat_id in db_list_chats():
-        try:
-            sent = await context.bot.send_message(
-                chat_id=chat_id,
-                text=message_text,
-                parse_mode=ParseMode.HTML,
-                disable_web_page_preview=True,
-            )
-            schedule_message_delete(context, sent)
-            ok += 1
-        except Exception as exc:
-            logger.exception("Cannot notify meeting change to %s: %s", chat_id, exc)
-            fail += 1
-    return ok, fail
+    async def deliver(chat_id):
+        sent = await DELIVERY.call(chat_id, lambda: context.bot.send_message(
+            chat_id=chat_id,
+            text=message_text,
+            parse_mode=ParseMode.HTML,
+            disable_web_page_preview=True,
+        ))
+        schedule_message_delete(context, sent)
+
+    return await DELIVERY.run(db_list_chats(), deliver, label="Meeting change notice")
 
 
 # ---------------- ADMIN CHECK (scoped) ----------------
@@ -4906,29 +6774,35 @@ async def send_birthday_congrats(context: ContextTypes.DEFAULT_TYPE) -> bool:
     else:
         tpl_idx = tpl_idx % len(BDAY_TEMPLATES)
 
-    sent_any = False
-
+    texts = []
     for p in people:
         full_name = p.get("full_name", "")
         mention = normalize_tg_mention(p.get("tg_link", ""))
 
-        text = pick_bday_text(tpl_idx, full_name, mention)
+        texts.append(pick_bday_text(tpl_idx, full_name, mention))
 
         # следующий шаблон по кругу
         if BDAY_TEMPLATES:
             tpl_idx = (tpl_idx + 1) % len(BDAY_TEMPLATES)
 
-        for chat_id in chat_ids:
+    sent_any = False
+
+    async def deliver(chat_id):
+        nonlocal sent_any
+        # чаты обрабатываются параллельно, поздравления внутри чата — по порядку
+        for text in texts:
             try:
-                await context.bot.send_message(
+                await DELIVERY.call(chat_id, lambda: context.bot.send_message(
                     chat_id=chat_id,
                     text=text,
                     disable_web_page_preview=True,
-                )
+                ))
                 sent_any = True
             except Exception as e:
                 logger.exception("Cannot send birthday to %s: %s", chat_id, e)
 
+    await DELIVERY.run(chat_ids, deliver, label="Birthday")
+
     # сохраняем “следующий шаблон” (какой будет использоваться в следующий раз)
     db_set_meta("bday_template_next", str(tpl_idx))
 
@@ -4980,18 +6854,17 @@ async def send_meeting_message(
     else:
         text = build_industry_text(INDUSTRY_ZOOM_URL)
 
-    for chat_id in chat_ids:
-        try:
-            sent_message = await context.bot.send_message(
-                chat_id=chat_id,
-                text=text,
-                parse_mode=ParseMode.HTML,
-                disable_web_page_preview=True,
-                reply_markup=kb_cancel_menu(meeting_type),
-            )
-            schedule_message_delete(context, sent_message)
-        except Exception as e:
-            logger.exception("Cannot send %s to %s: %s", meeting_type, chat_id, e)
+    async def deliver(chat_id):
+        sent_message = await DELIVERY.call(chat_id, lambda: context.bot.send_message(
+            chat_id=chat_id,
+            text=text,
+            parse_mode=ParseMode.HTML,
+            disable_web_page_preview=True,
+            reply_markup=kb_cancel_menu(meeting_type),
+        ))
+        schedule_message_delete(context, sent_message)
+
+    await DELIVERY.run(chat_ids, deliver, label=f"Meeting {meeting_type}")
 
     if reschedule_due:
         db_mark_reschedules_sent(meeting_type, due_orig_isos)
@@ -4999,6 +6872,29 @@ async def send_meeting_message(
     return True
 
 
+# Ежедневные автоотправки (час, минута по МСК); отметка об отправке за день
+# хранится в meta под ключом last_auto_sent_date:<имя>.
+AUTO_SEND_SLOTS = {
+    "birthday": (9, 0),
+    "standup": (9, 15),
+    "industry": (11, 30),
+}
+# Слот, пропущенный из-за долгого предыдущего прогона или перезапуска,
+# догоняется в течение этого окна; позже он переходит на следующий день.
+AUTO_SEND_CATCHUP_MINUTES = max(1, int(os.getenv("AUTO_SEND_CATCHUP_MINUTES", "30")))
+
+
+def auto_send_slot_at(name: str, day: date) -> datetime:
+    hour, minute = AUTO_SEND_SLOTS[name]
+    return MOSCOW_TZ.localize(datetime(day.year, day.month, day.day, hour, minute))
+
+
+def auto_send_slot_due(name: str, now_msk: datetime) -> bool:
+    """Время слота наступило сегодня и окно догона ещё не прошло."""
+    slot = auto_send_slot_at(name, now_msk.date())
+    return slot <= now_msk < slot + timedelta(minutes=AUTO_SEND_CATCHUP_MINUTES)
+
+
 async def check_and_send_jobs(context: ContextTypes.DEFAULT_TYPE):
     try:
         await process_due_communications(context)
@@ -5009,40 +6905,119 @@ async def check_and_send_jobs(context: ContextTypes.DEFAULT_TYPE):
     today_iso = now_msk.date().isoformat()
 
     # 🎂 Автопоздравления в 09:00 МСК
-    if now_msk.hour == 9 and now_msk.minute == 0:
+    if auto_send_slot_due("birthday", now_msk):
         key = "last_auto_sent_date:birthday"
-        if db_get_meta(key) != today_iso:
+        if await db.call(db_get_meta, key) != today_iso:
             await send_birthday_congrats(context)
-            db_set_meta(key, today_iso)
+            await db.write(db_set_meta, key, today_iso)
 
-    if now_msk.hour == 9 and now_msk.minute == 15:
+    if auto_send_slot_due("standup", now_msk):
         key = "last_auto_sent_date:standup"
-        if db_get_meta(key) != today_iso:
+        if await db.call(db_get_meta, key) != today_iso:
             await send_meeting_message(
                 MEETING_STANDUP, context, force=False,
                 include_standard=True, due_time=now_msk.strftime("%H:%M"),
             )
-            db_set_meta(key, today_iso)
+            await db.write(db_set_meta, key, today_iso)
 
-    if now_msk.hour == 11 and now_msk.minute == 30:
+    if auto_send_slot_due("industry", now_msk):
         key = "last_auto_sent_date:industry"
-        if db_get_meta(key) != today_iso:
+        if await db.call(db_get_meta, key) != today_iso:
             await send_meeting_message(
                 MEETING_INDUSTRY, context, force=False,
                 include_standard=True, due_time=now_msk.strftime("%H:%M"),
             )
-            db_set_meta(key, today_iso)
+            await db.write(db_set_meta, key, today_iso)
 
-    # Перенесённые встречи могут иметь собственное время уведомления.
-    # Проверяем их каждую минуту; sent=1 защищает от повторной отправки.
+    # Перенесённые встречи могут иметь собственное время уведомления;
+    # sent=1 защищает от повторной отправки.
     current_hhmm = now_msk.strftime("%H:%M")
     for meeting_type in (MEETING_STANDUP, MEETING_INDUSTRY):
-        if db_get_due_reschedules(meeting_type, now_msk.date(), current_hhmm):
+        if await db.call(db_get_due_reschedules, meeting_type, now_msk.date(), current_hhmm):
             await send_meeting_message(
                 meeting_type, context, force=False,
                 include_standard=False, due_time=current_hhmm,
             )
 
+# ---------------- KEYBOARD CACHE ----------------
+# Клавиатуры из справочников (категории, теги и подборки документов, теги
+# рассылок, каталог команды) и статичные меню не собираются на каждое
+# нажатие: разметка кэшируется по (построитель, аргументы, версии данных).
+# Версию группы таблиц ведут триггеры в meta.<группа>_version — так же, как
+# meta.profiles_version для анкет, — поэтому любая запись, в том числе
+# «сырой» SQL и восстановление из бэкапа, меняет ключ, и старая разметка
+# больше не находится. InlineKeyboardMarkup в PTB неизменяем, поэтому одну
+# разметку можно отдавать всем пользователям.
+
+# группа -> таблицы, запись в которые меняет meta.<группа>_version
+DATA_VERSION_GROUPS = {
+    "doc_categories": ("doc_categories",),
+    "doc_tags": ("doc_tags", "doc_tag_links"),
+    "doc_collections": ("doc_collections", "doc_collection_items"),
+    "broadcast_tags": ("broadcast_tags",),
+    "faq": ("faq_items",),
+    "docs": ("docs",),
+}
+
+KEYBOARD_CACHE = TTLCache("keyboards", ttl=24 * 60 * 60, maxsize=512)
+
+
+def _create_data_version_triggers(con, group: str):
+    for table in DATA_VERSION_GROUPS[group]:
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            con.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_data_version_{table}_{event.lower()} AFTER {event} ON {table}
+                BEGIN
+                    INSERT INTO meta(key, value) VALUES('{group}_version', '1')
+                    ON CONFLICT(key) DO UPDATE SET value=CAST(value AS INTEGER) + 1;
+                END
+            """)
+
+
+@schema_migration(19, "data_versions")
+def _migrate_data_versions(con):
+    for group in DATA_VERSION_GROUPS:
+        _create_data_version_triggers(con, group)
+
+
+def db_data_versions(groups: tuple[str, ...]) -> tuple:
+    """Версии групп таблиц (None — группу ещё не меняли); profiles — версия анкет."""
+    if not groups:
+        return ()
+    keys = [f"{group}_version" for group in groups]
+    con = db_connect()
+    cur = con.cursor()
+    cur.execute(f"SELECT key, value FROM meta WHERE key IN ({', '.join('?' * len(keys))})", keys)
+    values = dict(cur.fetchall())
+    con.close()
+    return tuple(values.get(key) for key in keys)
+
+
+def cached_keyboard(*groups: str, daily: bool = False):
+    """Кэширует построитель клавиатуры по аргументам и версиям групп groups.
+
+    daily=True — разметка зависит ещё и от сегодняшней даты по Москве
+    (например, счётчик ближайших дней рождения), дата входит в ключ.
+    """
+    def decorate(builder):
+        @functools.wraps(builder)
+        def wrapper(*args, **kwargs):
+            # Сам построитель в ключе: слои одного меню (kb_help_team и его
+            # обёртки) называются одинаково, но кэшируются раздельно.
+            key = (builder, args, tuple(sorted(kwargs.items())), db_data_versions(groups))
+            if daily:
+                key += (datetime.now(MOSCOW_TZ).date(),)
+            markup = KEYBOARD_CACHE.get(key)
+            if markup is _CACHE_MISSING:
+                markup = builder(*args, **kwargs)
+                KEYBOARD_CACHE.set(key, markup)
+            return markup
+
+        return wrapper
+
+    return decorate
+
+
 # ---------------- HELP MENUS ----------------
 
 def help_text_main(
@@ -5561,6 +7536,7 @@ def kb_bcast_tag_pick():
     return InlineKeyboardMarkup(rows)
 
 
+@cached_keyboard("broadcast_tags")
 def kb_broadcast_tags_manage():
     rows = [[InlineKeyboardButton("➕ Создать тег", callback_data="help:settings:bcast_tags:add")]]
     tags = db_broadcast_tags_list()
@@ -5628,6 +7604,7 @@ def kb_meeting_profile_picker(selected: set[int], page: int = 0):
     rows.append([InlineKeyboardButton("⬅️ Назад", callback_data="help:settings:meeting:recipients_back")])
     return InlineKeyboardMarkup(rows)
 
+@cached_keyboard("doc_categories")
 def kb_help_docs_categories():
     cats = db_docs_list_categories()
     rows = []
@@ -5685,7 +7662,7 @@ def faq_search_items(query: str) -> list[dict]:
         return []
 
     result: list[dict] = []
-    for item in db_faq_list_full():
+    for item in faq_items_all():
         haystack = (
             faq_plain_text(item.get("question"))
             + "\n"
@@ -5806,9 +7783,49 @@ def faq_pack_pages(items: list[dict]) -> list[list[str]]:
     return pages or [[]]
 
 
+# Раскладка FAQ по страницам считается один раз на ревизию faq_items, а не на
+# каждое нажатие ◀️/▶️: ключ — (упаковщик, id строк, meta.faq_version).
+# Версию ведут триггеры группы "faq" (см. KEYBOARD CACHE), так что правки
+# «сырым» SQL и восстановление из бэкапа тоже сбрасывают раскладку.
+FAQ_LAYOUT_CACHE = TTLCache("faq_layout", ttl=24 * 60 * 60, maxsize=256)
+
+
+@schema_migration(20, "faq_version")
+def _migrate_faq_version(con):
+    _create_data_version_triggers(con, "faq")
+
+
+def db_faq_revision() -> str | None:
+    return db_data_versions(("faq",))[0]
+
+
+def faq_items_all() -> list[dict]:
+    """db_faq_list_full() текущей ревизии; список общий — не изменять."""
+    key = (db_faq_list_full, db_faq_revision())
+    items = FAQ_LAYOUT_CACHE.get(key)
+    if items is _CACHE_MISSING:
+        items = db_faq_list_full()
+        FAQ_LAYOUT_CACHE.set(key, items)
+    return items
+
+
+def faq_layout(packer, items: list[dict]):
+    """packer(items), посчитанный один раз на ревизию FAQ и набор строк.
+
+    Строки одной ревизии с теми же id раскладываются одинаково, поэтому
+    страница N — это поиск в готовом списке.
+    """
+    key = (packer, tuple(int(item["id"]) for item in items), db_faq_revision())
+    pages = FAQ_LAYOUT_CACHE.get(key)
+    if pages is _CACHE_MISSING:
+        pages = packer(items)
+        FAQ_LAYOUT_CACHE.set(key, pages)
+    return pages
+
+
 def build_help_faq_menu() -> tuple[str, InlineKeyboardMarkup]:
     """Main FAQ screen without a separate button for every question."""
-    count = len(db_faq_list_full())
+    count = len(faq_items_all())
     count_line = (
         f"В базе знаний: <b>{count}</b> "
         f"{ru_word_form(count, 'вопрос', 'вопроса', 'вопросов')}"
@@ -5844,7 +7861,7 @@ def build_help_faq_cards_page(
     callback_prefix: str = "help:faq:answers",
     show_search: bool = True,
 ) -> tuple[str, InlineKeyboardMarkup]:
-    pages = faq_pack_pages(items)
+    pages = faq_layout(faq_pack_pages, items)
     total_pages = max(1, len(pages))
     page = max(0, min(int(page), total_pages - 1))
     page_blocks = pages[page]
@@ -5905,7 +7922,7 @@ def build_help_faq_cards_page(
 
 def build_help_faq_answers_page(page: int = 0) -> tuple[str, InlineKeyboardMarkup]:
     return build_help_faq_cards_page(
-        db_faq_list_full(),
+        faq_items_all(),
         page,
         callback_prefix="help:faq:answers",
         show_search=True,
@@ -6048,13 +8065,17 @@ def get_docs_search_state(context: ContextTypes.DEFAULT_TYPE) -> dict | None:
     }
 
 
-def _docs_search_items_from_state(state: dict) -> list[dict]:
-    query = (state.get("query") or "").strip()
+def _docs_search_state_tag_id(state: dict) -> int | None:
     filters_state = state.get("filters") or {}
     try:
-        tag_id = int(filters_state.get("tag_id")) if filters_state.get("tag_id") is not None else None
+        return int(filters_state.get("tag_id")) if filters_state.get("tag_id") is not None else None
     except (TypeError, ValueError):
-        tag_id = None
+        return None
+
+
+def _docs_search_items_from_state(state: dict) -> list[dict]:
+    query = (state.get("query") or "").strip()
+    tag_id = _docs_search_state_tag_id(state)
 
     if query:
         items = db_docs_search(query)
@@ -6067,9 +8088,39 @@ def _docs_search_items_from_state(state: dict) -> list[dict]:
     return []
 
 
-def kb_docs_search_result_list(items: list[dict], page: int, total_pages: int):
-    start = page * DOCS_SEARCH_PAGE_SIZE
-    page_items = items[start:start + DOCS_SEARCH_PAGE_SIZE]
+# Сессия поиска документов: на пользователя хранится упорядоченный список id
+# результатов для (запрос, фильтры, версии данных). Листание ◀️/▶️ не
+# повторяет поиск по FTS5 и тегам, а читает только карточки видимой страницы.
+# Версии групп docs, doc_categories и doc_tags ведут триггеры (см. KEYBOARD
+# CACHE): правка документа, категории или тега меняет подпись, и поиск
+# выполняется заново. Старые сессии вытесняются по TTL и LRU.
+DOCS_SEARCH_SESSIONS = TTLCache("docs_search_sessions", ttl=30 * 60, maxsize=1000)
+DOCS_SEARCH_VERSION_GROUPS = ("docs", "doc_categories", "doc_tags")
+
+
+@schema_migration(21, "docs_version")
+def _migrate_docs_version(con):
+    _create_data_version_triggers(con, "docs")
+
+
+def docs_search_result_ids(user_id: int | None, state: dict) -> list[int]:
+    """id результатов поиска из сессии пользователя; при смене подписи — поиск заново."""
+    signature = (
+        (state.get("query") or "").strip(),
+        _docs_search_state_tag_id(state),
+        db_data_versions(DOCS_SEARCH_VERSION_GROUPS),
+    )
+    if user_id is not None:
+        session = DOCS_SEARCH_SESSIONS.get(int(user_id))
+        if session is not _CACHE_MISSING and session[0] == signature:
+            return session[1]
+    ids = [int(item["id"]) for item in _docs_search_items_from_state(state)]
+    if user_id is not None:
+        DOCS_SEARCH_SESSIONS.set(int(user_id), (signature, ids))
+    return ids
+
+
+def kb_docs_search_result_list(page_items: list[dict], page: int, total_pages: int):
     rows = []
     if not page_items:
         rows.append([InlineKeyboardButton("— ничего не найдено —", callback_data="noop")])
@@ -6102,9 +8153,10 @@ def kb_docs_search_result_list(items: list[dict], page: int, total_pages: int):
     return InlineKeyboardMarkup(rows)
 
 
-def build_docs_search_results(
+async def build_docs_search_results(
     context: ContextTypes.DEFAULT_TYPE,
     requested_page: int | None = None,
+    user_id: int | None = None,
 ) -> tuple[str, InlineKeyboardMarkup]:
     state = get_docs_search_state(context)
     if not state:
@@ -6116,10 +8168,12 @@ def build_docs_search_results(
             ]),
         )
 
-    items = _docs_search_items_from_state(state)
-    total_pages = max(1, (len(items) + DOCS_SEARCH_PAGE_SIZE - 1) // DOCS_SEARCH_PAGE_SIZE)
+    ids = await db.call(docs_search_result_ids, user_id, state)
+    total_pages = max(1, (len(ids) + DOCS_SEARCH_PAGE_SIZE - 1) // DOCS_SEARCH_PAGE_SIZE)
     page = state["page"] if requested_page is None else max(0, int(requested_page))
     page = min(page, total_pages - 1)
+    start = page * DOCS_SEARCH_PAGE_SIZE
+    page_items = await db.call(_db_docs_by_ids, ids[start:start + DOCS_SEARCH_PAGE_SIZE])
     state["page"] = page
     context.user_data[DOCS_SEARCH_STATE] = state
     context.user_data[DOCS_RETURN_CB] = f"help:docs:search:results:{page}"
@@ -6132,13 +8186,13 @@ def build_docs_search_results(
     if filters_state.get("tag_title"):
         filter_lines.append(f"Тег: <b>#{escape(str(filters_state['tag_title']))}</b>")
     criteria = "\n".join(filter_lines) or "Все документы"
-    page_line = f"\nСтраница: <b>{page + 1}/{total_pages}</b>" if items else ""
+    page_line = f"\nСтраница: <b>{page + 1}/{total_pages}</b>" if ids else ""
     text = (
         "🔎 <b>Результаты поиска</b>\n\n"
         f"{criteria}\n"
-        f"Найдено: <b>{len(items)}</b>{page_line}"
+        f"Найдено: <b>{len(ids)}</b>{page_line}"
     )
-    return text, kb_docs_search_result_list(items, page, total_pages)
+    return text, kb_docs_search_result_list(page_items, page, total_pages)
 
 
 def kb_docs_result_list(items: list[dict], empty_text: str = "— документов нет —", back_cb: str = "help:docs"):
@@ -6175,6 +8229,7 @@ def kb_doc_card(doc_id: int, user_id: int | None, back_cb: str = "help:docs"):
     ])
 
 
+@cached_keyboard("doc_collections")
 def kb_doc_collections(back_cb: str = "help:docs"):
     collections = db_doc_collections_list()
     rows = []
@@ -6248,6 +8303,7 @@ def kb_doc_tag_picker(doc_id: int):
     return InlineKeyboardMarkup(rows)
 
 
+@cached_keyboard("doc_tags")
 def kb_doc_tags_manage():
     rows = [[InlineKeyboardButton("➕ Создать тег", callback_data="help:docs:admin:tags:add")]]
     for tag in db_doc_tags_list():
@@ -6261,6 +8317,7 @@ def kb_doc_tags_manage():
     return InlineKeyboardMarkup(rows)
 
 
+@cached_keyboard("doc_collections")
 def kb_doc_collections_manage():
     rows = [[InlineKeyboardButton("➕ Создать подборку", callback_data="help:docs:admin:collections:add")]]
     for item in db_doc_collections_list():
@@ -6466,6 +8523,7 @@ def get_links_catalog() -> dict[str, dict]:
 
     return catalog
 
+@cached_keyboard()
 def kb_help_links_menu():
     catalog = get_links_catalog()
     rows = []
@@ -6546,28 +8604,37 @@ def _parse_birthday_ddmm(value: str | None) -> tuple[int, int] | None:
     return day, month
 
 
+# События за период кэшируются по границам периода (то есть по дню по Москве)
+# и версии анкет: меню команды и листание дней рождения не ходят в БД заново.
+BIRTHDAY_CACHE = TTLCache("birthdays", ttl=24 * 60 * 60, maxsize=64)
+
+
 def _birthday_occurrences(start_day: date, end_day: date) -> list[dict]:
     """Собирает дни рождения сотрудников в заданном включительном периоде."""
+    key = (start_day, end_day, db_profiles_version())
+    cached = BIRTHDAY_CACHE.get(key)
+    if cached is not _CACHE_MISSING:
+        return cached
+
     events: list[dict] = []
-    for profile in db_profiles_with_birthdays():
-        parsed = _parse_birthday_ddmm(profile.get("birthday"))
-        if not parsed:
-            continue
-        day, month = parsed
-        for year in range(start_day.year, end_day.year + 1):
+    # Период через Новый год разбивается на отрезки внутри одного года.
+    for year in range(start_day.year, end_day.year + 1):
+        first = max(start_day, date(year, 1, 1))
+        last = min(end_day, date(year, 12, 31))
+        for profile in db_profiles_birthdays_between((first.month, first.day), (last.month, last.day)):
             try:
-                event_day = date(year, month, day)
+                event_day = date(year, profile["birth_month"], profile["birth_day"])
             except ValueError:
                 # Например, 29 февраля в невисокосном году.
                 continue
-            if start_day <= event_day <= end_day:
-                events.append({
-                    "profile_id": int(profile["id"]),
-                    "full_name": profile["full_name"],
-                    "birthday": profile["birthday"],
-                    "event_date": event_day,
-                })
+            events.append({
+                "profile_id": int(profile["id"]),
+                "full_name": profile["full_name"],
+                "birthday": profile["birthday"],
+                "event_date": event_day,
+            })
     events.sort(key=lambda item: (item["event_date"], item["full_name"].casefold()))
+    BIRTHDAY_CACHE.set(key, events)
     return events
 
 
@@ -6735,7 +8802,7 @@ def kb_help_team_similar(
 ):
     own_interests = normalize_profile_interests(profile.get("interests"))
     selected_filter = interest_key if interest_key in PROFILE_INTEREST_KEYS else None
-    matches = filter_shared_interest_matches(all_matches, selected_filter)
+    matches = db_profiles_with_shared_interests(int(profile["id"]), selected_filter)
     page = _team_clamp_page(page, len(matches))
     total_pages = _team_total_pages(len(matches))
     start = page * TEAM_PAGE_SIZE
@@ -6751,7 +8818,7 @@ def kb_help_team_similar(
     ])
 
     for key in own_interests:
-        count = sum(1 for item in all_matches if key in item.get("shared_interests", []))
+        count = len(db_profiles_with_shared_interests(int(profile["id"]), key))
         prefix = "✅ " if selected_filter == key else ""
         rows.append([
             InlineKeyboardButton(
@@ -6787,6 +8854,7 @@ def kb_help_team_similar(
     return InlineKeyboardMarkup(rows)
 
 
+@cached_keyboard("profiles", daily=True)
 def kb_help_team(page: int = 0, can_create_profile: bool = False):
     """Компактный каталог: 8 сотрудников на странице, по 2 кнопки в строке."""
     people = db_profiles_list()
@@ -7490,10 +9558,9 @@ async def _telegram_bot_api_json(method: str, payload: dict):
     Это позволяет использовать sendRichMessage/editMessageText даже до того,
     как установленная версия python-telegram-bot добавит соответствующие классы.
     """
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/{method}"
+    url = f"{TELEGRAM_API_URL}/bot{BOT_TOKEN}/{method}"
     try:
-        async with httpx.AsyncClient(timeout=25.0) as client:
-            response = await client.post(url, json=payload)
+        response = await HTTP_CLIENTS.get("telegram").post(url, json=payload)
     except httpx.HTTPError as exc:
         raise RuntimeError(f"Telegram Bot API {method}: ошибка соединения") from exc
 
@@ -8045,18 +10112,18 @@ async def render_profile_card(
     except (TypeError, ValueError, AttributeError):
         profile_id = 0
     if profile_id:
-        stored_profile = db_profiles_get(profile_id)
+        stored_profile = await db.call(db_profiles_get, profile_id)
         if stored_profile:
             profile = stored_profile
 
     viewer_profile = None
     viewer = getattr(query, "from_user", None)
     if viewer:
-        viewer_profile = db_profiles_get_by_tg_user_id(int(viewer.id))
+        viewer_profile = await db.call(db_profiles_get_by_tg_user_id, int(viewer.id))
         if not viewer_profile:
             viewer_tg = _normalize_profile_tg_link(getattr(viewer, "username", None))
             if viewer_tg:
-                viewer_profile = db_profiles_get_by_tg_link(viewer_tg)
+                viewer_profile = await db.call(db_profiles_get_by_tg_link, viewer_tg)
     shared_interests = profile_shared_interests(viewer_profile, profile)
 
     markup = kb_help_profile_card(
@@ -8173,6 +10240,7 @@ async def render_profile_card(
     )
 
 
+@cached_keyboard()
 def kb_help_settings():
     return InlineKeyboardMarkup([
         [
@@ -8221,6 +10289,7 @@ def kb_settings_communications():
 def kb_settings_system():
     return InlineKeyboardMarkup([
         [InlineKeyboardButton("📦 Скачать бэкап ZIP", callback_data="help:settings:backup_zip")],
+        [InlineKeyboardButton("🧩 Изменения с прошлого бэкапа", callback_data="help:settings:backup_zip:changes")],
         [InlineKeyboardButton("📥 Восстановить бэкап ZIP", callback_data="help:settings:restore_zip")],
         [
             InlineKeyboardButton("📤 Экспорт CSV", callback_data="help:settings:export_csv"),
@@ -8288,7 +10357,7 @@ def kb_pick_category_for_new_doc():
     return InlineKeyboardMarkup(rows)
 
 def kb_pick_doc_to_delete():
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("""
         SELECT d.id, c.title, d.title
@@ -8430,11 +10499,12 @@ def _safe_json_loads(s: str, default):
 # ---------------- TESTING DB helpers ----------------
 
 def db_test_create_template(title: str, created_by: int | None) -> int:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
+    now = _now_iso()
     cur.execute(
-        "INSERT INTO test_templates(title, created_by, created_at, is_draft_visible) VALUES(?, ?, ?, 1)",
-        (title.strip(), created_by, _now_iso()),
+        "INSERT INTO test_templates(title, created_by, created_at, updated_at, is_draft_visible) VALUES(?, ?, ?, ?, 1)",
+        (title.strip(), created_by, now, now),
     )
     con.commit()
     tid = int(cur.lastrowid)
@@ -8442,7 +10512,7 @@ def db_test_create_template(title: str, created_by: int | None) -> int:
     return tid
 
 def db_test_add_question(template_id: int, idx: int, q_type: str, question_text: str, options: list[str] | None, correct: list[int] | None) -> int:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """INSERT INTO test_questions(template_id, idx, q_type, question_text, options_json, correct_json, created_at)
@@ -8463,7 +10533,7 @@ def db_test_add_question(template_id: int, idx: int, q_type: str, question_text:
     return qid
 
 def db_test_get_questions(template_id: int) -> list[dict]:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         "SELECT id, idx, q_type, question_text, options_json, correct_json FROM test_questions WHERE template_id=? ORDER BY idx ASC",
@@ -8485,20 +10555,22 @@ def db_test_get_questions(template_id: int) -> list[dict]:
 
 def db_test_create_assignment(template_id: int, profile_id: int, assigned_by: int | None, time_limit_sec: int | None) -> int:
     assigned_at = _now_iso()
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """INSERT INTO test_assignments(template_id, profile_id, assigned_by, assigned_at, time_limit_sec, deadline_at, status, started_at, finished_at, current_idx)
              VALUES(?, ?, ?, ?, ?, NULL, 'assigned', NULL, NULL, 0)""",
         (int(template_id), int(profile_id), assigned_by, assigned_at, (int(time_limit_sec) if time_limit_sec is not None else None)),
     )
-    con.commit()
     aid = int(cur.lastrowid)
+    # Группа попыток, как у назначений TESTING V2.
+    cur.execute("UPDATE test_assignments SET attempt_group='legacy-' || id WHERE id=?", (aid,))
+    con.commit()
     con.close()
     return aid
 
 def db_test_get_assignment(aid: int) -> dict | None:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """SELECT id, template_id, profile_id, assigned_by, assigned_at, time_limit_sec, deadline_at, status,
@@ -8525,7 +10597,7 @@ def db_test_get_assignment(aid: int) -> dict | None:
     }
 
 def db_test_update_assignment_start(aid: int, deadline_at_iso: str | None):
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """UPDATE test_assignments
@@ -8540,7 +10612,7 @@ def db_test_update_assignment_start(aid: int, deadline_at_iso: str | None):
     return ok
 
 def db_test_update_assignment_progress(aid: int, current_idx: int):
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         "UPDATE test_assignments SET current_idx=? "
@@ -8551,7 +10623,7 @@ def db_test_update_assignment_progress(aid: int, current_idx: int):
     con.close()
 
 def db_test_finish_assignment(aid: int, status: str):
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """UPDATE test_assignments
@@ -8563,14 +10635,14 @@ def db_test_finish_assignment(aid: int, status: str):
     con.close()
 
 def db_test_set_assignment_status(aid: int, status: str):
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("UPDATE test_assignments SET status=? WHERE id=?", (status, int(aid)))
     con.commit()
     con.close()
 
 def db_test_save_answer(assignment_id: int, question_id: int, answer_obj: dict, is_correct: int | None):
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         "SELECT status FROM test_assignments WHERE id=?",
@@ -8594,7 +10666,7 @@ def db_test_save_answer(assignment_id: int, question_id: int, answer_obj: dict,
     return True
 
 def db_test_list_recent_results(limit: int = 20) -> list[dict]:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """SELECT a.id, a.profile_id, a.status, a.finished_at, a.assigned_at, t.title
@@ -8620,7 +10692,7 @@ def db_test_list_recent_results(limit: int = 20) -> list[dict]:
     return out
 
 def db_test_get_answers_for_assignment(aid: int) -> list[dict]:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """SELECT q.idx, q.q_type, q.question_text, q.options_json, q.correct_json,
@@ -8654,7 +10726,7 @@ def db_test_delete_assignment_full(aid: int) -> bool:
 
     Важно: SQLite по умолчанию может быть без PRAGMA foreign_keys=ON, поэтому удаляем явно.
     """
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
 
     cur.execute("SELECT template_id FROM test_assignments WHERE id=?", (int(aid),))
@@ -8676,7 +10748,7 @@ def db_test_delete_assignment_full(aid: int) -> bool:
     con.close()
     return True
 def db_test_list_templates(limit: int = 50) -> list[dict]:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """SELECT id, title, created_at
@@ -8692,7 +10764,7 @@ def db_test_list_templates(limit: int = 50) -> list[dict]:
 
 
 def db_test_get_template(tid: int) -> dict | None:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("SELECT id, title, created_by, created_at FROM test_templates WHERE id=?", (int(tid),))
     r = cur.fetchone()
@@ -8703,7 +10775,7 @@ def db_test_get_template(tid: int) -> dict | None:
 
 
 def db_test_get_questions_for_template(tid: int) -> list[dict]:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """SELECT id, idx, q_type, question_text, options_json, correct_json
@@ -8732,7 +10804,7 @@ def db_test_delete_template_full(tid: int) -> bool:
     Полностью удаляет шаблон теста из 'Черновиков' и всю связанную историю:
     assignments + answers + questions + template.
     """
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     try:
         # collect assignment ids
@@ -8753,7 +10825,7 @@ def db_test_delete_template_full(tid: int) -> bool:
 
 
 def db_test_template_has_assignments(tid: int) -> bool:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("SELECT 1 FROM test_assignments WHERE template_id=? LIMIT 1", (int(tid),))
     ok = cur.fetchone() is not None
@@ -8762,7 +10834,7 @@ def db_test_template_has_assignments(tid: int) -> bool:
 
 
 def db_test_hide_template(tid: int):
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("UPDATE test_templates SET is_draft_visible=0 WHERE id=?", (int(tid),))
     con.commit()
@@ -8781,7 +10853,7 @@ def db_test_delete_draft_only(tid: int) -> bool:
         return True
 
     # Иначе можно удалить полностью (вместе с вопросами), т.к. результатов нет
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     try:
         cur.execute("DELETE FROM test_questions WHERE template_id=?", (int(tid),))
@@ -8794,7 +10866,7 @@ def db_test_delete_draft_only(tid: int) -> bool:
 
 def db_test_delete_assignment_only(aid: int) -> bool:
     """Удаляет только результат (assignment + ответы), не трогая шаблон/черновик."""
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("SELECT id FROM test_assignments WHERE id=?", (int(aid),))
     if not cur.fetchone():
@@ -8807,7 +10879,7 @@ def db_test_delete_assignment_only(aid: int) -> bool:
     return True
 
 def db_test_delete_answers(aid: int):
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("DELETE FROM test_answers WHERE assignment_id=?", (int(aid),))
     con.commit()
@@ -9120,7 +11192,7 @@ async def finalize_profile_wizard(update: Update, context: ContextTypes.DEFAULT_
 
         # Самостоятельно можно изменять только собственную анкету.
         if mode == "self_edit":
-            owner_profile = get_profile_for_user(update)
+            owner_profile = await profile_for_user(update)
             current_user = update.effective_user
             if (
                 not current_user
@@ -9210,17 +11282,22 @@ def get_profile_for_user(update: Update) -> dict | None:
     return None
 
 
+async def profile_for_user(update: Update) -> dict | None:
+    """get_profile_for_user() в потоке чтения — для обработчиков."""
+    return await db.call(get_profile_for_user, update)
+
+
 async def can_create_own_profile(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
     if not update.effective_user:
         return False
     if await is_admin_scoped(update, context):
         return False
-    return get_profile_for_user(update) is None
+    return await profile_for_user(update) is None
 
 
 
 def db_profile_test_summary(profile_id: int) -> dict:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -9246,7 +11323,7 @@ def db_profile_test_summary(profile_id: int) -> dict:
 
 
 def db_profile_tests(profile_id: int, limit: int = 10) -> list[dict]:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -9430,14 +11507,17 @@ async def cmd_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     bot_username = context.bot.username or "blablabird_bot"
     is_adm = await is_admin_scoped(update, context)
-    profile = get_profile_for_user(update)
-    unread_count = db_notifications_unread_count(int(user.id))
-    text = help_text_main(
+    profile = await profile_for_user(update)
+    dashboard = await user_dashboard(int(user.id), profile["id"] if profile else None)
+    unread_count = dashboard["unread_count"]
+    text = await db.call(
+        help_text_main,
         bot_username,
         profile=profile,
         unread_count=unread_count,
         is_admin_user=is_adm,
         user_full_name=user.full_name,
+        dashboard=dashboard,
     )
     markup = kb_help_main(
         is_admin_user=is_adm,
@@ -9550,7 +11630,7 @@ async def cmd_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if await deny_no_access_for_private_command(update, context):
         return
     await sync_profile_user_id_from_update(update)
-    profile = get_profile_for_user(update)
+    profile = await profile_for_user(update)
     user = update.effective_user
 
     if profile_needs_onboarding(profile):
@@ -9660,7 +11740,7 @@ async def cmd_docs(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if raw_query:
-        items = db_docs_search(raw_query, limit=12)
+        items = await db.call(db_docs_search, raw_query, limit=12)
         text = _docs_search_text(raw_query, items)
     else:
         text = _docs_overview_text()
@@ -9677,6 +11757,65 @@ async def cmd_docs(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 
+# ---------------- HOROSCOPE: DAILY CACHE ----------------
+# Гороскоп одинаков для всех пользователей знака, поэтому страница Rambler
+# скачивается и разбирается один раз в день на знак: фоновая задача заранее
+# заполняет таблицу horo_cache, а промах (задача ещё не успела или Rambler
+# отдал вчерашний текст) загружается один раз, даже при одновременных запросах.
+
+HORO_PREFETCH_INTERVAL_SECONDS = 60 * 60
+HORO_CACHE = TTLCache("horo", ttl=24 * 60 * 60, negative_ttl=10 * 60, maxsize=64)
+
+
+def _horo_date_is_current(date_str: str | None, day: date) -> bool:
+    """Дата на странице совпадает с днём кэша (Rambler обновляется около полуночи)."""
+    if not date_str:
+        return True
+    return date_str.casefold().startswith(f"{day.day} {RU_MONTHS_GENITIVE[day.month]}")
+
+
+async def _horo_fetch_parsed(sign_slug: str, day: date) -> dict:
+    horo_text, date_str = await fetch_rambler_horo(sign_slug)
+    body_text, advice, focus = extract_horo_blocks(horo_text)
+    horo = {"date_str": date_str, "body": body_text, "advice": advice, "focus": focus}
+    horo["current"] = _horo_date_is_current(date_str, day)
+    if horo["current"]:
+        await db.write(db_horo_cache_put, day.isoformat(), sign_slug, horo)
+    return horo
+
+
+async def get_daily_horo(sign_slug: str) -> dict:
+    """Гороскоп знака на сегодня: память → SQLite → Rambler (single-flight)."""
+    day = datetime.now(MOSCOW_TZ).date()
+
+    async def load() -> dict:
+        cached = await db.call(db_horo_cache_get, day.isoformat(), sign_slug)
+        if cached is not None:
+            return dict(cached, current=True)
+        return await _horo_fetch_parsed(sign_slug, day)
+
+    # Устаревший текст кэшируется ненадолго: через 10 минут Rambler спросят снова.
+    return await HORO_CACHE.get_or_load((day.isoformat(), sign_slug), load, is_negative=lambda horo: not horo["current"])
+
+
+async def job_horo_prefetch(context: ContextTypes.DEFAULT_TYPE):
+    """Заранее загружает гороскопы всех знаков, которых ещё нет в кэше на сегодня."""
+    day = datetime.now(MOSCOW_TZ).date()
+    cached = await db.call(db_horo_cache_signs, day.isoformat())
+    missing = [slug for slug, _title in ZODIAC if slug not in cached]
+    if not missing:
+        return
+    results = await asyncio.gather(
+        *(_horo_fetch_parsed(slug, day) for slug in missing),
+        return_exceptions=True,
+    )
+    for slug, result in zip(missing, results):
+        if isinstance(result, Exception):
+            logger.warning("Horoscope prefetch failed: sign=%s error=%s", slug, result)
+        elif result["current"]:
+            HORO_CACHE.set((day.isoformat(), slug), result)
+
+
 async def _send_horo_dm(user_id: int, sign_slug: str, context: ContextTypes.DEFAULT_TYPE):
     today_iso = datetime.now(MOSCOW_TZ).date().isoformat()
 
@@ -9685,15 +11824,15 @@ async def _send_horo_dm(user_id: int, sign_slug: str, context: ContextTypes.DEFA
         await context.bot.send_message(chat_id=user_id, text="Звёзды свою работу выполнили, приходи завтра 🙂")
         return
 
-    horo_text, date_str = await fetch_rambler_horo(sign_slug)
+    horo = await get_daily_horo(sign_slug)
+    date_str = horo["date_str"]
+    body_text, advice, focus = horo["body"], horo["advice"], horo["focus"]
 
     title = ZODIAC_NAME.get(sign_slug, sign_slug)
     head = title
     if date_str:
         head += f" • {date_str}"
 
-    body_text, advice, focus = extract_horo_blocks(horo_text)
-
     sep = "\n────────────\n\n"
 
     msg = (
@@ -9915,6 +12054,19 @@ async def cmd_test_industry(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await send_meeting_message(MEETING_INDUSTRY, context, force=True)
     await update.message.reply_text("🚀 Отправил тестовое уведомление отраслевой встречи.")
 
+def _status_db_snapshot(today: date) -> tuple:
+    """Чтения /status одним вызовом в потоке чтения."""
+    return (
+        db_list_chats(),
+        db_get_meta("last_auto_sent_date:standup"),
+        db_get_meta("last_auto_sent_date:industry"),
+        db_get_state(MEETING_STANDUP, today),
+        db_get_state(MEETING_INDUSTRY, today),
+        db_get_due_reschedules(MEETING_STANDUP, today),
+        db_get_due_reschedules(MEETING_INDUSTRY, today),
+    )
+
+
 async def cmd_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if await deny_no_access(update, context):
         return
@@ -9927,15 +12079,30 @@ async def cmd_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     now_msk = datetime.now(MOSCOW_TZ)
     today = now_msk.date()
 
-    chats = db_list_chats()
-    last_standup = db_get_meta("last_auto_sent_date:standup")
-    last_industry = db_get_meta("last_auto_sent_date:industry")
-
-    st_state = db_get_state(MEETING_STANDUP, today)
-    in_state = db_get_state(MEETING_INDUSTRY, today)
-
-    st_due_res = db_get_due_reschedules(MEETING_STANDUP, today)
-    in_due_res = db_get_due_reschedules(MEETING_INDUSTRY, today)
+    (
+        chats, last_standup, last_industry, st_state, in_state, st_due_res, in_due_res,
+    ) = await db.call(_status_db_snapshot, today)
+
+    lag = LOOP_LAG.snapshot()
+    pool = db_pool_stats()
+    member_cache = CHAT_MEMBER_CACHE.stats()
+    external_cache = EXTERNAL_ACCESS_CACHE.stats()
+    keyboard_cache = KEYBOARD_CACHE.stats()
+    delivery = DELIVERY.stats()
+    doc_index = DOC_INDEXER.stats()
+    deadlines = DEADLINES.stats()
+    persistence = context.application.persistence
+    persistence_line = ""
+    if isinstance(persistence, SQLitePersistence):
+        saved_state = persistence.stats()
+        persistence_line = (
+            f"💾 Состояние мастеров: загружено <b>{saved_state['loaded']}</b>, "
+            f"записей <b>{saved_state['flushes']}</b> ({saved_state['keys_written']} ключей), "
+            f"в очереди <b>{saved_state['pending']}</b>\n"
+        )
+    next_deadline = (
+        deadlines["next_at"].astimezone(MOSCOW_TZ).strftime("%d.%m %H:%M:%S") if deadlines["next_at"] else "—"
+    )
 
     def fmt_state(title: str, state: dict, due_res: list[str]) -> str:
         if state["canceled"] == 1:
@@ -9966,7 +12133,24 @@ async def cmd_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"• Отраслевая: <code>{last_industry or '—'}</code>\n\n"
         f"🗂️ Состояние на сегодня:\n"
         f"{fmt_state('Планёрка', st_state, st_due_res)}\n"
-        f"{fmt_state('Отраслевая', in_state, in_due_res)}\n"
+        f"{fmt_state('Отраслевая', in_state, in_due_res)}\n\n"
+        f"⏱️ Задержка event loop: p50 <code>{lag['p50_ms']:.0f}</code> мс, "
+        f"p99 <code>{lag['p99_ms']:.0f}</code> мс, макс <code>{lag['max_ms']:.0f}</code> мс\n"
+        f"🗄️ Соединения SQLite: открыто <b>{pool['open']}</b>, переиспользовано <b>{pool['reused']}</b>\n"
+        f"🔐 Кэш доступа: участники <b>{member_cache['hit_rate']:.0%}</b> попаданий "
+        f"({member_cache['hits']}/{member_cache['hits'] + member_cache['misses']}), "
+        f"внешний доступ <b>{external_cache['hit_rate']:.0%}</b>\n"
+        f"⌨️ Кэш клавиатур: <b>{keyboard_cache['hit_rate']:.0%}</b> попаданий "
+        f"({keyboard_cache['hits']}/{keyboard_cache['hits'] + keyboard_cache['misses']}), "
+        f"в памяти <b>{keyboard_cache['size']}</b>\n"
+        f"📨 Рассылки: отправлено <b>{delivery['sent']}</b>, "
+        f"повторов после RetryAfter <b>{delivery['retries']}</b>, ошибок <b>{delivery['failed']}</b>\n"
+        f"📄 Индексация: в очереди <b>{doc_index['queued']}</b>, в работе <b>{doc_index['running']}</b>, "
+        f"готово <b>{doc_index['done']}</b> (из кэша <b>{doc_index['cache_hits']}</b>), тайм-аутов <b>{doc_index['timeouts']}</b>, "
+        f"перезапусков пула <b>{doc_index['recycled']}</b>\n"
+        f"⏱ Сроки: ближайший <b>{next_deadline}</b> ({deadlines['next_source'] or '—'}), "
+        f"запусков <b>{deadlines['fires']}</b>, макс. опоздание <b>{deadlines['max_lateness']:.1f} с</b>\n"
+        f"{persistence_line}"
     )
 
     await update.message.reply_text(text, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
@@ -9997,645 +12181,781 @@ def _csv_bool(v: str | None) -> str:
     return "1" if str(v).strip().lower() in ("1", "true", "yes", "y") else "0"
 
 
-def export_backup_zip_bytes() -> bytes:
-    """Формирует ZIP-бэкап с несколькими CSV (profiles/docs/categories/notify_chats/achievements_awards)."""
-    files: dict[str, str] = {}
+# Инкрементальный бэкап. У выгружаемых таблиц есть backup_rev: триггеры
+# при вставке и изменении выгружаемых колонок проставляют строке следующий
+# номер из meta.backup_revision. Бэкап «изменений» берёт только строки с
+# backup_rev больше водяного знака meta.backup_watermark, который сдвигается
+# после каждой успешной отправки бэкапа. Удаления в бэкап не попадают:
+# восстановление из ZIP только добавляет и обновляет записи.
+BACKUP_REVISION_KEY = "backup_revision"
+BACKUP_WATERMARK_KEY = "backup_watermark"
+BACKUP_TRACKED_COLUMNS = {
+    "doc_categories": "title, created_at",
+    "docs": "category_id, title, description, file_id, file_unique_id, mime_type, local_path",
+    "doc_tags": "title",
+    "doc_tag_links": "doc_id, tag_id",
+    "doc_collections": "title, description",
+    "doc_collection_items": "collection_id, doc_id, position",
+    "profiles": (
+        "full_name, year_start, city, birthday, about, topics, interests_json, tg_link, "
+        "tg_user_id, is_active, avg_test_score, photo_file_id"
+    ),
+    "notify_chats": "chat_id, added_at",
+    "achievement_awards": (
+        "profile_id, emoji, title, description, awarded_at, awarded_by, achievement_key, level"
+    ),
+    "faq_items": "question, answer, created_at",
+}
 
-    # doc_categories.csv
-    buf = io.StringIO()
-    w = csv.DictWriter(buf, fieldnames=["title", "created_at"])
-    w.writeheader()
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    try:
-        cur.execute("SELECT title, created_at FROM doc_categories ORDER BY title COLLATE NOCASE ASC")
-        for title, created_at in cur.fetchall():
-            w.writerow({"title": title or "", "created_at": created_at or ""})
-    finally:
-        con.close()
-    files["doc_categories.csv"] = buf.getvalue()
 
-    # legacy name (для совместимости со старым импортом, который ищет categories.csv)
-    files["categories.csv"] = buf.getvalue()
+@schema_migration(2, "backup_revisions")
+def _migrate_backup_revisions(con):
+    for table, columns in BACKUP_TRACKED_COLUMNS.items():
+        try:
+            con.execute(f"ALTER TABLE {table} ADD COLUMN backup_rev INTEGER NOT NULL DEFAULT 0")
+        except sqlite3.OperationalError:
+            pass
+        con.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_backup_rev ON {table}(backup_rev)")
+        for event, suffix in (("INSERT", "ins"), (f"UPDATE OF {columns}", "upd")):
+            con.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_backup_rev_{table}_{suffix} AFTER {event} ON {table}
+                BEGIN
+                    INSERT INTO meta(key, value) VALUES('{BACKUP_REVISION_KEY}', '1')
+                    ON CONFLICT(key) DO UPDATE SET value=CAST(value AS INTEGER) + 1;
+                    UPDATE {table}
+                    SET backup_rev=(SELECT CAST(value AS INTEGER) FROM meta WHERE key='{BACKUP_REVISION_KEY}')
+                    WHERE rowid=NEW.rowid;
+                END
+            """)
+
+
+def _backup_write_csv(zf: zipfile.ZipFile, name: str, fieldnames: list[str], rows) -> int:
+    """Пишет CSV построчно прямо в запись ZIP; возвращает число строк."""
+    count = 0
+    with io.TextIOWrapper(zf.open(name, "w", force_zip64=True), encoding="utf-8-sig", newline="") as text:
+        writer = csv.DictWriter(text, fieldnames=fieldnames)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
 
-    # docs.csv
-    buf = io.StringIO()
-    w = csv.DictWriter(buf, fieldnames=[
-        "category_title",
-        "doc_title",
-        "doc_description",
-        "doc_file_id",
-        "doc_file_unique_id",
-        "doc_mime_type",
-        "doc_local_path",
-    ])
-    w.writeheader()
-    con = sqlite3.connect(DB_PATH)
+
+def export_backup_zip(path: str | Path, since_revision: int | None = None) -> dict:
+    """
+    Пишет ZIP-бэкап (profiles/docs/categories/notify_chats/achievements_awards/...)
+    в файл path, не собирая CSV в памяти.
+
+    since_revision=None — полный бэкап, иначе только строки, изменённые после
+    этой ревизии. Все CSV читаются из одного снимка БД; возвращает
+    {"revision", "rows", "incremental"}, где revision — водяной знак снимка.
+    """
+    incremental = since_revision is not None
+    params = {"since": int(since_revision or 0)}
+
+    def changed(*aliases: str) -> str:
+        if not incremental:
+            return ""
+        return "WHERE " + " OR ".join(f"COALESCE({alias}.backup_rev, 0) > :since" for alias in aliases)
+
+    con = db_connect()
     cur = con.cursor()
+    rows_total = 0
     try:
-        cur.execute("""
-            SELECT c.title, d.title, d.description, d.file_id, d.file_unique_id, d.mime_type, d.local_path
-            FROM docs d
-            JOIN doc_categories c ON c.id = d.category_id
-            ORDER BY d.id ASC
-        """)
-        rows = cur.fetchall()
-        has_local = True
-    except sqlite3.OperationalError:
-        cur.execute("""
-            SELECT c.title, d.title, d.description, d.file_id, d.file_unique_id, d.mime_type
-            FROM docs d
-            JOIN doc_categories c ON c.id = d.category_id
-            ORDER BY d.id ASC
-        """)
-        rows = cur.fetchall()
-        has_local = False
-    con.close()
-    for r in rows:
-        if has_local:
-            cat_title, doc_title, desc, file_id, file_unique_id, mime_type, local_path = r
-        else:
-            cat_title, doc_title, desc, file_id, file_unique_id, mime_type = r
-            local_path = ""
-        w.writerow({
-            "category_title": cat_title or "",
-            "doc_title": doc_title or "",
-            "doc_description": desc or "",
-            "doc_file_id": file_id or "",
-            "doc_file_unique_id": file_unique_id or "",
-            "doc_mime_type": mime_type or "",
-            "doc_local_path": local_path or "",
-        })
-    files["docs.csv"] = buf.getvalue()
+        # Одна читающая транзакция: все файлы и ревизия из одного снимка WAL.
+        cur.execute("BEGIN")
+        cur.execute("SELECT value FROM meta WHERE key=?", (BACKUP_REVISION_KEY,))
+        row = cur.fetchone()
+        revision = int(row[0]) if row and row[0] else 0
 
-    # doc_tags.csv — связи тегов с документами
-    buf = io.StringIO()
-    w = csv.DictWriter(buf, fieldnames=[
-        "doc_title", "category_title", "doc_file_unique_id", "doc_file_id", "tag_title"
-    ])
-    w.writeheader()
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.execute("""
-        SELECT d.title, c.title, d.file_unique_id, d.file_id, t.title
-        FROM doc_tag_links l
-        JOIN docs d ON d.id=l.doc_id
-        JOIN doc_categories c ON c.id=d.category_id
-        JOIN doc_tags t ON t.id=l.tag_id
-        ORDER BY t.title COLLATE NOCASE, d.title COLLATE NOCASE
-    """)
-    for doc_title, cat_title, unique_id, file_id, tag_title in cur.fetchall():
-        w.writerow({
-            "doc_title": doc_title or "",
-            "category_title": cat_title or "",
-            "doc_file_unique_id": unique_id or "",
-            "doc_file_id": file_id or "",
-            "tag_title": tag_title or "",
-        })
-    con.close()
-    files["doc_tags.csv"] = buf.getvalue()
+        with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+            # doc_categories.csv и legacy categories.csv (старый импорт ищет его)
+            for name in ("doc_categories.csv", "categories.csv"):
+                cur.execute(
+                    f"SELECT title, created_at FROM doc_categories c {changed('c')} "
+                    "ORDER BY title COLLATE NOCASE ASC",
+                    params,
+                )
+                rows_total += _backup_write_csv(zf, name, ["title", "created_at"], (
+                    {"title": title or "", "created_at": created_at or ""}
+                    for title, created_at in cur
+                ))
+
+            # docs.csv
+            docs_sql = """
+                SELECT c.title, d.title, d.description, d.file_id, d.file_unique_id, d.mime_type, {local_path}
+                FROM docs d
+                JOIN doc_categories c ON c.id = d.category_id
+                {where}
+                ORDER BY d.id ASC
+            """
+            try:
+                cur.execute(docs_sql.format(local_path="d.local_path", where=changed("d", "c")), params)
+            except sqlite3.OperationalError:
+                cur.execute(docs_sql.format(local_path="''", where=changed("d", "c")), params)
+            rows_total += _backup_write_csv(zf, "docs.csv", [
+                "category_title",
+                "doc_title",
+                "doc_description",
+                "doc_file_id",
+                "doc_file_unique_id",
+                "doc_mime_type",
+                "doc_local_path",
+            ], (
+                {
+                    "category_title": cat_title or "",
+                    "doc_title": doc_title or "",
+                    "doc_description": desc or "",
+                    "doc_file_id": file_id or "",
+                    "doc_file_unique_id": file_unique_id or "",
+                    "doc_mime_type": mime_type or "",
+                    "doc_local_path": local_path or "",
+                }
+                for cat_title, doc_title, desc, file_id, file_unique_id, mime_type, local_path in cur
+            ))
 
-    # doc_collections.csv — подборки и их состав
-    buf = io.StringIO()
-    w = csv.DictWriter(buf, fieldnames=[
-        "collection_title", "collection_description", "position",
-        "doc_title", "category_title", "doc_file_unique_id", "doc_file_id"
-    ])
-    w.writeheader()
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.execute("""
-        SELECT col.title, col.description, i.position, d.title, cat.title, d.file_unique_id, d.file_id
-        FROM doc_collections col
-        LEFT JOIN doc_collection_items i ON i.collection_id=col.id
-        LEFT JOIN docs d ON d.id=i.doc_id
-        LEFT JOIN doc_categories cat ON cat.id=d.category_id
-        ORDER BY col.title COLLATE NOCASE, COALESCE(i.position, 0), d.title COLLATE NOCASE
-    """)
-    for collection_title, description, position, doc_title, cat_title, unique_id, file_id in cur.fetchall():
-        w.writerow({
-            "collection_title": collection_title or "",
-            "collection_description": description or "",
-            "position": position if position is not None else "",
-            "doc_title": doc_title or "",
-            "category_title": cat_title or "",
-            "doc_file_unique_id": unique_id or "",
-            "doc_file_id": file_id or "",
-        })
-    con.close()
-    files["doc_collections.csv"] = buf.getvalue()
+            # doc_tags.csv — связи тегов с документами
+            cur.execute(f"""
+                SELECT d.title, c.title, d.file_unique_id, d.file_id, t.title
+                FROM doc_tag_links l
+                JOIN docs d ON d.id=l.doc_id
+                JOIN doc_categories c ON c.id=d.category_id
+                JOIN doc_tags t ON t.id=l.tag_id
+                {changed('l', 'd', 'c', 't')}
+                ORDER BY t.title COLLATE NOCASE, d.title COLLATE NOCASE
+            """, params)
+            rows_total += _backup_write_csv(zf, "doc_tags.csv", [
+                "doc_title", "category_title", "doc_file_unique_id", "doc_file_id", "tag_title"
+            ], (
+                {
+                    "doc_title": doc_title or "",
+                    "category_title": cat_title or "",
+                    "doc_file_unique_id": unique_id or "",
+                    "doc_file_id": file_id or "",
+                    "tag_title": tag_title or "",
+                }
+                for doc_title, cat_title, unique_id, file_id, tag_title in cur
+            ))
 
-    # profiles.csv
-    buf = io.StringIO()
-    w = csv.DictWriter(buf, fieldnames=[
-        "profile_id",
-        "full_name",
-        "year_start",
-        "city",
-        "birthday",
-        "about",
-        "topics",
-        "interests_json",
-        "tg_link",
-        "tg_user_id",
-        "is_active",
-        "avg_test_score",
-        "photo_file_id",
-    ])
-    w.writeheader()
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.execute("""
-        SELECT id, full_name, year_start, city, birthday, about, topics, interests_json, tg_link,
-               tg_user_id, is_active, avg_test_score, photo_file_id
-        FROM profiles
-        ORDER BY id ASC
-    """)
-    for row in cur.fetchall():
-        w.writerow({
-            "profile_id": row[0],
-            "full_name": row[1] or "",
-            "year_start": row[2] or "",
-            "city": row[3] or "",
-            "birthday": row[4] or "",
-            "about": row[5] or "",
-            "topics": row[6] or "",
-            "interests_json": row[7] or "[]",
-            "tg_link": row[8] or "",
-            "tg_user_id": row[9] if row[9] is not None else "",
-            "is_active": int(row[10]) if row[10] is not None else 1,
-            "avg_test_score": row[11] if row[11] is not None else "",
-            "photo_file_id": row[12] or "",
-        })
-    con.close()
-    files["profiles.csv"] = buf.getvalue()
+            # doc_collections.csv — подборки и их состав
+            cur.execute(f"""
+                SELECT col.title, col.description, i.position, d.title, cat.title, d.file_unique_id, d.file_id
+                FROM doc_collections col
+                LEFT JOIN doc_collection_items i ON i.collection_id=col.id
+                LEFT JOIN docs d ON d.id=i.doc_id
+                LEFT JOIN doc_categories cat ON cat.id=d.category_id
+                {changed('col', 'i', 'd', 'cat')}
+                ORDER BY col.title COLLATE NOCASE, COALESCE(i.position, 0), d.title COLLATE NOCASE
+            """, params)
+            rows_total += _backup_write_csv(zf, "doc_collections.csv", [
+                "collection_title", "collection_description", "position",
+                "doc_title", "category_title", "doc_file_unique_id", "doc_file_id"
+            ], (
+                {
+                    "collection_title": collection_title or "",
+                    "collection_description": description or "",
+                    "position": position if position is not None else "",
+                    "doc_title": doc_title or "",
+                    "category_title": cat_title or "",
+                    "doc_file_unique_id": unique_id or "",
+                    "doc_file_id": file_id or "",
+                }
+                for collection_title, description, position, doc_title, cat_title, unique_id, file_id in cur
+            ))
 
-    # notify_chats.csv
-    buf = io.StringIO()
-    w = csv.DictWriter(buf, fieldnames=["chat_id", "added_at"])
-    w.writeheader()
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.execute("SELECT chat_id, added_at FROM notify_chats ORDER BY chat_id ASC")
-    for row in cur.fetchall():
-        w.writerow({"chat_id": row[0], "added_at": row[1]})
-    con.close()
-    files["notify_chats.csv"] = buf.getvalue()
+            # profiles.csv
+            cur.execute(f"""
+                SELECT id, full_name, year_start, city, birthday, about, topics, interests_json, tg_link,
+                       tg_user_id, is_active, avg_test_score, photo_file_id
+                FROM profiles p
+                {changed('p')}
+                ORDER BY id ASC
+            """, params)
+            rows_total += _backup_write_csv(zf, "profiles.csv", [
+                "profile_id",
+                "full_name",
+                "year_start",
+                "city",
+                "birthday",
+                "about",
+                "topics",
+                "interests_json",
+                "tg_link",
+                "tg_user_id",
+                "is_active",
+                "avg_test_score",
+                "photo_file_id",
+            ], (
+                {
+                    "profile_id": row[0],
+                    "full_name": row[1] or "",
+                    "year_start": row[2] or "",
+                    "city": row[3] or "",
+                    "birthday": row[4] or "",
+                    "about": row[5] or "",
+                    "topics": row[6] or "",
+                    "interests_json": row[7] or "[]",
+                    "tg_link": row[8] or "",
+                    "tg_user_id": row[9] if row[9] is not None else "",
+                    "is_active": int(row[10]) if row[10] is not None else 1,
+                    "avg_test_score": row[11] if row[11] is not None else "",
+                    "photo_file_id": row[12] or "",
+                }
+                for row in cur
+            ))
 
-    # achievements_awards.csv
-    buf = io.StringIO()
-    w = csv.DictWriter(buf, fieldnames=[
-        "award_id",
-        "profile_id",
-        "full_name",
-        "tg_link",
-        "emoji",
-        "title",
-        "description",
-        "awarded_at",
-        "awarded_by",
-        "achievement_key",
-        "level",
-    ])
-    w.writeheader()
-    for r in export_achievement_awards_rows():
-        w.writerow(r)
-    files["achievements_awards.csv"] = buf.getvalue()
+            # notify_chats.csv
+            cur.execute(
+                f"SELECT chat_id, added_at FROM notify_chats n {changed('n')} ORDER BY chat_id ASC",
+                params,
+            )
+            rows_total += _backup_write_csv(zf, "notify_chats.csv", ["chat_id", "added_at"], (
+                {"chat_id": row[0], "added_at": row[1]} for row in cur
+            ))
 
+            # achievements_awards.csv (те же поля, что export_achievement_awards_rows)
+            cur.execute(f"""
+                SELECT a.id, p.id, p.full_name, p.tg_link,
+                       a.emoji, a.title, a.description, a.awarded_at, a.awarded_by,
+                       COALESCE(a.achievement_key, ''), COALESCE(a.level, 1)
+                FROM achievement_awards a
+                JOIN profiles p ON p.id = a.profile_id
+                {changed('a', 'p')}
+                ORDER BY a.id ASC
+            """, params)
+            rows_total += _backup_write_csv(zf, "achievements_awards.csv", [
+                "award_id",
+                "profile_id",
+                "full_name",
+                "tg_link",
+                "emoji",
+                "title",
+                "description",
+                "awarded_at",
+                "awarded_by",
+                "achievement_key",
+                "level",
+            ], (
+                {
+                    "award_id": r[0],
+                    "profile_id": r[1],
+                    "full_name": r[2] or "",
+                    "tg_link": r[3] or "",
+                    "emoji": r[4] or "",
+                    "title": r[5] or "",
+                    "description": r[6] or "",
+                    "awarded_at": r[7] or "",
+                    "awarded_by": r[8] or "",
+                    "achievement_key": r[9] or normalize_achievement_key(r[5] or "Ачивка"),
+                    "level": int(r[10] or 1),
+                }
+                for r in cur
+            ))
 
-    # faq.csv
-    buf = io.StringIO()
-    w = csv.DictWriter(buf, fieldnames=["question", "answer", "created_at"])
-    w.writeheader()
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    try:
-        cur.execute("SELECT question, answer, created_at FROM faq_items ORDER BY id ASC")
-        for question, answer, created_at in cur.fetchall():
-            w.writerow({"question": question or "", "answer": answer or "", "created_at": created_at or ""})
+            # faq.csv
+            cur.execute(
+                f"SELECT question, answer, created_at FROM faq_items f {changed('f')} ORDER BY id ASC",
+                params,
+            )
+            rows_total += _backup_write_csv(zf, "faq.csv", ["question", "answer", "created_at"], (
+                {"question": question or "", "answer": answer or "", "created_at": created_at or ""}
+                for question, answer, created_at in cur
+            ))
     finally:
+        con.rollback()
         con.close()
-    files["faq.csv"] = buf.getvalue()
+    return {"revision": revision, "rows": rows_total, "incremental": incremental}
 
-    zbuf = io.BytesIO()
-    with zipfile.ZipFile(zbuf, "w", compression=zipfile.ZIP_DEFLATED) as zf:
-        for name, content in files.items():
-            zf.writestr(name, content.encode("utf-8-sig"))
-    return zbuf.getvalue()
 
+def export_backup_zip_bytes() -> bytes:
+    """Полный ZIP-бэкап одним bytes (для скриптов); бот отправляет файл из export_backup_zip."""
+    fd, path = tempfile.mkstemp(prefix="backup_", suffix=".zip")
+    os.close(fd)
+    try:
+        export_backup_zip(path)
+        return Path(path).read_bytes()
+    finally:
+        os.unlink(path)
+
+
+# Восстановление из ZIP идёт одной транзакцией на одном соединении: CSV
+# читаются построчно прямо из архива, строки пишутся executemany пачками по
+# RESTORE_BATCH_SIZE, а уже существующие записи ищутся по словарям, которые
+# загружаются один раз. Если CSV таблицы крупный, её вторичные индексы на
+# время загрузки удаляются и строятся заново перед COMMIT: одна сортировка
+# дешевле, чем правка B-дерева на каждой строке. Поисковые индексы документов
+# и FAQ перестраиваются один раз после COMMIT.
+RESTORE_BATCH_SIZE = max(1, int(os.getenv("RESTORE_BATCH_SIZE", "500")))
+RESTORE_DEFER_INDEXES_MIN_BYTES = max(0, int(os.getenv("RESTORE_DEFER_INDEXES_MIN_BYTES", str(1024 * 1024))))
+# Telegram не любит частые правки одного сообщения.
+RESTORE_PROGRESS_INTERVAL_SECONDS = max(1.0, float(os.getenv("RESTORE_PROGRESS_INTERVAL_SECONDS", "3")))
+
+_RESTORE_PROFILE_UPSERT_SQL = """
+    INSERT INTO profiles(
+        id, full_name, year_start, city, birthday, about, topics, interests_json, tg_link,
+        tg_user_id, is_active, avg_test_score, photo_file_id, created_at
+    ) VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(id) DO UPDATE SET
+        full_name=excluded.full_name,
+        year_start=excluded.year_start,
+        city=excluded.city,
+        birthday=excluded.birthday,
+        about=excluded.about,
+        topics=excluded.topics,
+        interests_json=excluded.interests_json,
+        tg_link=excluded.tg_link,
+        tg_user_id=COALESCE(excluded.tg_user_id, profiles.tg_user_id),
+        is_active=excluded.is_active,
+        avg_test_score=excluded.avg_test_score,
+        photo_file_id=COALESCE(excluded.photo_file_id, profiles.photo_file_id)
+"""
+
+
+class _RestoreBatch:
+    """Копит параметры одного запроса и пишет их executemany пачками."""
+
+    def __init__(self, cur: sqlite3.Cursor, sql: str):
+        self.cur = cur
+        self.sql = sql
+        self.rows: list[tuple] = []
+
+    def add(self, params: tuple):
+        self.rows.append(params)
+        if len(self.rows) >= RESTORE_BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.cur.executemany(self.sql, self.rows)
+            self.rows.clear()
+
+
+def _restore_drop_indexes(cur: sqlite3.Cursor, table: str) -> list[str]:
+    """Удаляет неуникальные индексы таблицы и возвращает их CREATE для восстановления."""
+    cur.execute(
+        """
+        SELECT name, sql FROM sqlite_master
+        WHERE type='index' AND tbl_name=? AND sql IS NOT NULL AND sql NOT LIKE 'CREATE UNIQUE%'
+        """,
+        (table,),
+    )
+    found = cur.fetchall()
+    for name, _sql in found:
+        cur.execute(f'DROP INDEX "{name}"')
+    return [sql for _name, sql in found]
 
-def restore_backup_zip_bytes(data: bytes) -> dict:
-    """Восстановление из ZIP бэкапа (CSV). Возвращает статистику по импортированным сущностям."""
+
+def restore_backup_zip(source, progress: dict | None = None) -> dict:
+    """
+    Восстановление из ZIP бэкапа (путь, файл или BytesIO) одной транзакцией.
+    Возвращает статистику по импортированным сущностям; при ошибке база не меняется.
+
+    progress, если передан, обновляется по ходу: stage — текущий CSV,
+    rows — сколько его строк прочитано, done — уже загруженные CSV.
+    """
     stats = {"profiles": 0, "categories": 0, "docs": 0, "doc_tags": 0, "doc_collections": 0, "faq": 0, "notify_chats": 0, "achievements_awards": 0}
-    zbuf = io.BytesIO(data)
-    with zipfile.ZipFile(zbuf, "r") as zf:
-        names = set(zf.namelist())
-
-        # 1) profiles.csv
-        profile_id_map: dict[str, int] = {}
-        if "profiles.csv" in names:
-            raw = zf.read("profiles.csv").decode("utf-8", errors="replace")
-            rdr = csv.DictReader(io.StringIO(raw))
-            con = sqlite3.connect(DB_PATH)
-            cur = con.cursor()
-            for row in rdr:
-                if not row:
-                    continue
-                pid = (row.get("profile_id") or "").strip()
-                full_name = (row.get("full_name") or "").strip()
-                year_start = (row.get("year_start") or "").strip() or "2000"
-                city = (row.get("city") or "").strip()
-                birthday = (row.get("birthday") or "").strip() or None
-                about = (row.get("about") or "").strip()
-                topics = (row.get("topics") or "").strip()
-                interests = _profile_interests_decode((row.get("interests_json") or "[]").strip())
-                tg_link = (row.get("tg_link") or "").strip()
-                photo_file_id = (row.get("photo_file_id") or "").strip() or None
-
-                tg_user_id_raw = (row.get("tg_user_id") or "").strip()
-                tg_user_id = int(tg_user_id_raw) if tg_user_id_raw.lstrip("-").isdigit() else None
-                active_raw = (row.get("is_active") or "1").strip().lower()
-                is_active = 0 if active_raw in ("0", "false", "no", "нет") else 1
-
-                avg_raw = (row.get("avg_test_score") or "").strip()
-                avg_test_score = None
-                if avg_raw:
-                    try:
-                        avg_test_score = int(float(avg_raw))
-                    except Exception:
-                        avg_test_score = None
+    if progress is None:
+        progress = {}
+    progress.update(stage="", rows=0, done=[])
+    now = datetime.utcnow().isoformat()
+    deferred_indexes: list[str] = []
 
-                created_at = datetime.utcnow().isoformat()
+    con = db_connect()
+    cur = con.cursor()
+    try:
+        cur.execute("BEGIN IMMEDIATE")
+        with zipfile.ZipFile(source, "r") as zf:
+            names = set(zf.namelist())
+
+            def csv_rows(name: str):
+                progress.update(stage=name, rows=0)
+                with zf.open(name) as raw:
+                    text = io.TextIOWrapper(raw, encoding="utf-8-sig", errors="replace", newline="")
+                    for row in csv.DictReader(text):
+                        progress["rows"] += 1
+                        yield row
+                if name not in progress["done"]:
+                    progress["done"].append(name)
+
+            def defer_indexes(name: str, table: str):
+                if zf.getinfo(name).file_size >= RESTORE_DEFER_INDEXES_MIN_BYTES:
+                    deferred_indexes.extend(_restore_drop_indexes(cur, table))
+
+            # 1) profiles.csv
+            profile_id_map: dict[str, int] = {}
+            if "profiles.csv" in names:
+                defer_indexes("profiles.csv", "profiles")
+                upserts = _RestoreBatch(cur, _RESTORE_PROFILE_UPSERT_SQL)
+                for row in csv_rows("profiles.csv"):
+                    if not row:
+                        continue
+                    pid = (row.get("profile_id") or "").strip()
+                    full_name = (row.get("full_name") or "").strip()
+                    year_start = (row.get("year_start") or "").strip() or "2000"
+                    city = (row.get("city") or "").strip()
+                    birthday = (row.get("birthday") or "").strip() or None
+                    about = (row.get("about") or "").strip()
+                    topics = (row.get("topics") or "").strip()
+                    interests = _profile_interests_decode((row.get("interests_json") or "[]").strip())
+                    tg_link = (row.get("tg_link") or "").strip()
+                    photo_file_id = (row.get("photo_file_id") or "").strip() or None
+
+                    tg_user_id_raw = (row.get("tg_user_id") or "").strip()
+                    tg_user_id = int(tg_user_id_raw) if tg_user_id_raw.lstrip("-").isdigit() else None
+                    active_raw = (row.get("is_active") or "1").strip().lower()
+                    is_active = 0 if active_raw in ("0", "false", "no", "нет") else 1
+
+                    avg_raw = (row.get("avg_test_score") or "").strip()
+                    avg_test_score = None
+                    if avg_raw:
+                        try:
+                            avg_test_score = int(float(avg_raw))
+                        except Exception:
+                            avg_test_score = None
 
-                # upsert by id if present, else by (tg_link, full_name) heuristic
-                if pid.isdigit():
-                    cur.execute(
-                        """INSERT INTO profiles(
-                               id, full_name, year_start, city, birthday, about, topics, interests_json, tg_link,
-                               tg_user_id, is_active, avg_test_score, photo_file_id, created_at
-                           ) VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                               ON CONFLICT(id) DO UPDATE SET
-                                 full_name=excluded.full_name,
-                                 year_start=excluded.year_start,
-                                 city=excluded.city,
-                                 birthday=excluded.birthday,
-                                 about=excluded.about,
-                                 topics=excluded.topics,
-                                 interests_json=excluded.interests_json,
-                                 tg_link=excluded.tg_link,
-                                 tg_user_id=COALESCE(excluded.tg_user_id, profiles.tg_user_id),
-                                 is_active=excluded.is_active,
-                                 avg_test_score=excluded.avg_test_score,
-                                 photo_file_id=COALESCE(excluded.photo_file_id, profiles.photo_file_id)
-                        """,
-                        (
+                    # upsert by id if present, else by (tg_link, full_name) heuristic
+                    if pid.isdigit():
+                        upserts.add((
                             int(pid), full_name, int(year_start), city, birthday, about, topics,
                             _profile_interests_encode(interests), tg_link, tg_user_id, is_active,
-                            avg_test_score, photo_file_id, created_at,
-                        ),
-                    )
-                    new_id = int(pid)
-                else:
-                    # try find existing by tg_link first
-                    new_id = None
-                    if tg_link:
-                        cur.execute("SELECT id FROM profiles WHERE tg_link=?", (tg_link,))
-                        r = cur.fetchone()
-                        if r:
-                            new_id = int(r[0])
-                    if new_id is None and full_name:
-                        cur.execute("SELECT id FROM profiles WHERE full_name=?", (full_name,))
-                        r = cur.fetchone()
-                        if r:
-                            new_id = int(r[0])
-                    if new_id is None:
-                        cur.execute(
-                            """INSERT INTO profiles(
-                                   full_name, year_start, city, birthday, about, topics, interests_json, tg_link,
-                                   tg_user_id, is_active, avg_test_score, photo_file_id, created_at
-                               ) VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                            """,
-                            (
-                                full_name, int(year_start), city, birthday, about, topics,
-                                _profile_interests_encode(interests), tg_link, tg_user_id, is_active,
-                                avg_test_score, photo_file_id, created_at,
-                            ),
-                        )
-                        new_id = int(cur.lastrowid)
-
-                if pid:
-                    profile_id_map[pid] = new_id
-                stats["profiles"] += 1
-
-            con.commit()
-            con.close()
-
-        # 2) doc_categories.csv (или legacy categories.csv)
-        cat_filename = None
-        if "doc_categories.csv" in names:
-            cat_filename = "doc_categories.csv"
-        elif "categories.csv" in names:
-            cat_filename = "categories.csv"
-
-        if cat_filename:
-            raw = zf.read(cat_filename).decode("utf-8", errors="replace")
-            rdr = csv.DictReader(io.StringIO(raw))
-            con = sqlite3.connect(DB_PATH)
-            cur = con.cursor()
-            for row in rdr:
-                title = (row.get("title") or "").strip()
-                created_at = (row.get("created_at") or "").strip() or datetime.utcnow().isoformat()
-                if not title:
-                    continue
-                cur.execute(
-                    """INSERT INTO doc_categories(title, created_at)
-                           VALUES(?, ?)
-                           ON CONFLICT(title) DO UPDATE SET created_at=excluded.created_at
-                    """,
-                    (title, created_at),
-                )
-                stats["categories"] += 1
-            con.commit()
-            con.close()
+                            avg_test_score, photo_file_id, now,
+                        ))
+                        new_id = int(pid)
+                    else:
+                        # поиск должен видеть уже загруженные строки
+                        upserts.flush()
+                        new_id = None
+                        if tg_link:
+                            cur.execute("SELECT id FROM profiles WHERE tg_link=?", (tg_link,))
+                            r = cur.fetchone()
+                            if r:
+                                new_id = int(r[0])
+                        if new_id is None and full_name:
+                            cur.execute("SELECT id FROM profiles WHERE full_name=?", (full_name,))
+                            r = cur.fetchone()
+                            if r:
+                                new_id = int(r[0])
+                        if new_id is None:
+                            cur.execute(
+                                """INSERT INTO profiles(
+                                       full_name, year_start, city, birthday, about, topics, interests_json, tg_link,
+                                       tg_user_id, is_active, avg_test_score, photo_file_id, created_at
+                                   ) VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                                """,
+                                (
+                                    full_name, int(year_start), city, birthday, about, topics,
+                                    _profile_interests_encode(interests), tg_link, tg_user_id, is_active,
+                                    avg_test_score, photo_file_id, now,
+                                ),
+                            )
+                            new_id = int(cur.lastrowid)
+
+                    if pid:
+                        profile_id_map[pid] = new_id
+                    stats["profiles"] += 1
+                upserts.flush()
+
+            # 2) doc_categories.csv (или legacy categories.csv)
+            category_upsert = _RestoreBatch(
+                cur,
+                """INSERT INTO doc_categories(title, created_at)
+                       VALUES(?, ?)
+                       ON CONFLICT(title) DO UPDATE SET created_at=excluded.created_at
+                """,
+            )
+            cat_filename = None
+            if "doc_categories.csv" in names:
+                cat_filename = "doc_categories.csv"
+            elif "categories.csv" in names:
+                cat_filename = "categories.csv"
+
+            if cat_filename:
+                for row in csv_rows(cat_filename):
+                    title = (row.get("title") or "").strip()
+                    created_at = (row.get("created_at") or "").strip() or now
+                    if not title:
+                        continue
+                    category_upsert.add((title, created_at))
+                    stats["categories"] += 1
+                category_upsert.flush()
 
-        # Если файл категорий отсутствует/пустой — попробуем восстановить категории из docs.csv
-        # (на случай, если в старом бэкапе категории не выгружались отдельным файлом).
-        if stats.get("categories", 0) == 0 and "docs.csv" in names:
-            try:
-                raw_docs = zf.read("docs.csv").decode("utf-8", errors="replace")
-                rdr_docs = csv.DictReader(io.StringIO(raw_docs))
-                titles = []
+            # Если файл категорий отсутствует/пустой — восстановим категории из docs.csv
+            # (на случай, если в старом бэкапе категории не выгружались отдельным файлом).
+            if stats["categories"] == 0 and "docs.csv" in names:
                 seen = set()
-                for row in rdr_docs:
+                for row in csv_rows("docs.csv"):
                     t = (row.get("category_title") or row.get("category") or "").strip()
-                    if not t:
+                    if not t or t.casefold() in seen:
                         continue
-                    key = t.casefold()
-                    if key in seen:
-                        continue
-                    seen.add(key)
-                    titles.append(t)
-                if titles:
-                    con = sqlite3.connect(DB_PATH)
-                    cur = con.cursor()
-                    for t in titles:
-                        cur.execute(
-                            "INSERT INTO doc_categories(title, created_at) VALUES(?, ?) ON CONFLICT(title) DO UPDATE SET created_at=excluded.created_at",
-                            (t, datetime.utcnow().isoformat()),
-                        )
-                        stats["categories"] += 1
-                    con.commit()
-                    con.close()
-            except Exception:
-                # не критично — продолжим восстановление документов
-                pass
-
-        # helper: get category_id by title (create if missing)
-        def _ensure_category(title: str) -> int:
-            con = sqlite3.connect(DB_PATH)
-            cur = con.cursor()
-            cur.execute("SELECT id FROM doc_categories WHERE title=?", (title,))
-            r = cur.fetchone()
-            if r:
-                con.close()
-                return int(r[0])
-            cur.execute("INSERT INTO doc_categories(title, created_at) VALUES(?, ?)", (title, datetime.utcnow().isoformat()))
-            con.commit()
-            cid = int(cur.lastrowid)
-            con.close()
-            return cid
-
-        # 3) docs.csv (by category_title)
-        if "docs.csv" in names:
-            raw = zf.read("docs.csv").decode("utf-8", errors="replace")
-            rdr = csv.DictReader(io.StringIO(raw))
-            con = sqlite3.connect(DB_PATH)
-            cur = con.cursor()
-            for row in rdr:
-                cat_title = (row.get("category_title") or "").strip() or "Без категории"
-                doc_title = (row.get("doc_title") or "").strip() or "Документ"
-                doc_desc = (row.get("doc_description") or "").strip() or None
-                file_id = (row.get("doc_file_id") or "").strip()
-                file_unique_id = (row.get("doc_file_unique_id") or "").strip() or None
-                mime_type = (row.get("doc_mime_type") or "").strip() or None
-                if not file_id:
-                    continue
-                cid = _ensure_category(cat_title)
-                # вставляем как новый, но избегаем дублей по (category_id, title, file_id)
-                cur.execute(
-                    """SELECT id FROM docs WHERE category_id=? AND title=? AND file_id=?""",
-                    (cid, doc_title, file_id),
-                )
-                if cur.fetchone():
-                    continue
-                cur.execute(
+                    seen.add(t.casefold())
+                    category_upsert.add((t, now))
+                    stats["categories"] += 1
+                category_upsert.flush()
+
+            cur.execute("SELECT id, title FROM doc_categories")
+            category_ids = {title: int(cid) for cid, title in cur.fetchall()}
+
+            # get category_id by title (create if missing)
+            def ensure_category(title: str) -> int:
+                cid = category_ids.get(title)
+                if cid is None:
+                    cur.execute("INSERT INTO doc_categories(title, created_at) VALUES(?, ?)", (title, now))
+                    cid = category_ids[title] = int(cur.lastrowid)
+                return cid
+
+            # 3) docs.csv (by category_title)
+            if "docs.csv" in names:
+                defer_indexes("docs.csv", "docs")
+                cur.execute("SELECT category_id, title, file_id FROM docs")
+                existing_docs = set(cur.fetchall())
+                doc_insert = _RestoreBatch(
+                    cur,
                     """INSERT INTO docs(category_id, title, description, file_id, file_unique_id, mime_type, uploaded_at)
                            VALUES (?, ?, ?, ?, ?, ?, ?)""",
-                    (cid, doc_title, doc_desc, file_id, file_unique_id, mime_type, datetime.utcnow().isoformat()),
                 )
-                stats["docs"] += 1
-            con.commit()
-            con.close()
+                for row in csv_rows("docs.csv"):
+                    cat_title = (row.get("category_title") or "").strip() or "Без категории"
+                    doc_title = (row.get("doc_title") or "").strip() or "Документ"
+                    doc_desc = (row.get("doc_description") or "").strip() or None
+                    file_id = (row.get("doc_file_id") or "").strip()
+                    file_unique_id = (row.get("doc_file_unique_id") or "").strip() or None
+                    mime_type = (row.get("doc_mime_type") or "").strip() or None
+                    if not file_id:
+                        continue
+                    cid = ensure_category(cat_title)
+                    # вставляем как новый, но избегаем дублей по (category_id, title, file_id)
+                    key = (cid, doc_title, file_id)
+                    if key in existing_docs:
+                        continue
+                    existing_docs.add(key)
+                    doc_insert.add((cid, doc_title, doc_desc, file_id, file_unique_id, mime_type, now))
+                    stats["docs"] += 1
+                doc_insert.flush()
 
-        def _find_restored_doc_id(row: dict) -> int | None:
-            unique_id = (row.get("doc_file_unique_id") or "").strip()
-            file_id = (row.get("doc_file_id") or "").strip()
-            doc_title = (row.get("doc_title") or "").strip()
-            cat_title = (row.get("category_title") or "").strip()
-            con = sqlite3.connect(DB_PATH)
-            cur = con.cursor()
-            found = None
-            if unique_id:
-                cur.execute("SELECT id FROM docs WHERE file_unique_id=? ORDER BY id DESC LIMIT 1", (unique_id,))
-                r = cur.fetchone()
-                if r:
-                    found = int(r[0])
-            if found is None and file_id:
-                cur.execute("SELECT id FROM docs WHERE file_id=? ORDER BY id DESC LIMIT 1", (file_id,))
-                r = cur.fetchone()
-                if r:
-                    found = int(r[0])
-            if found is None and doc_title and cat_title:
-                cur.execute(
-                    """SELECT d.id FROM docs d JOIN doc_categories c ON c.id=d.category_id
-                       WHERE d.title=? AND c.title=? ORDER BY d.id DESC LIMIT 1""",
-                    (doc_title, cat_title),
-                )
-                r = cur.fetchone()
-                if r:
-                    found = int(r[0])
-            con.close()
-            return found
+            doc_lookup: dict[str, dict] = {}
 
-        # 4) теги документов
-        if "doc_tags.csv" in names:
-            raw = zf.read("doc_tags.csv").decode("utf-8-sig", errors="ignore")
-            reader = csv.DictReader(io.StringIO(raw))
-            con = sqlite3.connect(DB_PATH)
-            cur = con.cursor()
-            for row in reader:
-                tag_title = (row.get("tag_title") or "").strip().lstrip("#")
-                doc_id = _find_restored_doc_id(row)
-                if not tag_title or not doc_id:
-                    continue
-                cur.execute(
-                    "INSERT INTO doc_tags(title, created_at) VALUES(?, ?) ON CONFLICT(title) DO NOTHING",
-                    (tag_title[:50], datetime.utcnow().isoformat()),
-                )
-                cur.execute("SELECT id FROM doc_tags WHERE title=? COLLATE NOCASE", (tag_title[:50],))
-                tag_row = cur.fetchone()
-                if tag_row:
+            def find_restored_doc_id(row: dict) -> int | None:
+                if not doc_lookup:
+                    doc_lookup.update(unique={}, file={}, title={})
                     cur.execute(
-                        "INSERT OR IGNORE INTO doc_tag_links(doc_id, tag_id) VALUES(?, ?)",
-                        (int(doc_id), int(tag_row[0])),
+                        """SELECT d.id, d.file_unique_id, d.file_id, d.title, c.title
+                           FROM docs d LEFT JOIN doc_categories c ON c.id=d.category_id
+                           ORDER BY d.id DESC"""
                     )
-                    stats["doc_tags"] += 1
-            con.commit()
-            con.close()
-
-        # 5) подборки документов
-        if "doc_collections.csv" in names:
-            raw = zf.read("doc_collections.csv").decode("utf-8-sig", errors="ignore")
-            reader = csv.DictReader(io.StringIO(raw))
-            con = sqlite3.connect(DB_PATH)
-            cur = con.cursor()
-            restored_collections = set()
-            for row in reader:
-                title = (row.get("collection_title") or "").strip()
-                description = (row.get("collection_description") or "").strip() or None
-                if not title:
-                    continue
-                cur.execute(
-                    """INSERT INTO doc_collections(title, description, created_at) VALUES(?, ?, ?)
-                       ON CONFLICT(title) DO UPDATE SET description=excluded.description""",
-                    (title[:80], description, datetime.utcnow().isoformat()),
+                    for doc_id, unique_id, file_id, doc_title, cat_title in cur.fetchall():
+                        if unique_id:
+                            doc_lookup["unique"].setdefault(unique_id, int(doc_id))
+                        if file_id:
+                            doc_lookup["file"].setdefault(file_id, int(doc_id))
+                        if doc_title and cat_title:
+                            doc_lookup["title"].setdefault((doc_title, cat_title), int(doc_id))
+                unique_id = (row.get("doc_file_unique_id") or "").strip()
+                file_id = (row.get("doc_file_id") or "").strip()
+                doc_title = (row.get("doc_title") or "").strip()
+                cat_title = (row.get("category_title") or "").strip()
+                found = doc_lookup["unique"].get(unique_id) if unique_id else None
+                if found is None and file_id:
+                    found = doc_lookup["file"].get(file_id)
+                if found is None and doc_title and cat_title:
+                    found = doc_lookup["title"].get((doc_title, cat_title))
+                return found
+
+            # 4) теги документов
+            if "doc_tags.csv" in names:
+                tag_ids: dict[str, int | None] = {}
+                link_insert = _RestoreBatch(cur, "INSERT OR IGNORE INTO doc_tag_links(doc_id, tag_id) VALUES(?, ?)")
+                for row in csv_rows("doc_tags.csv"):
+                    tag_title = (row.get("tag_title") or "").strip().lstrip("#")[:50]
+                    doc_id = find_restored_doc_id(row)
+                    if not tag_title or not doc_id:
+                        continue
+                    if tag_title not in tag_ids:
+                        cur.execute(
+                            "INSERT INTO doc_tags(title, created_at) VALUES(?, ?) ON CONFLICT(title) DO NOTHING",
+                            (tag_title, now),
+                        )
+                        cur.execute("SELECT id FROM doc_tags WHERE title=? COLLATE NOCASE", (tag_title,))
+                        tag_row = cur.fetchone()
+                        tag_ids[tag_title] = int(tag_row[0]) if tag_row else None
+                    if tag_ids[tag_title]:
+                        link_insert.add((int(doc_id), tag_ids[tag_title]))
+                        stats["doc_tags"] += 1
+                link_insert.flush()
+
+            # 5) подборки документов
+            if "doc_collections.csv" in names:
+                collections: dict[str, tuple[int, str | None]] = {}
+                item_insert = _RestoreBatch(
+                    cur,
+                    "INSERT OR IGNORE INTO doc_collection_items(collection_id, doc_id, position) VALUES(?, ?, ?)",
+                )
+                restored_collections = set()
+                for row in csv_rows("doc_collections.csv"):
+                    title = (row.get("collection_title") or "").strip()[:80]
+                    description = (row.get("collection_description") or "").strip() or None
+                    if not title:
+                        continue
+                    known = collections.get(title)
+                    if known is None or known[1] != description:
+                        cur.execute(
+                            """INSERT INTO doc_collections(title, description, created_at) VALUES(?, ?, ?)
+                               ON CONFLICT(title) DO UPDATE SET description=excluded.description""",
+                            (title, description, now),
+                        )
+                        cur.execute("SELECT id FROM doc_collections WHERE title=? COLLATE NOCASE", (title,))
+                        collection_row = cur.fetchone()
+                        if not collection_row:
+                            continue
+                        known = collections[title] = (int(collection_row[0]), description)
+                    collection_id = known[0]
+                    restored_collections.add(collection_id)
+                    doc_id = find_restored_doc_id(row)
+                    if doc_id:
+                        try:
+                            position = int(row.get("position") or 0)
+                        except Exception:
+                            position = 0
+                        item_insert.add((collection_id, int(doc_id), position))
+                item_insert.flush()
+                stats["doc_collections"] += len(restored_collections)
+
+            # 6) faq.csv — upsert по question, как db_faq_upsert
+            if "faq.csv" in names:
+                cur.execute("SELECT id, question FROM faq_items ORDER BY id DESC")
+                faq_ids = {question: int(fid) for fid, question in cur.fetchall()}
+                faq_update = _RestoreBatch(cur, "UPDATE faq_items SET answer=? WHERE id=?")
+                faq_new: dict[str, str] = {}
+                for row in csv_rows("faq.csv"):
+                    q = (row.get("question") or "").strip()
+                    a = (row.get("answer") or "").strip()
+                    if not q or not a:
+                        continue
+                    if q in faq_ids:
+                        faq_update.add((a, faq_ids[q]))
+                    else:
+                        faq_new[q] = a
+                    stats["faq"] += 1
+                faq_update.flush()
+                cur.executemany(
+                    "INSERT INTO faq_items(question, answer, created_at) VALUES(?, ?, ?)",
+                    [(q, a, now) for q, a in faq_new.items()],
                 )
-                cur.execute("SELECT id FROM doc_collections WHERE title=? COLLATE NOCASE", (title[:80],))
-                collection_row = cur.fetchone()
-                if not collection_row:
-                    continue
-                collection_id = int(collection_row[0])
-                restored_collections.add(collection_id)
-                doc_id = _find_restored_doc_id(row)
-                if doc_id:
-                    try:
-                        position = int(row.get("position") or 0)
-                    except Exception:
-                        position = 0
-                    cur.execute(
-                        "INSERT OR IGNORE INTO doc_collection_items(collection_id, doc_id, position) VALUES(?, ?, ?)",
-                        (collection_id, int(doc_id), position),
-                    )
-            stats["doc_collections"] += len(restored_collections)
-            con.commit()
-            con.close()
 
-                # 6) faq.csv
-        if "faq.csv" in names:
-            raw = zf.read("faq.csv").decode("utf-8-sig", errors="ignore")
-            reader = csv.DictReader(io.StringIO(raw))
-            for row in reader:
-                q = (row.get("question") or "").strip()
-                a = (row.get("answer") or "").strip()
-                if not q or not a:
-                    continue
-                db_faq_upsert(q, a)
-                stats["faq"] += 1
-
-# 4) notify_chats.csv
-        if "notify_chats.csv" in names:
-            raw = zf.read("notify_chats.csv").decode("utf-8", errors="replace")
-            rdr = csv.DictReader(io.StringIO(raw))
-            con = sqlite3.connect(DB_PATH)
-            cur = con.cursor()
-            for row in rdr:
-                chat_id = (row.get("chat_id") or "").strip()
-                added_at = (row.get("added_at") or "").strip() or datetime.utcnow().isoformat()
-                if not chat_id:
-                    continue
-                try:
-                    cid = int(chat_id)
-                except Exception:
-                    continue
-                cur.execute(
+            # 7) notify_chats.csv
+            if "notify_chats.csv" in names:
+                chat_upsert = _RestoreBatch(
+                    cur,
                     """INSERT INTO notify_chats(chat_id, added_at)
                            VALUES(?, ?)
                            ON CONFLICT(chat_id) DO UPDATE SET added_at=excluded.added_at""",
-                    (cid, added_at),
                 )
-                stats["notify_chats"] += 1
-            con.commit()
-            con.close()
-
-        # 5) achievements_awards.csv
-        if "achievements_awards.csv" in names:
-            raw = zf.read("achievements_awards.csv").decode("utf-8", errors="replace")
-            rdr = csv.DictReader(io.StringIO(raw))
-            con = sqlite3.connect(DB_PATH)
-            cur = con.cursor()
-            for row in rdr:
-                pid_old = (row.get("profile_id") or "").strip()
-                full_name = (row.get("full_name") or "").strip()
-                tg_link = (row.get("tg_link") or "").strip()
-                emoji = (row.get("emoji") or "🏆").strip()
-                title = (row.get("title") or "Ачивка").strip()
-                description = (row.get("description") or "").strip()
-                awarded_at = (row.get("awarded_at") or "").strip() or datetime.utcnow().isoformat()
-                awarded_by = (row.get("awarded_by") or "").strip()
-                awarded_by_val = int(awarded_by) if awarded_by.isdigit() else None
-                achievement_key = (row.get("achievement_key") or normalize_achievement_key(title)).strip()
-                try:
-                    level = max(1, int(row.get("level") or 1))
-                except (TypeError, ValueError):
-                    level = 1
-
-                target_pid = None
-                if pid_old and pid_old in profile_id_map:
-                    target_pid = profile_id_map[pid_old]
-                elif pid_old.isdigit():
-                    target_pid = int(pid_old)
-                else:
-                    # fallback: by tg_link or full_name
-                    if tg_link:
-                        cur.execute("SELECT id FROM profiles WHERE tg_link=?", (tg_link,))
-                        r = cur.fetchone()
-                        if r:
-                            target_pid = int(r[0])
-                    if target_pid is None and full_name:
-                        cur.execute("SELECT id FROM profiles WHERE full_name=?", (full_name,))
-                        r = cur.fetchone()
-                        if r:
-                            target_pid = int(r[0])
-
-                if not target_pid:
-                    continue
-
-                # avoid duplicate exact same award
-                cur.execute(
-                    """SELECT id FROM achievement_awards
-                           WHERE profile_id=? AND emoji=? AND title=? AND description=?""",
-                    (int(target_pid), emoji, title, description),
-                )
-                if cur.fetchone():
-                    continue
-
-                cur.execute(
+                for row in csv_rows("notify_chats.csv"):
+                    chat_id = (row.get("chat_id") or "").strip()
+                    added_at = (row.get("added_at") or "").strip() or now
+                    if not chat_id:
+                        continue
+                    try:
+                        cid = int(chat_id)
+                    except Exception:
+                        continue
+                    chat_upsert.add((cid, added_at))
+                    stats["notify_chats"] += 1
+                chat_upsert.flush()
+
+            # 8) achievements_awards.csv
+            if "achievements_awards.csv" in names:
+                cur.execute("SELECT profile_id, emoji, title, description FROM achievement_awards")
+                existing_awards = set(cur.fetchall())
+                award_insert = _RestoreBatch(
+                    cur,
                     """INSERT INTO achievement_awards(
                            profile_id, emoji, title, description, awarded_at, awarded_by,
                            achievement_key, level
                        ) VALUES(?, ?, ?, ?, ?, ?, ?, ?)""",
-                    (
+                )
+                for row in csv_rows("achievements_awards.csv"):
+                    pid_old = (row.get("profile_id") or "").strip()
+                    full_name = (row.get("full_name") or "").strip()
+                    tg_link = (row.get("tg_link") or "").strip()
+                    emoji = (row.get("emoji") or "🏆").strip()
+                    title = (row.get("title") or "Ачивка").strip()
+                    description = (row.get("description") or "").strip()
+                    awarded_at = (row.get("awarded_at") or "").strip() or now
+                    awarded_by = (row.get("awarded_by") or "").strip()
+                    awarded_by_val = int(awarded_by) if awarded_by.isdigit() else None
+                    achievement_key = (row.get("achievement_key") or normalize_achievement_key(title)).strip()
+                    try:
+                        level = max(1, int(row.get("level") or 1))
+                    except (TypeError, ValueError):
+                        level = 1
+
+                    target_pid = None
+                    if pid_old and pid_old in profile_id_map:
+                        target_pid = profile_id_map[pid_old]
+                    elif pid_old.isdigit():
+                        target_pid = int(pid_old)
+                    else:
+                        # fallback: by tg_link or full_name
+                        if tg_link:
+                            cur.execute("SELECT id FROM profiles WHERE tg_link=?", (tg_link,))
+                            r = cur.fetchone()
+                            if r:
+                                target_pid = int(r[0])
+                        if target_pid is None and full_name:
+                            cur.execute("SELECT id FROM profiles WHERE full_name=?", (full_name,))
+                            r = cur.fetchone()
+                            if r:
+                                target_pid = int(r[0])
+
+                    if not target_pid:
+                        continue
+
+                    # avoid duplicate exact same award
+                    key = (int(target_pid), emoji, title, description)
+                    if key in existing_awards:
+                        continue
+                    existing_awards.add(key)
+                    award_insert.add((
                         int(target_pid), emoji, title, description, awarded_at, awarded_by_val,
                         achievement_key, level,
-                    ),
-                )
-                stats["achievements_awards"] += 1
+                    ))
+                    stats["achievements_awards"] += 1
+                award_insert.flush()
 
-            con.commit()
-            con.close()
+        progress.update(stage="indexes", rows=0)
+        for sql in deferred_indexes:
+            cur.execute(sql)
+        con.commit()
+    except BaseException:
+        con.rollback()
+        raise
+    finally:
+        con.close()
 
+    if stats["docs"] or stats["categories"] or stats["doc_tags"]:
+        db_docs_fts_rebuild()
+    if stats["faq"]:
+        FAQ_LAYOUT_CACHE.clear()
+        if FAQ_SEARCH_INDEX.loaded:
+            FAQ_SEARCH_INDEX.rebuild(_faq_search_index_load())
     return stats
 
+
+def restore_backup_zip_bytes(data: bytes) -> dict:
+    """Восстановление из ZIP бэкапа (CSV), переданного целиком в памяти."""
+    return restore_backup_zip(io.BytesIO(data))
+
+
+def format_restore_progress(progress: dict) -> str:
+    lines = ["⏳ <b>Восстанавливаю бэкап…</b>", ""]
+    lines += [f"✅ {escape(name)}" for name in progress.get("done", [])]
+    stage = progress.get("stage")
+    if stage == "indexes":
+        lines.append("🔧 Перестраиваю индексы")
+    elif stage and stage not in progress.get("done", []):
+        lines.append(f"▶️ {escape(stage)}: {int(progress.get('rows') or 0)} строк")
+    return "\n".join(lines)
+
 def export_backup_csv_bytes() -> bytes:
     """
     Собирает CSV-бэкап (категории/документы/анкеты) и возвращает как bytes (UTF-8).
@@ -10672,7 +12992,7 @@ def export_backup_csv_bytes() -> bytes:
         })
 
     # docs
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     # local_path колонка может отсутствовать в старых БД — попробуем мягко
     try:
@@ -10713,7 +13033,7 @@ def export_backup_csv_bytes() -> bytes:
         })
 
     # profiles
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("""
         SELECT full_name, year_start, city, birthday, about, topics, interests_json, tg_link
@@ -10780,7 +13100,7 @@ async def cmd_export_csv(update: Update, context: ContextTypes.DEFAULT_TYPE):
         })
 
     # docs
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("""
         SELECT c.title, d.title, d.description, d.file_id, d.file_unique_id, d.mime_type, d.local_path
@@ -10802,7 +13122,7 @@ async def cmd_export_csv(update: Update, context: ContextTypes.DEFAULT_TYPE):
     con.close()
 
     # profiles
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute("""
         SELECT id, full_name, year_start, city, birthday, about, topics, interests_json, tg_link, avg_test_score
@@ -11107,7 +13427,7 @@ async def cb_test(update: Update, context: ContextTypes.DEFAULT_TYPE):
         a = db_test_get_assignment(aid)
         if not a:
             return
-        user_profile = get_profile_for_user(update)
+        user_profile = await profile_for_user(update)
         if not user_profile or int(a.get("profile_id") or 0) != int(user_profile["id"]):
             await q.answer("Этот тест назначен другому сотруднику.", show_alert=True)
             return
@@ -11256,18 +13576,25 @@ async def cb_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     if data == "help:main":
         bot_username = (context.bot.username or "blablabird_bot")
-        profile = get_profile_for_user(update)
-        unread_count = db_notifications_unread_count(update.effective_user.id if update.effective_user else None)
+        profile = await profile_for_user(update)
+        dashboard = await user_dashboard(
+            update.effective_user.id if update.effective_user else None,
+            profile["id"] if profile else None,
+        )
+        unread_count = dashboard["unread_count"]
+        text = await db.call(
+            help_text_main,
+            bot_username,
+            profile=profile,
+            unread_count=unread_count,
+            is_admin_user=is_adm,
+            user_full_name=(update.effective_user.full_name if update.effective_user else None),
+            dashboard=dashboard,
+        )
         await replace_callback_message_with_text(
             q,
             context,
-            help_text_main(
-                bot_username,
-                profile=profile,
-                unread_count=unread_count,
-                is_admin_user=is_adm,
-                user_full_name=(update.effective_user.full_name if update.effective_user else None),
-            ),
+            text,
             parse_mode=ParseMode.HTML,
             reply_markup=kb_help_main(is_admin_user=is_adm, unread_count=unread_count),
             disable_web_page_preview=True,
@@ -11310,14 +13637,14 @@ async def cb_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 page = int(data.rsplit(":", 1)[-1])
             except ValueError:
                 page = 0
-        unread = db_notifications_unread_count(user_id)
+        unread = await db.call(db_notifications_unread_count, user_id)
         await q.edit_message_text(
             "🔔 <b>Новые уведомления</b>\n\n"
             f"Непрочитанных: <b>{unread}</b>\n"
             "Здесь показываются только непрочитанные уведомления. "
             "После открытия уведомление отмечается прочитанным и исчезает из списка.",
             parse_mode=ParseMode.HTML,
-            reply_markup=kb_notifications(user_id, page),
+            reply_markup=await db.call(kb_notifications, user_id, page),
         )
         return
 
@@ -11332,11 +13659,11 @@ async def cb_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except (IndexError, ValueError):
             await q.answer("Уведомление не найдено.", show_alert=True)
             return
-        item = db_notification_get(notification_id, user_id)
+        item = await db.call(db_notification_get, notification_id, user_id)
         if not item:
             await q.answer("Уведомление не найдено.", show_alert=True)
             return
-        db_notification_mark_read(notification_id, user_id)
+        await db.write(db_notification_mark_read, notification_id, user_id)
         rows = []
         callback_data = (item.get("callback_data") or "").strip()
         # Старые записи центра уведомлений вели напрямую в `test:start`.
@@ -11348,7 +13675,7 @@ async def cb_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 legacy_aid = int(callback_data.rsplit(":", 1)[-1])
             except (TypeError, ValueError):
                 legacy_aid = 0
-            legacy_assignment = db_test_get_assignment(legacy_aid) if legacy_aid else None
+            legacy_assignment = await db.call(db_test_get_assignment, legacy_aid) if legacy_aid else None
             callback_data = (
                 f"help:testv2:myopen:{legacy_aid}"
                 if legacy_assignment
@@ -11472,7 +13799,7 @@ async def cb_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # ---------------- Мой кабинет ----------------
     if data == "help:me":
-        profile = get_profile_for_user(update)
+        profile = await profile_for_user(update)
         if not profile:
             can_create = await can_create_own_profile(update, context)
             await q.edit_message_text(
@@ -11484,15 +13811,15 @@ async def cb_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
         await q.edit_message_text(
-            build_my_account_text(profile),
+            await db.call(build_my_account_text, profile),
             parse_mode=ParseMode.HTML,
-            reply_markup=kb_my_account(profile),
+            reply_markup=await db.call(kb_my_account, profile),
             disable_web_page_preview=True,
         )
         return
 
     if data == "help:me:edit":
-        profile = get_profile_for_user(update)
+        profile = await profile_for_user(update)
         if not profile:
             await q.answer("Ваша анкета не найдена.", show_alert=True)
             return
@@ -11507,7 +13834,7 @@ async def cb_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if data.startswith("help:me:edit:"):
-        profile = get_profile_for_user(update)
+        profile = await profile_for_user(update)
         if not profile:
             await q.answer("Ваша анкета не найдена.", show_alert=True)
             return
@@ -11567,7 +13894,7 @@ async def cb_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     if data == "help:me:achievements":
-        profile = get_profile_for_user(update)
+        profile = await profile_for_user(update)
         if not profile:
             await q.answer("Анкета не найдена.", show_alert=True)
             return
@@ -11588,7 +13915,7 @@ async def cb_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if data == "help:me:tests":
-        profile = get_profile_for_user(update)
+        profile = await profile_for_user(update)
         if not profile:
             await q.answer("Анкета не найдена.", show_alert=True)
             return
@@ -11609,7 +13936,7 @@ async def cb_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if data.startswith("help:me:test:continue:"):
-        profile = get_profile_for_user(update)
+        profile = await profile_for_user(update)
         if not profile:
             await q.answer("Анкета не найдена.", show_alert=True)
             return
@@ -11653,7 +13980,7 @@ async def cb_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if data == "help:nomination:start" or data.startswith("help:nomination:page:"):
-        profile = get_profile_for_user(update)
+        profile = await profile_for_user(update)
         if not profile:
             await q.edit_message_text(
                 "🙌 <b>Номинация</b>\n\n"
@@ -11691,7 +14018,7 @@ async def cb_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except (IndexError, ValueError):
             await q.answer("Не удалось выбрать сотрудника.", show_alert=True)
             return
-        profile = get_profile_for_user(update)
+        profile = await profile_for_user(update)
         nominee = db_profiles_get(nominee_id)
         if not profile or not nominee or int(profile["id"]) == nominee_id:
             await q.answer("Нельзя выбрать эту анкету.", show_alert=True)
@@ -11940,17 +14267,21 @@ async def cb_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await q.edit_message_text(
             "📂 <b>Все документы</b>\n\nВыберите категорию:",
             parse_mode=ParseMode.HTML,
-            reply_markup=kb_help_docs_categories(),
+            reply_markup=await db.call(kb_help_docs_categories),
         )
         return
 
     if data.startswith("help:docs:cat:"):
         cid = int(data.split(":")[-1])
-        cats = dict(db_docs_list_categories())
+        cats = dict(await db.call(db_docs_list_categories))
         title = cats.get(cid, "Категория")
         context.user_data[DOCS_RETURN_CB] = f"help:docs:cat:{cid}"
         text = f"📂 <b>{escape(title)}</b>\n\nВыберите документ:"
-        await q.edit_message_text(text, parse_mode=ParseMode.HTML, reply_markup=kb_help_docs_files(cid))
+        await q.edit_message_text(
+            text,
+            parse_mode=ParseMode.HTML,
+            reply_markup=await db.call(kb_help_docs_files, cid),
+        )
         return
 
     if data.startswith("help:docs:search:tag:"):
@@ -11969,7 +14300,9 @@ async def cb_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
             filters_state={"tag_id": tag_id, "tag_title": tag["title"]},
             page=0,
         )
-        search_text, search_keyboard = build_docs_search_results(context, 0)
+        search_text, search_keyboard = await build_docs_search_results(
+            context, 0, update.effective_user.id if update.effective_user else None,
+        )
         await q.edit_message_text(
             search_text,
             parse_mode=ParseMode.HTML,
@@ -11982,7 +14315,9 @@ async def cb_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
             page = max(0, int(data.rsplit(":", 1)[-1]))
         except (TypeError, ValueError):
             page = 0
-        search_text, search_keyboard = build_docs_search_results(context, page)
+        search_text, search_keyboard = await build_docs_search_results(
+            context, page, update.effective_user.id if update.effective_user else None,
+        )
         await q.edit_message_text(
             search_text,
             parse_mode=ParseMode.HTML,
@@ -12073,7 +14408,7 @@ async def cb_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
         category = db_docs_get_category(int(doc["category_id"])) or {"title": "Без категории"}
         doc["category_title"] = category["title"]
         try:
-            con = sqlite3.connect(DB_PATH)
+            con = db_connect()
             cur = con.cursor()
             cur.execute("SELECT uploaded_at, COALESCE(updated_at, uploaded_at) FROM docs WHERE id=?", (doc_id,))
             date_row = cur.fetchone()
@@ -12313,6 +14648,8 @@ async def cb_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if data.startswith("help:docs:admin:delete:confirm:"):
             doc_id = int(data.split(":")[-1])
             ok = db_docs_delete_doc(doc_id)
+            if ok:
+                DOC_INDEXER.cancel(doc_id)
             await q.edit_message_text(
                 "✅ Документ удалён." if ok else "⚠️ Документ уже отсутствует.",
                 reply_markup=kb_help_docs_main(True),
@@ -12477,7 +14814,7 @@ async def cb_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
             except (TypeError, ValueError):
                 page = 0
 
-        people_count = len(db_profiles_list())
+        people_count = len(await db.call(db_profiles_list))
         page = _team_clamp_page(page, people_count)
         total_pages = _team_total_pages(people_count)
 
@@ -12495,7 +14832,8 @@ async def cb_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
             context,
             text,
             parse_mode=ParseMode.HTML,
-            reply_markup=kb_help_team(
+            reply_markup=await db.call(
+                kb_help_team,
                 page=page,
                 can_create_profile=await can_create_own_profile(update, context),
             ),
@@ -12510,7 +14848,7 @@ async def cb_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except (IndexError, TypeError, ValueError):
             await q.answer("Не удалось открыть совпадения.", show_alert=True)
             return
-        own_profile = get_profile_for_user(update)
+        own_profile = await profile_for_user(update)
         colleague = db_profiles_get(pid)
         shared = profile_shared_interests(own_profile, colleague)
         if not own_profile or not colleague or not shared:
@@ -12561,7 +14899,7 @@ async def cb_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except (IndexError, TypeError, ValueError):
             await q.answer("Не удалось открыть интересы.", show_alert=True)
             return
-        own_profile = get_profile_for_user(update)
+        own_profile = await profile_for_user(update)
         colleague = db_profiles_get(pid)
         shared = profile_shared_interests(own_profile, colleague)
         if not own_profile or not colleague or not shared:
@@ -12632,7 +14970,7 @@ async def cb_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except (TypeError, ValueError):
             page = 0
 
-        own_profile = get_profile_for_user(update)
+        own_profile = await profile_for_user(update)
         if not own_profile:
             await replace_callback_message_with_text(
                 q,
@@ -12663,7 +15001,7 @@ async def cb_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         all_matches = db_profiles_with_shared_interests(int(own_profile["id"]))
-        matches = filter_shared_interest_matches(all_matches, interest_key)
+        matches = db_profiles_with_shared_interests(int(own_profile["id"]), interest_key)
         if not matches:
             if interest_key in PROFILE_INTEREST_KEYS:
                 empty_title = f"Пока никто не совпал по теме «{PROFILE_INTEREST_LABELS[interest_key]}»"
@@ -12736,7 +15074,7 @@ async def cb_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if data == "help:team:create_profile":
-        existing = get_profile_for_user(update)
+        existing = await profile_for_user(update)
         if existing:
             await q.answer("У вас уже есть анкета ✅", show_alert=True)
             await q.edit_message_text(
@@ -12982,19 +15320,26 @@ async def cb_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
         clear_nomination_flow(context)
         clear_ach_wiz(context)
         clear_bcast_flow(context)
-        profile = get_profile_for_user(update)
-        unread_count = db_notifications_unread_count(update.effective_user.id if update.effective_user else None)
+        profile = await profile_for_user(update)
+        dashboard = await user_dashboard(
+            update.effective_user.id if update.effective_user else None,
+            profile["id"] if profile else None,
+        )
+        unread_count = dashboard["unread_count"]
         bot_username = (context.bot.username or "blablabird_bot")
+        text = await db.call(
+            help_text_main,
+            bot_username,
+            profile=profile,
+            unread_count=unread_count,
+            is_admin_user=is_adm,
+            user_full_name=(update.effective_user.full_name if update.effective_user else None),
+            dashboard=dashboard,
+        )
         await replace_callback_message_with_text(
             q,
             context,
-            "✅ Действие отменено.\n\n" + help_text_main(
-                bot_username,
-                profile=profile,
-                unread_count=unread_count,
-                is_admin_user=is_adm,
-                user_full_name=(update.effective_user.full_name if update.effective_user else None),
-            ),
+            "✅ Действие отменено.\n\n" + text,
             parse_mode=ParseMode.HTML,
             reply_markup=kb_help_main(is_admin_user=is_adm, unread_count=unread_count),
         )
@@ -13892,21 +16237,41 @@ async def cb_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
 
-        if data == "help:settings:backup_zip":
-            # сформировать ZIP и отправить документом в текущий чат (обычно ЛС)
+        if data in ("help:settings:backup_zip", "help:settings:backup_zip:changes"):
+            # сформировать ZIP во временном файле и отправить документом в текущий чат (обычно ЛС)
+            incremental = data.endswith(":changes")
+            fd, path = tempfile.mkstemp(prefix="backup_", suffix=".zip")
+            os.close(fd)
             try:
-                b = export_backup_zip_bytes()
-                bio = io.BytesIO(b)
-                bio.name = f"backup_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.zip"
-                await context.bot.send_document(
-                    chat_id=update.effective_chat.id,
-                    document=bio,
-                    caption="📦 Бэкап готов. Сохраните ZIP — его можно потом загрузить обратно для восстановления.",
-                )
+                since = None
+                if incremental:
+                    since = int(await db.call(db_get_meta, BACKUP_WATERMARK_KEY) or 0)
+                result = await db.call(export_backup_zip, path, since)
+                stamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
+                if incremental:
+                    caption = (
+                        f"🧩 Изменения с прошлого бэкапа: {result['rows']} строк. "
+                        "Восстанавливайте поверх полного бэкапа; удаления в него не попадают."
+                    )
+                else:
+                    caption = "📦 Бэкап готов. Сохраните ZIP — его можно потом загрузить обратно для восстановления."
+                with open(path, "rb") as fh:
+                    await context.bot.send_document(
+                        chat_id=update.effective_chat.id,
+                        document=fh,
+                        filename=f"backup_{'changes_' if incremental else ''}{stamp}.zip",
+                        caption=caption,
+                    )
+                await db.write(db_set_meta, BACKUP_WATERMARK_KEY, str(result["revision"]))
                 await q.answer("Бэкап отправлен ✅")
             except Exception as e:
                 logger.exception("backup_zip send failed: %s", e)
                 await q.answer("Не смог сформировать бэкап 😕", show_alert=True)
+            finally:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
             return
 
         if data == "help:settings:restore_zip":
@@ -14931,6 +17296,8 @@ async def cb_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if data.startswith("help:settings:del_doc_confirm:"):
             did = int(data.split(":")[-1])
             ok = db_docs_delete_doc(did)
+            if ok:
+                DOC_INDEXER.cancel(did)
             await q.edit_message_text(
                 "✅ Файл удалён." if ok else "⚠️ Файл уже не найден.",
                 parse_mode=ParseMode.HTML,
@@ -15111,6 +17478,8 @@ async def on_new_members(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if member.is_bot:
             continue
 
+        access_cache_invalidate_user(member.id, update.effective_chat.id)
+
         name = (member.full_name or member.first_name or "коллега").strip()
         if name:
             names.append(name)
@@ -15155,10 +17524,12 @@ async def on_left_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Скрывает карточку сотрудника после выхода или удаления из рабочего чата."""
     if not update.message or not update.effective_chat:
         return
-    if update.effective_chat.id != ACCESS_CHAT_ID:
-        return
 
     member = update.message.left_chat_member
+    if member:
+        access_cache_invalidate_user(member.id, update.effective_chat.id)
+    if update.effective_chat.id != ACCESS_CHAT_ID:
+        return
     if not member:
         return
     if member.id == context.bot.id or member.is_bot:
@@ -15215,12 +17586,30 @@ async def on_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("❌ Нужен ZIP-файл (backup.zip). Пришлите корректный файл или нажмите «Отмена».")
             return
 
+        # ZIP скачивается во временный файл и читается потоком в потоке записи БД;
+        # пока идёт восстановление, статусное сообщение показывает прогресс.
+        status = await update.message.reply_text("⏳ Скачиваю бэкап…")
+        fd, path = tempfile.mkstemp(prefix="restore_", suffix=".zip")
+        os.close(fd)
+        progress: dict = {}
         try:
             tg_file = await context.bot.get_file(doc.file_id)
-            b = await tg_file.download_as_bytearray()
-            stats = restore_backup_zip_bytes(bytes(b))
+            await tg_file.download_to_drive(custom_path=path)
+            restore = asyncio.ensure_future(db.write(restore_backup_zip, path, progress))
+            shown = None
+            while not restore.done():
+                await asyncio.wait({restore}, timeout=RESTORE_PROGRESS_INTERVAL_SECONDS)
+                text = format_restore_progress(progress)
+                if restore.done() or text == shown:
+                    continue
+                try:
+                    await status.edit_text(text, parse_mode=ParseMode.HTML)
+                    shown = text
+                except (BadRequest, RetryAfter, TimedOut, NetworkError):
+                    pass
+            stats = restore.result()
             clear_restore_zip(context)
-            await update.message.reply_text(
+            await status.edit_text(
                 "✅ Бэкап загружен и восстановлен.\n\n"
                 f"👥 Профили: <b>{stats.get('profiles', 0)}</b>\n"
                 f"🗂️ Категории: <b>{stats.get('categories', 0)}</b>\n"
@@ -15232,7 +17621,12 @@ async def on_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
         except Exception as e:
             logger.exception("restore zip failed: %s", e)
-            await update.message.reply_text("❌ Не смог восстановить из ZIP. Проверьте файл и попробуйте ещё раз.")
+            await status.edit_text("❌ Не смог восстановить из ZIP: база не изменена. Проверьте файл и попробуйте ещё раз.")
+        finally:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
         return
 
 
@@ -15426,7 +17820,7 @@ async def on_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
                         pid = id_map.get(tg_link) if tg_link else None
                         if not pid and tg_link:
                             # попробуем найти в БД
-                            con = sqlite3.connect(DB_PATH)
+                            con = db_connect()
                             cur = con.cursor()
                             cur.execute("SELECT id FROM profiles WHERE tg_link=?", (tg_link,))
                             r = cur.fetchone()
@@ -16508,7 +18902,9 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         context.chat_data.pop(WAITING_USER_ID, None)
         context.chat_data.pop(WAITING_SINCE_TS, None)
         set_docs_search_state(context, query=text, filters_state={}, page=0)
-        search_text, search_keyboard = build_docs_search_results(context, 0)
+        search_text, search_keyboard = await build_docs_search_results(
+            context, 0, update.effective_user.id if update.effective_user else None,
+        )
         await update.message.reply_text(
             search_text,
             parse_mode=ParseMode.HTML,
@@ -16837,7 +19233,7 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("❌ Для этого сценария используйте раздел настроек администратора.")
             return
         if mode == "self_edit":
-            own_profile = get_profile_for_user(update)
+            own_profile = await profile_for_user(update)
             edit_pid = context.chat_data.get(PROFILE_WIZ_EDIT_PID)
             if not own_profile or not edit_pid or int(own_profile["id"]) != int(edit_pid):
                 clear_profile_wiz(context)
@@ -17242,51 +19638,51 @@ def _meeting_confirmation_html(data: dict) -> str:
     )
 
 
-async def send_custom_meeting(context: ContextTypes.DEFAULT_TYPE, payload: dict) -> tuple[int, int]:
+async def send_custom_meeting(
+    context: ContextTypes.DEFAULT_TYPE,
+    payload: dict,
+    *,
+    progress: DeliveryProgress | None = None,
+) -> tuple[int, int]:
     message_html = _meeting_compose_message(
         payload.get("topic") or "",
         payload.get("description_html"),
         payload.get("link"),
     )
-    ok = 0
-    fail = 0
+    bot = context.bot
+
+    async def send(chat_id):
+        return await DELIVERY.call(chat_id, lambda: bot.send_message(
+            chat_id=chat_id,
+            text=message_html,
+            parse_mode=ParseMode.HTML,
+            disable_web_page_preview=True,
+        ))
+
     if payload.get("recipient_mode") == "chats":
-        for chat_id in db_list_chats():
-            try:
-                sent = await context.bot.send_message(
-                    chat_id=int(chat_id),
-                    text=message_html,
-                    parse_mode=ParseMode.HTML,
-                    disable_web_page_preview=True,
-                )
-                # Custom meeting notices follow the same clean-chat rule as regular meetings.
-                schedule_message_delete(context, sent)
-                ok += 1
-            except Exception as exc:
-                logger.exception("Custom meeting failed to chat %s: %s", chat_id, exc)
-                fail += 1
-        return ok, fail
+        async def deliver_chat(chat_id):
+            sent = await send(chat_id)
+            # Custom meeting notices follow the same clean-chat rule as regular meetings.
+            schedule_message_delete(context, sent)
+
+        return await DELIVERY.run(
+            [int(chat_id) for chat_id in db_list_chats()],
+            deliver_chat,
+            label="Custom meeting",
+            progress=progress,
+        )
 
-    seen_user_ids = set()
+    fail = 0
+    user_ids = []
     for pid in payload.get("profile_ids") or []:
         profile = db_profiles_get(int(pid))
         user_id = profile.get("tg_user_id") if profile else None
-        if not user_id or int(user_id) in seen_user_ids:
+        if not user_id or int(user_id) in user_ids:
             fail += 1
             continue
-        seen_user_ids.add(int(user_id))
-        try:
-            await context.bot.send_message(
-                chat_id=int(user_id),
-                text=message_html,
-                parse_mode=ParseMode.HTML,
-                disable_web_page_preview=True,
-            )
-            ok += 1
-        except Exception as exc:
-            logger.exception("Custom meeting failed to profile %s: %s", pid, exc)
-            fail += 1
-    return ok, fail
+        user_ids.append(int(user_id))
+    ok, send_fail = await DELIVERY.run(user_ids, send, label="Custom meeting", progress=progress)
+    return ok, fail + send_fail
 
 
 def _bcast_get_data(context: ContextTypes.DEFAULT_TYPE) -> dict:
@@ -17339,113 +19735,94 @@ async def broadcast_to_chats(
     context: ContextTypes.DEFAULT_TYPE,
     message_html: str,
     files: list[dict],
+    *,
+    progress: DeliveryProgress | None = None,
 ) -> tuple[int, int]:
     """Broadcasts to notify_chats while preserving complete HTML entities."""
-    ok = 0
-    fail = 0
     chat_ids = db_list_chats()
     files = files or []
+    bot = context.bot
 
     # Never cut HTML in the middle of an entity/tag. If the formatted text is too
     # long for a caption, send it as a separate text message and keep files clean.
     can_use_caption = len(_html_plain_text(message_html)) <= 900
 
-    for cid in chat_ids:
-        try:
-            if not files:
-                if message_html:
-                    await context.bot.send_message(
-                        chat_id=cid,
-                        text=message_html,
-                        parse_mode=ParseMode.HTML,
-                        disable_web_page_preview=True,
-                    )
-                ok += 1
-                continue
-
-            if len(files) == 1:
-                f0 = files[0]
-                kind = f0.get("kind")
-                file_id = f0.get("file_id")
-                caption = message_html if message_html and can_use_caption else None
-                if message_html and not caption:
-                    await context.bot.send_message(
-                        chat_id=cid,
-                        text=message_html,
-                        parse_mode=ParseMode.HTML,
-                        disable_web_page_preview=True,
-                    )
-                if kind == "document":
-                    await context.bot.send_document(
-                        chat_id=cid, document=file_id, caption=caption,
-                        parse_mode=ParseMode.HTML if caption else None,
-                    )
-                elif kind == "photo":
-                    await context.bot.send_photo(
-                        chat_id=cid, photo=file_id, caption=caption,
-                        parse_mode=ParseMode.HTML if caption else None,
-                    )
-                elif kind == "video":
-                    await context.bot.send_video(
-                        chat_id=cid, video=file_id, caption=caption,
-                        parse_mode=ParseMode.HTML if caption else None,
-                    )
-                else:
-                    if file_id:
-                        await context.bot.send_document(chat_id=cid, document=file_id)
-                ok += 1
-                continue
-
-            all_media = all((x.get("kind") in ("photo", "video")) for x in files)
-            if all_media:
-                caption = message_html if message_html and can_use_caption else None
-                if message_html and not caption:
-                    await context.bot.send_message(
-                        chat_id=cid,
-                        text=message_html,
-                        parse_mode=ParseMode.HTML,
-                        disable_web_page_preview=True,
-                    )
-                media = []
-                for i, f0 in enumerate(files[:10]):
-                    kind = f0.get("kind")
-                    file_id = f0.get("file_id")
-                    if not file_id:
-                        continue
-                    common = {
-                        "media": file_id,
-                        "caption": caption if i == 0 and caption else None,
-                        "parse_mode": ParseMode.HTML if i == 0 and caption else None,
-                    }
-                    media.append(InputMediaPhoto(**common) if kind == "photo" else InputMediaVideo(**common))
-                if media:
-                    await context.bot.send_media_group(chat_id=cid, media=media)
-                    ok += 1
-                    continue
+    async def send_text(cid):
+        await DELIVERY.call(cid, lambda: bot.send_message(
+            chat_id=cid,
+            text=message_html,
+            parse_mode=ParseMode.HTML,
+            disable_web_page_preview=True,
+        ))
 
+    async def deliver(cid):
+        if not files:
             if message_html:
-                await context.bot.send_message(
-                    chat_id=cid,
-                    text=message_html,
-                    parse_mode=ParseMode.HTML,
-                    disable_web_page_preview=True,
-                )
-            for f0 in files:
+                await send_text(cid)
+            return
+
+        if len(files) == 1:
+            f0 = files[0]
+            kind = f0.get("kind")
+            file_id = f0.get("file_id")
+            caption = message_html if message_html and can_use_caption else None
+            parse_mode = ParseMode.HTML if caption else None
+            if message_html and not caption:
+                await send_text(cid)
+            if kind == "document":
+                await DELIVERY.call(cid, lambda: bot.send_document(
+                    chat_id=cid, document=file_id, caption=caption, parse_mode=parse_mode,
+                ))
+            elif kind == "photo":
+                await DELIVERY.call(cid, lambda: bot.send_photo(
+                    chat_id=cid, photo=file_id, caption=caption, parse_mode=parse_mode,
+                ))
+            elif kind == "video":
+                await DELIVERY.call(cid, lambda: bot.send_video(
+                    chat_id=cid, video=file_id, caption=caption, parse_mode=parse_mode,
+                ))
+            elif file_id:
+                await DELIVERY.call(cid, lambda: bot.send_document(chat_id=cid, document=file_id))
+            return
+
+        text_sent = False
+        all_media = all((x.get("kind") in ("photo", "video")) for x in files)
+        if all_media:
+            caption = message_html if message_html and can_use_caption else None
+            if message_html and not caption:
+                await send_text(cid)
+                text_sent = True
+            media = []
+            for i, f0 in enumerate(files[:10]):
                 kind = f0.get("kind")
                 file_id = f0.get("file_id")
                 if not file_id:
                     continue
-                if kind == "document":
-                    await context.bot.send_document(chat_id=cid, document=file_id)
-                elif kind == "photo":
-                    await context.bot.send_photo(chat_id=cid, photo=file_id)
-                elif kind == "video":
-                    await context.bot.send_video(chat_id=cid, video=file_id)
-            ok += 1
-        except Exception as exc:
-            logger.exception("Broadcast failed to %s: %s", cid, exc)
-            fail += 1
-    return ok, fail
+                common = {
+                    "media": file_id,
+                    "caption": caption if i == 0 and caption else None,
+                    "parse_mode": ParseMode.HTML if i == 0 and caption else None,
+                }
+                media.append(InputMediaPhoto(**common) if kind == "photo" else InputMediaVideo(**common))
+            if media:
+                await DELIVERY.call(cid, lambda: bot.send_media_group(chat_id=cid, media=media))
+                return
+
+        if message_html and not text_sent:
+            await send_text(cid)
+        for f0 in files:
+            kind = f0.get("kind")
+            file_id = f0.get("file_id")
+            if not file_id:
+                continue
+            if kind == "document":
+                await DELIVERY.call(cid, lambda: bot.send_document(chat_id=cid, document=file_id))
+            elif kind == "photo":
+                await DELIVERY.call(cid, lambda: bot.send_photo(chat_id=cid, photo=file_id))
+            elif kind == "video":
+                await DELIVERY.call(cid, lambda: bot.send_video(chat_id=cid, video=file_id))
+
+    return await DELIVERY.run(chat_ids, deliver, label="Broadcast", progress=progress)
 
 
 async def process_due_communications(context: ContextTypes.DEFAULT_TYPE):
@@ -17454,15 +19831,23 @@ async def process_due_communications(context: ContextTypes.DEFAULT_TYPE):
         item_id = int(item["id"])
         if not db_scheduled_communication_reserve(item_id):
             continue
+        progress = DeliveryProgress(item_id, item.get("result_json"))
+        if progress.resumed:
+            logger.info(
+                "Resuming scheduled communication %s: %s recipients already delivered",
+                item_id, progress.resumed,
+            )
         try:
             payload = json.loads(item.get("payload_json") or "{}")
             if item.get("kind") == "meeting":
-                ok, fail = await send_custom_meeting(context, payload)
+                ok, fail = await send_custom_meeting(context, payload, progress=progress)
             elif item.get("kind") == "broadcast":
                 message_html = _bcast_compose_message(
                     payload.get("topic"), payload.get("text_html"), payload.get("tag")
                 )
-                ok, fail = await broadcast_to_chats(context, message_html, payload.get("files") or [])
+                ok, fail = await broadcast_to_chats(
+                    context, message_html, payload.get("files") or [], progress=progress
+                )
             else:
                 raise RuntimeError(f"Unknown scheduled communication kind: {item.get('kind')}")
 
@@ -17470,12 +19855,14 @@ async def process_due_communications(context: ContextTypes.DEFAULT_TYPE):
             db_scheduled_communication_finish(
                 item_id,
                 status,
-                result={"ok": int(ok), "fail": int(fail)},
+                result=progress.result(ok, fail),
                 error=("No deliveries succeeded" if status == "failed" else None),
             )
         except Exception as exc:
             logger.exception("Scheduled communication %s failed: %s", item_id, exc)
-            db_scheduled_communication_finish(item_id, "failed", error=str(exc)[:1000])
+            db_scheduled_communication_finish(
+                item_id, "failed", result=progress.result(0, 0), error=str(exc)[:1000]
+            )
 
 
 # ---------------- ERROR HANDLER ----------------
@@ -17500,7 +19887,6 @@ TV2_ACTIVE_ASSIGNMENT = "tv2_active_assignment"
 TV2_ADMIN_PAGE_SIZE = 8
 TV2_MY_PAGE_SIZE = 6
 
-_tv2_legacy_db_init = db_init
 _tv2_legacy_cb_help = cb_help
 _tv2_legacy_cb_test = cb_test
 _tv2_legacy_on_text = on_text
@@ -17514,9 +19900,8 @@ def _tv2_add_column(cur, table: str, definition: str):
         pass
 
 
-def db_init():
-    _tv2_legacy_db_init()
-    con = sqlite3.connect(DB_PATH)
+@schema_migration(3, "testing_v2")
+def _migrate_testing_v2(con):
     cur = con.cursor()
 
     # Optional organizational field used for group test assignment.
@@ -17631,13 +20016,15 @@ def db_init():
     cur.execute("UPDATE test_templates SET updated_at=COALESCE(updated_at, created_at)")
     cur.execute("UPDATE test_questions SET points=1 WHERE points IS NULL OR points<=0")
     cur.execute("UPDATE test_assignments SET attempt_group=COALESCE(attempt_group, 'legacy-' || id)")
-    con.commit()
-    con.close()
+
+
+@db_startup_task
+def _tv2_log_build():
     logger.warning("=== %s | FILE=%s | DB=%s ===", TEST_V2_BUILD, os.path.abspath(__file__), os.path.abspath(DB_PATH))
 
 
 def tv2_connect():
-    con = sqlite3.connect(DB_PATH, timeout=20)
+    con = db_connect()
     con.row_factory = sqlite3.Row
     con.execute("PRAGMA foreign_keys=ON")
     con.execute("PRAGMA busy_timeout=20000")
@@ -18691,154 +21078,211 @@ async def tv2_notify_assignment(context, aid: int):
         return False
 
 
-async def tv2_send_reminders(context):
-    """Напоминает о сроке и отдельно сигнализирует, если тест ещё не начат."""
-    now = datetime.utcnow()
+# Корзины напоминаний: (имя, условие по due_at, флаг отправки).
+# Границы не пересекаются, поэтому за тик назначение попадает не более чем в одну.
+TV2_REMINDER_BUCKETS = (
+    ("overdue", "a.due_at<=:now", "overdue_notice_sent"),
+    ("2h", "a.due_at>:now AND a.due_at<=:in_2h", "reminder_2_sent"),
+    ("24h", "a.due_at>:in_2h AND a.due_at<=:in_24h", "reminder_24_sent"),
+)
+
+
+def tv2_due_reminders(now: datetime) -> list[dict]:
+    """
+    Назначения, пересёкшие порог напоминания.
+
+    due_at хранится как naive UTC ISO, поэтому каждая корзина — диапазон по
+    индексу idx_test_assign_due, а не обход всех открытых назначений.
+    """
+    bounds = {
+        "now": now.isoformat(),
+        "in_2h": (now + timedelta(hours=2)).isoformat(),
+        "in_24h": (now + timedelta(hours=24)).isoformat(),
+    }
+    result = []
     with tv2_connect() as con:
-        rows = con.execute(
-            """
-            SELECT a.id, a.due_at, a.reminder_24_sent, a.reminder_2_sent,
-                   a.overdue_notice_sent, p.tg_user_id, t.title, a.status
-            FROM test_assignments a
-            JOIN profiles p ON p.id=a.profile_id
-            JOIN test_templates t ON t.id=a.template_id
-            WHERE a.status IN ('assigned','in_progress','saved')
-              AND a.due_at IS NOT NULL
-            """
-        ).fetchall()
+        for bucket, due_range, flag in TV2_REMINDER_BUCKETS:
+            rows = con.execute(
+                f"""
+                SELECT a.id, a.due_at, a.status, p.tg_user_id, t.title
+                FROM test_assignments a
+                JOIN profiles p ON p.id=a.profile_id
+                JOIN test_templates t ON t.id=a.template_id
+                WHERE a.status IN ('assigned','in_progress','saved')
+                  AND {due_range}
+                  AND COALESCE(a.{flag}, 0)=0
+                  AND p.tg_user_id IS NOT NULL
+                ORDER BY a.due_at
+                """,
+                bounds,
+            ).fetchall()
+            for row in rows:
+                result.append({
+                    "bucket": bucket,
+                    "aid": int(row["id"]),
+                    "due_at": row["due_at"],
+                    "status": str(row["status"] or "assigned"),
+                    "user_id": int(row["tg_user_id"]),
+                    "title": str(row["title"] or "Тест"),
+                })
+    return result
 
-    for row in rows:
-        aid = int(row[0])
-        due_iso = row[1]
-        user_id = row[5]
-        title = str(row[6] or "Тест")
-        status = str(row[7] or "assigned")
-        if not user_id:
-            continue
 
-        try:
-            due_dt = datetime.fromisoformat(due_iso)
-        except Exception:
-            continue
+def tv2_reminder_payload(item: dict) -> dict:
+    """Тексты push и внутреннего уведомления для назначения из корзины."""
+    title = item["title"]
+    due_text = tv2_fmt_dt(item["due_at"])
+    not_started = item["status"] == "assigned"
+    payload = {
+        "callback": f"help:testv2:myopen:{item['aid']}",
+        "button_text": "Открыть тест",
+    }
 
-        remaining = (due_dt - now).total_seconds()
-        callback = f"help:testv2:myopen:{aid}"
-        due_text = tv2_fmt_dt(due_iso)
-        flag = None
-        extra_flag = None
-        message_text = None
-        notification_type = None
-        notification_title = None
-        notification_body = None
-        button_text = "Открыть тест"
-
-        if remaining <= 0 and not int(row[4] or 0):
-            was_not_started = status == "assigned"
-            tv2_mark_expired(aid)
-            flag = "overdue_notice_sent"
-            notification_type = "test_not_started_expired" if was_not_started else "test_expired"
-            if was_not_started:
-                message_text = (
-                    f"⌛ Срок теста «{escape(title)}» истёк. "
-                    "Вы не успели приступить к тестированию."
-                )
-                notification_title = f"Срок теста истёк: {title}"
-                notification_body = (
-                    f"Тест не был начат. Предельный срок: {due_text}."
-                )
-            else:
-                message_text = f"⌛ Срок теста «{escape(title)}» истёк."
-                notification_title = f"Срок теста истёк: {title}"
-                notification_body = f"Предельный срок: {due_text}."
-
-        elif remaining <= 7200 and not int(row[3] or 0):
-            flag = "reminder_2_sent"
-            # Не отправляем вслед за срочным alarm более слабое уведомление «за сутки».
-            extra_flag = "reminder_24_sent"
-            if status == "assigned":
-                notification_type = "test_not_started_2h"
-                notification_title = f"Срочно начните тест: {title}"
-                notification_body = (
-                    f"До предельного срока осталось менее 2 часов. "
-                    f"Пройти до: {due_text}. Тест ещё не начат. "
-                    f"{TEST_RETAKE_POLICY_TEXT}"
-                )
-                message_text = (
-                    f"🚨 <b>Вы ещё не приступили к тесту</b>\n\n"
-                    f"Тест: <b>{escape(title)}</b>\n"
-                    f"До предельного срока осталось <b>менее 2 часов</b>.\n"
-                    f"Пройти до: <b>{escape(due_text)}</b>"
-                )
-                button_text = "▶️ Начать тест"
-            else:
-                notification_type = "test_due_2h"
-                notification_title = f"До срока теста менее 2 часов: {title}"
-                notification_body = f"Пройти до: {due_text}."
-                message_text = (
-                    f"⏰ До срока теста «{escape(title)}» осталось менее 2 часов."
-                )
+    if item["bucket"] == "overdue":
+        payload["notification_type"] = "test_not_started_expired" if not_started else "test_expired"
+        payload["notification_title"] = f"Срок теста истёк: {title}"
+        if not_started:
+            payload["message_text"] = (
+                f"⌛ Срок теста «{escape(title)}» истёк. "
+                "Вы не успели приступить к тестированию."
+            )
+            payload["notification_body"] = (
+                f"Тест не был начат. Предельный срок: {due_text}."
+            )
+        else:
+            payload["message_text"] = f"⌛ Срок теста «{escape(title)}» истёк."
+            payload["notification_body"] = f"Предельный срок: {due_text}."
+
+    elif item["bucket"] == "2h":
+        if not_started:
+            payload["notification_type"] = "test_not_started_2h"
+            payload["notification_title"] = f"Срочно начните тест: {title}"
+            payload["notification_body"] = (
+                f"До предельного срока осталось менее 2 часов. "
+                f"Пройти до: {due_text}. Тест ещё не начат. "
+                f"{TEST_RETAKE_POLICY_TEXT}"
+            )
+            payload["message_text"] = (
+                f"🚨 <b>Вы ещё не приступили к тесту</b>\n\n"
+                f"Тест: <b>{escape(title)}</b>\n"
+                f"До предельного срока осталось <b>менее 2 часов</b>.\n"
+                f"Пройти до: <b>{escape(due_text)}</b>"
+            )
+            payload["button_text"] = "▶️ Начать тест"
+        else:
+            payload["notification_type"] = "test_due_2h"
+            payload["notification_title"] = f"До срока теста менее 2 часов: {title}"
+            payload["notification_body"] = f"Пройти до: {due_text}."
+            payload["message_text"] = (
+                f"⏰ До срока теста «{escape(title)}» осталось менее 2 часов."
+            )
 
-        elif 7200 < remaining <= 86400 and not int(row[2] or 0):
-            flag = "reminder_24_sent"
-            if status == "assigned":
-                notification_type = "test_not_started_24h"
-                notification_title = f"Пора начать тест: {title}"
-                notification_body = (
-                    f"До предельного срока осталось менее суток. "
-                    f"Пройти до: {due_text}. Тест ещё не начат. "
-                    f"{TEST_RETAKE_POLICY_TEXT}"
-                )
-                message_text = (
-                    f"⏰ <b>Вы ещё не приступили к тесту</b>\n\n"
-                    f"Тест: <b>{escape(title)}</b>\n"
-                    f"До предельного срока осталось <b>менее суток</b>.\n"
-                    f"Пройти до: <b>{escape(due_text)}</b>"
-                )
-                button_text = "▶️ Начать тест"
-            else:
-                notification_type = "test_due_24h"
-                notification_title = f"До срока теста менее суток: {title}"
-                notification_body = f"Пройти до: {due_text}."
-                message_text = (
-                    f"⏰ До срока теста «{escape(title)}» осталось менее суток."
-                )
+    else:
+        if not_started:
+            payload["notification_type"] = "test_not_started_24h"
+            payload["notification_title"] = f"Пора начать тест: {title}"
+            payload["notification_body"] = (
+                f"До предельного срока осталось менее суток. "
+                f"Пройти до: {due_text}. Тест ещё не начат. "
+                f"{TEST_RETAKE_POLICY_TEXT}"
+            )
+            payload["message_text"] = (
+                f"⏰ <b>Вы ещё не приступили к тесту</b>\n\n"
+                f"Тест: <b>{escape(title)}</b>\n"
+                f"До предельного срока осталось <b>менее суток</b>.\n"
+                f"Пройти до: <b>{escape(due_text)}</b>"
+            )
+            payload["button_text"] = "▶️ Начать тест"
+        else:
+            payload["notification_type"] = "test_due_24h"
+            payload["notification_title"] = f"До срока теста менее суток: {title}"
+            payload["notification_body"] = f"Пройти до: {due_text}."
+            payload["message_text"] = (
+                f"⏰ До срока теста «{escape(title)}» осталось менее суток."
+            )
+    return payload
 
-        if not flag or not message_text:
-            continue
 
-        db_notification_add_once(
-            int(user_id),
-            notification_type or "test_reminder",
-            notification_title or "Напоминание о тесте",
-            notification_body or "",
-            callback_data=callback,
-        )
+def tv2_claim_reminders(items: list[dict]) -> None:
+    """
+    Одной транзакцией: истёкшие назначения, флаги напоминаний и внутренние
+    уведомления (с той же дедупликацией, что db_notification_add_once).
+    """
+    if not items:
+        return
+    now_iso = datetime.utcnow().isoformat()
+    overdue = [(now_iso, item["aid"]) for item in items if item["bucket"] == "overdue"]
+    flags = {
+        "overdue": "overdue_notice_sent=1",
+        # Не отправляем вслед за срочным alarm более слабое уведомление «за сутки».
+        "2h": "reminder_2_sent=1, reminder_24_sent=1",
+        "24h": "reminder_24_sent=1",
+    }
+    notifications = []
+    for item in items:
+        payload = item["payload"]
+        notification_type = (payload["notification_type"] or "info")[:40]
+        notifications.append((
+            item["user_id"],
+            notification_type,
+            (payload["notification_title"] or "Уведомление")[:180],
+            (payload["notification_body"] or "")[:2000],
+            payload["callback"],
+            now_iso,
+            item["user_id"],
+            notification_type,
+            payload["callback"],
+        ))
 
-        try:
-            await context.bot.send_message(
-                int(user_id),
-                message_text,
-                parse_mode=ParseMode.HTML,
-                reply_markup=InlineKeyboardMarkup([[
-                    InlineKeyboardButton(button_text, callback_data=callback)
-                ]]),
+    with tv2_connect() as con:
+        con.executemany(
+            "UPDATE test_assignments SET status='expired', finished_at=? "
+            "WHERE id=? AND status NOT IN ('finished','reviewed','expired','canceled')",
+            overdue,
+        )
+        for bucket, assignments in flags.items():
+            ids = [(item["aid"],) for item in items if item["bucket"] == bucket]
+            if ids:
+                con.executemany(f"UPDATE test_assignments SET {assignments} WHERE id=?", ids)
+        con.executemany(
+            """
+            INSERT INTO notifications(user_id, notification_type, title, body, callback_data, is_read, created_at)
+            SELECT ?, ?, ?, ?, ?, 0, ?
+            WHERE NOT EXISTS (
+                SELECT 1 FROM notifications
+                WHERE user_id=? AND notification_type=?
+                  AND COALESCE(callback_data, '')=COALESCE(?, '')
             )
-        except Exception as exc:
-            logger.warning("Cannot send test reminder %s to %s: %s", aid, user_id, exc)
+            """,
+            notifications,
+        )
 
-        # Фиксируем событие один раз, даже если Telegram временно не доставил push:
-        # запись остаётся доступной в разделе «Уведомления».
-        with tv2_connect() as con:
-            if extra_flag:
-                con.execute(
-                    f"UPDATE test_assignments SET {flag}=1, {extra_flag}=1 WHERE id=?",
-                    (aid,),
-                )
-            else:
-                con.execute(
-                    f"UPDATE test_assignments SET {flag}=1 WHERE id=?",
-                    (aid,),
-                )
+
+async def tv2_send_reminders(context):
+    """Напоминает о сроке и отдельно сигнализирует, если тест ещё не начат."""
+    items = await db.call(tv2_due_reminders, datetime.utcnow())
+    if not items:
+        return
+    for item in items:
+        item["payload"] = tv2_reminder_payload(item)
+
+    # Фиксируем событие до отправки и один раз, даже если Telegram временно не
+    # доставил push: запись остаётся доступной в разделе «Уведомления».
+    await db.write(tv2_claim_reminders, items)
+
+    async def deliver(index: int):
+        item = items[index]
+        payload = item["payload"]
+        await DELIVERY.call(item["user_id"], lambda: context.bot.send_message(
+            item["user_id"],
+            payload["message_text"],
+            parse_mode=ParseMode.HTML,
+            reply_markup=InlineKeyboardMarkup([[
+                InlineKeyboardButton(payload["button_text"], callback_data=payload["callback"])
+            ]]),
+        ))
+
+    await DELIVERY.run(range(len(items)), deliver, label="Test reminder")
 
 
 async def check_and_send_jobs(context: ContextTypes.DEFAULT_TYPE):
@@ -18897,7 +21341,7 @@ async def cb_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await q.edit_message_text(f"🏢 <b>{escape(p['full_name'])}</b>\nТекущий отдел: <b>{escape((row[0] if row else '') or '—')}</b>\n\nВведите название отдела или '-' чтобы очистить.",parse_mode=ParseMode.HTML,reply_markup=tv2_kb_cancel(f"help:testv2:departments:{page}")); return
 
     if data.startswith("help:testv2:my:"):
-        profile=get_profile_for_user(update)
+        profile=await profile_for_user(update)
         if not profile:
             await q.answer("Анкета не найдена",show_alert=True); return
         parts=data.split(":"); filt=parts[3] if len(parts)>3 else "all"; page=int(parts[4]) if len(parts)>4 else 0
@@ -18912,13 +21356,13 @@ async def cb_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if data.startswith("help:testv2:myopen:"):
-        aid=int(data.rsplit(":",1)[-1]); a=tv2_get_assignment(aid); p=get_profile_for_user(update)
+        aid=int(data.rsplit(":",1)[-1]); a=tv2_get_assignment(aid); p=await profile_for_user(update)
         if not a or not p or int(a["profile_id"])!=int(p["id"]): await q.answer("Тест не найден",show_alert=True); return
         await q.edit_message_text(tv2_my_open_text(a),parse_mode=ParseMode.HTML,reply_markup=tv2_kb_my_open(a))
         return
 
     if data.startswith("help:testv2:result:"):
-        aid=int(data.rsplit(":",1)[-1]); a=tv2_get_assignment(aid); p=get_profile_for_user(update)
+        aid=int(data.rsplit(":",1)[-1]); a=tv2_get_assignment(aid); p=await profile_for_user(update)
         if not a or (not await is_admin_scoped(update,context) and (not p or int(a["profile_id"])!=int(p["id"]))): return
         is_admin = await is_admin_scoped(update, context)
         rows=[]
@@ -19325,7 +21769,7 @@ async def cb_test(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try: await q.answer()
     except Exception: pass
     parts=data.split(":"); action=parts[2]; aid=int(parts[3]) if len(parts)>3 else 0
-    a=tv2_get_assignment(aid); p=get_profile_for_user(update)
+    a=tv2_get_assignment(aid); p=await profile_for_user(update)
     if not a or not p or int(a["profile_id"])!=int(p["id"]): await q.answer("Тест назначен другому сотруднику",show_alert=True); return
 
     if action in ("start","continue"):
@@ -19515,8 +21959,10 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     return await _tv2_legacy_on_text(update,context)
 
+
 # =================== END TESTING V2 ===================
 
+
 # ===================== EMPLOYEE REMINDERS V1 =====================
 # Личные напоминания сотрудников: создание, редактирование, удаление,
 # отображение на рабочей панели и надёжная отправка в ЛС.
@@ -19533,7 +21979,6 @@ REMINDER_TIMEZONE_LABELS = {
 }
 
 # Сохраняем актуальные реализации, включая переопределения TESTING V2.
-_reminder_legacy_db_init = db_init
 _reminder_legacy_help_text_main = help_text_main
 _reminder_legacy_kb_help_main = kb_help_main
 _reminder_legacy_cb_help = cb_help
@@ -19635,9 +22080,8 @@ def _reminder_short_text(value: str, limit: int = 42) -> str:
     return clean if len(clean) <= limit else clean[: max(1, limit - 1)].rstrip() + "…"
 
 
-def db_init():
-    _reminder_legacy_db_init()
-    con = sqlite3.connect(DB_PATH)
+@schema_migration(4, "employee_reminders")
+def _migrate_employee_reminders(con):
     cur = con.cursor()
     cur.execute(
         """
@@ -19670,21 +22114,24 @@ def db_init():
         ON employee_reminders(user_id, status, remind_at_utc)
         """
     )
+
+
+@db_startup_task
+def _reminders_requeue_sending():
     # После перезапуска безопасно возвращаем незавершённые отправки в очередь.
-    cur.execute(
-        """
-        UPDATE employee_reminders
-        SET status='pending', updated_at=?
-        WHERE status='sending'
-        """,
-        (_reminder_utc_now().isoformat(),),
-    )
-    con.commit()
-    con.close()
+    with db_connect() as con:
+        con.execute(
+            """
+            UPDATE employee_reminders
+            SET status='pending', updated_at=?
+            WHERE status='sending'
+            """,
+            (_reminder_utc_now().isoformat(),),
+        )
 
 
 def db_reminders_active(user_id: int, limit: int = REMINDER_MAX_ACTIVE) -> list[dict]:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -19715,7 +22162,7 @@ def db_reminders_active(user_id: int, limit: int = REMINDER_MAX_ACTIVE) -> list[
 
 
 def db_reminders_active_count(user_id: int) -> int:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -19731,7 +22178,7 @@ def db_reminders_active_count(user_id: int) -> int:
 
 
 def db_reminder_get(reminder_id: int, user_id: int) -> dict | None:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -19777,7 +22224,7 @@ def db_reminder_create(
     if when_utc <= _reminder_utc_now() + timedelta(seconds=30):
         raise ValueError("Время напоминания должно быть в будущем")
 
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     try:
         con.execute("BEGIN IMMEDIATE")
         cur = con.cursor()
@@ -19828,7 +22275,7 @@ def db_reminder_update_text(reminder_id: int, user_id: int, new_text: str) -> bo
         raise ValueError("Описание не может быть пустым")
     if len(clean) > REMINDER_TEXT_MAX_LENGTH:
         raise ValueError(f"Описание должно быть не длиннее {REMINDER_TEXT_MAX_LENGTH} символов")
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -19855,7 +22302,7 @@ def db_reminder_update_schedule(
     when_utc = remind_at_utc.astimezone(pytz.UTC)
     if when_utc <= _reminder_utc_now() + timedelta(seconds=30):
         raise ValueError("Время напоминания должно быть в будущем")
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -19878,7 +22325,7 @@ def db_reminder_update_schedule(
 
 
 def db_reminder_cancel(reminder_id: int, user_id: int) -> bool:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -19895,7 +22342,7 @@ def db_reminder_cancel(reminder_id: int, user_id: int) -> bool:
 
 
 def db_reminders_due(limit: int = 50) -> list[dict]:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -19922,7 +22369,7 @@ def db_reminders_due(limit: int = 50) -> list[dict]:
 
 
 def db_reminder_reserve(reminder_id: int) -> bool:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -19940,7 +22387,7 @@ def db_reminder_reserve(reminder_id: int) -> bool:
 
 def db_reminder_mark_sent(reminder_id: int):
     now_iso = _reminder_utc_now().isoformat()
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -19955,7 +22402,7 @@ def db_reminder_mark_sent(reminder_id: int):
 
 
 def db_reminder_return_pending(reminder_id: int, error: str | None = None):
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -19970,7 +22417,7 @@ def db_reminder_return_pending(reminder_id: int, error: str | None = None):
 
 
 def db_reminder_mark_failed(reminder_id: int, error: str | None = None):
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     cur = con.cursor()
     cur.execute(
         """
@@ -20094,6 +22541,7 @@ def help_text_main(
     unread_count: int = 0,
     is_admin_user: bool = False,
     user_full_name: str | None = None,
+    dashboard: dict | None = None,
 ) -> str:
     if not profile:
         return _reminder_legacy_help_text_main(
@@ -20106,28 +22554,31 @@ def help_text_main(
 
     profile_full_name = (profile.get("full_name") or "Коллега").strip()
     display_name = (user_full_name or "").strip() or profile_full_name
-    tests = db_profile_test_summary(int(profile["id"]))
-    achievements_count = db_achievements_count(int(profile["id"]))
+    if dashboard is None:
+        # Синхронный вызов без сводки от обработчика: только чтение, без записи.
+        dashboard = (
+            db_user_dashboard_stored(profile.get("tg_user_id"), int(profile["id"]))
+            or db_user_dashboard_compute(profile.get("tg_user_id"), int(profile["id"]))
+        )
+    achievements_count = dashboard["achievements_count"]
     attention: list[str] = []
 
-    if tests.get("assigned"):
-        attention.append(f"📝 новых тестов: <b>{tests['assigned']}</b>")
-    if tests.get("in_progress"):
-        attention.append(f"⏳ тестов в процессе: <b>{tests['in_progress']}</b>")
+    if dashboard["tests_assigned"]:
+        attention.append(f"📝 новых тестов: <b>{dashboard['tests_assigned']}</b>")
+    if dashboard["tests_in_progress"]:
+        attention.append(f"⏳ тестов в процессе: <b>{dashboard['tests_in_progress']}</b>")
     if unread_count:
         attention.append(f"🔔 непрочитанных уведомлений: <b>{unread_count}</b>")
 
-    user_id = profile.get("tg_user_id")
-    reminders = db_reminders_active(int(user_id), REMINDER_MAX_ACTIVE) if user_id else []
-    if reminders:
-        nearest = reminders[0]
+    nearest = dashboard["nearest_reminder"]
+    if nearest:
         attention.append(
             "⏰ ближайшее: "
             f"<b>{escape(_reminder_format_when(nearest, include_timezone=False))}</b> — "
             f"{escape(_reminder_short_text(nearest['reminder_text'], 58))}"
         )
-        if len(reminders) > 1:
-            attention.append(f"⏰ ещё активных напоминаний: <b>{len(reminders) - 1}</b>")
+        if dashboard["reminders_count"] > 1:
+            attention.append(f"⏰ ещё активных напоминаний: <b>{dashboard['reminders_count'] - 1}</b>")
 
     if attention:
         # Эмодзи уже выполняют роль визуальных маркеров — точки не нужны.
@@ -20230,7 +22681,7 @@ def db_industry_division_get_choices(user_id: int | None) -> list[str]:
     """Возвращает выбранные пользователем разделы в порядке выбора."""
     if user_id is None:
         return []
-    with sqlite3.connect(DB_PATH) as con:
+    with db_connect() as con:
         rows = con.execute(
             """
             SELECT industry_key
@@ -20257,7 +22708,7 @@ def db_industry_division_toggle_choice(
     """Переключает отрасль: added, removed, limit или invalid."""
     if user_id is None or industry_key not in INDUSTRY_DIVISION_BY_KEY:
         return "invalid", db_industry_division_get_choices(user_id)
-    with sqlite3.connect(DB_PATH) as con:
+    with db_connect() as con:
         con.execute("BEGIN IMMEDIATE")
         exists = con.execute(
             """
@@ -20307,7 +22758,7 @@ def db_industry_division_toggle_choice(
 def db_industry_division_clear_choices(user_id: int | None) -> bool:
     if user_id is None:
         return False
-    with sqlite3.connect(DB_PATH) as con:
+    with db_connect() as con:
         cur = con.execute(
             "DELETE FROM industry_division_user_choices WHERE user_id=?",
             (int(user_id),),
@@ -21315,9 +23766,9 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def send_due_employee_reminders(context: ContextTypes.DEFAULT_TYPE):
-    for item in db_reminders_due(limit=50):
+    for item in await db.call(db_reminders_due, limit=50):
         reminder_id = int(item["id"])
-        if not db_reminder_reserve(reminder_id):
+        if not await db.write(db_reminder_reserve, reminder_id):
             continue
         try:
             await context.bot.send_message(
@@ -21332,14 +23783,14 @@ async def send_due_employee_reminders(context: ContextTypes.DEFAULT_TYPE):
                     [InlineKeyboardButton("📋 Мои напоминания", callback_data="help:reminder:list")]
                 ]),
             )
-            db_reminder_mark_sent(reminder_id)
+            await db.write(db_reminder_mark_sent, reminder_id)
         except Forbidden as exc:
-            db_reminder_mark_failed(reminder_id, f"Forbidden: {exc}")
+            await db.write(db_reminder_mark_failed, reminder_id, f"Forbidden: {exc}")
         except (TimedOut, NetworkError) as exc:
-            db_reminder_return_pending(reminder_id, str(exc))
+            await db.write(db_reminder_return_pending, reminder_id, str(exc))
         except Exception as exc:
             logger.exception("Employee reminder %s failed: %s", reminder_id, exc)
-            db_reminder_return_pending(reminder_id, str(exc))
+            await db.write(db_reminder_return_pending, reminder_id, str(exc))
 
 
 async def check_and_send_jobs(context: ContextTypes.DEFAULT_TYPE):
@@ -21349,8 +23800,10 @@ async def check_and_send_jobs(context: ContextTypes.DEFAULT_TYPE):
     except Exception as exc:
         logger.exception("Employee reminders checker failed: %s", exc)
 
+
 # =================== END EMPLOYEE REMINDERS V1 ===================
 
+
 # ===================== TESTING MODES V3 =====================
 # Два варианта прохождения:
 # 1) результат публикуется только после проверки;
@@ -21360,7 +23813,6 @@ async def check_and_send_jobs(context: ContextTypes.DEFAULT_TYPE):
 
 TEST_MODES_V3_BUILD = "TESTING-MODES-V3-2026-07-22"
 
-_test_modes_legacy_db_init = db_init
 _test_modes_legacy_cb_help = cb_help
 _test_modes_legacy_cb_test = cb_test
 _test_modes_legacy_on_text = on_text
@@ -21372,9 +23824,8 @@ _test_modes_legacy_publish_template = tv2_publish_template
 _test_modes_legacy_update_question = tv2_update_question
 
 
-def db_init():
-    _test_modes_legacy_db_init()
-    con = sqlite3.connect(DB_PATH)
+@schema_migration(5, "testing_modes_v3")
+def _migrate_testing_modes_v3(con):
     cur = con.cursor()
     _tv2_add_column(cur, "test_templates", "grading_mode TEXT NOT NULL DEFAULT 'review'")
     _tv2_add_column(cur, "test_questions", "correct_text TEXT")
@@ -21401,8 +23852,10 @@ def db_init():
         "UPDATE test_assignments SET result_released=1 "
         "WHERE status='finished' AND COALESCE(result_released,0)=0"
     )
-    con.commit()
-    con.close()
+
+
+@db_startup_task
+def _test_modes_log_build():
     logger.warning("=== %s ===", TEST_MODES_V3_BUILD)
 
 
@@ -22700,7 +25153,7 @@ async def cb_test(update: Update, context: ContextTypes.DEFAULT_TYPE):
     action = parts[2]
     aid = int(parts[3]) if len(parts) > 3 else 0
     assignment = tv2_get_assignment(aid)
-    profile = get_profile_for_user(update)
+    profile = await profile_for_user(update)
     if not assignment or not profile or int(assignment["profile_id"]) != int(profile["id"]):
         try:
             await update.callback_query.answer("Тест назначен другому сотруднику", show_alert=True)
@@ -23059,6 +25512,7 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # =================== END TESTING MODES V3 ===================
 
+
 # ===================== TEST HISTORY + QUESTION BANK V4 =====================
 # Администратор может убрать ненужные шаблоны, опубликованные версии и
 # тестирования из рабочих списков, но история сотрудника, ответы и средний балл
@@ -23066,7 +25520,6 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 TEST_HISTORY_V4_BUILD = "TEST-HISTORY-BANK-V4-2026-07-22"
 
-_test_history_legacy_db_init = db_init
 _test_history_legacy_cb_help = cb_help
 _test_history_legacy_publish_template = tv2_publish_template
 _test_history_legacy_update_question = tv2_update_question
@@ -23173,9 +25626,8 @@ def _tv4_ensure_bank_question(
     return int(cur.lastrowid)
 
 
-def db_init():
-    _test_history_legacy_db_init()
-    con = sqlite3.connect(DB_PATH)
+@schema_migration(6, "testing_history_v4")
+def _migrate_testing_history_v4(con):
     con.row_factory = sqlite3.Row
     cur = con.cursor()
 
@@ -23233,8 +25685,9 @@ def db_init():
             (bank_id, int(item["id"])),
         )
 
-    con.commit()
-    con.close()
+
+@db_startup_task
+def _test_history_log_build():
     logger.warning("=== %s ===", TEST_HISTORY_V4_BUILD)
 
 
@@ -23870,19 +26323,18 @@ async def cb_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # =================== END TEST HISTORY + QUESTION BANK V4 ===================
 
+
 # ===================== FAQ PERSONAL FAVORITES V5 =====================
 # Избранное FAQ хранится отдельно для каждого Telegram-пользователя. Оно не
 # меняет общую базу вопросов и переживает обновление текста ответа.
 
 FAQ_FAVORITES_V5_BUILD = "FAQ-PERSONAL-FAVORITES-V5-2026-07-22"
 
-_faq_favorites_legacy_db_init = db_init
 _faq_favorites_legacy_cb_help = cb_help
 
 
-def db_init():
-    _faq_favorites_legacy_db_init()
-    con = sqlite3.connect(DB_PATH)
+@schema_migration(7, "faq_case_favorites")
+def _migrate_faq_case_favorites(con):
     cur = con.cursor()
     cur.execute(
         """
@@ -23983,15 +26435,17 @@ def db_init():
         """
     )
     cur.execute("DELETE FROM case_user_industries")
-    con.commit()
-    con.close()
+
+
+@db_startup_task
+def _faq_favorites_log_build():
     logger.warning("=== %s ===", FAQ_FAVORITES_V5_BUILD)
 
 
 def db_faq_is_favorite(user_id: int | None, faq_id: int) -> bool:
     if user_id is None:
         return False
-    with sqlite3.connect(DB_PATH) as con:
+    with db_connect() as con:
         row = con.execute(
             "SELECT 1 FROM faq_favorites WHERE user_id=? AND faq_id=?",
             (int(user_id), int(faq_id)),
@@ -24002,7 +26456,7 @@ def db_faq_is_favorite(user_id: int | None, faq_id: int) -> bool:
 def db_faq_toggle_favorite(user_id: int | None, faq_id: int) -> bool:
     if user_id is None:
         return False
-    with sqlite3.connect(DB_PATH) as con:
+    with db_connect() as con:
         row = con.execute(
             "SELECT 1 FROM faq_favorites WHERE user_id=? AND faq_id=?",
             (int(user_id), int(faq_id)),
@@ -24023,7 +26477,7 @@ def db_faq_toggle_favorite(user_id: int | None, faq_id: int) -> bool:
 def db_faq_favorites(user_id: int | None, limit: int = 100) -> list[dict]:
     if user_id is None:
         return []
-    with sqlite3.connect(DB_PATH) as con:
+    with db_connect() as con:
         rows = con.execute(
             """
             SELECT f.id, f.question, f.answer
@@ -24043,10 +26497,13 @@ def db_faq_favorites(user_id: int | None, limit: int = 100) -> list[dict]:
 
 def db_faq_delete(fid: int) -> bool:
     """Удаляет FAQ и явно чистит закладки для БД без включённых FK."""
-    with sqlite3.connect(DB_PATH) as con:
+    with db_connect() as con:
         con.execute("DELETE FROM faq_favorites WHERE faq_id=?", (int(fid),))
         cur = con.execute("DELETE FROM faq_items WHERE id=?", (int(fid),))
-        return cur.rowcount > 0
+        deleted = cur.rowcount > 0
+    FAQ_SEARCH_INDEX.remove(int(fid))
+    FAQ_LAYOUT_CACHE.clear()
+    return deleted
 
 
 def _faq_favorites_pack_pages(items: list[dict]) -> list[list[tuple[dict, str]]]:
@@ -24073,7 +26530,7 @@ def _faq_favorites_pack_pages(items: list[dict]) -> list[list[tuple[dict, str]]]
 
 
 def build_help_faq_menu(user_id: int | None = None) -> tuple[str, InlineKeyboardMarkup]:
-    count = len(db_faq_list_full())
+    count = len(faq_items_all())
     count_line = (
         f"В базе знаний: <b>{count}</b> "
         f"{ru_word_form(count, 'вопрос', 'вопроса', 'вопросов')}"
@@ -24104,7 +26561,7 @@ def build_help_faq_cards_page(
     user_id: int | None = None,
     item_source: str = "all",
 ) -> tuple[str, InlineKeyboardMarkup]:
-    pages = _faq_favorites_pack_pages(items)
+    pages = faq_layout(_faq_favorites_pack_pages, items)
     total_pages = max(1, len(pages))
     page = max(0, min(int(page), total_pages - 1))
     page_entries = pages[page]
@@ -24168,7 +26625,7 @@ def build_help_faq_answers_page(
     page: int = 0, user_id: int | None = None,
 ) -> tuple[str, InlineKeyboardMarkup]:
     return build_help_faq_cards_page(
-        db_faq_list_full(), page, callback_prefix="help:faq:answers",
+        faq_items_all(), page, callback_prefix="help:faq:answers",
         show_search=True, user_id=user_id, item_source="all",
     )
 
@@ -24514,7 +26971,7 @@ CASES_BY_ID = {item["id"]: item for item in CASES_DATA}
 def db_case_is_favorite(user_id: int | None, case_id: str) -> bool:
     if user_id is None:
         return False
-    with sqlite3.connect(DB_PATH) as con:
+    with db_connect() as con:
         row = con.execute(
             "SELECT 1 FROM case_favorites WHERE user_id=? AND case_id=?",
             (int(user_id), str(case_id)),
@@ -24526,7 +26983,7 @@ def db_case_toggle_favorite(user_id: int | None, case_id: str) -> bool:
     if user_id is None or str(case_id) not in CASES_BY_ID:
         return False
     case_id = str(case_id)
-    with sqlite3.connect(DB_PATH) as con:
+    with db_connect() as con:
         row = con.execute(
             "SELECT 1 FROM case_favorites WHERE user_id=? AND case_id=?",
             (int(user_id), case_id),
@@ -24547,7 +27004,7 @@ def db_case_toggle_favorite(user_id: int | None, case_id: str) -> bool:
 def db_case_favorites(user_id: int | None, limit: int = 100) -> list[dict]:
     if user_id is None:
         return []
-    with sqlite3.connect(DB_PATH) as con:
+    with db_connect() as con:
         rows = con.execute(
             """
             SELECT case_id
@@ -24568,7 +27025,7 @@ def db_case_favorites(user_id: int | None, limit: int = 100) -> list[dict]:
 def db_case_get_industries(user_id: int | None) -> list[str]:
     if user_id is None:
         return []
-    with sqlite3.connect(DB_PATH) as con:
+    with db_connect() as con:
         rows = con.execute(
             """
             SELECT category_key
@@ -24600,7 +27057,7 @@ def db_case_toggle_industry(
 ) -> tuple[str, list[str]]:
     if user_id is None or category_key not in CASES_CATEGORY_LABELS or category_key == "all":
         return "invalid", db_case_get_industries(user_id)
-    with sqlite3.connect(DB_PATH) as con:
+    with db_connect() as con:
         con.execute("BEGIN IMMEDIATE")
         existing = con.execute(
             """
@@ -24663,7 +27120,7 @@ def db_case_set_industry(user_id: int | None, category_key: str) -> bool:
 def db_case_clear_industry(user_id: int | None) -> bool:
     if user_id is None:
         return False
-    with sqlite3.connect(DB_PATH) as con:
+    with db_connect() as con:
         cur = con.execute(
             "DELETE FROM case_user_industry_choices WHERE user_id=?",
             (int(user_id),),
@@ -24681,15 +27138,24 @@ def _cases_normalize(value: str) -> str:
     return re.sub(r"[^0-9a-zа-я]+", " ", value).strip()
 
 
-def _cases_token_matches(token: str, search_blob: str) -> bool:
-    if token in search_blob:
-        return True
-    # Учитываем русские окончания: например, «последняя миля» и
-    # «последнюю милю» должны находиться одним запросом.
-    if len(token) < 3:
-        return False
-    stem = token[:3] if re.search(r"[а-я]", token) else token[:4]
-    return any(part.startswith(stem) for part in search_blob.split())
+# Общие слова, по которым находится любой кейс каталога.
+CASES_SEARCH_COMMON_WORDS = "кейс логистика доставка маршруты маршрутизация планирование транспорт"
+
+
+def _cases_search_index_fields(item: dict) -> list[tuple[str, float]]:
+    return [
+        (_cases_normalize(item["company"]), 3.0),
+        (_cases_normalize(item["metric"]), 2.0),
+        (_cases_normalize(item["summary"]), 1.0),
+        (_cases_normalize(" ".join(item["categories"])), 2.0),
+        (CASES_SEARCH_COMMON_WORDS, 0.5),
+    ]
+
+
+CASES_SEARCH_INDEX = SearchIndex(
+    "cases",
+    lambda: [(str(item["id"]), _cases_search_index_fields(item)) for item in CASES_DATA],
+)
 
 
 def cases_search_items(
@@ -24704,25 +27170,17 @@ def cases_search_items(
         for key in category_keys
         if key in CASES_CATEGORY_LABELS and key != "all"
     }
-    query_tokens = [token for token in _cases_normalize(query).split() if token]
+    normalized_query = _cases_normalize(query)
+    matched_ids = None
+    if normalized_query:
+        # Словоформы («последняя миля» / «последнюю милю») и опечатки
+        # учитывает общий SearchIndex.
+        matched_ids = {case_id for case_id, _score in CASES_SEARCH_INDEX.search(normalized_query)}
     result = []
     for item in CASES_DATA:
         if selected_categories and not selected_categories.intersection(item["categories"]):
             continue
-        search_blob = _cases_normalize(
-            " ".join(
-                [
-                    item["company"],
-                    item["metric"],
-                    item["summary"],
-                    " ".join(item["categories"]),
-                    "кейс логистика доставка маршруты маршрутизация планирование транспорт",
-                ]
-            )
-        )
-        if query_tokens and not all(
-            _cases_token_matches(token, search_blob) for token in query_tokens
-        ):
+        if matched_ids is not None and str(item["id"]) not in matched_ids:
             continue
         result.append(item)
     return result
@@ -25576,9 +28034,6 @@ async def cb_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # =================== END FAQ PERSONAL FAVORITES V5 ===================
 
 
-# ---------------- APP ----------------
-
-
 # ===================== INDUSTRY SPECIALISTS V2 =====================
 # Один отраслевой специалист может относиться сразу к нескольким отраслям.
 # Связи хранятся в отдельной таблице many-to-many. Старое поле industry_key
@@ -25634,61 +28089,57 @@ def industry_specialist_tg_url(value: str | None) -> str | None:
     return f"https://t.me/{mention[1:]}" if mention else None
 
 
-_industry_specialists_legacy_db_init = db_init
-
-
-def db_init():
-    _industry_specialists_legacy_db_init()
-    with sqlite3.connect(DB_PATH) as con:
-        con.execute(
-            """
-            CREATE TABLE IF NOT EXISTS industry_specialists (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                full_name TEXT NOT NULL,
-                industry_key TEXT NOT NULL,
-                telegram_link TEXT NOT NULL,
-                created_at TEXT NOT NULL,
-                updated_at TEXT NOT NULL
-            )
-            """
-        )
-        con.execute(
-            "CREATE INDEX IF NOT EXISTS idx_industry_specialists_industry "
-            "ON industry_specialists(industry_key, full_name COLLATE NOCASE)"
-        )
-        con.execute(
-            """
-            CREATE TABLE IF NOT EXISTS industry_specialist_industries (
-                specialist_id INTEGER NOT NULL,
-                industry_key TEXT NOT NULL,
-                position INTEGER NOT NULL DEFAULT 0,
-                PRIMARY KEY (specialist_id, industry_key),
-                FOREIGN KEY(specialist_id) REFERENCES industry_specialists(id) ON DELETE CASCADE
-            )
-            """
+@schema_migration(8, "industry_specialists")
+def _migrate_industry_specialists(con):
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS industry_specialists (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            full_name TEXT NOT NULL,
+            industry_key TEXT NOT NULL,
+            telegram_link TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
         )
-        con.execute(
-            "CREATE INDEX IF NOT EXISTS idx_industry_specialist_industries_key "
-            "ON industry_specialist_industries(industry_key, specialist_id)"
+        """
+    )
+    con.execute(
+        "CREATE INDEX IF NOT EXISTS idx_industry_specialists_industry "
+        "ON industry_specialists(industry_key, full_name COLLATE NOCASE)"
+    )
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS industry_specialist_industries (
+            specialist_id INTEGER NOT NULL,
+            industry_key TEXT NOT NULL,
+            position INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (specialist_id, industry_key),
+            FOREIGN KEY(specialist_id) REFERENCES industry_specialists(id) ON DELETE CASCADE
         )
+        """
+    )
+    con.execute(
+        "CREATE INDEX IF NOT EXISTS idx_industry_specialist_industries_key "
+        "ON industry_specialist_industries(industry_key, specialist_id)"
+    )
 
-        # Миграция старых записей: прежняя единственная отрасль становится
-        # первой записью в новой таблице связей. INSERT OR IGNORE безопасен
-        # при каждом перезапуске.
-        con.execute(
-            """
-            INSERT OR IGNORE INTO industry_specialist_industries(
-                specialist_id, industry_key, position
-            )
-            SELECT id, industry_key, 0
-            FROM industry_specialists
-            WHERE industry_key IS NOT NULL AND industry_key<>''
-            """
+    # Миграция старых записей: прежняя единственная отрасль становится
+    # первой записью в новой таблице связей. INSERT OR IGNORE безопасен
+    # при каждом перезапуске.
+    con.execute(
+        """
+        INSERT OR IGNORE INTO industry_specialist_industries(
+            specialist_id, industry_key, position
         )
+        SELECT id, industry_key, 0
+        FROM industry_specialists
+        WHERE industry_key IS NOT NULL AND industry_key<>''
+        """
+    )
 
 
 def db_industry_specialist_industry_keys(specialist_id: int) -> list[str]:
-    with sqlite3.connect(DB_PATH) as con:
+    with db_connect() as con:
         rows = con.execute(
             """
             SELECT industry_key
@@ -25735,7 +28186,7 @@ def db_industry_specialists_list(
     if industry_keys is not None and not clean_keys:
         return []
 
-    with sqlite3.connect(DB_PATH) as con:
+    with db_connect() as con:
         if clean_keys is not None:
             placeholders = ",".join("?" for _ in clean_keys)
             rows = con.execute(
@@ -25762,7 +28213,7 @@ def db_industry_specialists_list(
 
 
 def db_industry_specialist_get(specialist_id: int) -> dict | None:
-    with sqlite3.connect(DB_PATH) as con:
+    with db_connect() as con:
         row = con.execute(
             """
             SELECT id, full_name, industry_key, telegram_link, created_at, updated_at
@@ -25819,7 +28270,7 @@ def db_industry_specialist_add(
     if not clean_tg:
         raise ValueError("Некорректная ссылка на Telegram")
     now = datetime.utcnow().isoformat()
-    with sqlite3.connect(DB_PATH) as con:
+    with db_connect() as con:
         cur = con.execute(
             """
             INSERT INTO industry_specialists(
@@ -25870,7 +28321,7 @@ def db_industry_specialist_update(
         if not clean_industries:
             raise ValueError("Выберите хотя бы одну отрасль")
 
-    with sqlite3.connect(DB_PATH) as con:
+    with db_connect() as con:
         cur = con.execute(
             """
             UPDATE industry_specialists
@@ -25894,7 +28345,7 @@ def db_industry_specialist_update(
 
 
 def db_industry_specialist_delete(specialist_id: int) -> bool:
-    with sqlite3.connect(DB_PATH) as con:
+    with db_connect() as con:
         con.execute(
             "DELETE FROM industry_specialist_industries WHERE specialist_id=?",
             (int(specialist_id),),
@@ -27542,35 +29993,32 @@ async def cb_help(
 
 # ============== CALENDAR PLANNING EXPERTS V1 ==============
 
-_calendar_experts_previous_db_init = db_init
-
 
-def db_init():
-    _calendar_experts_previous_db_init()
-    with sqlite3.connect(DB_PATH) as con:
-        try:
-            con.execute(
-                "ALTER TABLE industry_specialists "
-                "ADD COLUMN is_calendar_planning_expert "
-                "INTEGER NOT NULL DEFAULT 0"
-            )
-        except sqlite3.OperationalError:
-            pass
-        con.execute(
-            "UPDATE industry_specialists "
-            "SET is_calendar_planning_expert=0 "
-            "WHERE is_calendar_planning_expert IS NULL"
-        )
+@schema_migration(9, "calendar_experts")
+def _migrate_calendar_experts(con):
+    try:
         con.execute(
-            "CREATE INDEX IF NOT EXISTS "
-            "idx_industry_specialists_calendar_expert "
-            "ON industry_specialists("
-            "is_calendar_planning_expert, full_name COLLATE NOCASE)"
+            "ALTER TABLE industry_specialists "
+            "ADD COLUMN is_calendar_planning_expert "
+            "INTEGER NOT NULL DEFAULT 0"
         )
+    except sqlite3.OperationalError:
+        pass
+    con.execute(
+        "UPDATE industry_specialists "
+        "SET is_calendar_planning_expert=0 "
+        "WHERE is_calendar_planning_expert IS NULL"
+    )
+    con.execute(
+        "CREATE INDEX IF NOT EXISTS "
+        "idx_industry_specialists_calendar_expert "
+        "ON industry_specialists("
+        "is_calendar_planning_expert, full_name COLLATE NOCASE)"
+    )
 
 
 def db_calendar_planning_expert_is(specialist_id: int) -> bool:
-    with sqlite3.connect(DB_PATH) as con:
+    with db_connect() as con:
         row = con.execute(
             """
             SELECT COALESCE(is_calendar_planning_expert, 0)
@@ -27586,7 +30034,7 @@ def db_calendar_planning_expert_set(
     specialist_id: int,
     enabled: bool,
 ) -> bool:
-    with sqlite3.connect(DB_PATH) as con:
+    with db_connect() as con:
         cur = con.execute(
             """
             UPDATE industry_specialists
@@ -27615,7 +30063,7 @@ def db_calendar_planning_expert_toggle(
 
 
 def db_calendar_planning_experts_list() -> list[dict]:
-    with sqlite3.connect(DB_PATH) as con:
+    with db_connect() as con:
         rows = con.execute(
             """
             SELECT id
@@ -28051,6 +30499,7 @@ def _calendar_planning_case_upsert(item: dict):
     else:
         CASES_DATA[existing_index] = item
     CASES_BY_ID[case_id] = item
+    CASES_SEARCH_INDEX.add(case_id, _cases_search_index_fields(item))
 
 
 _calendar_planning_case_upsert(
@@ -29007,8 +31456,6 @@ async def cb_help(
 
 # ====================== VIDEO GUIDES + FINAL MAIN MENU V1 ======================
 
-BUILD_VERSION = "FAQ-NUMBERED-LIST-2026-07-29-V25"
-
 VIDEO_GUIDE_STATE = "video_guide_state"
 VIDEO_GUIDE_DRAFT = "video_guide_draft"
 VIDEO_GUIDE_TITLE_MAX = 80
@@ -29020,35 +31467,30 @@ def _video_guides_clear_flow(context: ContextTypes.DEFAULT_TYPE):
     context.user_data.pop(VIDEO_GUIDE_DRAFT, None)
 
 
-_video_guides_previous_db_init = db_init
-
-
-def db_init():
-    """Инициализирует прежнюю схему и таблицу видео-инструкций."""
-    _video_guides_previous_db_init()
-    with sqlite3.connect(DB_PATH) as con:
-        con.execute(
-            """
-            CREATE TABLE IF NOT EXISTS video_guides (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT NOT NULL,
-                description TEXT NOT NULL,
-                video_file_id TEXT NOT NULL,
-                video_file_unique_id TEXT,
-                duration_sec INTEGER,
-                position INTEGER NOT NULL DEFAULT 0,
-                is_published INTEGER NOT NULL DEFAULT 1,
-                created_by INTEGER,
-                created_at TEXT NOT NULL,
-                updated_at TEXT NOT NULL
-            )
-            """
-        )
-        con.execute(
-            "CREATE INDEX IF NOT EXISTS idx_video_guides_visible "
-            "ON video_guides(is_published, position, id)"
+@schema_migration(10, "video_guides")
+def _migrate_video_guides(con):
+    """Таблица видео-инструкций."""
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS video_guides (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            description TEXT NOT NULL,
+            video_file_id TEXT NOT NULL,
+            video_file_unique_id TEXT,
+            duration_sec INTEGER,
+            position INTEGER NOT NULL DEFAULT 0,
+            is_published INTEGER NOT NULL DEFAULT 1,
+            created_by INTEGER,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
         )
-        con.commit()
+        """
+    )
+    con.execute(
+        "CREATE INDEX IF NOT EXISTS idx_video_guides_visible "
+        "ON video_guides(is_published, position, id)"
+    )
 
 
 def _video_guide_row(row) -> dict | None:
@@ -29079,7 +31521,7 @@ def db_video_guides_list(published_only: bool = False) -> list[dict]:
     if published_only:
         sql += " WHERE is_published=1"
     sql += " ORDER BY position ASC, id ASC"
-    with sqlite3.connect(DB_PATH) as con:
+    with db_connect() as con:
         rows = con.execute(sql, params).fetchall()
     return [_video_guide_row(row) for row in rows]
 
@@ -29093,7 +31535,7 @@ def db_video_guide_get(guide_id: int, published_only: bool = False) -> dict | No
     params: list = [int(guide_id)]
     if published_only:
         sql += " AND is_published=1"
-    with sqlite3.connect(DB_PATH) as con:
+    with db_connect() as con:
         row = con.execute(sql, tuple(params)).fetchone()
     return _video_guide_row(row)
 
@@ -29107,7 +31549,7 @@ def db_video_guide_add(
     created_by: int | None,
 ) -> int:
     now = datetime.utcnow().isoformat()
-    with sqlite3.connect(DB_PATH) as con:
+    with db_connect() as con:
         row = con.execute(
             "SELECT COALESCE(MAX(position), 0) FROM video_guides"
         ).fetchone()
@@ -29149,7 +31591,7 @@ def db_video_guide_update_text(
     fields.append("updated_at=?")
     values.append(datetime.utcnow().isoformat())
     values.append(int(guide_id))
-    with sqlite3.connect(DB_PATH) as con:
+    with db_connect() as con:
         cur = con.execute(
             f"UPDATE video_guides SET {', '.join(fields)} WHERE id=?",
             tuple(values),
@@ -29164,7 +31606,7 @@ def db_video_guide_replace_video(
     video_file_unique_id: str | None,
     duration_sec: int | None,
 ) -> bool:
-    with sqlite3.connect(DB_PATH) as con:
+    with db_connect() as con:
         cur = con.execute(
             """
             UPDATE video_guides
@@ -29184,7 +31626,7 @@ def db_video_guide_replace_video(
 
 
 def db_video_guide_toggle_published(guide_id: int) -> bool | None:
-    with sqlite3.connect(DB_PATH) as con:
+    with db_connect() as con:
         row = con.execute(
             "SELECT is_published FROM video_guides WHERE id=?",
             (int(guide_id),),
@@ -29201,7 +31643,7 @@ def db_video_guide_toggle_published(guide_id: int) -> bool | None:
 
 
 def db_video_guide_delete(guide_id: int) -> bool:
-    with sqlite3.connect(DB_PATH) as con:
+    with db_connect() as con:
         cur = con.execute("DELETE FROM video_guides WHERE id=?", (int(guide_id),))
         con.commit()
         return cur.rowcount > 0
@@ -29217,7 +31659,7 @@ def db_video_guide_move(guide_id: int, direction: int) -> bool:
         return False
     current = items[index]
     target = items[target_index]
-    with sqlite3.connect(DB_PATH) as con:
+    with db_connect() as con:
         con.execute(
             "UPDATE video_guides SET position=?, updated_at=? WHERE id=?",
             (target["position"], datetime.utcnow().isoformat(), current["id"]),
@@ -29941,24 +32383,12 @@ def _faq_search_normalize(value: str | None) -> str:
 
 
 def faq_search_items(query: str) -> list[dict]:
-    """Ищет все слова запроса в вопросе и ответе без учёта регистра и знаков."""
-    tokens = [
-        token
-        for token in _faq_search_normalize(query).split()
-        if len(token) >= 2
-    ]
-    if not tokens:
-        return []
-
-    result: list[dict] = []
-    for item in db_faq_list_full():
-        haystack = _faq_search_normalize(
-            f"{faq_plain_text(item.get('question'))} "
-            f"{faq_plain_text(item.get('answer'))}"
-        )
-        if all(token in haystack for token in tokens):
-            result.append(item)
-    return result
+    """Ищет все слова запроса в вопросе и ответе с учётом словоформ и опечаток."""
+    matched_ids = {
+        int(fid)
+        for fid, _score in FAQ_SEARCH_INDEX.search(_faq_search_normalize(query), min_word_len=2)
+    }
+    return db_faq_list_by_ids(sorted(matched_ids))
 
 
 def _faq_question_label(item: dict, limit: int = 56) -> str:
@@ -29969,6 +32399,18 @@ def _faq_question_label(item: dict, limit: int = 56) -> str:
     return question
 
 
+def _faq_list_pages(items: list[dict]) -> list[list[tuple[int, int, str]]]:
+    """Страницы списка: (id, номер вопроса, вопрос одной строкой)."""
+    entries = []
+    for number, item in enumerate(items, start=1):
+        question = faq_plain_text(item.get("question")) or "Без названия"
+        entries.append((int(item["id"]), number, re.sub(r"\s+", " ", question).strip()))
+    return [
+        entries[start:start + FAQ_LIST_PAGE_SIZE]
+        for start in range(0, len(entries), FAQ_LIST_PAGE_SIZE)
+    ] or [[]]
+
+
 def build_help_faq_cards_page(
     items: list[dict],
     page: int = 0,
@@ -29988,10 +32430,9 @@ def build_help_faq_cards_page(
     номер соответствующего вопроса.
     """
     total_items = len(items)
-    total_pages = max(1, (total_items + FAQ_LIST_PAGE_SIZE - 1) // FAQ_LIST_PAGE_SIZE)
+    pages = faq_layout(_faq_list_pages, items)
+    total_pages = len(pages)
     page = max(0, min(int(page), total_pages - 1))
-    start = page * FAQ_LIST_PAGE_SIZE
-    page_items = items[start:start + FAQ_LIST_PAGE_SIZE]
 
     text_lines = [f"<b>{title}</b>"]
     if subtitle:
@@ -30007,11 +32448,7 @@ def build_help_faq_cards_page(
         text_lines.extend(["", "По вашему запросу ничего не найдено."])
 
     open_buttons: list[InlineKeyboardButton] = []
-    for local_index, item in enumerate(page_items, start=1):
-        faq_id = int(item["id"])
-        question_number = start + local_index
-        question = faq_plain_text(item.get("question")) or "Без названия"
-        question = re.sub(r"\s+", " ", question).strip()
+    for faq_id, question_number, question in pages[page]:
         favorite = "★ " if db_faq_is_favorite(user_id, faq_id) else ""
 
         # В тексте сообщения вопрос виден полностью и переносится по словам.
@@ -30076,7 +32513,7 @@ def build_help_faq_answers_page(
     user_id: int | None = None,
 ) -> tuple[str, InlineKeyboardMarkup]:
     return build_help_faq_cards_page(
-        db_faq_list_full(),
+        faq_items_all(),
         page,
         title="❓ Частые вопросы",
         callback_prefix="help:faq:answers",
@@ -30254,7 +32691,7 @@ async def cb_help(
     if data == "help:faq" or data == "help:faq:answers":
         clear_faq_search_flow(context)
         await query.answer()
-        text, keyboard = build_help_faq_answers_page(0, user_id)
+        text, keyboard = await db.call(build_help_faq_answers_page, 0, user_id)
         await query.edit_message_text(
             text,
             parse_mode=ParseMode.HTML,
@@ -30270,7 +32707,7 @@ async def cb_help(
         except (TypeError, ValueError):
             page = 0
         await query.answer()
-        text, keyboard = build_help_faq_answers_page(page, user_id)
+        text, keyboard = await db.call(build_help_faq_answers_page, page, user_id)
         await query.edit_message_text(
             text,
             parse_mode=ParseMode.HTML,
@@ -30286,8 +32723,9 @@ async def cb_help(
         except (TypeError, ValueError):
             page = 0
         await query.answer()
-        text, keyboard = build_help_faq_cards_page(
-            db_faq_favorites(user_id),
+        text, keyboard = await db.call(
+            build_help_faq_cards_page,
+            await db.call(db_faq_favorites, user_id),
             page,
             title="⭐ Избранные вопросы",
             callback_prefix="help:faq:favorites",
@@ -30341,7 +32779,7 @@ async def cb_help(
         except (TypeError, ValueError):
             page = 0
         await query.answer()
-        text, keyboard = build_help_faq_search_page(query_text, page, user_id)
+        text, keyboard = await db.call(build_help_faq_search_page, query_text, page, user_id)
         await query.edit_message_text(
             text,
             parse_mode=ParseMode.HTML,
@@ -30363,10 +32801,10 @@ async def cb_help(
         if source not in {"all", "search", "favorites"}:
             source = "all"
 
-        item = db_faq_get(faq_id)
+        item = await db.call(db_faq_get, faq_id)
         if not item:
             await query.answer("Вопрос уже удалён", show_alert=True)
-            text, keyboard = build_help_faq_answers_page(0, user_id)
+            text, keyboard = await db.call(build_help_faq_answers_page, 0, user_id)
             await query.edit_message_text(
                 text,
                 parse_mode=ParseMode.HTML,
@@ -30381,7 +32819,8 @@ async def cb_help(
         await query.edit_message_text(
             pages[answer_page],
             parse_mode=ParseMode.HTML,
-            reply_markup=kb_faq_item(
+            reply_markup=await db.call(
+                kb_faq_item,
                 faq_id,
                 list_page,
                 user_id,
@@ -30407,12 +32846,12 @@ async def cb_help(
         if source not in {"all", "search", "favorites"}:
             source = "all"
 
-        item = db_faq_get(faq_id)
+        item = await db.call(db_faq_get, faq_id)
         if not item:
             await query.answer("Вопрос уже удалён", show_alert=True)
             return
 
-        enabled = db_faq_toggle_favorite(user_id, faq_id)
+        enabled = await db.write(db_faq_toggle_favorite, user_id, faq_id)
         pages = _faq_item_parts(item)
         answer_page = min(answer_page, len(pages) - 1)
         await query.answer(
@@ -30420,7 +32859,8 @@ async def cb_help(
         )
         try:
             await query.edit_message_reply_markup(
-                reply_markup=kb_faq_item(
+                reply_markup=await db.call(
+                    kb_faq_item,
                     faq_id,
                     list_page,
                     user_id,
@@ -30465,7 +32905,8 @@ async def on_text(
     context.user_data.pop(WAITING_FAQ_SEARCH, None)
     context.user_data[FAQ_SEARCH_QUERY] = query_text
     user_id = update.effective_user.id
-    result_text, result_keyboard = build_help_faq_search_page(
+    result_text, result_keyboard = await db.call(
+        build_help_faq_search_page,
         query_text,
         0,
         user_id,
@@ -30484,8 +32925,6 @@ async def on_text(
 # Изолированный модуль рейтингов. Он добавлен поверх существующих обработчиков,
 # чтобы не менять уже работающие сценарии большого монолитного файла.
 
-BUILD_VERSION = "TEAM-LEADERS-2026-07-30-MRR-DEMO-NOTE"
-
 LEADERBOARD_FLOW_KEY = "team_leaderboard_flow_v1"
 LEADERBOARD_PREVIEW_MEDIA_MESSAGE_ID = "team_leaderboard_preview_media_message_id"
 LEADERBOARD_PROFILE_PAGE_SIZE = 8
@@ -30515,63 +32954,54 @@ LEADERBOARD_MONTHS_RU = (
 )
 
 
-# ---------- DB schema wrapper ----------
-_leaderboard_previous_db_init = db_init
-
-
-def db_init():
-    _leaderboard_previous_db_init()
-    con = sqlite3.connect(DB_PATH)
-    try:
-        con.execute("PRAGMA foreign_keys=ON")
-        cur = con.cursor()
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS leaderboards (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                period_type TEXT NOT NULL CHECK(period_type IN ('week', 'month')),
-                period_start TEXT NOT NULL,
-                period_end TEXT NOT NULL,
-                metric_type TEXT NOT NULL CHECK(metric_type IN ('mrr', 'leads')),
-                congratulation_html TEXT NOT NULL,
-                media_type TEXT,
-                media_file_id TEXT,
-                media_file_name TEXT,
-                status TEXT NOT NULL DEFAULT 'published',
-                created_by INTEGER,
-                created_at TEXT NOT NULL,
-                published_at TEXT
-            )
-            """
-        )
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS leaderboard_entries (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                leaderboard_id INTEGER NOT NULL,
-                profile_id INTEGER NOT NULL,
-                profile_name TEXT NOT NULL,
-                place INTEGER NOT NULL CHECK(place BETWEEN 1 AND 5),
-                metric_value INTEGER NOT NULL CHECK(metric_value >= 0),
-                metric_display TEXT NOT NULL,
-                UNIQUE(leaderboard_id, place),
-                UNIQUE(leaderboard_id, profile_id),
-                FOREIGN KEY(leaderboard_id) REFERENCES leaderboards(id) ON DELETE CASCADE,
-                FOREIGN KEY(profile_id) REFERENCES profiles(id) ON DELETE RESTRICT
-            )
-            """
-        )
-        cur.execute(
-            "CREATE INDEX IF NOT EXISTS idx_leaderboards_latest "
-            "ON leaderboards(status, period_type, metric_type, published_at DESC, id DESC)"
+# ---------- DB schema ----------
+@schema_migration(11, "leaderboards")
+def _migrate_leaderboards(con):
+    cur = con.cursor()
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS leaderboards (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            period_type TEXT NOT NULL CHECK(period_type IN ('week', 'month')),
+            period_start TEXT NOT NULL,
+            period_end TEXT NOT NULL,
+            metric_type TEXT NOT NULL CHECK(metric_type IN ('mrr', 'leads')),
+            congratulation_html TEXT NOT NULL,
+            media_type TEXT,
+            media_file_id TEXT,
+            media_file_name TEXT,
+            status TEXT NOT NULL DEFAULT 'published',
+            created_by INTEGER,
+            created_at TEXT NOT NULL,
+            published_at TEXT
         )
-        cur.execute(
-            "CREATE INDEX IF NOT EXISTS idx_leaderboard_entries_board_place "
-            "ON leaderboard_entries(leaderboard_id, place)"
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS leaderboard_entries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            leaderboard_id INTEGER NOT NULL,
+            profile_id INTEGER NOT NULL,
+            profile_name TEXT NOT NULL,
+            place INTEGER NOT NULL CHECK(place BETWEEN 1 AND 5),
+            metric_value INTEGER NOT NULL CHECK(metric_value >= 0),
+            metric_display TEXT NOT NULL,
+            UNIQUE(leaderboard_id, place),
+            UNIQUE(leaderboard_id, profile_id),
+            FOREIGN KEY(leaderboard_id) REFERENCES leaderboards(id) ON DELETE CASCADE,
+            FOREIGN KEY(profile_id) REFERENCES profiles(id) ON DELETE RESTRICT
         )
-        con.commit()
-    finally:
-        con.close()
+        """
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_leaderboards_latest "
+        "ON leaderboards(status, period_type, metric_type, published_at DESC, id DESC)"
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_leaderboard_entries_board_place "
+        "ON leaderboard_entries(leaderboard_id, place)"
+    )
 
 
 def _leaderboard_row_to_dict(row) -> dict | None:
@@ -30618,7 +33048,7 @@ def _db_leaderboard_entries(con: sqlite3.Connection, leaderboard_id: int) -> lis
 
 
 def db_leaderboard_get(leaderboard_id: int) -> dict | None:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     try:
         cur = con.cursor()
         cur.execute(
@@ -30642,7 +33072,7 @@ def db_leaderboard_get(leaderboard_id: int) -> dict | None:
 def db_leaderboard_latest(period_type: str, metric_type: str) -> dict | None:
     if period_type not in LEADERBOARD_PERIOD_TITLES or metric_type not in LEADERBOARD_METRIC_TITLES:
         return None
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     try:
         cur = con.cursor()
         cur.execute(
@@ -30666,7 +33096,7 @@ def db_leaderboard_latest(period_type: str, metric_type: str) -> dict | None:
 
 
 def db_leaderboards_history(limit: int = 12) -> list[dict]:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     try:
         cur = con.cursor()
         cur.execute(
@@ -30696,7 +33126,7 @@ def db_leaderboard_publish(flow: dict, created_by: int | None) -> int:
 
     now = datetime.utcnow().isoformat()
     media = flow.get("media") or {}
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     try:
         con.execute("PRAGMA foreign_keys=ON")
         cur = con.cursor()
@@ -31069,6 +33499,7 @@ def kb_leaderboard_history(items: list[dict]) -> InlineKeyboardMarkup:
 _leaderboard_previous_kb_help_team = kb_help_team
 
 
+@cached_keyboard("profiles", daily=True)
 def kb_help_team(page: int = 0, can_create_profile: bool = False):
     markup = _leaderboard_previous_kb_help_team(page=page, can_create_profile=can_create_profile)
     rows = [list(row) for row in markup.inline_keyboard]
@@ -31080,6 +33511,7 @@ def kb_help_team(page: int = 0, can_create_profile: bool = False):
 _leaderboard_previous_kb_help_settings = kb_help_settings
 
 
+@cached_keyboard()
 def kb_help_settings():
     markup = _leaderboard_previous_kb_help_settings()
     rows = [list(row) for row in markup.inline_keyboard]
@@ -31733,44 +34165,34 @@ async def on_video(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # ================= END TEAM LEADERS / LEADERBOARDS V1 =================
 
+
 # =================== TEAM LEADERS / LEADERBOARDS V2 ===================
 # Сохранение результатов и рассылка разделены:
 # - «Сохранить» сразу делает результат доступным сотрудникам;
 # - сохранённый результат можно повторно открыть и отредактировать;
 # - рассылка запускается отдельной кнопкой в любой удобный момент.
 
-BUILD_VERSION = "TEAM-LEADERS-2026-07-30-V2-SAVE-SEPARATE"
-
 
 # ---------- DB migrations and delivery history ----------
-_leaderboard_v2_previous_db_init = db_init
-
-
-def db_init():
-    _leaderboard_v2_previous_db_init()
-    con = sqlite3.connect(DB_PATH)
-    try:
-        con.execute("PRAGMA foreign_keys=ON")
-        con.execute(
-            """
-            CREATE TABLE IF NOT EXISTS leaderboard_deliveries (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                leaderboard_id INTEGER NOT NULL,
-                sent_by INTEGER,
-                sent_at TEXT NOT NULL,
-                success_count INTEGER NOT NULL DEFAULT 0,
-                failure_count INTEGER NOT NULL DEFAULT 0,
-                FOREIGN KEY(leaderboard_id) REFERENCES leaderboards(id) ON DELETE CASCADE
-            )
-            """
-        )
-        con.execute(
-            "CREATE INDEX IF NOT EXISTS idx_leaderboard_deliveries_board_time "
-            "ON leaderboard_deliveries(leaderboard_id, sent_at DESC, id DESC)"
+@schema_migration(12, "leaderboard_deliveries")
+def _migrate_leaderboard_deliveries(con):
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS leaderboard_deliveries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            leaderboard_id INTEGER NOT NULL,
+            sent_by INTEGER,
+            sent_at TEXT NOT NULL,
+            success_count INTEGER NOT NULL DEFAULT 0,
+            failure_count INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY(leaderboard_id) REFERENCES leaderboards(id) ON DELETE CASCADE
         )
-        con.commit()
-    finally:
-        con.close()
+        """
+    )
+    con.execute(
+        "CREATE INDEX IF NOT EXISTS idx_leaderboard_deliveries_board_time "
+        "ON leaderboard_deliveries(leaderboard_id, sent_at DESC, id DESC)"
+    )
 
 
 def _leaderboard_validate_flow(flow: dict):
@@ -31796,7 +34218,7 @@ def db_leaderboard_save(flow: dict, saved_by: int | None) -> int:
     leaderboard_id = flow.get("leaderboard_id")
     now = datetime.utcnow().isoformat()
 
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     try:
         con.execute("PRAGMA foreign_keys=ON")
         cur = con.cursor()
@@ -31891,7 +34313,7 @@ def db_leaderboard_record_delivery(
     success_count: int,
     failure_count: int,
 ):
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     try:
         con.execute(
             """
@@ -31913,7 +34335,7 @@ def db_leaderboard_record_delivery(
 
 
 def db_leaderboard_last_delivery(leaderboard_id: int) -> dict | None:
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     try:
         cur = con.cursor()
         cur.execute(
@@ -32312,14 +34734,10 @@ async def cb_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
 #   «Сделать рассылку» и не изменяют сохранённый результат;
 # - первое место может занимать от одного до трёх сотрудников.
 
-BUILD_VERSION = "TEAM-LEADERS-2026-07-30-V3-BROADCAST-COMPOSER-TIES"
 LEADERBOARD_FIRST_PLACE_MAX = 3
 
 
 # ---------- DB migration: несколько сотрудников на одном месте ----------
-_leaderboard_v3_previous_db_init = db_init
-
-
 def _leaderboard_entries_allow_shared_first_place(con: sqlite3.Connection):
     cur = con.cursor()
     cur.execute(
@@ -32331,65 +34749,53 @@ def _leaderboard_entries_allow_shared_first_place(con: sqlite3.Connection):
     if "unique(leaderboard_id,place)" not in normalized:
         return
 
+    # Пересборка идёт в транзакции шага миграции; FK на это время
+    # выключены в db_migrate.
     logger.info("Migrating leaderboard_entries: enabling shared first place")
-    con.execute("PRAGMA foreign_keys=OFF")
-    try:
-        cur.execute("BEGIN")
-        cur.execute(
-            "ALTER TABLE leaderboard_entries RENAME TO leaderboard_entries_v2_legacy"
-        )
-        cur.execute(
-            """
-            CREATE TABLE leaderboard_entries (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                leaderboard_id INTEGER NOT NULL,
-                profile_id INTEGER NOT NULL,
-                profile_name TEXT NOT NULL,
-                place INTEGER NOT NULL CHECK(place BETWEEN 1 AND 5),
-                metric_value INTEGER NOT NULL CHECK(metric_value >= 0),
-                metric_display TEXT NOT NULL,
-                UNIQUE(leaderboard_id, profile_id),
-                FOREIGN KEY(leaderboard_id) REFERENCES leaderboards(id) ON DELETE CASCADE,
-                FOREIGN KEY(profile_id) REFERENCES profiles(id) ON DELETE RESTRICT
-            )
-            """
-        )
-        cur.execute(
-            """
-            INSERT INTO leaderboard_entries(
-                id, leaderboard_id, profile_id, profile_name, place,
-                metric_value, metric_display
-            )
-            SELECT id, leaderboard_id, profile_id, profile_name, place,
-                   metric_value, metric_display
-            FROM leaderboard_entries_v2_legacy
-            """
+    cur.execute(
+        "ALTER TABLE leaderboard_entries RENAME TO leaderboard_entries_v2_legacy"
+    )
+    cur.execute(
+        """
+        CREATE TABLE leaderboard_entries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            leaderboard_id INTEGER NOT NULL,
+            profile_id INTEGER NOT NULL,
+            profile_name TEXT NOT NULL,
+            place INTEGER NOT NULL CHECK(place BETWEEN 1 AND 5),
+            metric_value INTEGER NOT NULL CHECK(metric_value >= 0),
+            metric_display TEXT NOT NULL,
+            UNIQUE(leaderboard_id, profile_id),
+            FOREIGN KEY(leaderboard_id) REFERENCES leaderboards(id) ON DELETE CASCADE,
+            FOREIGN KEY(profile_id) REFERENCES profiles(id) ON DELETE RESTRICT
         )
-        cur.execute("DROP TABLE leaderboard_entries_v2_legacy")
-        cur.execute(
-            "CREATE INDEX IF NOT EXISTS idx_leaderboard_entries_board_place "
-            "ON leaderboard_entries(leaderboard_id, place, id)"
+        """
+    )
+    cur.execute(
+        """
+        INSERT INTO leaderboard_entries(
+            id, leaderboard_id, profile_id, profile_name, place,
+            metric_value, metric_display
         )
-        con.commit()
-    except Exception:
-        con.rollback()
-        raise
-    finally:
-        con.execute("PRAGMA foreign_keys=ON")
+        SELECT id, leaderboard_id, profile_id, profile_name, place,
+               metric_value, metric_display
+        FROM leaderboard_entries_v2_legacy
+        """
+    )
+    cur.execute("DROP TABLE leaderboard_entries_v2_legacy")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_leaderboard_entries_board_place "
+        "ON leaderboard_entries(leaderboard_id, place, id)"
+    )
 
 
-def db_init():
-    _leaderboard_v3_previous_db_init()
-    con = sqlite3.connect(DB_PATH)
-    try:
-        _leaderboard_entries_allow_shared_first_place(con)
-        con.execute(
-            "CREATE INDEX IF NOT EXISTS idx_leaderboard_entries_board_place "
-            "ON leaderboard_entries(leaderboard_id, place, id)"
-        )
-        con.commit()
-    finally:
-        con.close()
+@schema_migration(13, "leaderboard_shared_places")
+def _migrate_leaderboard_shared_places(con):
+    _leaderboard_entries_allow_shared_first_place(con)
+    con.execute(
+        "CREATE INDEX IF NOT EXISTS idx_leaderboard_entries_board_place "
+        "ON leaderboard_entries(leaderboard_id, place, id)"
+    )
 
 
 # ---------- DB helpers ----------
@@ -32464,7 +34870,7 @@ def db_leaderboard_save(flow: dict, saved_by: int | None) -> int:
     leaderboard_id = flow.get("leaderboard_id")
     now = datetime.utcnow().isoformat()
 
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     try:
         con.execute("PRAGMA foreign_keys=ON")
         cur = con.cursor()
@@ -33425,7 +35831,6 @@ async def on_video(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # - поздравительный текст и обязательное фото вводятся только перед отправкой;
 # - итог отправляется одним сообщением: фото с HTML-подписью.
 
-BUILD_VERSION = "TEAM-LEADERS-2026-07-30-V4-COMBINED-PERIOD-BROADCAST"
 LEADERBOARD_METRIC_TITLES["leads"] = "Количество"
 LEADERBOARD_COMBINED_CAPTION_MAX = 900
 LEADERBOARD_COMBINED_PLACE_EMOJIS = {
@@ -33449,7 +35854,7 @@ def db_leaderboard_for_range(
         return None
     if metric_type not in LEADERBOARD_METRIC_TITLES:
         return None
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     try:
         cur = con.cursor()
         cur.execute(
@@ -34183,8 +36588,6 @@ async def on_video(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # - при редактировании период автоматически становится текущей неделей/месяцем;
 # - для каждой пары период + показатель хранится только один актуальный результат.
 
-BUILD_VERSION = "TEAM-LEADERS-2026-07-30-V5-PARTIAL-EDIT"
-
 
 def _leaderboard_refresh_flow_period(flow: dict):
     """Подставляет границы текущей недели или месяца в редактируемый результат."""
@@ -34368,7 +36771,7 @@ _leaderboard_v5_previous_db_leaderboard_save = db_leaderboard_save
 
 def db_leaderboard_save(flow: dict, saved_by: int | None) -> int:
     result_id = _leaderboard_v5_previous_db_leaderboard_save(flow, saved_by)
-    con = sqlite3.connect(DB_PATH)
+    con = db_connect()
     try:
         con.execute("PRAGMA foreign_keys=ON")
         con.execute(
@@ -34649,6 +37052,7 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # ================= END TEAM LEADERS / LEADERBOARDS V5 =================
 
+
 # ================= TEAM LEADERS / LEADERBOARDS V6 =================
 # Гибкий состав каждого места:
 # - на любом из мест с 1-го по 5-е может быть от одного до трёх сотрудников;
@@ -34657,7 +37061,6 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # - при точечном редактировании можно добавить или убрать участника конкретного
 #   места, не пересобирая остальные результаты.
 
-BUILD_VERSION = "TEAM-LEADERS-2026-07-30-V6-FLEXIBLE-PLACE-MEMBERS"
 LEADERBOARD_PLACE_MAX = 3
 LEADERBOARD_FIRST_PLACE_MAX = LEADERBOARD_PLACE_MAX  # обратная совместимость
 
@@ -35579,6 +37982,7 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # ================= END TEAM LEADERS / LEADERBOARDS V6 =================
 
+
 # ================= TEAM LEADERS / LEADERBOARDS V7 =================
 # Точечная замена и удаление выбранного участника рейтинга:
 # - если на месте несколько сотрудников, администратор сначала выбирает
@@ -35586,8 +37990,6 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # - замена сохраняет место, но запрашивает показатель нового сотрудника;
 # - последнего сотрудника с места удалить нельзя.
 
-BUILD_VERSION = "TEAM-LEADERS-2026-07-30-V7-MEMBER-REMOVE-REPLACE"
-
 
 def kb_leaderboard_employee_actions(profile_id: int) -> InlineKeyboardMarkup:
     """Действия над одним конкретным участником рейтинга."""
@@ -36043,6 +38445,7 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # ================= END TEAM LEADERS / LEADERBOARDS V7 =================
 
+
 # ================= TEAM LEADERS / LEADERBOARDS V8 =================
 # Неполные и временно пустые рейтинги:
 # - можно сохранить только фактически занятые места (например, только первое);
@@ -36052,7 +38455,6 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
 #   сотрудники видят сообщение, что рейтинг появится позже;
 # - единственного участника можно удалить с последнего занятого места.
 
-BUILD_VERSION = "EPHEMERAL-COMMAND-REPLY-FIX-2026-07-30-V29"
 LEADERBOARD_EMPTY_TEXT = "⏳ <b>Рейтинг будет опубликован позже.</b>"
 
 
@@ -36550,6 +38952,7 @@ async def cb_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # ================= END TEAM LEADERS / LEADERBOARDS V8 =================
 
+
 # ================= DOCUMENT PLACEMENT IN SECTIONS V2 =================
 # Один документ хранится в docs один раз и может быть показан в нескольких
 # продуктовых разделах. Для каждой привязки сохраняется собственный текст
@@ -36627,7 +39030,7 @@ def db_document_section_list(section_key: str) -> list[dict]:
     key = _document_section_key(section_key)
     if not key:
         return []
-    with sqlite3.connect(DB_PATH) as con:
+    with db_connect() as con:
         rows = con.execute(
             """
             SELECT d.id, d.category_id, d.title, d.description, d.file_id,
@@ -36672,7 +39075,7 @@ def db_document_section_add(
         return False
     did = int(doc_id)
     now = datetime.utcnow().isoformat()
-    with sqlite3.connect(DB_PATH) as con:
+    with db_connect() as con:
         row = con.execute(
             "SELECT id, title FROM docs WHERE id=?",
             (did,),
@@ -36725,7 +39128,7 @@ def db_document_section_set_button_label(
         or len(clean_label) > DOCUMENT_SECTION_BUTTON_MAX_LENGTH
     ):
         return False
-    with sqlite3.connect(DB_PATH) as con:
+    with db_connect() as con:
         cur = con.execute(
             """
             UPDATE document_section_links
@@ -36742,7 +39145,7 @@ def db_document_section_remove(section_key: str, doc_id: int) -> bool:
     key = _document_section_key(section_key)
     if not key:
         return False
-    with sqlite3.connect(DB_PATH) as con:
+    with db_connect() as con:
         cur = con.execute(
             "DELETE FROM document_section_links WHERE section_key=? AND doc_id=?",
             (key, int(doc_id)),
@@ -36780,7 +39183,7 @@ def _seed_legacy_document_sections():
             document = db_industry_document_find(tuple(slot.get("aliases") or ()))
             if not document:
                 continue
-            with sqlite3.connect(DB_PATH) as con:
+            with db_connect() as con:
                 existing_row = con.execute(
                     "SELECT button_label FROM document_section_links "
                     "WHERE section_key=? AND doc_id=?",
@@ -36808,7 +39211,7 @@ def _backfill_document_section_button_labels():
     # Сначала проставляем известные точные подписи старых кнопок.
     _seed_legacy_document_sections()
     # Остальным связям даём безопасную универсальную подпись.
-    with sqlite3.connect(DB_PATH) as con:
+    with db_connect() as con:
         con.execute(
             """
             UPDATE document_section_links
@@ -36822,37 +39225,38 @@ def _backfill_document_section_button_labels():
         con.commit()
 
 
-_document_sections_previous_db_init = db_init
-
-
-def db_init():
-    _document_sections_previous_db_init()
-    with sqlite3.connect(DB_PATH) as con:
-        con.execute(
-            """
-            CREATE TABLE IF NOT EXISTS document_section_links (
-                section_key TEXT NOT NULL,
-                doc_id INTEGER NOT NULL,
-                position INTEGER NOT NULL DEFAULT 0,
-                added_by INTEGER,
-                added_at TEXT NOT NULL,
-                button_label TEXT,
-                PRIMARY KEY (section_key, doc_id),
-                FOREIGN KEY(doc_id) REFERENCES docs(id) ON DELETE CASCADE
-            )
-            """
+@schema_migration(14, "document_sections")
+def _migrate_document_sections(con):
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS document_section_links (
+            section_key TEXT NOT NULL,
+            doc_id INTEGER NOT NULL,
+            position INTEGER NOT NULL DEFAULT 0,
+            added_by INTEGER,
+            added_at TEXT NOT NULL,
+            button_label TEXT,
+            PRIMARY KEY (section_key, doc_id),
+            FOREIGN KEY(doc_id) REFERENCES docs(id) ON DELETE CASCADE
         )
-        try:
-            con.execute(
-                "ALTER TABLE document_section_links ADD COLUMN button_label TEXT"
-            )
-        except sqlite3.OperationalError:
-            pass
+        """
+    )
+    try:
         con.execute(
-            "CREATE INDEX IF NOT EXISTS idx_document_section_links_order "
-            "ON document_section_links(section_key, position, added_at)"
+            "ALTER TABLE document_section_links ADD COLUMN button_label TEXT"
         )
-        con.commit()
+    except sqlite3.OperationalError:
+        pass
+    con.execute(
+        "CREATE INDEX IF NOT EXISTS idx_document_section_links_order "
+        "ON document_section_links(section_key, position, added_at)"
+    )
+
+
+# Подписи и старые автоматические связи пишутся через db_document_section_*,
+# у которых свои соединения, поэтому шаг идёт вне общей транзакции.
+@schema_migration(15, "document_section_labels", transaction=False)
+def _migrate_document_section_labels():
     _backfill_document_section_button_labels()
 
 
@@ -36862,7 +39266,7 @@ _document_sections_previous_db_docs_delete_doc = db_docs_delete_doc
 def db_docs_delete_doc(doc_id: int) -> bool:
     # В проекте не на всех соединениях включён PRAGMA foreign_keys, поэтому
     # удаляем связи явно до удаления основной записи документа.
-    with sqlite3.connect(DB_PATH) as con:
+    with db_connect() as con:
         con.execute(
             "DELETE FROM document_section_links WHERE doc_id=?",
             (int(doc_id),),
@@ -37648,7 +40052,7 @@ def _external_access_identity_label(item: dict) -> str:
 
 def db_external_access_list(include_expired: bool = True) -> list[dict]:
     now_iso = _external_access_now_iso()
-    with sqlite3.connect(DB_PATH) as con:
+    with db_connect() as con:
         cur = con.cursor()
         if include_expired:
             cur.execute(
@@ -37692,7 +40096,7 @@ def db_external_access_list(include_expired: bool = True) -> list[dict]:
 
 
 def db_external_access_get(access_id: int) -> dict | None:
-    with sqlite3.connect(DB_PATH) as con:
+    with db_connect() as con:
         row = con.execute(
             """
             SELECT id, tg_user_id, username, display_name, is_admin,
@@ -37728,7 +40132,7 @@ def db_external_access_find_active(
     uid = int(user_id)
     uname = _normalize_external_username(username)
     now_iso = _external_access_now_iso()
-    with sqlite3.connect(DB_PATH) as con:
+    with db_connect() as con:
         cur = con.cursor()
         cur.execute(
             """
@@ -37831,7 +40235,7 @@ def db_external_access_upsert(
     if uid is None and not uname:
         raise ValueError("Telegram ID or username is required")
     now_iso = _external_access_now_iso()
-    with sqlite3.connect(DB_PATH) as con:
+    with db_connect() as con:
         cur = con.cursor()
         row = None
         if uid is not None:
@@ -37885,25 +40289,28 @@ def db_external_access_upsert(
             )
             access_id = int(cur.lastrowid)
         con.commit()
+    EXTERNAL_ACCESS_CACHE.clear()
     return access_id
 
 
 def db_external_access_delete(access_id: int) -> bool:
-    with sqlite3.connect(DB_PATH) as con:
+    with db_connect() as con:
         cur = con.execute("DELETE FROM external_access WHERE id=?", (int(access_id),))
         con.commit()
-        return cur.rowcount > 0
+    EXTERNAL_ACCESS_CACHE.clear()
+    return cur.rowcount > 0
 
 
 def db_external_access_delete_expired() -> int:
     now_iso = _external_access_now_iso()
-    with sqlite3.connect(DB_PATH) as con:
+    with db_connect() as con:
         cur = con.execute(
             "DELETE FROM external_access WHERE expires_at IS NOT NULL AND expires_at<=?",
             (now_iso,),
         )
         con.commit()
-        return int(cur.rowcount)
+    EXTERNAL_ACCESS_CACHE.clear()
+    return int(cur.rowcount)
 
 
 def _external_access_resolve_identifier(value: str) -> dict | None:
@@ -37933,7 +40340,7 @@ def _external_access_bootstrap_from_env():
     raw = (os.getenv("EXTERNAL_ACCESS_BOOTSTRAP") or "").strip()
     if not raw:
         return
-    with sqlite3.connect(DB_PATH) as con:
+    with db_connect() as con:
         already_done = con.execute(
             "SELECT value FROM meta WHERE key='external_access_bootstrap_done_v1'"
         ).fetchone()
@@ -37970,43 +40377,158 @@ def _external_access_bootstrap_from_env():
     db_set_meta("external_access_bootstrap_done_v1", _external_access_now_iso())
 
 
-_external_access_previous_db_init = db_init
+@schema_migration(16, "external_access")
+def _migrate_external_access(con):
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS external_access (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tg_user_id INTEGER,
+            username TEXT COLLATE NOCASE,
+            display_name TEXT,
+            is_admin INTEGER NOT NULL DEFAULT 0,
+            expires_at TEXT,
+            created_by INTEGER,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            last_seen_at TEXT
+        )
+        """
+    )
+    con.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_external_access_user_id "
+        "ON external_access(tg_user_id) WHERE tg_user_id IS NOT NULL"
+    )
+    con.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_external_access_pending_username "
+        "ON external_access(username COLLATE NOCASE) "
+        "WHERE tg_user_id IS NULL AND username IS NOT NULL"
+    )
+    con.execute(
+        "CREATE INDEX IF NOT EXISTS idx_external_access_expiry "
+        "ON external_access(expires_at)"
+    )
 
 
-def db_init():
-    _external_access_previous_db_init()
-    with sqlite3.connect(DB_PATH) as con:
-        con.execute(
-            """
-            CREATE TABLE IF NOT EXISTS external_access (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                tg_user_id INTEGER,
-                username TEXT COLLATE NOCASE,
-                display_name TEXT,
-                is_admin INTEGER NOT NULL DEFAULT 0,
-                expires_at TEXT,
-                created_by INTEGER,
-                created_at TEXT NOT NULL,
-                updated_at TEXT NOT NULL,
-                last_seen_at TEXT
-            )
-            """
-        )
-        con.execute(
-            "CREATE UNIQUE INDEX IF NOT EXISTS idx_external_access_user_id "
-            "ON external_access(tg_user_id) WHERE tg_user_id IS NOT NULL"
-        )
-        con.execute(
-            "CREATE UNIQUE INDEX IF NOT EXISTS idx_external_access_pending_username "
-            "ON external_access(username COLLATE NOCASE) "
-            "WHERE tg_user_id IS NULL AND username IS NOT NULL"
-        )
-        con.execute(
-            "CREATE INDEX IF NOT EXISTS idx_external_access_expiry "
-            "ON external_access(expires_at)"
-        )
-        con.commit()
-    _external_access_bootstrap_from_env()
+# EXTERNAL_ACCESS_BOOTSTRAP проверяется при каждом запуске: переменная могла
+# появиться позже первой миграции (повторный импорт отсекает метка в meta).
+db_startup_task(_external_access_bootstrap_from_env)
+
+
+# Кэш проверок доступа. Статус участника чата и внешний доступ читаются почти
+# на каждое нажатие (deny_no_access + is_admin_scoped), поэтому ответы Bot API
+# и SQLite кэшируются по (chat_id, user_id) / user_id. Вступление, выход и
+# обновления ChatMember сбрасывают или сразу обновляют запись, изменения
+# внешних доступов очищают их кэш целиком.
+ACCESS_CACHE_TTL_SECONDS = max(0, int(os.getenv("ACCESS_CACHE_TTL_SECONDS", "300")))
+ACCESS_CACHE_NEGATIVE_TTL_SECONDS = max(0, int(os.getenv("ACCESS_CACHE_NEGATIVE_TTL_SECONDS", "60")))
+CHAT_MEMBER_ACTIVE_STATUSES = ("member", "administrator", "creator")
+
+CHAT_MEMBER_CACHE = TTLCache(
+    "chat_member",
+    ttl=ACCESS_CACHE_TTL_SECONDS,
+    negative_ttl=ACCESS_CACHE_NEGATIVE_TTL_SECONDS,
+    maxsize=20_000,
+)
+EXTERNAL_ACCESS_CACHE = TTLCache(
+    "external_access",
+    ttl=ACCESS_CACHE_TTL_SECONDS,
+    negative_ttl=ACCESS_CACHE_NEGATIVE_TTL_SECONDS,
+    maxsize=20_000,
+)
+
+
+async def get_chat_member_status_cached(
+    context: ContextTypes.DEFAULT_TYPE,
+    chat_id: int,
+    user_id: int,
+) -> str:
+    """Статус пользователя в чате; пустая строка, если Telegram его не знает."""
+
+    async def load() -> str:
+        try:
+            member = await context.bot.get_chat_member(int(chat_id), int(user_id))
+        except BadRequest:
+            # «User not found» и похожие ответы стабильны — кэшируем как отказ.
+            return ""
+        return member.status
+
+    return await CHAT_MEMBER_CACHE.get_or_load(
+        (int(chat_id), int(user_id)),
+        load,
+        is_negative=lambda status: status not in CHAT_MEMBER_ACTIVE_STATUSES,
+    )
+
+
+def external_access_find_active_cached(
+    user_id: int,
+    username: str | None = None,
+    display_name: str | None = None,
+) -> dict | None:
+    uid = int(user_id)
+    cached = EXTERNAL_ACCESS_CACHE.get(uid)
+    if cached is not _CACHE_MISSING:
+        return cached
+    found = db_external_access_find_active(
+        uid,
+        username=username,
+        display_name=display_name,
+        bind_username=True,
+    )
+    ttl = None
+    if found and found.get("expires_at"):
+        # Временный доступ не должен пережить срок действия из-за кэша.
+        try:
+            expires_at = datetime.fromisoformat(str(found["expires_at"]))
+            left = (expires_at - datetime.utcnow()).total_seconds()
+            ttl = max(0.0, min(float(ACCESS_CACHE_TTL_SECONDS), left))
+        except ValueError:
+            ttl = 0.0
+    EXTERNAL_ACCESS_CACHE.set(uid, found, ttl=ttl, negative=not found)
+    return found
+
+
+async def external_access_find_active_async(
+    user_id: int,
+    username: str | None = None,
+    display_name: str | None = None,
+) -> dict | None:
+    """Как external_access_find_active_cached, но промах кэша — в потоке записи.
+
+    Поиск при промахе может привязать username к записи доступа, поэтому он
+    идёт через db.write, а не в event loop.
+    """
+    cached = EXTERNAL_ACCESS_CACHE.get(int(user_id))
+    if cached is not _CACHE_MISSING:
+        return cached
+    return await db.write(
+        external_access_find_active_cached,
+        int(user_id),
+        username=username,
+        display_name=display_name,
+    )
+
+
+def access_cache_invalidate_user(user_id: int, chat_id: int | None = None):
+    uid = int(user_id)
+    if chat_id is None:
+        CHAT_MEMBER_CACHE.invalidate_where(lambda key: key[1] == uid)
+    else:
+        CHAT_MEMBER_CACHE.invalidate((int(chat_id), uid))
+
+
+async def on_chat_member_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обновляет кэш статусов по событиям ChatMember (бот — админ чата)."""
+    change = update.chat_member
+    if not change or not change.new_chat_member:
+        return
+    member = change.new_chat_member
+    status = member.status
+    CHAT_MEMBER_CACHE.set(
+        (int(change.chat.id), int(member.user.id)),
+        status,
+        negative=status not in CHAT_MEMBER_ACTIVE_STATUSES,
+    )
 
 
 async def is_member_of_access_chat(
@@ -38015,16 +40537,15 @@ async def is_member_of_access_chat(
     username: str | None = None,
     display_name: str | None = None,
 ) -> bool:
-    if db_external_access_find_active(
+    if await external_access_find_active_async(
         int(user_id),
         username=username,
         display_name=display_name,
-        bind_username=True,
     ):
         return True
     try:
-        member = await context.bot.get_chat_member(ACCESS_CHAT_ID, int(user_id))
-        return member.status in ("member", "administrator", "creator")
+        status = await get_chat_member_status_cached(context, ACCESS_CHAT_ID, int(user_id))
+        return status in CHAT_MEMBER_ACTIVE_STATUSES
     except Forbidden:
         logger.warning(
             "Forbidden while checking ACCESS_CHAT_ID. "
@@ -38043,17 +40564,16 @@ async def is_admin_in_chat(
     username: str | None = None,
     display_name: str | None = None,
 ) -> bool:
-    external = db_external_access_find_active(
+    external = await external_access_find_active_async(
         int(user_id),
         username=username,
         display_name=display_name,
-        bind_username=True,
     )
     if external and external.get("is_admin"):
         return True
     try:
-        member = await context.bot.get_chat_member(int(chat_id), int(user_id))
-        return member.status in ("administrator", "creator")
+        status = await get_chat_member_status_cached(context, int(chat_id), int(user_id))
+        return status in ("administrator", "creator")
     except Exception:
         return False
 
@@ -38062,11 +40582,10 @@ async def is_admin_scoped(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     user = update.effective_user
     if not user:
         return False
-    external = db_external_access_find_active(
+    external = await external_access_find_active_async(
         int(user.id),
         username=getattr(user, "username", None),
         display_name=getattr(user, "full_name", None),
-        bind_username=True,
     )
     if external and external.get("is_admin"):
         return True
@@ -38285,6 +40804,7 @@ def kb_external_access_confirm() -> InlineKeyboardMarkup:
 _external_access_previous_kb_help_settings = kb_help_settings
 
 
+@cached_keyboard()
 def kb_help_settings():
     legacy = _external_access_previous_kb_help_settings()
     rows = [list(row) for row in legacy.inline_keyboard]
@@ -38581,7 +41101,1028 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # =============== END EXTERNAL ACCESS MANAGEMENT V1 ===============
 
 
-BUILD_VERSION = "EXTERNAL-ACCESS-2026-08-04-V33"
+# ---------------- USER DASHBOARD ----------------
+# Сводка главного меню (тесты, достижения, непрочитанные уведомления,
+# активные напоминания) хранится в таблице user_dashboard: меню читает одну
+# строку по user_id. Триггеры на исходных таблицах удаляют строки затронутого
+# пользователя или анкеты при любой записи, в том числе из «сырого» SQL;
+# следующее открытие меню пересчитывает только эту строку.
+
+# (таблица, ключ в user_dashboard и в таблице, колонки для UPDATE OF)
+DASHBOARD_SOURCES = (
+    ("notifications", "user_id", "user_id, is_read"),
+    ("employee_reminders", "user_id", "user_id, status, remind_at_utc, reminder_text, timezone_delta"),
+    ("test_assignments", "profile_id", "profile_id, status"),
+    ("achievement_awards", "profile_id", "profile_id"),
+)
+
+
+@schema_migration(17, "user_dashboard")
+def _migrate_user_dashboard(con):
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS user_dashboard (
+            user_id INTEGER PRIMARY KEY,
+            profile_id INTEGER,
+            tests_assigned INTEGER NOT NULL DEFAULT 0,
+            tests_in_progress INTEGER NOT NULL DEFAULT 0,
+            achievements_count INTEGER NOT NULL DEFAULT 0,
+            unread_count INTEGER NOT NULL DEFAULT 0,
+            reminders_count INTEGER NOT NULL DEFAULT 0,
+            nearest_reminder TEXT,
+            updated_at TEXT NOT NULL
+        )
+        """
+    )
+    con.execute("CREATE INDEX IF NOT EXISTS idx_user_dashboard_profile ON user_dashboard(profile_id)")
+    for table, key, columns in DASHBOARD_SOURCES:
+        con.execute(
+            f"CREATE TRIGGER IF NOT EXISTS trg_dashboard_{table}_ins AFTER INSERT ON {table} "
+            f"BEGIN DELETE FROM user_dashboard WHERE {key}=NEW.{key}; END"
+        )
+        con.execute(
+            f"CREATE TRIGGER IF NOT EXISTS trg_dashboard_{table}_del AFTER DELETE ON {table} "
+            f"BEGIN DELETE FROM user_dashboard WHERE {key}=OLD.{key}; END"
+        )
+        con.execute(
+            f"CREATE TRIGGER IF NOT EXISTS trg_dashboard_{table}_upd AFTER UPDATE OF {columns} ON {table} "
+            f"BEGIN DELETE FROM user_dashboard WHERE {key} IN (OLD.{key}, NEW.{key}); END"
+        )
+
+
+def _dashboard_compute(cur, user_id: int | None, profile_id: int | None) -> dict:
+    tests_assigned = tests_in_progress = achievements_count = 0
+    if profile_id is not None:
+        cur.execute(
+            """
+            SELECT SUM(CASE WHEN status='assigned' THEN 1 ELSE 0 END),
+                   SUM(CASE WHEN status='in_progress' THEN 1 ELSE 0 END)
+            FROM test_assignments
+            WHERE profile_id=?
+            """,
+            (int(profile_id),),
+        )
+        row = cur.fetchone() or (0, 0)
+        tests_assigned, tests_in_progress = int(row[0] or 0), int(row[1] or 0)
+        cur.execute("SELECT COUNT(*) FROM achievement_awards WHERE profile_id=?", (int(profile_id),))
+        achievements_count = int(cur.fetchone()[0] or 0)
+
+    unread_count = reminders_count = 0
+    nearest = None
+    if user_id:
+        cur.execute("SELECT COUNT(*) FROM notifications WHERE user_id=? AND is_read=0", (int(user_id),))
+        unread_count = int(cur.fetchone()[0] or 0)
+        cur.execute(
+            """
+            SELECT id, reminder_text, remind_at_utc, timezone_delta, status,
+                   COUNT(*) OVER ()
+            FROM employee_reminders
+            WHERE user_id=? AND status IN ('pending', 'sending')
+            ORDER BY remind_at_utc ASC, id ASC
+            LIMIT 1
+            """,
+            (int(user_id),),
+        )
+        row = cur.fetchone()
+        if row:
+            nearest = {
+                "id": int(row[0]),
+                "user_id": int(user_id),
+                "reminder_text": row[1],
+                "remind_at_utc": row[2],
+                "timezone_delta": int(row[3] or 0),
+                "status": row[4],
+            }
+            reminders_count = int(row[5])
+
+    return {
+        "profile_id": profile_id,
+        "tests_assigned": tests_assigned,
+        "tests_in_progress": tests_in_progress,
+        "achievements_count": achievements_count,
+        "unread_count": unread_count,
+        "reminders_count": reminders_count,
+        "nearest_reminder": nearest,
+    }
+
+
+def db_user_dashboard_stored(user_id: int | None, profile_id: int | None = None) -> dict | None:
+    """Сохранённая сводка или None, если триггеры её сбросили (только чтение)."""
+    if not user_id:
+        return None
+    profile_id = int(profile_id) if profile_id is not None else None
+    con = db_connect()
+    cur = con.cursor()
+    try:
+        cur.execute(
+            """
+            SELECT profile_id, tests_assigned, tests_in_progress, achievements_count,
+                   unread_count, reminders_count, nearest_reminder
+            FROM user_dashboard
+            WHERE user_id=?
+            """,
+            (int(user_id),),
+        )
+        row = cur.fetchone()
+    finally:
+        con.close()
+    # Строка принадлежит другой анкете, если tg_user_id перепривязали.
+    if row is None or row[0] != profile_id:
+        return None
+    return {
+        "profile_id": row[0],
+        "tests_assigned": int(row[1]),
+        "tests_in_progress": int(row[2]),
+        "achievements_count": int(row[3]),
+        "unread_count": int(row[4]),
+        "reminders_count": int(row[5]),
+        "nearest_reminder": json.loads(row[6]) if row[6] else None,
+    }
+
+
+def db_user_dashboard_compute(user_id: int | None, profile_id: int | None = None) -> dict:
+    """Сводка по исходным таблицам без записи в user_dashboard."""
+    con = db_connect()
+    try:
+        return _dashboard_compute(con.cursor(), user_id, int(profile_id) if profile_id is not None else None)
+    finally:
+        con.close()
+
+
+def db_user_dashboard_refresh(user_id: int, profile_id: int | None = None) -> dict:
+    """Пересчитывает и сохраняет строку сводки (запись — через db.write)."""
+    profile_id = int(profile_id) if profile_id is not None else None
+    con = db_connect()
+    cur = con.cursor()
+    try:
+        # Пересчёт и запись под одной блокировкой: запись, пришедшая между
+        # ними, иначе сбросила бы ещё не сохранённую строку.
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            dashboard = _dashboard_compute(cur, user_id, profile_id)
+            cur.execute(
+                """
+                INSERT OR REPLACE INTO user_dashboard(
+                    user_id, profile_id, tests_assigned, tests_in_progress,
+                    achievements_count, unread_count, reminders_count,
+                    nearest_reminder, updated_at
+                )
+                VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    int(user_id),
+                    profile_id,
+                    dashboard["tests_assigned"],
+                    dashboard["tests_in_progress"],
+                    dashboard["achievements_count"],
+                    dashboard["unread_count"],
+                    dashboard["reminders_count"],
+                    json.dumps(dashboard["nearest_reminder"], ensure_ascii=False)
+                    if dashboard["nearest_reminder"] else None,
+                    datetime.utcnow().isoformat(),
+                ),
+            )
+            con.commit()
+        except BaseException:
+            con.rollback()
+            raise
+        return dashboard
+    finally:
+        con.close()
+
+
+def db_user_dashboard(user_id: int | None, profile_id: int | None = None) -> dict:
+    """Синхронная сводка для задач и скриптов; обработчики используют user_dashboard()."""
+    if not user_id:
+        return db_user_dashboard_compute(None, profile_id)
+    return db_user_dashboard_stored(user_id, profile_id) or db_user_dashboard_refresh(user_id, profile_id)
+
+
+async def user_dashboard(user_id: int | None, profile_id: int | None = None) -> dict:
+    """Сводка главного меню: чтение в потоке чтения, пересчёт — в потоке записи.
+
+    BEGIN IMMEDIATE пересчёта может ждать блокировку до busy_timeout, поэтому
+    он не выполняется в event loop.
+    """
+    if not user_id:
+        return await db.call(db_user_dashboard_compute, None, profile_id)
+    dashboard = await db.call(db_user_dashboard_stored, user_id, profile_id)
+    if dashboard is None:
+        dashboard = await db.write(db_user_dashboard_refresh, user_id, profile_id)
+    return dashboard
+
+
+# ---------------- HELP ROUTER ----------------
+# cb_help и on_text собраны из слоёв: каждый новый раздел оборачивал
+# предыдущую версию и передавал ей всё, что не распознал. Чтобы нажатие не
+# проходило всю цепочку, main() один раз строит маршрутизаторы: callback_data
+# сопоставляется префиксам через символьный trie, текст — ключам состояния
+# в user_data. Ссылки слоёв на предыдущую версию (_..._previous_cb_help и т.п.)
+# переназначаются на «продолжить ниже этого слоя», поэтому сами слои не
+# меняются, а порядок приоритета остаётся прежним: выигрывает самый поздний.
+
+# Служебные ключи узла trie (многосимвольные, поэтому не совпадают с символами данных).
+_ROUTE_PREFIX = "prefix"
+_ROUTE_EXACT = "exact"
+
+
+class CallbackPrefixRouter:
+    def __init__(self, fallback):
+        self._handlers = [fallback]
+        self._root: dict = {}
+        # Переход «ниже слоя» повторяет поиск по тем же данным, поэтому
+        # совпавшие уровни запоминаются для последних callback_data.
+        self._levels = functools.lru_cache(maxsize=4096)(self._match_levels)
+
+    def register(self, handler, routes) -> int:
+        """Маршрут — префикс callback_data; с «$» на конце — точное значение."""
+        level = len(self._handlers)
+        self._handlers.append(handler)
+        for route in routes:
+            marker = _ROUTE_PREFIX
+            if route.endswith("$"):
+                route, marker = route[:-1], _ROUTE_EXACT
+            node = self._root
+            for ch in route:
+                node = node.setdefault(ch, {})
+            node.setdefault(marker, []).append(level)
+        self._levels.cache_clear()
+        return level
+
+    def _match_levels(self, data: str) -> tuple[int, ...]:
+        levels = set()
+        node = self._root
+        for ch in data:
+            levels.update(node.get(_ROUTE_PREFIX, ()))
+            node = node.get(ch)
+            if node is None:
+                break
+        else:
+            levels.update(node.get(_ROUTE_PREFIX, ()))
+            levels.update(node.get(_ROUTE_EXACT, ()))
+        return tuple(sorted(levels, reverse=True))
+
+    def resolve(self, data: str, below: int | None = None):
+        """Самый поздний слой с подходящим префиксом (ниже below, если задан)."""
+        for level in self._levels(data):
+            if below is None or level < below:
+                return self._handlers[level]
+        return self._handlers[0]
+
+    async def dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        data = (query.data or "") if query else ""
+        return await self.resolve(data)(update, context)
+
+    def below(self, level: int):
+        async def continue_below(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            query = update.callback_query
+            data = (query.data or "") if query else ""
+            return await self.resolve(data, below=level)(update, context)
+
+        return continue_below
+
+
+class StateKeyRouter:
+    def __init__(self, fallback):
+        self._handlers = [fallback]
+        # (уровень, ключ user_data) от верхнего слоя к нижнему
+        self._routes: list[tuple[int, str]] = []
+
+    def register(self, handler, keys) -> int:
+        level = len(self._handlers)
+        self._handlers.append(handler)
+        self._routes = [(level, key) for key in keys] + self._routes
+        return level
+
+    def resolve(self, user_data, below: int | None = None):
+        """Самый поздний слой, чьё состояние сейчас заполнено в user_data."""
+        user_data = user_data or {}
+        for level, key in self._routes:
+            if below is not None and level >= below:
+                continue
+            if user_data.get(key):
+                return self._handlers[level]
+        return self._handlers[0]
+
+    async def dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        return await self.resolve(context.user_data)(update, context)
+
+    def below(self, level: int):
+        async def continue_below(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            return await self.resolve(context.user_data, below=level)(update, context)
+
+        return continue_below
+
+
+def _leaderboard_routes(*suffixes: str) -> tuple[str, ...]:
+    return tuple(f"help:settings:leaders{suffix}" for suffix in suffixes)
+
+
+# Слои снизу вверх: (имя, через которое слой вызывает предыдущую версию,
+# маршруты callback_data, которые слой может перехватить). Маршруты могут быть
+# шире реальных условий слоя: лишнее он сам передаст ниже.
+HELP_CALLBACK_LAYERS = (
+    ("_tv2_legacy_cb_help", ("help:testv2:", "help:settings:test", "help:me:tests")),
+    # Любой другой help:* сбрасывает незавершённый мастер напоминания.
+    ("_reminder_legacy_cb_help", ("help:",)),
+    ("_test_modes_legacy_cb_help", ("help:testv2:",)),
+    ("_test_history_legacy_cb_help", ("help:testv2:",)),
+    ("_faq_favorites_legacy_cb_help", ("help:industry_division", "help:cases", "help:faq")),
+    ("_industry_specialists_legacy_cb_help", ("help:industry_specialist", "help:ispec")),
+    ("_industry_cards_previous_cb_help", ("help:idv:",)),
+    ("_projects_previous_cb_help", ("help:projects",)),
+    (
+        "_calendar_experts_previous_cb_help",
+        ("help:ispec:calendar", "help:ispec:caltoggle", "help:industry_specialist:"),
+    ),
+    (
+        "_calendar_cases_previous_cb_help",
+        ("help:calexperts", "help:calcases", "help:calcasefav:", "help:calcase:"),
+    ),
+    ("_project_documents_previous_cb_help", ("help:caldocs", "help:caldocmissing:")),
+    ("_video_guides_previous_cb_help", ("help:videos", "help:video:open:", "help:settings:videos")),
+    ("_faq_ux_previous_cb_help", ("help:faq",)),
+    ("_leaderboard_previous_cb_help", ("help:team:leaders", "help:settings:leaders")),
+    (
+        "_leaderboard_v2_previous_cb_help",
+        _leaderboard_routes(
+            "$", ":history", ":ready$", ":send$", ":edit:",
+            ":broadcast_confirm:", ":broadcast_send:",
+        ),
+    ),
+    (
+        "_leaderboard_v3_previous_cb_help",
+        _leaderboard_routes(
+            "$", ":cancel$", ":new:", ":pick", ":edit:", ":broadcast_",
+            ":reset_people$", ":edit_people$", ":first_place_more$",
+            ":first_place_done$", ":preview$", ":ready$", ":send$",
+        ),
+    ),
+    (
+        "_leaderboard_v4_previous_cb_help",
+        _leaderboard_routes(":combo", ":broadcast_confirm:"),
+    ),
+    (
+        "_leaderboard_v5_previous_cb_help",
+        _leaderboard_routes(
+            ":new:", ":edit:", ":edit_people$", ":edit_done$",
+            ":edit_employee:", ":edit_metric:", ":edit_place:", ":edit_swap:",
+        ),
+    ),
+    (
+        "_leaderboard_v6_previous_cb_help",
+        _leaderboard_routes(
+            ":place_more:", ":place_done:", ":first_place_more$",
+            ":first_place_done$", ":edit_places$", ":edit_place_members:",
+            ":edit_member_place:", ":edit_place_add:", ":edit_add_page:",
+            ":edit_add_pick:", ":edit_place_remove:", ":edit_remove_confirm:",
+            ":edit_remove_apply:", ":pick:", ":ready$",
+        ),
+    ),
+    ("_leaderboard_v7_previous_cb_help", ("help:ldr:",)),
+    (
+        "_leaderboard_v8_previous_cb_help",
+        _leaderboard_routes(
+            ":clear$", ":clear_apply$", ":clear_back$", ":edit_place_remove:",
+            ":edit_remove_confirm:", ":edit_remove_apply:",
+        ) + ("help:ldr:delete:", "help:ldr:dapply:"),
+    ),
+    ("_document_sections_previous_cb_help", ("help:docs:sections",)),
+    ("_external_access_previous_cb_help", ("help:settings:access",)),
+)
+
+# То же для текстового ввода: ключи user_data, при которых слой берёт текст себе.
+HELP_TEXT_LAYERS = (
+    ("_tv2_legacy_on_text", (TV2_STATE,)),
+    ("_reminder_legacy_on_text", (REMINDER_STATE,)),
+    ("_test_modes_legacy_on_text", (CASES_WAITING_SEARCH, TV2_STATE)),
+    ("_industry_specialists_legacy_on_text", (INDUSTRY_SPECIALIST_STATE,)),
+    ("_video_guides_previous_on_text", (VIDEO_GUIDE_STATE,)),
+    ("_faq_ux_previous_on_text", (WAITING_FAQ_SEARCH,)),
+    ("_leaderboard_previous_on_text", (LEADERBOARD_FLOW_KEY,)),
+    ("_leaderboard_v3_previous_on_text", (LEADERBOARD_FLOW_KEY,)),
+    ("_leaderboard_v4_previous_on_text", (LEADERBOARD_FLOW_KEY,)),
+    ("_leaderboard_v5_previous_on_text", (LEADERBOARD_FLOW_KEY,)),
+    ("_leaderboard_v6_previous_on_text", (LEADERBOARD_FLOW_KEY,)),
+    ("_leaderboard_v7_previous_on_text", (LEADERBOARD_FLOW_KEY,)),
+    ("_document_sections_previous_on_text", (DOCUMENT_SECTION_BUTTON_FLOW_KEY,)),
+    ("_external_access_previous_on_text", (EXTERNAL_ACCESS_FLOW_KEY,)),
+)
+
+
+_HELP_ROUTERS: tuple | None = None
+
+
+def _build_layer_router(router_cls, layers, top):
+    # Слой i — это то, что вызывает слой i+1 как «предыдущую версию»;
+    # самый верхний слой — текущий top, самый нижний — исходный обработчик.
+    module = globals()
+    handlers = [module[alias] for alias, _ in layers[1:]] + [top]
+    router = router_cls(module[layers[0][0]])
+    for (alias, routes), handler in zip(layers, handlers):
+        level = router.register(handler, routes)
+        module[alias] = router.below(level)
+    return router
+
+
+def build_help_routers() -> tuple[CallbackPrefixRouter, StateKeyRouter]:
+    """Строит маршрутизаторы cb_help/on_text (один раз за процесс)."""
+    global _HELP_ROUTERS
+    if _HELP_ROUTERS is None:
+        _HELP_ROUTERS = (
+            _build_layer_router(CallbackPrefixRouter, HELP_CALLBACK_LAYERS, cb_help),
+            _build_layer_router(StateKeyRouter, HELP_TEXT_LAYERS, on_text),
+        )
+    return _HELP_ROUTERS
+
+
+def search_indexes_warmup():
+    """Строит индексы поиска заранее, чтобы первый запрос не ждал загрузки."""
+    for index in (DOCS_SEARCH_INDEX, FAQ_SEARCH_INDEX, CASES_SEARCH_INDEX):
+        index.ensure_loaded()
+        logger.info("Search index %s: %s", index.name, index.stats())
+
+
+# ---------------- CONVERSATION PERSISTENCE ----------------
+# Состояние мастеров живёт в user_data/chat_data. Чтобы перезапуск не обрывал
+# начатые сценарии, оно хранится в SQLite по ключам: строка на
+# (scope, owner_id, key) с pickle значения. Запись отложенная: PTB раз в
+# PERSISTENCE_UPDATE_INTERVAL_SECONDS отдаёт данные затронутых пользователей,
+# в очередь попадают только изменившиеся или удалённые ключи, и через
+# PERSISTENCE_FLUSH_DELAY_SECONDS очередь пишется одной транзакцией. Данные
+# пользователя или чата читаются из БД при первом его апдейте, а не при старте.
+
+PERSISTENCE_ENABLED = os.getenv("PERSISTENCE_ENABLED", "1") != "0"
+PERSISTENCE_UPDATE_INTERVAL_SECONDS = max(1.0, float(os.getenv("PERSISTENCE_UPDATE_INTERVAL_SECONDS", "10")))
+PERSISTENCE_FLUSH_DELAY_SECONDS = max(0.0, float(os.getenv("PERSISTENCE_FLUSH_DELAY_SECONDS", "1")))
+# Брошенные мастера не копятся вечно.
+PERSISTENCE_MAX_AGE_DAYS = max(1, int(os.getenv("PERSISTENCE_MAX_AGE_DAYS", "30")))
+# Сколько пользователей и чатов держать загруженными; давно не писавшие
+# вытесняются и при следующем апдейте читаются из БД заново.
+PERSISTENCE_MAX_OWNERS = max(100, int(os.getenv("PERSISTENCE_MAX_OWNERS", "5000")))
+
+
+@schema_migration(18, "conversation_state")
+def _migrate_conversation_state(con):
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS conversation_state (
+            scope TEXT NOT NULL,
+            owner_id INTEGER NOT NULL,
+            key TEXT NOT NULL,
+            value BLOB NOT NULL,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY(scope, owner_id, key)
+        ) WITHOUT ROWID
+        """
+    )
+
+
+@db_startup_task
+def _conversation_state_prune():
+    cutoff = (datetime.utcnow() - timedelta(days=PERSISTENCE_MAX_AGE_DAYS)).isoformat()
+    with db_connect() as con:
+        con.execute("DELETE FROM conversation_state WHERE updated_at<?", (cutoff,))
+
+
+def db_conversation_state_load(scope: str, owner_id: int) -> list[tuple[str, bytes]]:
+    con = db_connect()
+    cur = con.cursor()
+    cur.execute(
+        "SELECT key, value FROM conversation_state WHERE scope=? AND owner_id=?",
+        (scope, int(owner_id)),
+    )
+    rows = cur.fetchall()
+    con.close()
+    return [(row[0], bytes(row[1])) for row in rows]
+
+
+def db_conversation_state_apply(drops: list[tuple[str, int]], changes: list[tuple[str, int, str, bytes | None]]):
+    """Одна транзакция: сброс владельцев целиком, затем изменения по ключам."""
+    now_iso = datetime.utcnow().isoformat()
+    con = db_connect()
+    cur = con.cursor()
+    cur.executemany("DELETE FROM conversation_state WHERE scope=? AND owner_id=?", drops)
+    cur.executemany(
+        "DELETE FROM conversation_state WHERE scope=? AND owner_id=? AND key=?",
+        [(scope, owner_id, key) for scope, owner_id, key, value in changes if value is None],
+    )
+    cur.executemany(
+        """
+        INSERT INTO conversation_state(scope, owner_id, key, value, updated_at)
+        VALUES(?, ?, ?, ?, ?)
+        ON CONFLICT(scope, owner_id, key) DO UPDATE SET
+            value=excluded.value,
+            updated_at=excluded.updated_at
+        """,
+        [
+            (scope, owner_id, key, value, now_iso)
+            for scope, owner_id, key, value in changes
+            if value is not None
+        ],
+    )
+    con.commit()
+    con.close()
+
+
+class SQLitePersistence(BasePersistence):
+    """Персистентность user_data/chat_data в conversation_state (bot_data не хранится)."""
+
+    def __init__(self, update_interval: float = PERSISTENCE_UPDATE_INTERVAL_SECONDS):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, callback_data=False),
+            update_interval=update_interval,
+        )
+        # Только идущие загрузки; завершённая (в том числе с ошибкой) удаляется.
+        self._loading: dict[tuple[str, int], asyncio.Task] = {}
+        # Загруженные владельцы в порядке последнего апдейта (LRU) и последние
+        # сохранённые pickle по ключам: по ним ищутся изменения.
+        self._saved: OrderedDict[tuple[str, int], dict[str, bytes]] = OrderedDict()
+        self._pending: dict[tuple[str, int, str], bytes | None] = {}
+        self._pending_drops: set[tuple[str, int]] = set()
+        self._flush_task: asyncio.Task | None = None
+        self.loads = 0
+        self.flushes = 0
+        self.keys_written = 0
+
+    # -- загрузка по требованию --
+
+    async def get_user_data(self) -> dict:
+        return {}
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        # ConversationHandler в боте не используется.
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        await self._ensure_loaded("user", user_id, user_data)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        await self._ensure_loaded("chat", chat_id, chat_data)
+
+    async def refresh_bot_data(self, bot_data) -> None:
+        return None
+
+    async def _ensure_loaded(self, scope: str, owner_id: int, data: dict):
+        owner = (scope, int(owner_id))
+        if owner in self._saved:
+            self._saved.move_to_end(owner)
+            return
+        task = self._loading.get(owner)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(self._load(owner, data))
+            self._loading[owner] = task
+            task.add_done_callback(functools.partial(self._load_done, owner))
+        await asyncio.shield(task)
+
+    def _load_done(self, owner: tuple[str, int], task: asyncio.Task):
+        # Ошибка получает только текущий апдейт; следующий повторит загрузку.
+        self._loading.pop(owner, None)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Cannot load %s %s state, retrying on next update: %s", owner[0], owner[1], task.exception())
+
+    async def _load(self, owner: tuple[str, int], data: dict):
+        rows = await db.call(db_conversation_state_load, *owner)
+        saved = self._saved.get(owner, {})
+        for key, blob in rows:
+            try:
+                value = pickle.loads(blob)
+            except Exception as exc:
+                logger.warning("Cannot restore %s %s key %s: %s", owner[0], owner[1], key, exc)
+                continue
+            # Значения, появившиеся до загрузки, новее сохранённых.
+            data.setdefault(key, value)
+            saved.setdefault(key, blob)
+        self._saved[owner] = saved
+        self._saved.move_to_end(owner)
+        while len(self._saved) > PERSISTENCE_MAX_OWNERS:
+            self._saved.popitem(last=False)
+        self.loads += 1
+
+    # -- отложенная запись --
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        self._stage(("user", int(user_id)), data)
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        self._stage(("chat", int(chat_id)), data)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._drop(("user", int(user_id)))
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._drop(("chat", int(chat_id)))
+
+    async def update_bot_data(self, data) -> None:
+        return None
+
+    async def update_callback_data(self, data) -> None:
+        return None
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        return None
+
+    def _stage(self, owner: tuple[str, int], data: dict):
+        # Для незагруженного владельца (загрузка не удалась или он вытеснен)
+        # пишутся все ключи, а удалённые ключи определить не по чему.
+        saved = self._saved.get(owner, {})
+        seen = set()
+        for key, value in data.items():
+            if not isinstance(key, str):
+                continue
+            seen.add(key)
+            try:
+                blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            except Exception as exc:
+                logger.debug("Skip unpicklable %s %s key %s: %s", owner[0], owner[1], key, exc)
+                continue
+            if saved.get(key) != blob:
+                saved[key] = blob
+                self._pending[(*owner, key)] = blob
+        for key in [key for key in saved if key not in seen]:
+            del saved[key]
+            self._pending[(*owner, key)] = None
+        if self._pending:
+            self._schedule_flush()
+
+    def _drop(self, owner: tuple[str, int]):
+        # Пустой «загруженный» владелец: строки удалит ближайшая запись, и
+        # перечитывать их до этого нельзя.
+        self._saved[owner] = {}
+        self._pending = {key: value for key, value in self._pending.items() if key[:2] != owner}
+        self._pending_drops.add(owner)
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(PERSISTENCE_FLUSH_DELAY_SECONDS)
+        await self._write_pending()
+
+    async def _write_pending(self):
+        changes, self._pending = self._pending, {}
+        drops, self._pending_drops = self._pending_drops, set()
+        if not changes and not drops:
+            return
+        try:
+            await db.write(
+                db_conversation_state_apply,
+                sorted(drops),
+                [(*owner_key, value) for owner_key, value in changes.items()],
+            )
+        except Exception as exc:
+            logger.exception("Cannot persist conversation state: %s", exc)
+            # Повторим со следующей записью; более новые значения не затираем.
+            for owner_key, value in changes.items():
+                self._pending.setdefault(owner_key, value)
+            self._pending_drops |= drops
+            return
+        self.flushes += 1
+        self.keys_written += len(changes)
+
+    async def flush(self) -> None:
+        task, self._flush_task = self._flush_task, None
+        if task is not None and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        await self._write_pending()
+
+    def stats(self) -> dict:
+        return {
+            "loaded": self.loads,
+            "pending": len(self._pending) + len(self._pending_drops),
+            "flushes": self.flushes,
+            "keys_written": self.keys_written,
+        }
+
+
+# ---------------- DEADLINE SCHEDULER ----------------
+# check_and_send_jobs запускается не раз в минуту, а точно к ближайшему сроку.
+# Для каждого источника (отложенные рассылки, встречи и переносы,
+# напоминания сотрудников, сроки тестов) известен следующий срок; сроки лежат
+# в min-heap, на вершину взведён один таймер job_queue.run_once. Функции
+# записи в таблицы источников (override ниже) пересчитывают его срок сразу
+# после записи. Прочие записи в эти таблицы (смена статуса теста, «сырой»
+# SQL администратора) только отодвигают срок или редки; их видят триггеры
+# версий meta.deadline_<источник>_version: раз в DEADLINE_WATCH_SECONDS
+# версии сверяются одним запросом, и изменившийся источник пересчитывается.
+# Раз в DEADLINE_RESYNC_SECONDS пересчитываются все сроки — для того, что
+# зависит не от этих таблиц (анкеты, отметки слотов в meta).
+
+DEADLINE_RETRY_SECONDS = 60
+DEADLINE_RESYNC_SECONDS = 5 * 60
+DEADLINE_WATCH_SECONDS = 60
+
+# источник -> таблицы, запись в которые может сдвинуть его срок
+DEADLINE_TABLES = {
+    "communications": ("scheduled_communications",),
+    "meetings": ("meeting_reschedules",),
+    "reminders": ("employee_reminders",),
+    "tests": ("test_assignments",),
+}
+DATA_VERSION_GROUPS.update({f"deadline_{name}": tables for name, tables in DEADLINE_TABLES.items()})
+
+
+@schema_migration(22, "deadline_versions")
+def _migrate_deadline_versions(con):
+    for name in DEADLINE_TABLES:
+        _create_data_version_triggers(con, f"deadline_{name}")
+
+
+def _deadline_parse_utc(value) -> datetime | None:
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        return pytz.UTC.localize(parsed)
+    return parsed.astimezone(pytz.UTC)
+
+
+def db_deadline_communications() -> datetime | None:
+    con = db_connect()
+    cur = con.cursor()
+    cur.execute("SELECT MIN(send_at_utc) FROM scheduled_communications WHERE status='pending'")
+    row = cur.fetchone()
+    con.close()
+    return _deadline_parse_utc(row[0] if row else None)
+
+
+def db_deadline_reminders() -> datetime | None:
+    con = db_connect()
+    cur = con.cursor()
+    cur.execute("SELECT MIN(remind_at_utc) FROM employee_reminders WHERE status='pending'")
+    row = cur.fetchone()
+    con.close()
+    return _deadline_parse_utc(row[0] if row else None)
+
+
+def db_deadline_tests() -> datetime | None:
+    """Ближайшая отметка tv2_send_reminders: за сутки, за 2 часа или сам срок."""
+    con = db_connect()
+    cur = con.cursor()
+    nearest = None
+    for flag, lead in (
+        ("reminder_24_sent", timedelta(hours=24)),
+        ("reminder_2_sent", timedelta(hours=2)),
+        ("overdue_notice_sent", timedelta(0)),
+    ):
+        cur.execute(
+            f"""
+            SELECT MIN(a.due_at)
+            FROM test_assignments a
+            JOIN profiles p ON p.id=a.profile_id
+            JOIN test_templates t ON t.id=a.template_id
+            WHERE a.status IN ('assigned','in_progress','saved')
+              AND a.due_at IS NOT NULL
+              AND COALESCE(a.{flag}, 0)=0
+              AND p.tg_user_id IS NOT NULL
+            """
+        )
+        due = _deadline_parse_utc(cur.fetchone()[0])
+        if due is not None and (nearest is None or due - lead < nearest):
+            nearest = due - lead
+    con.close()
+    return nearest
+
+
+def db_deadline_meetings() -> datetime | None:
+    """Ближайший ежедневный слот AUTO_SEND_SLOTS или перенесённая встреча."""
+    now_msk = datetime.now(MOSCOW_TZ)
+    today = now_msk.date()
+    candidates = []
+    for name in AUTO_SEND_SLOTS:
+        slot = auto_send_slot_at(name, today)
+        # Неотправленный слот остаётся сроком (в том числе прошедшим) до конца
+        # окна догона, поэтому долгий предыдущий прогон его не пропускает.
+        if (
+            db_get_meta(f"last_auto_sent_date:{name}") == today.isoformat()
+            or now_msk >= slot + timedelta(minutes=AUTO_SEND_CATCHUP_MINUTES)
+        ):
+            slot = auto_send_slot_at(name, today + timedelta(days=1))
+        candidates.append(slot)
+
+    con = db_connect()
+    cur = con.cursor()
+    cur.execute(
+        "SELECT meeting_type, new_date, new_time FROM meeting_reschedules WHERE sent=0 AND new_date>=?",
+        (today.isoformat(),),
+    )
+    rows = cur.fetchall()
+    con.close()
+    for meeting_type, new_date, new_time in rows:
+        clean_time = parse_regular_meeting_time(new_time) or regular_meeting_default_time(meeting_type)
+        try:
+            candidates.append(MOSCOW_TZ.localize(datetime.strptime(f"{new_date} {clean_time}", "%Y-%m-%d %H:%M")))
+        except ValueError:
+            continue
+    return min(candidates).astimezone(pytz.UTC) if candidates else None
+
+
+DEADLINE_SOURCES = {
+    "communications": db_deadline_communications,
+    "meetings": db_deadline_meetings,
+    "reminders": db_deadline_reminders,
+    "tests": db_deadline_tests,
+}
+
+
+class DeadlineScheduler:
+    def __init__(self, sources: dict, retry_seconds: float = DEADLINE_RETRY_SECONDS):
+        self.sources = sources
+        self.retry = timedelta(seconds=retry_seconds)
+        self._heap: list[tuple[datetime, int, str]] = []
+        self._versions: dict[str, int] = {}
+        self._data_versions: dict[str, str | None] = {}
+        self._touched: set[str] = set()
+        self._job_queue = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._job = None
+        self._armed_for: datetime | None = None
+        self._running = False
+        self.fires = 0
+        self.refreshes = 0
+        self.max_lateness = 0.0
+
+    async def start(self, job_queue):
+        self._job_queue = job_queue
+        self._loop = asyncio.get_running_loop()
+        await self.watch()
+        await self.resync()
+
+    async def watch(self):
+        """Пересчитывает источники, таблицы которых изменились с прошлой сверки."""
+        names = [name for name in self.sources if name in DEADLINE_TABLES]
+        versions = await db.call(db_data_versions, tuple(f"deadline_{name}" for name in names))
+        for name, version in zip(names, versions):
+            if name in self._data_versions and self._data_versions[name] != version:
+                self._schedule_refresh(name)
+            self._data_versions[name] = version
+
+    async def resync(self):
+        for name in self.sources:
+            await self.refresh(name)
+
+    async def refresh(self, name: str, not_before: datetime | None = None, fired: datetime | None = None):
+        """not_before действует, только если срок не ушёл дальше сработавшего fired."""
+        self.refreshes += 1
+        when = await db.call(self.sources[name])
+        if when is not None and not_before is not None and fired is not None and when <= fired and when < not_before:
+            when = not_before
+        version = self._versions.get(name, 0) + 1
+        self._versions[name] = version
+        if when is not None:
+            heapq.heappush(self._heap, (when, version, name))
+        self._arm()
+
+    def touch(self, name: str):
+        """Срок источника мог измениться; безопасно вызывать из потоков БД."""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            same_loop = asyncio.get_running_loop() is loop
+        except RuntimeError:
+            same_loop = False
+        if same_loop:
+            self._schedule_refresh(name)
+        else:
+            loop.call_soon_threadsafe(self._schedule_refresh, name)
+
+    def _schedule_refresh(self, name: str):
+        if name in self._touched:
+            return
+        self._touched.add(name)
+        self._loop.create_task(self._refresh_touched(name))
+
+    async def _refresh_touched(self, name: str):
+        self._touched.discard(name)
+        try:
+            await self.refresh(name)
+        except Exception:
+            logger.exception("Deadline refresh failed: source=%s", name)
+
+    def _peek(self) -> tuple[datetime, int, str] | None:
+        # Устаревшие записи (источник пересчитан позже) удаляются лениво.
+        while self._heap:
+            when, version, name = self._heap[0]
+            if self._versions.get(name) == version:
+                return self._heap[0]
+            heapq.heappop(self._heap)
+        return None
+
+    def _arm(self):
+        if self._job_queue is None or self._running:
+            return
+        top = self._peek()
+        when = top[0] if top else None
+        if self._job is not None and when == self._armed_for:
+            return
+        if self._job is not None:
+            self._job.schedule_removal()
+            self._job = None
+        self._armed_for = when
+        if when is not None:
+            delay = max(0.0, (when - datetime.now(pytz.UTC)).total_seconds())
+            self._job = self._job_queue.run_once(self._fire, when=delay, name="deadline_scheduler")
+
+    async def _fire(self, context: ContextTypes.DEFAULT_TYPE):
+        self._job = None
+        self._armed_for = None
+        now = datetime.now(pytz.UTC)
+        due = {name: when for when, version, name in self._heap if when <= now and self._versions.get(name) == version}
+        if not due:
+            self._arm()
+            return
+        self.fires += 1
+        self.max_lateness = max(self.max_lateness, (now - self._peek()[0]).total_seconds())
+        self._running = True
+        try:
+            await check_and_send_jobs(context)
+        except Exception:
+            logger.exception("Deadline scheduler run failed")
+        finally:
+            self._running = False
+        # Если срок источника не сдвинулся (например, ошибка сети), повторяем
+        # не раньше чем через DEADLINE_RETRY_SECONDS; новый срок — как есть.
+        not_before = datetime.now(pytz.UTC) + self.retry
+        for name, fired in due.items():
+            await self.refresh(name, not_before=not_before, fired=fired)
+        self._arm()
+
+    def stats(self) -> dict:
+        top = self._peek()
+        return {
+            "next_at": top[0] if top else None,
+            "next_source": top[2] if top else None,
+            "fires": self.fires,
+            "refreshes": self.refreshes,
+            "max_lateness": self.max_lateness,
+        }
+
+
+DEADLINES = DeadlineScheduler(DEADLINE_SOURCES)
+
+
+async def job_deadlines_resync(context: ContextTypes.DEFAULT_TYPE):
+    await DEADLINES.resync()
+
+
+async def job_deadlines_watch(context: ContextTypes.DEFAULT_TYPE):
+    await DEADLINES.watch()
+
+
+def _deadline_touching(fn, source: str):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        result = fn(*args, **kwargs)
+        DEADLINES.touch(source)
+        return result
+
+    return wrapper
+
+
+db_scheduled_communication_add = _deadline_touching(db_scheduled_communication_add, "communications")
+db_upsert_reschedule = _deadline_touching(db_upsert_reschedule, "meetings")
+db_delete_reschedule = _deadline_touching(db_delete_reschedule, "meetings")
+db_reminder_create = _deadline_touching(db_reminder_create, "reminders")
+db_reminder_update_schedule = _deadline_touching(db_reminder_update_schedule, "reminders")
+db_reminder_cancel = _deadline_touching(db_reminder_cancel, "reminders")
+tv2_create_assignment = _deadline_touching(tv2_create_assignment, "tests")
+
+
+async def on_post_init(application: Application):
+    HTTP_CLIENTS.start()
+    await configure_ephemeral_commands(application)
+    LOOP_LAG.start()
+    await db.call(search_indexes_warmup)
+    await DEADLINES.start(application.job_queue)
+
+
+async def on_post_shutdown(application: Application):
+    await LOOP_LAG.stop()
+    await HTTP_CLIENTS.aclose()
+    DOC_INDEXER.shutdown()
+    db.shutdown()
+    db_pool_close_all()
+
 
 def main():
     ensure_db_path(DB_PATH)
@@ -38590,13 +42131,18 @@ def main():
 
     request = HTTPXRequest(connect_timeout=15, read_timeout=30, write_timeout=30, pool_timeout=30)
 
-    app = (
+    builder = (
         Application.builder()
         .token(BOT_TOKEN)
+        .base_url(f"{TELEGRAM_API_URL}/bot")
+        .base_file_url(f"{TELEGRAM_API_URL}/file/bot")
         .request(request)
-        .post_init(configure_ephemeral_commands)
-        .build()
+        .post_init(on_post_init)
+        .post_shutdown(on_post_shutdown)
     )
+    if PERSISTENCE_ENABLED:
+        builder = builder.persistence(SQLitePersistence())
+    app = builder.build()
 
     # log errors
     app.add_error_handler(error_handler)
@@ -38629,7 +42175,8 @@ def main():
     app.add_handler(CallbackQueryHandler(cb_test, pattern=r"^test:"))
 
     # callbacks: help
-    app.add_handler(CallbackQueryHandler(cb_help, pattern=r"^(help:|noop)"))
+    help_callback_router, help_text_router = build_help_routers()
+    app.add_handler(CallbackQueryHandler(help_callback_router.dispatch, pattern=r"^(help:|noop)"))
 
     # inline sharing: result is sent to the selected chat by the user
     app.add_handler(InlineQueryHandler(inline_query_documents))
@@ -38637,6 +42184,7 @@ def main():
     # employee chat membership sync + welcome
     app.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, on_new_members))
     app.add_handler(MessageHandler(filters.StatusUpdate.LEFT_CHAT_MEMBER, on_left_member))
+    app.add_handler(ChatMemberHandler(on_chat_member_update, ChatMemberHandler.CHAT_MEMBER))
 
 
     # document upload
@@ -38647,16 +42195,39 @@ def main():
     app.add_handler(MessageHandler(filters.VIDEO, on_video))
 
     # text input
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, on_text))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, help_text_router.dispatch))
 
     # schedule checker
-    app.job_queue.run_repeating(check_and_send_jobs, interval=60, first=10, name="meetings_checker")
+    app.job_queue.run_repeating(
+        job_deadlines_resync,
+        interval=DEADLINE_RESYNC_SECONDS,
+        first=DEADLINE_RESYNC_SECONDS,
+        name="deadline_resync",
+    )
+    app.job_queue.run_repeating(
+        job_deadlines_watch,
+        interval=DEADLINE_WATCH_SECONDS,
+        first=DEADLINE_WATCH_SECONDS,
+        name="deadline_watch",
+    )
     app.job_queue.run_repeating(
         job_index_pending_documents,
         interval=2 * 60,
         first=5,
         name="document_content_indexer",
     )
+    app.job_queue.run_repeating(
+        job_doc_extract_cache_prune,
+        interval=24 * 60 * 60,
+        first=60 * 60,
+        name="doc_extract_cache_prune",
+    )
+    app.job_queue.run_repeating(
+        job_horo_prefetch,
+        interval=HORO_PREFETCH_INTERVAL_SECONDS,
+        first=30,
+        name="horo_prefetch",
+    )
 
     logger.warning(
         "=== BOT BUILD: %s | FILE: %s | DB: %s ===",
@@ -38670,5 +42241,71 @@ def main():
         logger.exception("run_polling crashed: %s", e)
         raise
 
+
+_SECTION_RE = re.compile(r"^# =+ (END )?(.+?) =+$")
+
+
+def startup_sections(lines: list[str]) -> list[tuple[str, int, int]]:
+    """
+    Разделы bot.py для --profile-startup: (имя, первая строка, последняя).
+    Раздел — от заголовка «# === X ===» до «# === END X ===»; вложенные
+    заголовки без своего END относятся к внешнему разделу.
+    """
+    headers: list[tuple[str, int]] = []
+    sections = []
+    for number, line in enumerate(lines, 1):
+        match = _SECTION_RE.match(line)
+        if not match:
+            continue
+        if not match.group(1):
+            headers.append((match.group(2), number))
+            continue
+        for index in range(len(headers) - 1, -1, -1):
+            title, first = headers[index]
+            if title.startswith(match.group(2)):
+                sections.append((match.group(2), first, number))
+                del headers[index:]
+                break
+    return sections
+
+
+def profile_startup():
+    """
+    python bot.py --profile-startup: время запуска по разделам bot.py без
+    polling. compile — компиляция исходника раздела (bot.py, запущенный
+    скриптом, компилируется при каждом запуске), db_init — шаги схемы и
+    задачи запуска, объявленные в разделе. Всё вне разделов — «core».
+    """
+    ensure_db_path(DB_PATH)
+    ensure_storage_dir(STORAGE_DIR)
+    db_init()
+    lines = Path(__file__).read_text(encoding="utf-8").splitlines(keepends=True)
+    sections = startup_sections(lines)
+    owners = ["core"] * (len(lines) + 1)
+    for name, first, last in sections:
+        owners[first:last + 1] = [name] * (last - first + 1)
+    db_seconds: dict[str, float] = {}
+    for fn, seconds in DB_INIT_TIMINGS:
+        owner = owners[fn.__code__.co_firstlineno]
+        db_seconds[owner] = db_seconds.get(owner, 0.0) + seconds
+    rows = [("core", "".join(line for number, line in enumerate(lines, 1) if owners[number] == "core"))]
+    rows += [(name, "".join(lines[first - 1:last])) for name, first, last in sections]
+    totals = [0.0, 0.0]
+    print(f"{'section':44} {'compile, ms':>11} {'db_init, ms':>11}")
+    for name, source in rows:
+        started = time.perf_counter()
+        compile(source, name, "exec")
+        values = (time.perf_counter() - started, db_seconds.get(name, 0.0))
+        totals = [total + value for total, value in zip(totals, values)]
+        print(f"{name[:44]:44} {values[0] * 1000:11.1f} {values[1] * 1000:11.1f}")
+    print(f"{'total':44} {totals[0] * 1000:11.1f} {totals[1] * 1000:11.1f}")
+    print(f"module body executed in {MODULE_EXEC_SECONDS * 1000:.1f} ms")
+
+
+MODULE_EXEC_SECONDS = time.perf_counter() - _MODULE_EXEC_STARTED
+
 if __name__ == "__main__":
-    main()
+    if "--profile-startup" in sys.argv[1:]:
+        profile_startup()
+    else:
+        main()
@@ -0,0 +1,590 @@
+# -*- coding: utf-8 -*-
+# Извлечение текста документов для поискового индекса.
+#
+# Модуль не зависит от bot.py: рабочие процессы индексации (spawn) получают
+# его функции по имени, а инструменты и бенчмарки импортируют его без бота.
+import hashlib
+import io
+import os
+import re
+import zipfile
+from pathlib import Path
+
+# Полнотекстовый индекс документов. Текст ограничивается по размеру, чтобы
+# очень большие файлы не раздували SQLite. OCR по умолчанию распознаёт русский
+# и английский; язык можно переопределить через DOC_OCR_LANG.
+DOC_INDEX_MAX_CHARS = max(10_000, int(os.getenv("DOC_INDEX_MAX_CHARS", "1000000")))
+DOC_OCR_LANG = os.getenv("DOC_OCR_LANG", "rus+eng")
+DOC_OCR_MAX_PAGES = max(1, int(os.getenv("DOC_OCR_MAX_PAGES", "50")))
+DOC_OCR_MAX_IMAGES = max(1, int(os.getenv("DOC_OCR_MAX_IMAGES", "50")))
+# Сначала страница распознаётся в DOC_OCR_FAST_DPI; при средней уверенности
+# tesseract ниже DOC_OCR_MIN_CONFIDENCE повторяется в DOC_OCR_DPI.
+DOC_OCR_DPI = max(72, int(os.getenv("DOC_OCR_DPI", "200")))
+DOC_OCR_FAST_DPI = max(72, int(os.getenv("DOC_OCR_FAST_DPI", "150")))
+DOC_OCR_MIN_CONFIDENCE = float(os.getenv("DOC_OCR_MIN_CONFIDENCE", "70"))
+DOC_OCR_PAGE_WINDOW = max(1, int(os.getenv("DOC_OCR_PAGE_WINDOW", "4")))
+
+
+def _normalize_document_text(text: str) -> str:
+    value = (text or "").replace("\x00", " ")
+    value = re.sub(r"[ \t\f\v]+", " ", value)
+    value = re.sub(r"\s*\n\s*", "\n", value)
+    value = re.sub(r"\n{3,}", "\n\n", value).strip()
+    return value[:DOC_INDEX_MAX_CHARS]
+
+
+def _xml_visible_text(data: bytes) -> str:
+    """Извлекает пользовательский текст из XML внутри Office-файла."""
+    import xml.etree.ElementTree as ET
+
+    root = ET.fromstring(data)
+    chunks: list[str] = []
+    text_tags = {"t", "instrText", "delText"}
+    break_tags = {"p", "tr", "br", "cr"}
+    for element in root.iter():
+        local_name = element.tag.rsplit("}", 1)[-1]
+        if local_name in text_tags and element.text:
+            chunks.append(element.text)
+        elif local_name == "tab":
+            chunks.append("\t")
+        elif local_name in break_tags:
+            chunks.append("\n")
+    return _normalize_document_text(" ".join(chunks))
+
+
+def _parse_tesseract_tsv(tsv: str) -> tuple[str, float]:
+    """
+    Текст и средняя уверенность слов из TSV-вывода tesseract.
+
+    Разметка собирается так же, как в текстовом выводе tesseract: слова
+    строки (line_num) через пробел, строки абзаца (par_num) с новой строки,
+    абзацы и блоки (block_num) через пустую строку.
+    """
+    paragraphs: list[list[list[str]]] = []
+    confidences: list[float] = []
+    paragraph_key = line_key = None
+    rows = tsv.splitlines()
+    for row in rows[1:]:
+        # level, page_num, block_num, par_num, line_num, word_num, left, top,
+        # width, height, conf, text
+        cells = row.split("\t")
+        if len(cells) < 12 or not cells[11].strip():
+            continue
+        try:
+            confidence = float(cells[10])
+        except ValueError:
+            continue
+        if confidence < 0:
+            continue
+        confidences.append(confidence)
+        if (cells[1], cells[2], cells[3]) != paragraph_key:
+            paragraph_key = (cells[1], cells[2], cells[3])
+            paragraphs.append([])
+            line_key = None
+        if cells[4] != line_key:
+            line_key = cells[4]
+            paragraphs[-1].append([])
+        paragraphs[-1][-1].append(cells[11].strip())
+    text = "\n\n".join("\n".join(" ".join(words) for words in lines) for lines in paragraphs)
+    return text, (sum(confidences) / len(confidences) if confidences else 0.0)
+
+
+def _ocr_pil_image_scored(image) -> tuple[str, float, str | None]:
+    """
+    OCR PIL-изображения с оценкой качества: (текст, уверенность 0–100, ошибка).
+
+    Сначала pytesseract, затем системный tesseract.
+    """
+    languages = [DOC_OCR_LANG]
+    if DOC_OCR_LANG != "eng":
+        languages.append("eng")
+
+    package_error = None
+    try:
+        import pytesseract
+
+        for language in languages:
+            try:
+                value, confidence = _parse_tesseract_tsv(pytesseract.image_to_data(image, lang=language))
+                if value.strip():
+                    return value, confidence, None
+            except Exception as exc:
+                package_error = str(exc)
+    except Exception as exc:
+        package_error = str(exc)
+
+    try:
+        import subprocess
+
+        image_buffer = io.BytesIO()
+        image.save(image_buffer, format="PNG")
+        last_error = package_error
+        for language in languages:
+            result = subprocess.run(
+                ["tesseract", "stdin", "stdout", "-l", language, "tsv"],
+                input=image_buffer.getvalue(),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                timeout=120,
+                check=False,
+            )
+            if result.returncode == 0:
+                value, confidence = _parse_tesseract_tsv(result.stdout.decode("utf-8", errors="ignore"))
+                if value.strip():
+                    return value, confidence, None
+            last_error = result.stderr.decode("utf-8", errors="ignore").strip() or last_error
+        return "", 0.0, last_error or "Tesseract не вернул текст"
+    except Exception as exc:
+        return "", 0.0, package_error or str(exc)
+
+
+def _ocr_pil_image(image) -> tuple[str, str | None]:
+    """OCR PIL-изображения: сначала pytesseract, затем системный tesseract."""
+    value, _confidence, error = _ocr_pil_image_scored(image)
+    return value, error
+
+
+def _ocr_image_blobs(blobs: list[bytes]) -> tuple[str, list[str]]:
+    if not blobs:
+        return "", []
+    errors: list[str] = []
+    parts: list[str] = []
+    try:
+        from PIL import Image
+    except Exception as exc:
+        return "", [f"OCR недоступен: {exc}"]
+
+    for blob in blobs[:DOC_OCR_MAX_IMAGES]:
+        try:
+            with Image.open(io.BytesIO(blob)) as image:
+                value, ocr_error = _ocr_pil_image(image)
+            if value and value.strip():
+                parts.append(value)
+            elif ocr_error:
+                errors.append(ocr_error)
+        except Exception as exc:
+            errors.append(str(exc))
+    return _normalize_document_text("\n".join(parts)), errors
+
+
+def _extract_docx_text(path: Path) -> tuple[str, bool, list[str]]:
+    errors: list[str] = []
+    parts: list[str] = []
+    ocr_used = False
+    with zipfile.ZipFile(path, "r") as zf:
+        names = zf.namelist()
+        xml_names = [
+            name
+            for name in names
+            if name == "word/document.xml"
+            or (
+                name.startswith("word/")
+                and name.endswith(".xml")
+                and any(key in name for key in ("header", "footer", "footnotes", "endnotes", "comments"))
+            )
+        ]
+        for name in sorted(xml_names):
+            try:
+                value = _xml_visible_text(zf.read(name))
+                if value:
+                    parts.append(value)
+            except Exception as exc:
+                errors.append(f"{name}: {exc}")
+
+        # Документы-сканы часто состоят только из изображений. OCR запускается
+        # лишь при отсутствии нормального текстового слоя.
+        text = _normalize_document_text("\n".join(parts))
+        if len(text) < 100:
+            image_blobs = [
+                zf.read(name)
+                for name in names
+                if name.startswith("word/media/") and not name.endswith("/")
+            ]
+            ocr_text, ocr_errors = _ocr_image_blobs(image_blobs)
+            errors.extend(ocr_errors)
+            if ocr_text:
+                parts.append(ocr_text)
+                ocr_used = True
+    return _normalize_document_text("\n".join(parts)), ocr_used, errors
+
+
+def _extract_xlsx_text(path: Path) -> tuple[str, bool, list[str]]:
+    import xml.etree.ElementTree as ET
+
+    errors: list[str] = []
+    parts: list[str] = []
+    ocr_used = False
+    with zipfile.ZipFile(path, "r") as zf:
+        names = zf.namelist()
+        shared_strings: list[str] = []
+        if "xl/sharedStrings.xml" in names:
+            try:
+                root = ET.fromstring(zf.read("xl/sharedStrings.xml"))
+                for item in root.iter():
+                    if item.tag.rsplit("}", 1)[-1] != "si":
+                        continue
+                    value = " ".join(
+                        node.text or ""
+                        for node in item.iter()
+                        if node.tag.rsplit("}", 1)[-1] == "t"
+                    ).strip()
+                    shared_strings.append(value)
+            except Exception as exc:
+                errors.append(f"sharedStrings.xml: {exc}")
+
+        for name in sorted(n for n in names if n.startswith("xl/worksheets/") and n.endswith(".xml")):
+            try:
+                root = ET.fromstring(zf.read(name))
+                parts.append(Path(name).stem)
+                for cell in root.iter():
+                    if cell.tag.rsplit("}", 1)[-1] != "c":
+                        continue
+                    cell_type = cell.attrib.get("t", "")
+                    raw_value = None
+                    inline_values: list[str] = []
+                    formula = None
+                    for node in cell.iter():
+                        local_name = node.tag.rsplit("}", 1)[-1]
+                        if local_name == "v":
+                            raw_value = node.text
+                        elif local_name == "t" and node.text:
+                            inline_values.append(node.text)
+                        elif local_name == "f" and node.text:
+                            formula = node.text
+                    if cell_type == "s" and raw_value is not None:
+                        try:
+                            parts.append(shared_strings[int(raw_value)])
+                        except (IndexError, TypeError, ValueError):
+                            pass
+                    elif inline_values:
+                        parts.append(" ".join(inline_values))
+                    elif raw_value is not None:
+                        parts.append(raw_value)
+                    if formula:
+                        parts.append(formula)
+            except Exception as exc:
+                errors.append(f"{name}: {exc}")
+
+        text = _normalize_document_text("\n".join(parts))
+        if len(text) < 100:
+            image_blobs = [
+                zf.read(name)
+                for name in names
+                if name.startswith("xl/media/") and not name.endswith("/")
+            ]
+            ocr_text, ocr_errors = _ocr_image_blobs(image_blobs)
+            errors.extend(ocr_errors)
+            if ocr_text:
+                parts.append(ocr_text)
+                ocr_used = True
+    return _normalize_document_text("\n".join(parts)), ocr_used, errors
+
+
+def _pdf_text_layer(path: Path) -> tuple[str, int, list[str]]:
+    """Текстовый слой PDF: (текст, число страниц, ошибки)."""
+    errors: list[str] = []
+    parts: list[str] = []
+    page_count = 0
+    try:
+        from pypdf import PdfReader
+
+        reader = PdfReader(str(path))
+        page_count = len(reader.pages)
+        for page in reader.pages:
+            try:
+                value = page.extract_text() or ""
+                if value.strip():
+                    parts.append(value)
+            except Exception as exc:
+                errors.append(f"PDF page: {exc}")
+    except Exception as exc:
+        errors.append(f"PDF text layer: {exc}")
+
+    text = _normalize_document_text("\n".join(parts))
+    if len(text) < _pdf_minimum_text(page_count):
+        # pdftotext — дополнительный fallback для окружений без pypdf.
+        try:
+            import subprocess
+
+            result = subprocess.run(
+                ["pdftotext", "-layout", str(path), "-"],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                timeout=120,
+                check=False,
+            )
+            if result.returncode == 0:
+                cli_text = result.stdout.decode("utf-8", errors="ignore")
+                if cli_text.strip():
+                    text = _normalize_document_text(f"{text}\n{cli_text}")
+            else:
+                errors.append(result.stderr.decode("utf-8", errors="ignore").strip())
+        except Exception as exc:
+            errors.append(f"pdftotext: {exc}")
+    return text, page_count, errors
+
+
+def _pdf_minimum_text(page_count: int) -> int:
+    """Меньше этого объёма текстового слоя — PDF считается сканом."""
+    return max(80, min(page_count or 1, DOC_OCR_MAX_PAGES) * 20)
+
+
+def _render_pdf_pages_to_dir(path: Path, first_page: int, last_page: int, dpi: int, out_dir: Path) -> list[tuple[int, Path]]:
+    """Рендерит страницы first..last в PNG-файлы (pdf2image или системный pdftoppm)."""
+    prefix = f"p{first_page}"
+    try:
+        from pdf2image import convert_from_path
+
+        paths = convert_from_path(
+            str(path),
+            dpi=dpi,
+            first_page=first_page,
+            last_page=last_page,
+            output_folder=str(out_dir),
+            output_file=prefix,
+            fmt="png",
+            paths_only=True,
+        )
+        return [(first_page + offset, Path(page_path)) for offset, page_path in enumerate(paths)]
+    except Exception:
+        pass
+
+    import subprocess
+
+    render_error = "pdftoppm недоступен"
+    executables = ["pdftoppm"]
+    if Path("/usr/bin/pdftoppm").exists():
+        executables.append("/usr/bin/pdftoppm")
+    for executable in dict.fromkeys(executables):
+        try:
+            result = subprocess.run(
+                [
+                    executable, "-png", "-r", str(int(dpi)),
+                    "-f", str(first_page), "-l", str(last_page),
+                    str(path), str(out_dir / prefix),
+                ],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                timeout=300,
+                check=False,
+            )
+            if result.returncode == 0:
+                # pdftoppm дописывает к префиксу номер страницы: p1-01.png, p1-02.png…
+                pages = [
+                    (int(page_path.stem.rsplit("-", 1)[1]), page_path)
+                    for page_path in out_dir.glob(f"{prefix}-*.png")
+                ]
+                return sorted(pages)
+            render_error = result.stderr.decode("utf-8", errors="ignore").strip() or render_error
+        except Exception as exc:
+            render_error = str(exc)
+    raise RuntimeError(render_error)
+
+
+def iter_pdf_page_images(path: Path, first_page: int, last_page: int, dpi: int, window: int = DOC_OCR_PAGE_WINDOW):
+    """
+    Генератор (номер страницы, PIL-изображение) для страниц first..last.
+
+    Страницы рендерятся на диск окнами по window штук, в память загружается
+    только текущая: изображение закрывается, как только запрошена следующая.
+    """
+    import tempfile
+    from PIL import Image
+
+    with tempfile.TemporaryDirectory(prefix="doc_ocr_") as tmp_dir:
+        start = first_page
+        while start <= last_page:
+            end = min(last_page, start + window - 1)
+            pages = _render_pdf_pages_to_dir(path, start, end, dpi, Path(tmp_dir))
+            for page_no, page_path in pages:
+                image = Image.open(page_path)
+                try:
+                    image.load()
+                    yield page_no, image
+                finally:
+                    image.close()
+                    page_path.unlink(missing_ok=True)
+            if len(pages) < end - start + 1:
+                break  # документ короче, чем ожидалось
+            start = end + 1
+
+
+def _ocr_pdf_page_high_dpi(path: Path, page_no: int, value: str, confidence: float, error: str | None) -> tuple[str, str | None]:
+    """Повтор OCR страницы в DOC_OCR_DPI; остаётся лучший из двух результатов."""
+    try:
+        for _page_no, image in iter_pdf_page_images(path, page_no, page_no, DOC_OCR_DPI):
+            retry_value, retry_confidence, retry_error = _ocr_pil_image_scored(image)
+            if retry_value.strip() and (retry_confidence >= confidence or not value.strip()):
+                return retry_value, None
+            return value, error or retry_error
+    except Exception as exc:
+        return value, error or f"PDF OCR: {exc}"
+    return value, error
+
+
+def ocr_pdf_pages(path: Path, first_page: int, last_page: int):
+    """
+    Генератор (текст, ошибка) по страницам PDF.
+
+    Первый проход идёт в DOC_OCR_FAST_DPI; страницы с низкой уверенностью
+    распознаются повторно в DOC_OCR_DPI.
+    """
+    adaptive = DOC_OCR_FAST_DPI < DOC_OCR_DPI
+    dpi = DOC_OCR_FAST_DPI if adaptive else DOC_OCR_DPI
+    for page_no, image in iter_pdf_page_images(path, first_page, last_page, dpi):
+        value, confidence, error = _ocr_pil_image_scored(image)
+        image.close()
+        if adaptive and (confidence < DOC_OCR_MIN_CONFIDENCE or not value.strip()):
+            value, error = _ocr_pdf_page_high_dpi(path, page_no, value, confidence, error)
+        yield value, error
+
+
+def ocr_pdf_page(local_path: str, page_no: int) -> tuple[str, str | None]:
+    """Распознаёт одну страницу. Выполняется в рабочем процессе индексации."""
+    try:
+        return next(ocr_pdf_pages(Path(local_path), int(page_no), int(page_no)), ("", None))
+    except Exception as exc:
+        return "", f"PDF OCR: {exc}"
+
+
+def _extract_pdf_text(path: Path) -> tuple[str, bool, list[str]]:
+    text, page_count, errors = _pdf_text_layer(path)
+    minimum_text = _pdf_minimum_text(page_count)
+    if len(text) >= minimum_text:
+        return text, False, errors
+
+    # Если текстового слоя нет или он почти пустой, распознаём страницы по
+    # одной. При отсутствии Python-обвязки используем системные pdftoppm и
+    # tesseract.
+    ocr_parts: list[str] = []
+    try:
+        last_page = min(page_count or DOC_OCR_MAX_PAGES, DOC_OCR_MAX_PAGES)
+        for value, ocr_error in ocr_pdf_pages(path, 1, last_page):
+            if value and value.strip():
+                ocr_parts.append(value)
+            elif ocr_error:
+                errors.append(ocr_error)
+    except Exception as exc:
+        errors.append(f"PDF OCR: {exc}")
+    ocr_text = _normalize_document_text("\n".join(ocr_parts))
+    if ocr_text:
+        return _normalize_document_text(f"{text}\n{ocr_text}"), True, errors
+    return text, False, errors
+
+
+def extract_document_text(local_path: str, mime_type: str | None) -> tuple[str, str, str | None]:
+    """Возвращает (текст, статус, диагностическая ошибка) для поискового индекса."""
+    path = Path(local_path)
+    if not path.exists() or not path.is_file():
+        return "", "pending", "Локальный файл пока недоступен"
+
+    suffix = path.suffix.casefold()
+    mime = (mime_type or "").casefold()
+    errors: list[str] = []
+    ocr_used = False
+    try:
+        if suffix == ".pdf" or mime == "application/pdf":
+            text, ocr_used, errors = _extract_pdf_text(path)
+        elif suffix == ".docx" or "wordprocessingml.document" in mime:
+            text, ocr_used, errors = _extract_docx_text(path)
+        elif suffix == ".xlsx" or "spreadsheetml.sheet" in mime:
+            text, ocr_used, errors = _extract_xlsx_text(path)
+        elif suffix in {".txt", ".md", ".csv", ".tsv", ".json", ".xml", ".html", ".htm"} or mime.startswith("text/"):
+            text = path.read_text(encoding="utf-8-sig", errors="ignore")
+        else:
+            return "", "unsupported", None
+    except Exception as exc:
+        return "", "error", str(exc)
+
+    return _document_index_result(text, ocr_used, errors)
+
+
+def _document_index_result(text: str, ocr_used: bool, errors: list[str]) -> tuple[str, str, str | None]:
+    text = _normalize_document_text(text)
+    error_text = "; ".join(e for e in errors[:5] if e) or None
+    if text:
+        return text, ("indexed_ocr" if ocr_used else "indexed"), error_text
+    return "", "empty", error_text
+
+
+def document_content_hash(local_path: str) -> str:
+    """SHA-256 содержимого файла — ключ кэша извлечения."""
+    digest = hashlib.sha256()
+    with open(local_path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def ocr_settings_key() -> str:
+    """Настройки, от которых зависит результат OCR; входят в ключи кэша."""
+    return f"{DOC_OCR_LANG}:{DOC_OCR_FAST_DPI}:{DOC_OCR_DPI}"
+
+
+def _pdf_page_fingerprints(path: Path, last_page: int) -> list[str]:
+    """
+    Отпечатки страниц 1..last_page: поток содержимого и встроенные изображения.
+
+    У заменённого файла неизменившиеся страницы дают те же отпечатки, и их
+    OCR берётся из кэша. Пустой список — отпечатки посчитать не удалось.
+    """
+    try:
+        from pypdf import PdfReader
+
+        reader = PdfReader(str(path))
+        settings = ocr_settings_key()
+        fingerprints = []
+        for page in reader.pages[:last_page]:
+            digest = hashlib.sha256()
+            contents = page.get_contents()
+            if contents is not None:
+                digest.update(contents.get_data())
+            resources = page.get("/Resources")
+            resources = resources.get_object() if resources is not None else {}
+            xobjects = resources.get("/XObject") if resources else None
+            if xobjects is not None:
+                xobjects = xobjects.get_object()
+                for name in sorted(xobjects):
+                    digest.update(name.encode("utf-8", errors="ignore"))
+                    digest.update(xobjects[name].get_object().get_data())
+            fingerprints.append(f"{settings}:{digest.hexdigest()}")
+        return fingerprints
+    except Exception:
+        return []
+
+
+def _is_pdf_document(path: Path, mime_type: str | None) -> bool:
+    return path.suffix.casefold() == ".pdf" or (mime_type or "").casefold() == "application/pdf"
+
+
+def extract_document_stage(local_path: str, mime_type: str | None) -> dict:
+    """
+    Первый этап индексации в рабочем процессе.
+
+    Для PDF без текстового слоя возвращает число страниц для OCR
+    (ocr_pages), которые затем распознаются параллельно; остальные форматы
+    извлекаются целиком.
+    """
+    path = Path(local_path)
+    if path.is_file() and _is_pdf_document(path, mime_type):
+        try:
+            text, page_count, errors = _pdf_text_layer(path)
+        except Exception as exc:
+            return {"text": "", "status": "error", "error": str(exc), "ocr_pages": 0}
+        if len(text) < _pdf_minimum_text(page_count) and page_count:
+            ocr_pages = min(page_count, DOC_OCR_MAX_PAGES)
+            return {
+                "text": text,
+                "errors": errors,
+                "ocr_pages": ocr_pages,
+                "page_keys": _pdf_page_fingerprints(path, ocr_pages),
+            }
+        if len(text) < _pdf_minimum_text(page_count):
+            # Число страниц неизвестно (нет pypdf) — OCR всего файла одним заданием.
+            text, status, error = extract_document_text(local_path, mime_type)
+            return {"text": text, "status": status, "error": error, "ocr_pages": 0}
+        text, status, error = _document_index_result(text, False, errors)
+        return {"text": text, "status": status, "error": error, "ocr_pages": 0}
+    text, status, error = extract_document_text(local_path, mime_type)
+    return {"text": text, "status": status, "error": error, "ocr_pages": 0}
+